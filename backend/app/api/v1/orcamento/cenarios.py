@@ -23,7 +23,12 @@ from app.schemas.orcamento import (
 from app.services.calculo_custos import calcular_custos_cenario, calcular_overhead_ineficiencia
 from app.services.capacity_planning import (
     calcular_quantidades_span, aplicar_spans_ao_quadro,
-    aplicar_calculo_span, recalcular_spans_afetados, recalcular_spans_afetados_sem_commit
+    aplicar_calculo_span, recalcular_spans_afetados, recalcular_spans_afetados_sem_commit,
+    CicloSpanError
+)
+from app.services.recalculo_incremental import (
+    registrar_alteracao_quadro, registrar_alteracao_posicao, registrar_alteracao_premissa,
+    meses_alterados
 )
 
 router = APIRouter(prefix="/cenarios", tags=["Cenários"])
@@ -768,11 +773,18 @@ async def create_posicao(
     await db.flush()  # Flush para obter o ID antes do cálculo
     
     # Se for tipo SPAN, calcular as quantidades automaticamente
-    if posicao.tipo_calculo == 'span':
-        await aplicar_calculo_span(db, posicao)
+    # (e os spans que dependem da função da posição, em cadeia)
+    try:
+        if posicao.tipo_calculo == 'span':
+            await aplicar_calculo_span(db, posicao)
+        elif await recalcular_spans_afetados_sem_commit(db, cenario_id, posicao.funcao_id, posicao.cenario_secao_id):
+            registrar_alteracao_quadro(db, cenario_id, posicao.cenario_secao_id, None, None)
+    except CicloSpanError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Invalidar custos calculados (pois o quadro mudou)
-    await invalidar_custos_cenario(db, cenario_id, posicao.cenario_secao_id)
+    # Registrar a posição para o recálculo incremental de custos
+    registrar_alteracao_posicao(db, posicao)
     
     await db.commit()
     # Refresh sem carregar relacionamento cenario para evitar erro com campos novos
@@ -809,27 +821,55 @@ async def update_posicao(
         # Verificar se quantidades foram alteradas (para recalcular SPANs)
         qtd_fields = [f'qtd_{m}' for m in ['jan', 'fev', 'mar', 'abr', 'mai', 'jun', 'jul', 'ago', 'set', 'out', 'nov', 'dez']]
         qtd_changed = any(field in update_data for field in qtd_fields)
+        # Campos que mudam a posição no grafo de spans (configuração ou lugar)
+        campos_span = ('tipo_calculo', 'span_ratio', 'span_funcoes_base_ids', 'funcao_id', 'cenario_secao_id', 'ativo')
+        span_changed = any(
+            field in update_data and update_data[field] != getattr(posicao, field)
+            for field in campos_span
+        )
         funcao_id = posicao.funcao_id
         cenario_secao_id = posicao.cenario_secao_id
+        centro_custo_id = posicao.centro_custo_id
+        meses = meses_alterados(update_data)
         
         for key, value in update_data.items():
             setattr(posicao, key, value)
         
-        # Se quantidades foram alteradas e não é uma posição SPAN, recalcular SPANs afetados
-        # Fazer tudo numa única transação
-        if qtd_changed and posicao.tipo_calculo != 'span':
-            await recalcular_spans_afetados_sem_commit(db, cenario_id, funcao_id, cenario_secao_id)
+        # Recalcular os SPANs a jusante (em cadeia), numa única transação:
+        # - posição SPAN com configuração alterada: ela mesma e os dependentes
+        # - demais posições: os dependentes da função, no lugar antigo e no novo
+        spans_recalculados = 0
+        if posicao.tipo_calculo == 'span' and span_changed:
+            await aplicar_calculo_span(db, posicao)
+            spans_recalculados = 1
+        elif (qtd_changed or span_changed) and posicao.tipo_calculo != 'span':
+            spans_recalculados = await recalcular_spans_afetados_sem_commit(db, cenario_id, funcao_id, cenario_secao_id)
+        if span_changed and (funcao_id, cenario_secao_id) != (posicao.funcao_id, posicao.cenario_secao_id):
+            spans_recalculados += await recalcular_spans_afetados_sem_commit(
+                db, cenario_id, posicao.funcao_id, posicao.cenario_secao_id
+            )
         
-        await db.commit()
+        # Registrar as células alteradas para o recálculo incremental de custos
+        registrar_alteracao_posicao(db, posicao, meses)
+        if (funcao_id, cenario_secao_id, centro_custo_id) != (posicao.funcao_id, posicao.cenario_secao_id, posicao.centro_custo_id):
+            # Posição mudou de função/seção/CC: as células antigas também precisam ser refeitas
+            registrar_alteracao_quadro(db, cenario_id, cenario_secao_id, funcao_id, centro_custo_id, posicao.id)
+        if spans_recalculados:
+            # Posições SPAN dependentes mudaram nos mesmos meses (funções/CCs da seção),
+            # na seção antiga e, se a posição mudou de seção, na nova
+            for secao_id in {cenario_secao_id, posicao.cenario_secao_id}:
+                registrar_alteracao_quadro(db, cenario_id, secao_id, None, None, meses=meses)
         
-        # Invalidar custos calculados (pois o quadro mudou)
-        await invalidar_custos_cenario(db, cenario_id, posicao.cenario_secao_id)
+        await db.commit()
         
         # Refresh sem carregar relacionamento cenario para evitar erro com campos novos
         await db.refresh(posicao, attribute_names=[col.name for col in QuadroPessoal.__table__.columns])
         return posicao
     except HTTPException:
         raise
+    except CicloSpanError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         await db.rollback()
         import traceback
@@ -868,35 +908,25 @@ async def delete_posicao(
     )
     await db.execute(stmt_premissas)
     
+    # Registrar a posição para o recálculo incremental de custos (antes de remover)
+    registrar_alteracao_posicao(db, posicao)
+    
     # Remover a posição
     await db.delete(posicao)
+    await db.flush()
     
-    # Invalidar custos calculados (pois o quadro mudou)
-    await invalidar_custos_cenario(db, cenario_id, cenario_secao_id)
+    # Spans que dependiam da função da posição (em cadeia)
+    try:
+        if await recalcular_spans_afetados_sem_commit(db, cenario_id, posicao.funcao_id, posicao.cenario_secao_id):
+            registrar_alteracao_quadro(db, cenario_id, posicao.cenario_secao_id, None, None)
+    except CicloSpanError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
     
     await db.commit()
     return {"message": "Posição e premissas excluídas com sucesso"}
 
 
-# ============================================
-# UTILITÁRIOS INTERNOS
-# ============================================
-
-async def invalidar_custos_cenario(db: AsyncSession, cenario_id: UUID, cenario_secao_id: Optional[UUID] = None):
-    """
-    Invalida (remove) os custos calculados de um cenário.
-    Deve ser chamado quando houver mudanças que afetam o cálculo de custos.
-    """
-    from sqlalchemy import delete
-    from app.db.models.orcamento import CustoCalculado
-    
-    stmt = delete(CustoCalculado).where(CustoCalculado.cenario_id == cenario_id)
-    if cenario_secao_id:
-        stmt = stmt.where(CustoCalculado.cenario_secao_id == cenario_secao_id)
-    
-    await db.execute(stmt)
-
-
 # ============================================
 # CÁLCULOS
 # ============================================
@@ -1084,14 +1114,14 @@ async def calcular_spans(
     if not cenario:
         raise HTTPException(status_code=404, detail="Cenário não encontrado")
     
-    if aplicar:
-        # Aplicar spans ao quadro
-        resultado = await aplicar_spans_ao_quadro(db, cenario_id)
-        return {
-            "aplicado": True,
-            **resultado
-        }
-    else:
+    try:
+        if aplicar:
+            # Aplicar spans ao quadro
+            resultado = await aplicar_spans_ao_quadro(db, cenario_id)
+            return {
+                "aplicado": True,
+                **resultado
+            }
         # Apenas calcular (sem aplicar)
         quantidades = await calcular_quantidades_span(db, cenario_id)
         return {
@@ -1100,6 +1130,8 @@ async def calcular_spans(
             "total_funcoes": len(set(k.split('_')[0] for k in quantidades.keys())),
             "total_meses": len(quantidades)
         }
+    except CicloSpanError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 # ============================================
@@ -1171,7 +1203,10 @@ async def create_premissa_funcao(
     
     if premissa:
         # Atualizar existente
-        update_data = data.model_dump(exclude={'cenario_id', 'funcao_id', 'mes', 'ano', 'cenario_secao_id'})
+        campos_chave = {'cenario_id', 'funcao_id', 'mes', 'ano', 'cenario_secao_id'}
+        if 'distribuicoes' not in data.model_fields_set:
+            campos_chave.add('distribuicoes')  # Não apagar distribuições já cadastradas
+        update_data = data.model_dump(exclude=campos_chave)
         for key, value in update_data.items():
             setattr(premissa, key, value)
     else:
@@ -1179,6 +1214,8 @@ async def create_premissa_funcao(
         premissa = PremissaFuncaoMes(**data.model_dump())
         db.add(premissa)
     
+    registrar_alteracao_premissa(db, cenario_id, data.cenario_secao_id, data.funcao_id, data.mes, data.ano)
+    
     await db.commit()
     await db.refresh(premissa)
     return premissa
@@ -1206,6 +1243,8 @@ async def update_premissa_funcao(
     for key, value in update_data.items():
         setattr(premissa, key, value)
     
+    registrar_alteracao_premissa(db, cenario_id, premissa.cenario_secao_id, premissa.funcao_id, premissa.mes, premissa.ano)
+    
     await db.commit()
     await db.refresh(premissa)
     return premissa
@@ -1258,7 +1297,10 @@ async def bulk_premissas_funcao(
         
         if premissa:
             # Atualizar
-            update_data = data.model_dump(exclude={'cenario_id', 'funcao_id', 'mes', 'ano', 'cenario_secao_id'})
+            campos_chave = {'cenario_id', 'funcao_id', 'mes', 'ano', 'cenario_secao_id'}
+            if 'distribuicoes' not in data.model_fields_set:
+                campos_chave.add('distribuicoes')  # Não apagar distribuições já cadastradas
+            update_data = data.model_dump(exclude=campos_chave)
             for key, value in update_data.items():
                 setattr(premissa, key, value)
         else:
@@ -1267,10 +1309,7 @@ async def bulk_premissas_funcao(
             db.add(premissa)
         
         resultados.append(premissa)
-    
-    # Invalidar custos calculados (pois as premissas mudaram)
-    # Invalida todo o cenário já que as premissas afetam todos os cálculos
-    await invalidar_custos_cenario(db, cenario_id)
+        registrar_alteracao_premissa(db, cenario_id, data.cenario_secao_id, data.funcao_id, data.mes, data.ano)
     
     await db.commit()
     for premissa in resultados:
@@ -1296,6 +1335,8 @@ async def delete_premissa_funcao(
     if not premissa:
         raise HTTPException(status_code=404, detail="Premissa não encontrada")
     
+    registrar_alteracao_premissa(db, cenario_id, premissa.cenario_secao_id, premissa.funcao_id, premissa.mes, premissa.ano)
+    
     await db.delete(premissa)
     await db.commit()
     return {"message": "Premissa excluída com sucesso"}
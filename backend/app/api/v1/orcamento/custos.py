@@ -6,23 +6,39 @@ from typing import Optional, List
 from uuid import UUID
 from fastapi import APIRouter, HTTPException, Query, Depends, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, func, or_
 from sqlalchemy.orm import selectinload
 
 from app.db.session import get_db
 from app.db.models.orcamento import (
     TipoCusto, CustoCalculado, CustoTecnologia, ParametroCusto, Cenario,
-    QuadroPessoal, TabelaSalarial, Funcao
+    QuadroPessoal, TabelaSalarial, Funcao, JobCalculoCustos, CustoPerfilCalculo,
+    DREResumo
 )
 from app.schemas.orcamento import (
     TipoCustoBase, TipoCustoCreate, TipoCustoUpdate, TipoCustoResponse,
     CustoCalculadoResponse, CustoCalculadoComRelacionamentos,
     CustoTecnologiaResponse, CustoTecnologiaComRelacionamentos,
     ParametroCustoCreate, ParametroCustoUpdate, ParametroCustoResponse,
-    DRELinha, DREResponse
+    DRELinha, DREResponse, SimulacaoCustosRequest, SensibilidadeCustosRequest,
+    MonteCarloCustosRequest
 )
 from app.services.calculo_custos import calcular_e_salvar_custos
 from app.services.calculo_custos_tecnologia import calcular_e_salvar_custos_tecnologia
+from app.services.plano_rubricas import invalidar_plano_rubricas, CicloRubricasError
+from app.services.rateio_reciproco import RateioReciprocoError
+from app.services.recalculo_incremental import recalcular_custos_incremental, listar_alteracoes_pendentes
+from app.services.memoria_calculo import explicar_custo
+from app.services.simulacao_custos import simular_custos
+from app.services.sensibilidade_custos import analisar_sensibilidade
+from app.services.monte_carlo_custos import simular_monte_carlo
+from app.services.perfil_calculo import perfil_para_dict
+from app.services.calculo_receitas import receitas_atualizadas, calcular_e_salvar_receitas
+from app.services.dre_resumo import dre_resumo_atualizado, ordem_fonte, FONTE_RECEITA
+from app.services.fila_calculo import (
+    enfileirar_calculo, obter_job, solicitar_cancelamento, job_para_dict,
+    STATUS_CONCLUIDO
+)
 from pydantic import BaseModel
 
 
@@ -223,6 +239,9 @@ async def atualizar_tipo_custo(
     
     await db.commit()
     await db.refresh(tipo)
+    
+    # Ordem/alíquotas/incidências podem ter mudado: recompilar o plano de rubricas
+    invalidar_plano_rubricas()
     return tipo
 
 
@@ -234,43 +253,263 @@ async def atualizar_tipo_custo(
 async def calcular_custos_cenario(
     cenario_id: UUID,
     cenario_secao_id: Optional[UUID] = Query(None, description="Calcular apenas uma seção"),
-    ano: Optional[int] = Query(None, description="Ano para cálculo"),
+    ano: Optional[int] = Query(None, description="Ano para cálculo (vazio = toda a janela do cenário)"),
+    incremental: bool = Query(False, description="Recalcular apenas as células alteradas desde o último cálculo"),
+    em_fila: bool = Query(False, description="Enfileirar o cálculo para o worker e retornar o job"),
+    persistencia: Optional[str] = Query(None, description="diff (grava só as mudanças) ou substituir (padrão: configuração)"),
+    forcar: bool = Query(False, description="Recalcular mesmo que as entradas não tenham mudado desde o último cálculo"),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Calcula os custos de um cenário.
-    Remove custos anteriores e recalcula tudo.
+    Remove custos anteriores e recalcula tudo, ou, com incremental=true,
+    recalcula apenas as células registradas em alteracoes-pendentes.
+    
+    Se nenhuma entrada do cálculo mudou desde o último cálculo do mesmo escopo,
+    devolve o resumo anterior com cache=true (forcar=true recalcula mesmo assim).
+    
+    Com em_fila=true o cálculo é executado pelo worker (python -m app.worker):
+    retorna o job imediatamente; acompanhe em /custos/jobs/{job_id}.
+    
+    Depois dos custos, recalcula as receitas do cenário (receitas_calculadas)
+    cujas entradas mudaram.
     """
     # Verificar se cenário existe
     cenario = await db.get(Cenario, cenario_id)
     if not cenario:
         raise HTTPException(status_code=404, detail="Cenário não encontrado")
     
+    if em_fila:
+        job = await enfileirar_calculo(db, cenario_id, cenario_secao_id, ano, incremental, forcar)
+        return {
+            "success": True,
+            "message": "Cálculo enfileirado",
+            "job_id": str(job.id),
+            "job": job_para_dict(job)
+        }
+    
     try:
+        if incremental and not cenario_secao_id and not ano:
+            resumo = await recalcular_custos_incremental(db, cenario_id)
+            return {
+                "success": True,
+                "message": "Custos recalculados com sucesso",
+                **resumo,
+                "receitas": await calcular_e_salvar_receitas(db, cenario_id)
+            }
+        
         resultado = await calcular_e_salvar_custos(
             db=db,
             cenario_id=cenario_id,
             cenario_secao_id=cenario_secao_id,
-            ano=ano
+            ano=ano,
+            persistencia=persistencia,
+            forcar=forcar
         )
         
-        # resultado agora contém { quantidade, rateio }
-        quantidade = resultado.get("quantidade", 0) if isinstance(resultado, dict) else resultado
-        rateio = resultado.get("rateio", {}) if isinstance(resultado, dict) else {}
-        
-        return {
+        # resultado contém { quantidade, rateio, cache, persistencia (modo diff) }
+        cache = resultado["cache"]
+        resposta = {
             "success": True,
-            "message": f"Custos calculados com sucesso",
-            "quantidade": quantidade,
-            "rateio": rateio
+            "message": "Custos sem alteração desde o último cálculo" if cache else f"Custos calculados com sucesso",
+            "quantidade": resultado["quantidade"],
+            "rateio": resultado["rateio"],
+            "cache": cache
         }
+        if "persistencia" in resultado:
+            resposta["persistencia"] = resultado["persistencia"]
+        
+        # Etapa de receitas: regrava receitas_calculadas se as entradas mudaram
+        resposta["receitas"] = await calcular_e_salvar_receitas(db, cenario_id, ano, forcar)
+        return resposta
+    except (RateioReciprocoError, CicloRubricasError) as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
     except Exception as e:
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Erro ao calcular custos: {str(e)}"
         )
 
 
+@router.post("/cenarios/{cenario_id}/simular")
+async def simular_custos_cenario(
+    cenario_id: UUID,
+    pedido: SimulacaoCustosRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Simula os custos do cenário com ajustes de premissas e parâmetros, sem gravar nada.
+    Retorna os agregados no formato do DRE (rubrica, categoria, mês e CC) e, com
+    comparar=true, o resultado sem ajustes e a variação.
+    """
+    try:
+        return await simular_custos(db, cenario_id, pedido)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/cenarios/{cenario_id}/sensibilidade")
+async def analisar_sensibilidade_cenario(
+    cenario_id: UUID,
+    pedido: SensibilidadeCustosRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Avalia uma grade de variações (premissas, parâmetros, reajuste salarial) em uma
+    única passada do motor e retorna o impacto no custo total de cada ponto,
+    ordenado para o gráfico tornado. Nada é gravado.
+    """
+    try:
+        return await analisar_sensibilidade(db, cenario_id, pedido)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/cenarios/{cenario_id}/monte-carlo")
+async def simular_monte_carlo_cenario(
+    cenario_id: UUID,
+    pedido: MonteCarloCustosRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Simulação de Monte Carlo dos custos sobre as distribuições das premissas
+    (absenteísmo, turnover, férias). Retorna faixas de percentis (ex: P50/P90)
+    por mês e por categoria. Informe a semente para reproduzir uma execução.
+    """
+    try:
+        return await simular_monte_carlo(db, cenario_id, pedido)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/cenarios/{cenario_id}/jobs")
+async def list_jobs_cenario(
+    cenario_id: UUID,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db)
+):
+    """Lista os jobs de cálculo mais recentes do cenário."""
+    result = await db.execute(
+        select(JobCalculoCustos)
+        .where(JobCalculoCustos.cenario_id == cenario_id)
+        .order_by(JobCalculoCustos.created_at.desc())
+        .limit(limit)
+    )
+    return [job_para_dict(job) for job in result.scalars().all()]
+
+
+@router.get("/jobs/{job_id}")
+async def get_job_calculo(
+    job_id: UUID,
+    db: AsyncSession = Depends(get_db)
+):
+    """Status e progresso de um job de cálculo."""
+    job = await obter_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job_para_dict(job)
+
+
+@router.get("/jobs/{job_id}/progresso")
+async def get_job_progresso(
+    job_id: UUID,
+    db: AsyncSession = Depends(get_db)
+):
+    """Progresso por seção de um job de cálculo."""
+    job = await obter_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return {
+        "job_id": str(job.id),
+        "status": job.status,
+        **(job.progresso or {"etapa": None, "secoes_total": None, "secoes_concluidas": 0, "registros": 0, "secoes": {}})
+    }
+
+
+@router.get("/jobs/{job_id}/resultado")
+async def get_job_resultado(
+    job_id: UUID,
+    db: AsyncSession = Depends(get_db)
+):
+    """Resumo do cálculo (quantidade, rateio) de um job concluído."""
+    job = await obter_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if job.status != STATUS_CONCLUIDO:
+        raise HTTPException(status_code=409, detail=f"Job não concluído (status: {job.status})")
+    return {
+        "job_id": str(job.id),
+        "success": True,
+        **(job.resultado or {})
+    }
+
+
+@router.post("/jobs/{job_id}/cancelar")
+async def cancelar_job_calculo(
+    job_id: UUID,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Cancela um job de cálculo. Jobs pendentes são cancelados na hora;
+    em execução, o worker interrompe no próximo lote sem gravar custos.
+    """
+    job = await obter_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    try:
+        job = await solicitar_cancelamento(db, job)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return job_para_dict(job)
+
+
+@router.get("/cenarios/{cenario_id}/alteracoes-pendentes")
+async def get_alteracoes_pendentes(
+    cenario_id: UUID,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Resumo das alterações de quadro/premissas ainda não refletidas nos custos calculados.
+    """
+    cenario = await db.get(Cenario, cenario_id)
+    if not cenario:
+        raise HTTPException(status_code=404, detail="Cenário não encontrado")
+    
+    return await listar_alteracoes_pendentes(db, cenario_id)
+
+
+@router.get("/cenarios/{cenario_id}/perfis")
+async def list_perfis_calculo(
+    cenario_id: UUID,
+    operacao: Optional[str] = Query(None, description="custos, rateio ou tecnologia"),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db)
+):
+    """Perfis de execução mais recentes dos cálculos do cenário (tempo, consultas, linhas)."""
+    query = select(CustoPerfilCalculo).where(CustoPerfilCalculo.cenario_id == cenario_id)
+    if operacao:
+        query = query.where(CustoPerfilCalculo.operacao == operacao)
+    result = await db.execute(query.order_by(CustoPerfilCalculo.iniciado_em.desc()).limit(limit))
+    return [perfil_para_dict(perfil, detalhes=False) for perfil in result.scalars().all()]
+
+
+@router.get("/perfis/{perfil_id}")
+async def get_perfil_calculo(
+    perfil_id: UUID,
+    db: AsyncSession = Depends(get_db)
+):
+    """Perfil de uma execução: tempo/consultas/linhas por fase, tempo por rubrica e por seção."""
+    perfil = await db.get(CustoPerfilCalculo, perfil_id)
+    if not perfil:
+        raise HTTPException(status_code=404, detail="Perfil não encontrado")
+    return perfil_para_dict(perfil)
+
+
 @router.post("/cenarios/{cenario_id}/calcular-tecnologia")
 async def calcular_custos_tecnologia_cenario(
     cenario_id: UUID,
@@ -370,6 +609,21 @@ async def listar_custos_cenario(
     return result.scalars().all()
 
 
+@router.get("/calculados/{custo_id}/memoria")
+async def explicar_custo_calculado(
+    custo_id: UUID,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Memória de cálculo de um custo calculado.
+    Usa a memória gravada (linha ou posição/mês) ou reconstrói sob demanda.
+    """
+    explicacao = await explicar_custo(db, custo_id)
+    if not explicacao:
+        raise HTTPException(status_code=404, detail="Custo não encontrado")
+    return explicacao
+
+
 @router.get("/cenarios/{cenario_id}/resumo")
 async def resumo_custos_cenario(
     cenario_id: UUID,
@@ -407,6 +661,20 @@ async def resumo_custos_cenario(
     }
 
 
+def _conta_completa(conta_codigo: str, conta_desc: str) -> str:
+    """Conta contábil no formato "CODIGO - DESCRICAO" (ou só a parte preenchida)."""
+    return f"{conta_codigo} - {conta_desc}" if conta_codigo and conta_desc else conta_codigo or conta_desc or ""
+
+
+async def _ano_inicio_cenario(db: AsyncSession, cenario_id: UUID) -> int:
+    """Ano inicial do cenário (404 se não existir), sem carregar os relacionamentos do modelo."""
+    result = await db.execute(select(Cenario.ano_inicio).where(Cenario.id == cenario_id))
+    ano_inicio = result.scalar_one_or_none()
+    if ano_inicio is None:
+        raise HTTPException(status_code=404, detail="Cenário não encontrado")
+    return ano_inicio
+
+
 @router.get("/cenarios/{cenario_id}/dre", response_model=DREResponse)
 async def gerar_dre_cenario(
     cenario_id: UUID,
@@ -414,343 +682,79 @@ async def gerar_dre_cenario(
     ano: Optional[int] = Query(None, description="Ano do DRE"),
     db: AsyncSession = Depends(get_db)
 ):
-    """Gera o DRE (Demonstrativo de Resultado) do cenário."""
-    
-    # Buscar cenário para pegar o ano padrão
-    cenario = await db.get(Cenario, cenario_id)
-    if not cenario:
-        raise HTTPException(status_code=404, detail="Cenário não encontrado")
+    """
+    Gera o DRE (Demonstrativo de Resultado) do cenário.
     
+    Lê o resumo pré-agregado (dre_resumo), atualizado ao fim de cada cálculo:
+    custos de pessoal, tecnologia (TEC_), custos diretos (DIR_) e receitas
+    (REC_). Não grava nada: "desatualizado" indica receitas ou fontes do
+    resumo com entradas alteradas desde o último cálculo (ver dre_resumo).
+    """
+    ano_inicio = await _ano_inicio_cenario(db, cenario_id)
     if not ano:
-        ano = cenario.ano_inicio
+        ano = ano_inicio
+    
+    desatualizado = not (
+        await receitas_atualizadas(db, cenario_id, [ano])
+        and await dre_resumo_atualizado(db, cenario_id)
+    )
     
     # ============================================
-    # 1. Buscar custos de PESSOAL agrupados por tipo e mês
+    # 1. Linhas do resumo por mês (uma consulta no índice cenário/ano)
     # ============================================
     query = select(
-        TipoCusto.codigo,
-        TipoCusto.nome,
-        TipoCusto.categoria,
-        TipoCusto.conta_contabil_codigo,
-        TipoCusto.conta_contabil_descricao,
-        CustoCalculado.mes,
-        func.sum(CustoCalculado.valor_calculado).label("valor")
-    ).join(
-        CustoCalculado, CustoCalculado.tipo_custo_id == TipoCusto.id
+        DREResumo.fonte,
+        DREResumo.linha_codigo,
+        DREResumo.linha_nome,
+        DREResumo.categoria,
+        DREResumo.conta_contabil_codigo,
+        DREResumo.conta_contabil_descricao,
+        DREResumo.mes,
+        func.sum(DREResumo.valor).label("valor")
     ).where(
-        CustoCalculado.cenario_id == cenario_id,
-        CustoCalculado.ano == ano
+        DREResumo.cenario_id == cenario_id,
+        DREResumo.ano == ano
     ).group_by(
-        TipoCusto.codigo,
-        TipoCusto.nome,
-        TipoCusto.categoria,
-        TipoCusto.conta_contabil_codigo,
-        TipoCusto.conta_contabil_descricao,
-        CustoCalculado.mes
-    ).order_by(TipoCusto.codigo, CustoCalculado.mes)
+        DREResumo.fonte,
+        DREResumo.linha_codigo,
+        DREResumo.linha_nome,
+        DREResumo.categoria,
+        DREResumo.conta_contabil_codigo,
+        DREResumo.conta_contabil_descricao,
+        DREResumo.mes
+    ).order_by(ordem_fonte(), DREResumo.linha_codigo, DREResumo.mes)
     
     if cenario_secao_id:
-        query = query.where(CustoCalculado.cenario_secao_id == cenario_secao_id)
+        # Receitas não têm seção: entram em todas
+        query = query.where(or_(
+            DREResumo.cenario_secao_id == cenario_secao_id,
+            DREResumo.fonte == FONTE_RECEITA
+        ))
     
     result = await db.execute(query)
-    rows = result.fetchall()
     
-    # Organizar dados por rubrica
+    # Organizar dados por linha
     rubricas_dict = {}
-    for row in rows:
-        codigo = row.codigo
+    for row in result.all():
+        codigo = row.linha_codigo
         if codigo not in rubricas_dict:
-            conta_codigo = row.conta_contabil_codigo or ""
-            conta_desc = row.conta_contabil_descricao or ""
-            conta_completa = f"{conta_codigo} - {conta_desc}" if conta_codigo and conta_desc else conta_codigo or conta_desc or ""
-            
             rubricas_dict[codigo] = {
                 "tipo_custo_codigo": codigo,
-                "tipo_custo_nome": row.nome,
+                "tipo_custo_nome": row.linha_nome,
                 "categoria": row.categoria,
-                "conta_contabil_codigo": conta_codigo,
-                "conta_contabil_descricao": conta_desc,
-                "conta_contabil_completa": conta_completa,
+                "conta_contabil_codigo": row.conta_contabil_codigo,
+                "conta_contabil_descricao": row.conta_contabil_descricao,
+                "conta_contabil_completa": _conta_completa(row.conta_contabil_codigo, row.conta_contabil_descricao),
                 "valores_mensais": [0.0] * 12,
                 "total": 0.0
             }
         
-        mes_idx = row.mes - 1
         valor = float(row.valor or 0)
-        rubricas_dict[codigo]["valores_mensais"][mes_idx] = valor
+        rubricas_dict[codigo]["valores_mensais"][row.mes - 1] += valor
         rubricas_dict[codigo]["total"] += valor
     
     # ============================================
-    # 2. Buscar custos de TECNOLOGIA agrupados por produto e mês
-    # ============================================
-    from app.db.models.orcamento import ProdutoTecnologia
-    
-    query_tec = select(
-        ProdutoTecnologia.codigo,
-        ProdutoTecnologia.nome,
-        ProdutoTecnologia.categoria,
-        ProdutoTecnologia.conta_contabil_codigo,
-        ProdutoTecnologia.conta_contabil_descricao,
-        CustoTecnologia.mes,
-        func.sum(CustoTecnologia.valor_calculado).label("valor")
-    ).join(
-        CustoTecnologia, CustoTecnologia.produto_id == ProdutoTecnologia.id
-    ).where(
-        CustoTecnologia.cenario_id == cenario_id,
-        CustoTecnologia.ano == ano
-    ).group_by(
-        ProdutoTecnologia.codigo,
-        ProdutoTecnologia.nome,
-        ProdutoTecnologia.categoria,
-        ProdutoTecnologia.conta_contabil_codigo,
-        ProdutoTecnologia.conta_contabil_descricao,
-        CustoTecnologia.mes
-    ).order_by(ProdutoTecnologia.codigo, CustoTecnologia.mes)
-    
-    if cenario_secao_id:
-        query_tec = query_tec.where(CustoTecnologia.cenario_secao_id == cenario_secao_id)
-    
-    result_tec = await db.execute(query_tec)
-    rows_tec = result_tec.fetchall()
-    
-    # Adicionar custos de tecnologia ao dicionário
-    for row in rows_tec:
-        codigo = f"TEC_{row.codigo}"  # Prefixo para diferenciar de custos de pessoal
-        if codigo not in rubricas_dict:
-            conta_codigo = row.conta_contabil_codigo or ""
-            conta_desc = row.conta_contabil_descricao or ""
-            conta_completa = f"{conta_codigo} - {conta_desc}" if conta_codigo and conta_desc else conta_codigo or conta_desc or ""
-            
-            rubricas_dict[codigo] = {
-                "tipo_custo_codigo": codigo,
-                "tipo_custo_nome": f"{row.nome} (Tecnologia)",
-                "categoria": f"TECNOLOGIA_{row.categoria}",
-                "conta_contabil_codigo": conta_codigo,
-                "conta_contabil_descricao": conta_desc,
-                "conta_contabil_completa": conta_completa,
-                "valores_mensais": [0.0] * 12,
-                "total": 0.0
-            }
-        
-        mes_idx = row.mes - 1
-        valor = float(row.valor or 0)
-        rubricas_dict[codigo]["valores_mensais"][mes_idx] = valor
-        rubricas_dict[codigo]["total"] += valor
-    
-    # ============================================
-    # 3. Buscar CUSTOS DIRETOS agrupados por item de custo e mês
-    # ============================================
-    from app.db.models.orcamento import CustoDireto, CentroCusto, QuadroPessoal
-    
-    # Calcular custos diretos para cada mês do cenário
-    mes_inicio = cenario.mes_inicio
-    mes_fim = cenario.mes_fim
-    ano_inicio_cenario = cenario.ano_inicio
-    ano_fim_cenario = cenario.ano_fim
-    
-    # Buscar custos diretos ativos do cenário
-    query_diretos = select(CustoDireto).options(
-        selectinload(CustoDireto.item_custo),
-        selectinload(CustoDireto.centro_custo)
-    ).where(
-        CustoDireto.cenario_id == cenario_id,
-        CustoDireto.ativo == True
-    )
-    
-    if cenario_secao_id:
-        query_diretos = query_diretos.where(CustoDireto.cenario_secao_id == cenario_secao_id)
-    
-    result_diretos = await db.execute(query_diretos)
-    custos_diretos = result_diretos.scalars().all()
-    
-    # OTIMIZAÇÃO: Pré-carregar TODO o quadro de pessoal de uma vez e criar cache
-    MESES = ['jan', 'fev', 'mar', 'abr', 'mai', 'jun', 'jul', 'ago', 'set', 'out', 'nov', 'dez']
-    
-    # Buscar todo o quadro de pessoal do cenário (1 query apenas)
-    result_quadro = await db.execute(
-        select(QuadroPessoal).where(
-            QuadroPessoal.cenario_id == cenario_id,
-            QuadroPessoal.ativo == True
-        )
-    )
-    todos_quadros = result_quadro.scalars().all()
-    
-    # Criar caches indexados para acesso O(1)
-    # Cache por centro de custo: {(cc_id, mes_idx): total_hc}
-    hc_cache_por_cc: dict = {}
-    # Cache por função: {(funcao_id, mes_idx): total_hc}
-    hc_cache_por_funcao: dict = {}
-    # Cache geral: {mes_idx: total_hc}
-    hc_cache_geral: dict = {i: 0.0 for i in range(12)}
-    
-    for q in todos_quadros:
-        for mes_idx, mes_key in enumerate(MESES):
-            qtd = float(getattr(q, f"qtd_{mes_key}", 0) or 0)
-            if qtd > 0:
-                # Cache por CC
-                cc_key = (q.centro_custo_id, mes_idx)
-                hc_cache_por_cc[cc_key] = hc_cache_por_cc.get(cc_key, 0.0) + qtd
-                
-                # Cache por função
-                func_key = (q.funcao_id, mes_idx)
-                hc_cache_por_funcao[func_key] = hc_cache_por_funcao.get(func_key, 0.0) + qtd
-                
-                # Cache geral
-                hc_cache_geral[mes_idx] += qtd
-    
-    def obter_hc_cache(centro_custo_id, funcao_id, mes_idx):
-        """Obtém HC do cache (acesso O(1) sem query)."""
-        if funcao_id:
-            return hc_cache_por_funcao.get((funcao_id, mes_idx), 0.0)
-        elif centro_custo_id:
-            return hc_cache_por_cc.get((centro_custo_id, mes_idx), 0.0)
-        else:
-            return hc_cache_geral.get(mes_idx, 0.0)
-    
-    # Para cada custo direto, calcular o valor por mês
-    for custo in custos_diretos:
-        if not custo.item_custo:
-            continue
-            
-        item = custo.item_custo
-        codigo = f"DIR_{item.codigo}"
-        
-        if codigo not in rubricas_dict:
-            conta_codigo = item.conta_contabil_codigo or ""
-            conta_desc = item.conta_contabil_descricao or ""
-            conta_completa = f"{conta_codigo} - {conta_desc}" if conta_codigo and conta_desc else conta_codigo or conta_desc or ""
-            
-            rubricas_dict[codigo] = {
-                "tipo_custo_codigo": codigo,
-                "tipo_custo_nome": f"{item.nome} (Custo Direto)",
-                "categoria": f"CUSTO_DIRETO_{item.categoria}",
-                "conta_contabil_codigo": conta_codigo,
-                "conta_contabil_descricao": conta_desc,
-                "conta_contabil_completa": conta_completa,
-                "valores_mensais": [0.0] * 12,
-                "total": 0.0
-            }
-        
-        # Distribuir valor nos meses do ano selecionado
-        for mes in range(1, 13):
-            # Verificar se o mês está dentro do período do cenário
-            if ano == ano_inicio_cenario and mes < mes_inicio:
-                continue
-            if ano == ano_fim_cenario and mes > mes_fim:
-                continue
-            if ano < ano_inicio_cenario or ano > ano_fim_cenario:
-                continue
-            
-            mes_idx = mes - 1
-            
-            # Calcular valor mensal baseado no tipo
-            valor_mensal = 0.0
-            if custo.tipo_valor == "FIXO":
-                valor_mensal = float(custo.valor_fixo or 0)
-            elif custo.tipo_valor == "VARIAVEL":
-                # Calcular baseado em HC/PA do quadro de pessoal
-                valor_unitario = float(custo.valor_unitario_variavel or 0)
-                
-                if custo.unidade_medida == "HC":
-                    # OTIMIZAÇÃO: Usar cache de HC (sem query)
-                    hc = obter_hc_cache(
-                        custo.centro_custo_id if custo.tipo_medida in ["HC_TOTAL", None] else None,
-                        custo.funcao_base_id if custo.tipo_medida == "HC_FUNCAO" else None,
-                        mes_idx
-                    )
-                    valor_mensal = valor_unitario * hc
-                elif custo.unidade_medida == "PA":
-                    # PA = Posição de Atendimento (usar mesmo cálculo de HC por simplicidade)
-                    pa = obter_hc_cache(
-                        custo.centro_custo_id,
-                        custo.funcao_base_id if custo.tipo_medida == "PA_FUNCAO" else None,
-                        mes_idx
-                    )
-                    valor_mensal = valor_unitario * pa
-                else:
-                    # Unidade genérica, usar valor unitário direto
-                    valor_mensal = valor_unitario
-                    
-            elif custo.tipo_valor == "FIXO_VARIAVEL":
-                valor_fixo = float(custo.valor_fixo or 0)
-                valor_unitario = float(custo.valor_unitario_variavel or 0)
-                
-                # OTIMIZAÇÃO: Usar cache de HC (sem query)
-                hc = obter_hc_cache(
-                    custo.centro_custo_id,
-                    custo.funcao_base_id,
-                    mes_idx
-                )
-                valor_mensal = valor_fixo + (valor_unitario * hc)
-            
-            # Aplicar rateio se existir
-            if custo.tipo_calculo == "rateio" and custo.rateio_percentual:
-                valor_mensal = valor_mensal * float(custo.rateio_percentual) / 100
-            
-            rubricas_dict[codigo]["valores_mensais"][mes_idx] += valor_mensal
-            rubricas_dict[codigo]["total"] += valor_mensal
-    
-    # ============================================
-    # 4. Buscar RECEITAS do cenário
-    # ============================================
-    from app.db.models.orcamento import ReceitaCenario, ReceitaPremissaMes, TipoReceita, Feriado
-    from app.api.v1.orcamento.receitas import _calcular_receita_mes
-    
-    # Buscar receitas ativas do cenário
-    query_receitas = select(ReceitaCenario).where(
-        ReceitaCenario.cenario_id == cenario_id,
-        ReceitaCenario.ativo == True
-    ).options(
-        selectinload(ReceitaCenario.tipo_receita),
-        selectinload(ReceitaCenario.centro_custo),
-        selectinload(ReceitaCenario.premissas)
-    )
-    
-    result_receitas = await db.execute(query_receitas)
-    receitas = result_receitas.scalars().all()
-    
-    # Calcular cada receita para cada mês do ano
-    for receita in receitas:
-        tipo_receita = receita.tipo_receita
-        if not tipo_receita:
-            continue
-        
-        codigo = f"REC_{tipo_receita.codigo}"
-        
-        # Inicializar entrada se não existir
-        if codigo not in rubricas_dict:
-            conta_codigo = tipo_receita.conta_contabil_codigo or ""
-            conta_desc = tipo_receita.conta_contabil_descricao or ""
-            conta_completa = f"{conta_codigo} - {conta_desc}" if conta_codigo and conta_desc else conta_codigo or conta_desc or ""
-            
-            rubricas_dict[codigo] = {
-                "tipo_custo_codigo": codigo,
-                "tipo_custo_nome": f"{tipo_receita.nome}",
-                "categoria": "RECEITA",
-                "conta_contabil_codigo": conta_codigo,
-                "conta_contabil_descricao": conta_desc,
-                "conta_contabil_completa": conta_completa,
-                "valores_mensais": [0.0] * 12,
-                "total": 0.0
-            }
-        
-        # Calcular receita para cada mês do ano solicitado
-        for mes in range(1, 13):
-            try:
-                resultado = await _calcular_receita_mes(receita, ano, mes, db)
-                valor = resultado.valor_calculado
-                
-                # Receitas são valores positivos (créditos)
-                # Invertemos o sinal para que apareçam como positivos no DRE
-                rubricas_dict[codigo]["valores_mensais"][mes - 1] += valor
-                rubricas_dict[codigo]["total"] += valor
-            except Exception as e:
-                # Se houver erro no cálculo, apenas ignora o mês
-                print(f"Erro ao calcular receita {receita.id} mês {mes}: {e}")
-                continue
-    
-    # ============================================
-    # 5. Converter para lista de DRELinha e calcular totais
+    # 2. Converter para lista de DRELinha e calcular totais
     # ============================================
     linhas = []
     total_geral = 0
@@ -782,7 +786,8 @@ async def gerar_dre_cenario(
         cenario_secao_id=cenario_secao_id,
         ano=ano,
         linhas=linhas,
-        total_geral=total_geral
+        total_geral=total_geral,
+        desatualizado=desatualizado
     )
 
 
@@ -802,18 +807,15 @@ async def gerar_dre_por_cc(
     """
     Gera o DRE agrupado por Centro de Custo com separação de custos diretos e indiretos.
     
-    Custos Indiretos são aqueles que vieram de rateio (CC POOL).
+    Custos Indiretos são aqueles que vieram de rateio (CC POOL). Lê o mesmo
+    resumo pré-agregado do DRE consolidado (custos de tecnologia não têm CC e
+    ficam só no consolidado).
     """
-    from app.db.models.orcamento import CentroCusto, ReceitaCenario, CustoDireto, QuadroPessoal, ProdutoTecnologia
-    from app.api.v1.orcamento.receitas import _calcular_receita_mes
-    
-    # Buscar cenário
-    cenario = await db.get(Cenario, cenario_id)
-    if not cenario:
-        raise HTTPException(status_code=404, detail="Cenário não encontrado")
+    from app.db.models.orcamento import CentroCusto
     
+    ano_inicio = await _ano_inicio_cenario(db, cenario_id)
     if not ano:
-        ano = cenario.ano_inicio
+        ano = ano_inicio
     
     # Buscar CCs operacionais (excluindo POOLs)
     query_ccs = select(CentroCusto).where(
@@ -826,198 +828,63 @@ async def gerar_dre_por_cc(
     result_ccs = await db.execute(query_ccs)
     centros_custo = result_ccs.scalars().all()
     
-    # Buscar todos os custos calculados do cenário/ano
-    query_custos = select(
-        CustoCalculado,
-        TipoCusto.codigo.label("tipo_codigo"),
-        TipoCusto.nome.label("tipo_nome"),
-        TipoCusto.categoria.label("tipo_categoria"),
-        TipoCusto.conta_contabil_codigo,
-        TipoCusto.conta_contabil_descricao
-    ).join(
-        TipoCusto, CustoCalculado.tipo_custo_id == TipoCusto.id
-    ).where(
-        CustoCalculado.cenario_id == cenario_id,
-        CustoCalculado.ano == ano
+    desatualizado = not (
+        await receitas_atualizadas(db, cenario_id, [ano])
+        and await dre_resumo_atualizado(db, cenario_id)
     )
     
-    result_custos = await db.execute(query_custos)
-    custos_rows = result_custos.fetchall()
-    
-    # Organizar custos por CC
-    custos_por_cc: dict = {}
-    for row in custos_rows:
-        custo = row[0]
-        cc_id = custo.centro_custo_id
-        if not cc_id:
-            continue  # Ignorar custos sem centro de custo
-        if cc_id not in custos_por_cc:
-            custos_por_cc[cc_id] = []
-        
-        # Identificar se é custo indireto (rateado)
-        memoria = custo.memoria_calculo or {}
-        origem = "INDIRETO" if memoria.get("tipo") == "rateio" else "DIRETO"
-        
-        conta_codigo = row.conta_contabil_codigo or ""
-        conta_desc = row.conta_contabil_descricao or ""
-        conta_completa = f"{conta_codigo} - {conta_desc}" if conta_codigo and conta_desc else conta_codigo or conta_desc or ""
-        
-        custos_por_cc[cc_id].append({
-            "tipo_codigo": row.tipo_codigo,
-            "tipo_nome": row.tipo_nome,
-            "categoria": row.tipo_categoria,
-            "conta_codigo": conta_codigo,
-            "conta_desc": conta_desc,
-            "conta_completa": conta_completa,
-            "mes": custo.mes,
-            "valor": float(custo.valor_calculado or 0),
-            "origem": origem,
-            "origem_pool": memoria.get("grupo_nome") if origem == "INDIRETO" else None
-        })
-    
-    # Buscar custos diretos (aluguel, etc.) - CustoDireto
-    query_custos_diretos = select(
-        CustoDireto,
-        ProdutoTecnologia.codigo.label("item_codigo"),
-        ProdutoTecnologia.nome.label("item_nome"),
-        ProdutoTecnologia.categoria.label("item_categoria"),
-        ProdutoTecnologia.conta_contabil_codigo,
-        ProdutoTecnologia.conta_contabil_descricao
-    ).join(
-        ProdutoTecnologia, CustoDireto.item_custo_id == ProdutoTecnologia.id
-    ).where(
-        CustoDireto.cenario_id == cenario_id,
-        CustoDireto.ativo == True
-    )
-    
-    result_custos_diretos = await db.execute(query_custos_diretos)
-    custos_diretos_rows = result_custos_diretos.fetchall()
-    
-    for row in custos_diretos_rows:
-        custo_direto = row[0]
-        cc_id = custo_direto.centro_custo_id
-        if not cc_id:
-            continue
-        if cc_id not in custos_por_cc:
-            custos_por_cc[cc_id] = []
-        
-        conta_codigo = row.conta_contabil_codigo or ""
-        conta_desc = row.conta_contabil_descricao or ""
-        conta_completa = f"{conta_codigo} - {conta_desc}" if conta_codigo and conta_desc else conta_codigo or conta_desc or ""
-        
-        # Calcular valor mensal
-        valor_mensal = float(custo_direto.valor_fixo or 0)
-        
-        # Para variável, precisamos calcular baseado no HC/PA do CC
-        if custo_direto.tipo_valor in ["VARIAVEL", "FIXO_VARIAVEL"] and custo_direto.valor_unitario_variavel:
-            # Por simplicidade, usar um multiplicador médio (pode ser refinado depois)
-            # TODO: Calcular baseado no HC/PA real do CC
-            valor_variavel = float(custo_direto.valor_unitario_variavel or 0) * 100  # placeholder
-            valor_mensal += valor_variavel
-        
-        # Adicionar para cada mês
-        for mes in range(1, 13):
-            custos_por_cc[cc_id].append({
-                "tipo_codigo": f"CD_{row.item_codigo}",
-                "tipo_nome": row.item_nome,
-                "categoria": row.item_categoria or "CUSTO_DIRETO",
-                "conta_codigo": conta_codigo,
-                "conta_desc": conta_desc,
-                "conta_completa": conta_completa,
-                "mes": mes,
-                "valor": valor_mensal,
-                "origem": "DIRETO",
-                "origem_pool": None
-            })
-    
-    # Buscar custos de tecnologia - CustoTecnologia
-    query_custos_tec = select(
-        CustoTecnologia,
-        ProdutoTecnologia.codigo.label("prod_codigo"),
-        ProdutoTecnologia.nome.label("prod_nome"),
-        ProdutoTecnologia.categoria.label("prod_categoria"),
-        ProdutoTecnologia.conta_contabil_codigo,
-        ProdutoTecnologia.conta_contabil_descricao
-    ).join(
-        ProdutoTecnologia, CustoTecnologia.produto_id == ProdutoTecnologia.id
+    # Linhas do resumo por CC, origem e mês (uma consulta no índice cenário/ano)
+    query = select(
+        DREResumo.centro_custo_id,
+        DREResumo.fonte,
+        DREResumo.linha_codigo,
+        DREResumo.linha_nome,
+        DREResumo.categoria,
+        DREResumo.conta_contabil_codigo,
+        DREResumo.conta_contabil_descricao,
+        DREResumo.origem,
+        DREResumo.origem_pool,
+        DREResumo.mes,
+        func.sum(DREResumo.valor).label("valor")
     ).where(
-        CustoTecnologia.cenario_id == cenario_id,
-        CustoTecnologia.ano == ano
-    )
-    
-    result_custos_tec = await db.execute(query_custos_tec)
-    custos_tec_rows = result_custos_tec.fetchall()
+        DREResumo.cenario_id == cenario_id,
+        DREResumo.ano == ano,
+        DREResumo.centro_custo_id.isnot(None)
+    ).group_by(
+        DREResumo.centro_custo_id,
+        DREResumo.fonte,
+        DREResumo.linha_codigo,
+        DREResumo.linha_nome,
+        DREResumo.categoria,
+        DREResumo.conta_contabil_codigo,
+        DREResumo.conta_contabil_descricao,
+        DREResumo.origem,
+        DREResumo.origem_pool,
+        DREResumo.mes
+    ).order_by(ordem_fonte(), DREResumo.linha_codigo, DREResumo.mes)
     
-    for row in custos_tec_rows:
-        custo_tec = row[0]
-        cc_id = custo_tec.centro_custo_id
-        if not cc_id:
-            continue
-        if cc_id not in custos_por_cc:
-            custos_por_cc[cc_id] = []
-        
-        conta_codigo = row.conta_contabil_codigo or ""
-        conta_desc = row.conta_contabil_descricao or ""
-        conta_completa = f"{conta_codigo} - {conta_desc}" if conta_codigo and conta_desc else conta_codigo or conta_desc or ""
-        
-        custos_por_cc[cc_id].append({
-            "tipo_codigo": f"TEC_{row.prod_codigo}",
-            "tipo_nome": f"{row.prod_nome} (Tecnologia)",
-            "categoria": f"TECNOLOGIA_{row.prod_categoria or 'GERAL'}",
-            "conta_codigo": conta_codigo,
-            "conta_desc": conta_desc,
-            "conta_completa": conta_completa,
-            "mes": custo_tec.mes,
-            "valor": float(custo_tec.valor_calculado or 0),
-            "origem": "DIRETO",
-            "origem_pool": None
-        })
+    if centro_custo_id:
+        query = query.where(DREResumo.centro_custo_id == centro_custo_id)
     
-    # Buscar receitas por CC
-    query_receitas = select(ReceitaCenario).where(
-        ReceitaCenario.cenario_id == cenario_id,
-        ReceitaCenario.ativo == True
-    ).options(
-        selectinload(ReceitaCenario.tipo_receita),
-        selectinload(ReceitaCenario.centro_custo),
-        selectinload(ReceitaCenario.premissas)
-    )
-    result_receitas = await db.execute(query_receitas)
-    receitas = result_receitas.scalars().all()
+    result = await db.execute(query)
     
+    # Organizar custos e receitas por CC
+    custos_por_cc: dict = {}
     receitas_por_cc: dict = {}
-    for receita in receitas:
-        cc_id = receita.centro_custo_id
-        if not cc_id:
-            continue
-        if cc_id not in receitas_por_cc:
-            receitas_por_cc[cc_id] = []
-        
-        tipo_receita = receita.tipo_receita
-        if not tipo_receita:
-            continue
-        
-        conta_codigo = tipo_receita.conta_contabil_codigo or ""
-        conta_desc = tipo_receita.conta_contabil_descricao or ""
-        conta_completa = f"{conta_codigo} - {conta_desc}" if conta_codigo and conta_desc else conta_codigo or conta_desc or ""
-        
-        for mes in range(1, 13):
-            try:
-                resultado = await _calcular_receita_mes(receita, ano, mes, db)
-                valor = resultado.valor_calculado
-                receitas_por_cc[cc_id].append({
-                    "tipo_codigo": f"REC_{tipo_receita.codigo}",
-                    "tipo_nome": tipo_receita.nome,
-                    "categoria": "RECEITA",
-                    "conta_codigo": conta_codigo,
-                    "conta_desc": conta_desc,
-                    "conta_completa": conta_completa,
-                    "mes": mes,
-                    "valor": valor,
-                    "origem": "DIRETO"
-                })
-            except:
-                continue
+    for row in result.all():
+        destino = receitas_por_cc if row.fonte == FONTE_RECEITA else custos_por_cc
+        destino.setdefault(row.centro_custo_id, []).append({
+            "tipo_codigo": row.linha_codigo,
+            "tipo_nome": row.linha_nome,
+            "categoria": row.categoria,
+            "conta_codigo": row.conta_contabil_codigo,
+            "conta_desc": row.conta_contabil_descricao,
+            "conta_completa": _conta_completa(row.conta_contabil_codigo, row.conta_contabil_descricao),
+            "mes": row.mes,
+            "valor": float(row.valor or 0),
+            "origem": row.origem,
+            "origem_pool": row.origem_pool
+        })
     
     # Montar resposta por CC
     dre_centros: List[DRECentroCusto] = []
@@ -1132,7 +999,8 @@ async def gerar_dre_por_cc(
         ano=ano,
         visao="por_cc",
         centros_custo=dre_centros,
-        consolidado=consolidado
+        consolidado=consolidado,
+        desatualizado=desatualizado
     )
 
 
@@ -11,6 +11,7 @@ from sqlalchemy import select, extract
 
 from app.db.session import get_db
 from app.db.models import Feriado
+from app.services.calendario import invalidar_calendario
 from app.schemas.orcamento import (
     FeriadoCreate,
     FeriadoUpdate,
@@ -175,6 +176,7 @@ async def create_feriado(
     feriado = Feriado(**data.model_dump())
     db.add(feriado)
     await db.commit()
+    invalidar_calendario()
     await db.refresh(feriado)
     
     return feriado
@@ -204,6 +206,7 @@ async def update_feriado(
         setattr(feriado, field, value)
     
     await db.commit()
+    invalidar_calendario()
     await db.refresh(feriado)
     
     return feriado
@@ -228,6 +231,7 @@ async def delete_feriado(
     
     await db.delete(feriado)
     await db.commit()
+    invalidar_calendario()
 
 
 @router.post("/gerar-nacionais/{ano}", response_model=List[FeriadoResponse])
@@ -272,6 +276,7 @@ async def gerar_feriados_nacionais(
         criados.append(feriado)
     
     await db.commit()
+    invalidar_calendario()
     
     for f in criados:
         await db.refresh(f)
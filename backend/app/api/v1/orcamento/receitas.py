@@ -5,18 +5,16 @@ Gerencia receitas alocadas em centros de custo com premissas mensais.
 
 from typing import List, Optional
 from uuid import UUID
-from datetime import date
-import calendar
 
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import select, func, and_
+from sqlalchemy import select, and_, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from app.db.session import get_db
 from app.db.models.orcamento import (
-    ReceitaCenario, ReceitaPremissaMes, TipoReceita,
-    Cenario, CentroCusto, Funcao, QuadroPessoal, Feriado, Secao
+    ReceitaCenario, ReceitaPremissaMes, TipoReceita, ReceitaCalculada,
+    Cenario, CentroCusto, Funcao, Secao
 )
 from app.schemas.orcamento import (
     ReceitaCenarioCreate,
@@ -26,7 +24,15 @@ from app.schemas.orcamento import (
     ReceitaPremissaMesResponse,
     ReceitaPremissasBulkUpdate,
     ReceitaCalculadaResponse,
+    MetaReceitaRequest,
 )
+from app.services.meta_receita import buscar_meta_receita
+from app.services.calendario import obter_calendario, RegimeTrabalho
+from app.services.calculo_receitas import (
+    carregar_receitas, calcular_receitas, garantir_receitas_calculadas,
+    calcular_e_salvar_receitas, resposta_gravada
+)
+from app.services.calculo_custos import periodos_cenario
 
 
 # ============================================
@@ -34,44 +40,9 @@ from app.schemas.orcamento import (
 # ============================================
 
 async def _calcular_dias_uteis(ano: int, mes: int, uf: Optional[str], db: AsyncSession) -> int:
-    """Calcula dias úteis do mês (dias totais - fins de semana - feriados).
-    Versão legada mantida para compatibilidade."""
-    # Total de dias no mês
-    _, dias_mes = calendar.monthrange(ano, mes)
-    
-    # Contar fins de semana
-    fins_semana = 0
-    for dia in range(1, dias_mes + 1):
-        data = date(ano, mes, dia)
-        if data.weekday() >= 5:  # Sábado = 5, Domingo = 6
-            fins_semana += 1
-    
-    # Buscar feriados do mês
-    query = select(Feriado).where(
-        func.extract('month', Feriado.data) == mes,
-        func.extract('year', Feriado.data) == ano
-    )
-    
-    # Feriados nacionais
-    query_nacional = query.where(Feriado.tipo == "NACIONAL")
-    result = await db.execute(query_nacional)
-    feriados_nacionais = result.scalars().all()
-    
-    # Feriados estaduais (se UF informado)
-    feriados_estaduais = []
-    if uf:
-        query_estadual = query.where(Feriado.tipo == "ESTADUAL", Feriado.uf == uf)
-        result = await db.execute(query_estadual)
-        feriados_estaduais = result.scalars().all()
-    
-    # Contar feriados que não caem no fim de semana
-    feriados_uteis = 0
-    for f in feriados_nacionais + feriados_estaduais:
-        if f.data.weekday() < 5:  # Dia útil
-            feriados_uteis += 1
-    
-    dias_uteis = dias_mes - fins_semana - feriados_uteis
-    return max(dias_uteis, 0)
+    """Dias úteis do mês (seg-sex, menos feriados nacionais e estaduais da UF)."""
+    calendario = await obter_calendario(db, ano)
+    return int(calendario.dias_uteis(ano, mes, RegimeTrabalho(uf=uf)))
 
 
 async def _calcular_dias_uteis_secao(ano: int, mes: int, secao_id: UUID, db: AsyncSession) -> float:
@@ -85,87 +56,13 @@ async def _calcular_dias_uteis_secao(ano: int, mes: int, secao_id: UUID, db: Asy
     - uf/cidade da seção para feriados estaduais/municipais
     
     Retorna float para suportar dias parciais (ex: meio período nos sábados).
+    Sem seção, usa o regime padrão (seg-sex, feriados nacionais).
     """
-    # Buscar configuração da seção
     result = await db.execute(select(Secao).where(Secao.id == secao_id))
     secao = result.scalar_one_or_none()
     
-    if not secao:
-        # Fallback para cálculo padrão sem seção
-        return float(await _calcular_dias_uteis(ano, mes, None, db))
-    
-    # Total de dias no mês
-    _, dias_mes = calendar.monthrange(ano, mes)
-    
-    # Contar sábados e domingos
-    sabados = 0
-    domingos = 0
-    for dia in range(1, dias_mes + 1):
-        data = date(ano, mes, dia)
-        if data.weekday() == 5:  # Sábado
-            sabados += 1
-        elif data.weekday() == 6:  # Domingo
-            domingos += 1
-    
-    # Calcular desconto de fins de semana
-    # trabalha_sabado: 0=desconta tudo, 0.5=desconta metade, 1=não desconta
-    fator_sabado = float(secao.trabalha_sabado or 0)
-    desconto_sabados = sabados * (1 - fator_sabado)
-    
-    # Domingos: trabalha=não desconta, não trabalha=desconta tudo
-    desconto_domingos = 0 if secao.trabalha_domingo else domingos
-    
-    # Buscar feriados do mês
-    query_base = select(Feriado).where(
-        func.extract('month', Feriado.data) == mes,
-        func.extract('year', Feriado.data) == ano
-    )
-    
-    # Feriados nacionais
-    feriados_nacionais = []
-    if not secao.trabalha_feriado_nacional:
-        result = await db.execute(query_base.where(Feriado.tipo == "NACIONAL"))
-        feriados_nacionais = result.scalars().all()
-    
-    # Feriados estaduais
-    feriados_estaduais = []
-    if not secao.trabalha_feriado_estadual and secao.uf:
-        result = await db.execute(
-            query_base.where(Feriado.tipo == "ESTADUAL", Feriado.uf == secao.uf)
-        )
-        feriados_estaduais = result.scalars().all()
-    
-    # Feriados municipais
-    feriados_municipais = []
-    if not secao.trabalha_feriado_municipal and secao.uf and secao.cidade:
-        result = await db.execute(
-            query_base.where(
-                Feriado.tipo == "MUNICIPAL",
-                Feriado.uf == secao.uf,
-                Feriado.cidade == secao.cidade
-            )
-        )
-        feriados_municipais = result.scalars().all()
-    
-    # Contar feriados que não caem no fim de semana (evitar duplicidade)
-    feriados_uteis = 0
-    for f in feriados_nacionais + feriados_estaduais + feriados_municipais:
-        dia_semana = f.data.weekday()
-        
-        # Se cai em dia de semana (seg-sex), sempre desconta
-        if dia_semana < 5:
-            feriados_uteis += 1
-        # Se cai em sábado e não trabalha sábado integral
-        elif dia_semana == 5 and fator_sabado < 1:
-            # Já foi descontado no cálculo de sábados, não contar novamente
-            pass
-        # Se cai em domingo e não trabalha domingo
-        elif dia_semana == 6 and not secao.trabalha_domingo:
-            # Já foi descontado no cálculo de domingos, não contar novamente
-            pass
-    
-    dias_uteis = dias_mes - desconto_sabados - desconto_domingos - feriados_uteis
-    return max(dias_uteis, 0.0)
+    calendario = await obter_calendario(db, ano)
+    return calendario.dias_uteis(ano, mes, RegimeTrabalho.de_secao(secao))
 
 
 router = APIRouter(prefix="/receitas", tags=["Receitas do Cenário"])
@@ -235,12 +132,15 @@ async def listar_dias_uteis_secao(
     if not secao:
         raise HTTPException(status_code=404, detail="Seção não encontrada")
     
+    calendario = await obter_calendario(db, ano_inicio, ano_fim)
+    regime = RegimeTrabalho.de_secao(secao)
+    
     resultado = []
     ano = ano_inicio
     mes = mes_inicio
     
     while (ano, mes) <= (ano_fim, mes_fim):
-        dias = await _calcular_dias_uteis_secao(ano, mes, secao_id, db)
+        dias = calendario.dias_uteis(ano, mes, regime)
         resultado.append({
             "ano": ano,
             "mes": mes,
@@ -506,257 +406,64 @@ async def calcular_receita(
     receita_id: UUID,
     db: AsyncSession = Depends(get_db)
 ):
-    """Calcula a receita por mês com base nas premissas e tipo de cálculo."""
-    # Buscar receita com relacionamentos
-    result = await db.execute(
-        select(ReceitaCenario)
-        .where(ReceitaCenario.id == receita_id)
-        .options(
-            selectinload(ReceitaCenario.cenario),
-            selectinload(ReceitaCenario.centro_custo),
-            selectinload(ReceitaCenario.premissas)
-        )
-    )
-    receita = result.scalar_one_or_none()
-    
+    """
+    Receita por mês (janela do cenário). Receitas ativas são lidas de
+    receitas_calculadas, recalculadas antes se as entradas mudaram.
+    """
+    receita = await db.get(ReceitaCenario, receita_id)
     if not receita:
         raise HTTPException(status_code=404, detail="Receita não encontrada")
     
-    cenario = receita.cenario
-    resultados = []
-    
-    # Gerar lista de meses do cenário
-    meses = []
-    ano = cenario.ano_inicio
-    mes = cenario.mes_inicio
-    while (ano, mes) <= (cenario.ano_fim, cenario.mes_fim):
-        meses.append((ano, mes))
-        mes += 1
-        if mes > 12:
-            mes = 1
-            ano += 1
-    
-    # Calcular para cada mês
-    for ano, mes in meses:
-        resultado = await _calcular_receita_mes(receita, ano, mes, db)
-        resultados.append(resultado)
-    
-    return resultados
-
-
-async def _calcular_receita_mes(
-    receita: ReceitaCenario,
-    ano: int,
-    mes: int,
-    db: AsyncSession
-) -> ReceitaCalculadaResponse:
-    """Calcula a receita para um mês específico."""
-    valor_calculado = 0.0
-    valor_bruto = None
-    hc_pa = None
-    qtd_pa = None
-    dias_uteis = None
-    memoria = {}
-    
-    tipo = receita.tipo_calculo
-    
-    if tipo == "FIXA_CC":
-        # Valor fixo por centro de custo
-        valor_calculado = float(receita.valor_fixo or 0)
-        memoria = {"tipo": "FIXA_CC", "valor_fixo": valor_calculado}
-    
-    elif tipo == "FIXA_HC":
-        # Valor fixo x HC total do CC
-        hc_total = await _get_hc_cc(receita.cenario_id, receita.centro_custo_id, ano, mes, db)
-        valor_calculado = float(receita.valor_fixo or 0) * hc_total
-        memoria = {"tipo": "FIXA_HC", "valor_fixo": float(receita.valor_fixo or 0), "hc_total": hc_total}
-    
-    elif tipo == "FIXA_PA":
-        # Valor fixo x Qtd PA da função
-        qtd_pa = await _get_pa_funcao(receita.cenario_id, receita.centro_custo_id, receita.funcao_pa_id, ano, mes, db)
-        valor_calculado = float(receita.valor_fixo or 0) * qtd_pa
-        memoria = {"tipo": "FIXA_PA", "valor_fixo": float(receita.valor_fixo or 0), "qtd_pa": qtd_pa}
-    
-    elif tipo == "VARIAVEL":
-        # Fórmula completa: HC_PA × VOPDU × Índice × Ticket × Fator × Dias × (1-Estorno)
-        # Buscar premissa do mês
-        premissa = next((p for p in receita.premissas if p.mes == mes and p.ano == ano), None)
-        
-        # DEBUG: Log para identificar problemas
-        print(f"[DEBUG RECEITA] receita_id={receita.id}, mes={mes}, ano={ano}")
-        print(f"[DEBUG RECEITA] funcao_pa_id={receita.funcao_pa_id}, centro_custo_id={receita.centro_custo_id}")
-        print(f"[DEBUG RECEITA] premissas encontradas para este mes/ano: {premissa is not None}")
-        
-        if premissa:
-            # Buscar HC do PA (função)
-            # CORREÇÃO: Se não tiver centro_custo_id específico, buscar de toda a operação
-            hc_pa = await _get_hc_funcao(receita.cenario_id, receita.centro_custo_id, receita.funcao_pa_id, ano, mes, db)
-            
-            # DEBUG: Log valores
-            print(f"[DEBUG RECEITA] hc_pa retornado: {hc_pa}")
-            
-            # Se hc_pa for 0, tentar buscar sem filtro de centro de custo
-            if hc_pa == 0 and receita.funcao_pa_id:
-                print(f"[DEBUG RECEITA] hc_pa=0, tentando buscar sem filtro de CC...")
-                hc_pa = await _get_hc_funcao_sem_cc(receita.cenario_id, receita.funcao_pa_id, ano, mes, db)
-                print(f"[DEBUG RECEITA] hc_pa (sem filtro CC): {hc_pa}")
-            
-            # Calcular dias úteis
-            dias_uteis = await _calcular_dias_uteis(ano, mes, receita.centro_custo.uf if receita.centro_custo else None, db)
-            
-            vopdu = float(premissa.vopdu or 0)
-            indice = float(premissa.indice_conversao or 0)
-            ticket = float(premissa.ticket_medio or 0)
-            fator = float(premissa.fator or 1)
-            estorno = float(premissa.indice_estorno or 0)
-            
-            # DEBUG: Log premissas
-            print(f"[DEBUG RECEITA] vopdu={vopdu}, indice={indice}, ticket={ticket}, fator={fator}, dias_uteis={dias_uteis}, estorno={estorno}")
-            
-            valor_bruto = hc_pa * vopdu * indice * ticket * fator * dias_uteis * (1 - estorno)
-            
-            print(f"[DEBUG RECEITA] valor_bruto calculado: {valor_bruto}")
-            
-            # Aplicar limites min/max por PA
-            qtd_pa = await _get_pa_funcao(receita.cenario_id, receita.centro_custo_id, receita.funcao_pa_id, ano, mes, db)
-            
-            valor_min = float(receita.valor_minimo_pa or 0) * qtd_pa if receita.valor_minimo_pa else None
-            valor_max = float(receita.valor_maximo_pa or 0) * qtd_pa if receita.valor_maximo_pa else None
-            
-            if valor_min is not None and valor_bruto < valor_min:
-                valor_calculado = valor_min
-            elif valor_max is not None and valor_bruto > valor_max:
-                valor_calculado = valor_max
-            else:
-                valor_calculado = valor_bruto
-            
-            memoria = {
-                "tipo": "VARIAVEL",
-                "hc_pa": hc_pa,
-                "vopdu": vopdu,
-                "indice_conversao": indice,
-                "ticket_medio": ticket,
-                "fator": fator,
-                "dias_uteis": dias_uteis,
-                "indice_estorno": estorno,
-                "qtd_pa": qtd_pa,
-                "valor_bruto": valor_bruto,
-                "valor_min": valor_min,
-                "valor_max": valor_max
-            }
-    
-    return ReceitaCalculadaResponse(
-        receita_cenario_id=receita.id,
-        mes=mes,
-        ano=ano,
-        valor_calculado=valor_calculado,
-        valor_bruto=valor_bruto,
-        hc_pa=hc_pa,
-        qtd_pa=qtd_pa,
-        dias_uteis=dias_uteis,
-        memoria_calculo=memoria
-    )
-
-
-async def _get_hc_cc(cenario_id: UUID, cc_id: UUID, ano: int, mes: int, db: AsyncSession) -> float:
-    """Obtém o total de HC do centro de custo no mês."""
-    # Mapear mês para coluna
-    col_map = {1: 'qtd_jan', 2: 'qtd_fev', 3: 'qtd_mar', 4: 'qtd_abr', 5: 'qtd_mai', 6: 'qtd_jun',
-               7: 'qtd_jul', 8: 'qtd_ago', 9: 'qtd_set', 10: 'qtd_out', 11: 'qtd_nov', 12: 'qtd_dez'}
-    
-    result = await db.execute(
-        select(QuadroPessoal).where(
-            QuadroPessoal.cenario_id == cenario_id,
-            QuadroPessoal.centro_custo_id == cc_id,
-            QuadroPessoal.ativo == True
-        )
-    )
-    quadros = result.scalars().all()
-    
-    total = 0.0
-    for q in quadros:
-        qtd = getattr(q, col_map[mes], 0) or 0
-        total += float(qtd)
-    
-    return total
-
-
-async def _get_hc_funcao(cenario_id: UUID, cc_id: UUID, funcao_id: UUID, ano: int, mes: int, db: AsyncSession) -> float:
-    """Obtém o HC de uma função específica no CC/mês."""
-    col_map = {1: 'qtd_jan', 2: 'qtd_fev', 3: 'qtd_mar', 4: 'qtd_abr', 5: 'qtd_mai', 6: 'qtd_jun',
-               7: 'qtd_jul', 8: 'qtd_ago', 9: 'qtd_set', 10: 'qtd_out', 11: 'qtd_nov', 12: 'qtd_dez'}
-    
-    # Construir query base
-    query = select(QuadroPessoal).where(
-        QuadroPessoal.cenario_id == cenario_id,
-        QuadroPessoal.funcao_id == funcao_id,
-        QuadroPessoal.ativo == True
-    )
-    
-    # Só filtrar por CC se foi informado
-    if cc_id:
-        query = query.where(QuadroPessoal.centro_custo_id == cc_id)
-    
-    result = await db.execute(query)
-    quadros = result.scalars().all()
+    cenario = await db.get(Cenario, receita.cenario_id)
+    periodos = periodos_cenario(cenario)
     
-    total = 0.0
-    for q in quadros:
-        qtd = getattr(q, col_map[mes], 0) or 0
-        total += float(qtd)
-    
-    return total
-
-
-async def _get_hc_funcao_sem_cc(cenario_id: UUID, funcao_id: UUID, ano: int, mes: int, db: AsyncSession) -> float:
-    """Obtém o HC total de uma função no cenário (sem filtrar por CC)."""
-    col_map = {1: 'qtd_jan', 2: 'qtd_fev', 3: 'qtd_mar', 4: 'qtd_abr', 5: 'qtd_mai', 6: 'qtd_jun',
-               7: 'qtd_jul', 8: 'qtd_ago', 9: 'qtd_set', 10: 'qtd_out', 11: 'qtd_nov', 12: 'qtd_dez'}
+    if not receita.ativo:
+        # Receitas inativas não são gravadas: calcula na hora
+        receitas = await carregar_receitas(db, receita.cenario_id, receita_id=receita_id)
+        calculadas = await calcular_receitas(db, receita.cenario_id, periodos, receitas)
+        return calculadas.respostas(receita_id)
     
+    await garantir_receitas_calculadas(db, receita.cenario_id, [ano for ano, _ in periodos])
     result = await db.execute(
-        select(QuadroPessoal).where(
-            QuadroPessoal.cenario_id == cenario_id,
-            QuadroPessoal.funcao_id == funcao_id,
-            QuadroPessoal.ativo == True
-        )
+        select(ReceitaCalculada).where(
+            ReceitaCalculada.receita_cenario_id == receita_id,
+            tuple_(ReceitaCalculada.ano, ReceitaCalculada.mes).in_(periodos)
+        ).order_by(ReceitaCalculada.ano, ReceitaCalculada.mes)
     )
-    quadros = result.scalars().all()
-    
-    total = 0.0
-    for q in quadros:
-        qtd = getattr(q, col_map[mes], 0) or 0
-        total += float(qtd)
-    
-    print(f"[DEBUG _get_hc_funcao_sem_cc] cenario={cenario_id}, funcao={funcao_id}, mes={mes}, quadros_encontrados={len(quadros)}, total_hc={total}")
-    
-    return total
+    return [resposta_gravada(linha) for linha in result.scalars().all()]
 
 
-async def _get_pa_funcao(cenario_id: UUID, cc_id: UUID, funcao_id: UUID, ano: int, mes: int, db: AsyncSession) -> float:
-    """Obtém o PA de uma função específica no CC/mês (HC / fator_pa)."""
-    col_map = {1: 'qtd_jan', 2: 'qtd_fev', 3: 'qtd_mar', 4: 'qtd_abr', 5: 'qtd_mai', 6: 'qtd_jun',
-               7: 'qtd_jul', 8: 'qtd_ago', 9: 'qtd_set', 10: 'qtd_out', 11: 'qtd_nov', 12: 'qtd_dez'}
-    
-    # Construir query base
-    query = select(QuadroPessoal).where(
-        QuadroPessoal.cenario_id == cenario_id,
-        QuadroPessoal.funcao_id == funcao_id,
-        QuadroPessoal.ativo == True
-    )
-    
-    # Só filtrar por CC se foi informado
-    if cc_id:
-        query = query.where(QuadroPessoal.centro_custo_id == cc_id)
-    
-    result = await db.execute(query)
-    quadros = result.scalars().all()
-    
-    total_pa = 0.0
-    for q in quadros:
-        qtd = getattr(q, col_map[mes], 0) or 0
-        fator = float(q.fator_pa or 1)
-        if fator > 0:
-            total_pa += float(qtd) / fator
-    
-    return total_pa
-
+@router.post("/cenarios/{cenario_id}/calcular")
+async def calcular_receitas_cenario(
+    cenario_id: UUID,
+    ano: Optional[int] = Query(None, description="Ano para cálculo (vazio = toda a janela do cenário)"),
+    forcar: bool = Query(False, description="Recalcular mesmo que as entradas não tenham mudado"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Calcula e grava as receitas do cenário (receitas_calculadas), se as entradas mudaram."""
+    try:
+        resultado = await calcular_e_salvar_receitas(db, cenario_id, ano, forcar)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {
+        "success": True,
+        "message": "Receitas sem alteração desde o último cálculo" if resultado["cache"] else "Receitas calculadas com sucesso",
+        **resultado
+    }
+
+
+@router.post("/cenarios/{cenario_id}/meta")
+async def buscar_meta_receita_cenario(
+    cenario_id: UUID,
+    pedido: MetaReceitaRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Busca, por CC e mês, o valor de VOPDU, índice de conversão ou ticket médio
+    que leva a margem (ou o resultado mensal) do CC à meta informada.
+    Não altera as premissas.
+    """
+    try:
+        return await buscar_meta_receita(db, cenario_id, pedido)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -17,6 +17,8 @@ from app.schemas.orcamento import (
     TabelaSalarialResponse,
 )
 from sqlalchemy import delete
+from app.services.dre_resumo import descartar_dre_resumo, FONTE_PESSOAL
+from app.services.impressao_calculo import invalidar_impressoes
 
 router = APIRouter(prefix="/tabela-salarial", tags=["Tabela Salarial"])
 
@@ -37,6 +39,9 @@ async def invalidar_custos_tabela_salarial(db: AsyncSession, tabela_salarial_id:
     if cenarios_ids:
         stmt = delete(CustoCalculado).where(CustoCalculado.cenario_id.in_(cenarios_ids))
         await db.execute(stmt)
+        for cenario_id in cenarios_ids:
+            await invalidar_impressoes(db, cenario_id)
+        await descartar_dre_resumo(db, cenarios_ids, (FONTE_PESSOAL,))
 
 
 @router.get("/", response_model=List[TabelaSalarialResponse])
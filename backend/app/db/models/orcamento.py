@@ -790,6 +790,10 @@ class PremissaFuncaoMes(Base):
     # Treinamento
     dias_treinamento = Column(Integer, default=15)  # Dias de treinamento
     
+    # Incerteza dos índices para a simulação de Monte Carlo:
+    # {"absenteismo": {"tipo": "triangular", "min": 2, "moda": 3, "max": 6}, ...}
+    distribuicoes = Column(JSON, nullable=True)
+    
     # Controle
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -886,7 +890,14 @@ class CustoCalculado(Base):
     indice_aplicado = Column(Numeric(10, 4), default=0)  # Índice/alíquota aplicada
     valor_calculado = Column(Numeric(14, 2), default=0)  # Resultado final
     
-    # Memória de cálculo (JSON com detalhes)
+    # Origem do custo (sem FK: quadro e custos são recalculados/excluídos livremente)
+    quadro_pessoal_id = Column(UUID(as_uuid=True), nullable=True, index=True)  # Posição que gerou o custo direto
+    rateio_grupo_id = Column(UUID(as_uuid=True), nullable=True, index=True)  # Preenchido = custo rateado (INDIRETO)
+    custo_origem_id = Column(UUID(as_uuid=True), nullable=True)  # CustoCalculado do POOL que foi rateado
+    custo_direto_id = Column(UUID(as_uuid=True), nullable=True)  # CustoDireto do POOL que foi rateado (ex: aluguel)
+    
+    # Memória de cálculo (JSON com detalhes) - só no modo CUSTOS_MEMORIA="linha";
+    # nos demais modos fica em custos_memoria_posicao ou é reconstruída sob demanda
     memoria_calculo = Column(JSON, nullable=True)
     
     # Controle
@@ -1190,3 +1201,304 @@ class ReceitaPremissaMes(Base):
     def __repr__(self):
         return f"<ReceitaPremissaMes {self.mes:02d}/{self.ano} VOPDU={self.vopdu}>"
 
+
+class ReceitaCalculada(Base):
+    """
+    Receita calculada por mês (materializada, como CustoCalculado).
+    Gravada pelo cálculo de receitas com a impressão das entradas; linhas com
+    impressão diferente da atual estão desatualizadas e são recalculadas.
+    """
+    __tablename__ = "receitas_calculadas"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    cenario_id = Column(UUID(as_uuid=True), ForeignKey("cenarios.id", ondelete="CASCADE"), nullable=False)
+    receita_cenario_id = Column(UUID(as_uuid=True), ForeignKey("receitas_cenario.id", ondelete="CASCADE"), nullable=False, index=True)
+    
+    # Copiados da receita para agregar sem join (DRE por tipo e por CC)
+    centro_custo_id = Column(UUID(as_uuid=True), ForeignKey("centros_custo.id", ondelete="CASCADE"), nullable=False)
+    tipo_receita_id = Column(UUID(as_uuid=True), ForeignKey("tipos_receita.id", ondelete="CASCADE"), nullable=False)
+    
+    mes = Column(Integer, nullable=False)
+    ano = Column(Integer, nullable=False)
+    
+    valor_calculado = Column(Numeric(15, 2), nullable=False)
+    valor_bruto = Column(Numeric(15, 2), nullable=True)  # Antes de limites min/max
+    hc_pa = Column(Numeric(12, 4), nullable=True)
+    qtd_pa = Column(Numeric(12, 4), nullable=True)
+    dias_uteis = Column(Integer, nullable=True)
+    memoria_calculo = Column(JSON, nullable=True)
+    
+    impressao = Column(String(64), nullable=False)  # Hash das entradas usadas no cálculo
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint('receita_cenario_id', 'ano', 'mes', name='uq_receita_calculada_mes'),
+        Index('ix_receitas_calculadas_cenario_ano', 'cenario_id', 'ano'),
+    )
+    
+    def __repr__(self):
+        return f"<ReceitaCalculada {self.mes:02d}/{self.ano} = R${self.valor_calculado}>"
+
+
+class ReceitaCalculadaAno(Base):
+    """
+    Impressão das entradas com que as receitas de um ano do cenário foram
+    calculadas. Separada das linhas de receitas_calculadas para que um ano sem
+    receitas também fique em cache.
+    """
+    __tablename__ = "receitas_calculadas_anos"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    cenario_id = Column(UUID(as_uuid=True), ForeignKey("cenarios.id", ondelete="CASCADE"), nullable=False)
+    ano = Column(Integer, nullable=False)
+    impressao = Column(String(64), nullable=False)
+    calculado_em = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint('cenario_id', 'ano', name='uq_receita_calculada_ano'),
+    )
+    
+    def __repr__(self):
+        return f"<ReceitaCalculadaAno {self.cenario_id} {self.ano}>"
+
+
+
+# ============================================
+# RECÁLCULO INCREMENTAL DE CUSTOS
+# ============================================
+
+class CustoAlteracaoPendente(Base):
+    """
+    Célula alterada desde o último cálculo de custos.
+    Registrada pelas edições de quadro/premissas; consumida pelo recálculo incremental,
+    que refaz apenas os custos (e rateios derivados) das células pendentes.
+    """
+    __tablename__ = "custos_alteracoes_pendentes"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    cenario_id = Column(UUID(as_uuid=True), ForeignKey("cenarios.id", ondelete="CASCADE"), nullable=False, index=True)
+    cenario_secao_id = Column(UUID(as_uuid=True), ForeignKey("cenario_secao.id", ondelete="CASCADE"), nullable=True)  # NULL = todas as seções
+    funcao_id = Column(UUID(as_uuid=True), ForeignKey("funcoes.id", ondelete="CASCADE"), nullable=True)  # NULL = todas as funções da seção
+    quadro_pessoal_id = Column(UUID(as_uuid=True), nullable=True)  # Posição de origem (sem FK: a posição pode ter sido excluída)
+    centro_custo_id = Column(UUID(as_uuid=True), nullable=True)  # CC da posição (para rateios HC/PA)
+    
+    # Período afetado (NULL = todos os meses/anos da janela)
+    mes = Column(Integer, nullable=True)
+    ano = Column(Integer, nullable=True)
+    
+    origem = Column(String(20), nullable=False)  # QUADRO, PREMISSA
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ix_custos_alteracoes_cenario_secao', 'cenario_id', 'cenario_secao_id'),
+    )
+    
+    def __repr__(self):
+        return f"<CustoAlteracaoPendente {self.origem} secao={self.cenario_secao_id} funcao={self.funcao_id} {self.mes}/{self.ano}>"
+
+
+# ============================================
+# FILA DE CÁLCULO DE CUSTOS
+# ============================================
+
+class JobCalculoCustos(Base):
+    """
+    Job de cálculo de custos executado pelo worker local (python -m app.worker).
+    Um cenário tem no máximo um job PENDENTE: novos pedidos são coalescidos nele.
+    """
+    __tablename__ = "jobs_calculo_custos"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    cenario_id = Column(UUID(as_uuid=True), ForeignKey("cenarios.id", ondelete="CASCADE"), nullable=False, index=True)
+    
+    # Escopo do cálculo (NULL = cenário inteiro / toda a janela)
+    cenario_secao_id = Column(UUID(as_uuid=True), ForeignKey("cenario_secao.id", ondelete="CASCADE"), nullable=True)
+    ano = Column(Integer, nullable=True)
+    incremental = Column(Boolean, default=False, nullable=False)
+    forcar = Column(Boolean, default=False, nullable=False)  # Recalcular mesmo sem mudança nas entradas
+    
+    # PENDENTE, EXECUTANDO, CONCLUIDO, ERRO, CANCELADO
+    status = Column(String(20), nullable=False, default="PENDENTE", index=True)
+    cancelamento_solicitado = Column(Boolean, default=False, nullable=False)
+    pedidos = Column(Integer, default=1, nullable=False)  # Quantos pedidos foram coalescidos neste job
+    
+    # Progresso: {"etapa", "secoes_total", "secoes_concluidas", "registros", "secoes": {secao_id: registros}}
+    progresso = Column(JSON, nullable=True)
+    resultado = Column(JSON, nullable=True)
+    erro = Column(Text, nullable=True)
+    
+    worker = Column(String(100), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    iniciado_em = Column(DateTime, nullable=True)
+    heartbeat_em = Column(DateTime, nullable=True)
+    concluido_em = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index(
+            'uq_jobs_calculo_custos_pendente', 'cenario_id',
+            unique=True, postgresql_where=(status == 'PENDENTE')
+        ),
+    )
+    
+    def __repr__(self):
+        return f"<JobCalculoCustos {self.cenario_id} {self.status}>"
+
+
+# ============================================
+# MEMÓRIA DE CÁLCULO POR POSIÇÃO
+# ============================================
+
+class CustoMemoriaPosicao(Base):
+    """
+    Memória de cálculo de uma posição do quadro em um mês (HC operando, HC folha,
+    salário, CC), compartilhada por todas as rubricas daquela posição/mês.
+    Substitui a repetição de memoria_calculo em cada linha de custos_calculados.
+    """
+    __tablename__ = "custos_memoria_posicao"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    cenario_id = Column(UUID(as_uuid=True), ForeignKey("cenarios.id", ondelete="CASCADE"), nullable=False)
+    cenario_secao_id = Column(UUID(as_uuid=True), ForeignKey("cenario_secao.id", ondelete="CASCADE"), nullable=True)
+    funcao_id = Column(UUID(as_uuid=True), nullable=True)
+    quadro_pessoal_id = Column(UUID(as_uuid=True), nullable=False)  # Sem FK: a posição pode ter sido excluída
+    
+    mes = Column(Integer, nullable=False)
+    ano = Column(Integer, nullable=False)
+    
+    memoria = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ix_custos_memoria_posicao_lote', 'cenario_id', 'cenario_secao_id', 'ano'),
+        Index('ix_custos_memoria_posicao_quadro', 'quadro_pessoal_id', 'ano', 'mes'),
+    )
+    
+    def __repr__(self):
+        return f"<CustoMemoriaPosicao {self.quadro_pessoal_id} {self.mes:02d}/{self.ano}>"
+
+
+# ============================================
+# IMPRESSÃO DAS ENTRADAS DO CÁLCULO
+# ============================================
+
+class CustoImpressaoCalculo(Base):
+    """
+    Hash das entradas do último cálculo de custos de um escopo (cenário, seção, ano),
+    gravado com o resumo. Se as entradas não mudaram, o cálculo devolve o resumo
+    sem recalcular.
+    """
+    __tablename__ = "custos_impressoes_calculo"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    cenario_id = Column(UUID(as_uuid=True), ForeignKey("cenarios.id", ondelete="CASCADE"), nullable=False, index=True)
+    
+    # Escopo do cálculo (NULL = cenário inteiro / toda a janela)
+    cenario_secao_id = Column(UUID(as_uuid=True), ForeignKey("cenario_secao.id", ondelete="CASCADE"), nullable=True)
+    ano = Column(Integer, nullable=True)
+    
+    impressao = Column(String(64), nullable=False)  # Hash combinado do escopo
+    impressoes_secoes = Column(JSON, nullable=True)  # {secao_id: hash das entradas da seção}
+    resumo = Column(JSON, nullable=True)  # Resumo devolvido pelo cálculo
+    calculado_em = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<CustoImpressaoCalculo {self.cenario_id} {self.impressao[:8]}>"
+
+
+# ============================================
+# PERFIL DE EXECUÇÃO DOS CÁLCULOS
+# ============================================
+
+class CustoPerfilCalculo(Base):
+    """
+    Perfil de uma execução de cálculo (custos, rateio ou tecnologia): tempo,
+    consultas e linhas por fase, tempo acumulado por rubrica e por seção.
+    """
+    __tablename__ = "custos_perfis_calculo"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    cenario_id = Column(UUID(as_uuid=True), ForeignKey("cenarios.id", ondelete="CASCADE"), nullable=False, index=True)
+    
+    # Escopo do cálculo (NULL = cenário inteiro / toda a janela)
+    cenario_secao_id = Column(UUID(as_uuid=True), ForeignKey("cenario_secao.id", ondelete="CASCADE"), nullable=True)
+    ano = Column(Integer, nullable=True)
+    
+    operacao = Column(String(20), nullable=False)  # custos, rateio, tecnologia
+    motor = Column(String(20), nullable=True)  # vetorizado, escalar (cálculo de custos)
+    duracao_ms = Column(Integer, nullable=False, default=0)
+    consultas = Column(Integer, nullable=False, default=0)
+    linhas = Column(Integer, nullable=False, default=0)
+    
+    fases = Column(JSON, nullable=True)  # [{fase, segundos, consultas, linhas, chamadas}]
+    rubricas = Column(JSON, nullable=True)  # {codigo: segundos acumulados}
+    secoes = Column(JSON, nullable=True)  # {secao_id: {fase: segundos}}
+    iniciado_em = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f"<CustoPerfilCalculo {self.operacao} {self.cenario_id} {self.duracao_ms}ms>"
+
+
+# ============================================
+# RESUMO DO DRE (PRÉ-AGREGADO)
+# ============================================
+
+class DREResumo(Base):
+    """
+    Valor do DRE por (cenário, seção, CC, linha, origem, ano, mês), pré-agregado
+    a partir de custos_calculados, custos_tecnologia, custos diretos e
+    receitas_calculadas. Atualizado ao fim de cada cálculo; os endpoints do DRE
+    leem só esta tabela.
+    """
+    __tablename__ = "dre_resumo"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    cenario_id = Column(UUID(as_uuid=True), ForeignKey("cenarios.id", ondelete="CASCADE"), nullable=False)
+    cenario_secao_id = Column(UUID(as_uuid=True), ForeignKey("cenario_secao.id", ondelete="CASCADE"), nullable=True)
+    centro_custo_id = Column(UUID(as_uuid=True), ForeignKey("centros_custo.id", ondelete="CASCADE"), nullable=True)
+    
+    fonte = Column(String(20), nullable=False)  # PESSOAL, TECNOLOGIA, CUSTO_DIRETO, RECEITA
+    
+    # Linha do DRE (código com prefixo da fonte: TEC_, DIR_, REC_) e conta contábil
+    linha_codigo = Column(String(60), nullable=False)
+    linha_nome = Column(String(255), nullable=False)
+    categoria = Column(String(80), nullable=False)
+    conta_contabil_codigo = Column(String(50), nullable=False, default="")
+    conta_contabil_descricao = Column(String(255), nullable=False, default="")
+    
+    origem = Column(String(10), nullable=False, default="DIRETO")  # DIRETO, INDIRETO (rateio)
+    origem_pool = Column(String(200), nullable=True)  # Grupo de rateio (INDIRETO)
+    
+    ano = Column(Integer, nullable=False)
+    mes = Column(Integer, nullable=False)
+    valor = Column(Numeric(15, 2), nullable=False, default=0)
+    
+    atualizado_em = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ix_dre_resumo_cenario_ano', 'cenario_id', 'ano', 'cenario_secao_id', 'centro_custo_id'),
+    )
+    
+    def __repr__(self):
+        return f"<DREResumo {self.linha_codigo} {self.mes:02d}/{self.ano} = {self.valor}>"
+
+
+class DREResumoEstado(Base):
+    """
+    Quando cada fonte do resumo do DRE foi atualizada para o cenário. Fonte sem
+    estado ainda não foi montada; `versao` guarda a assinatura das entradas das
+    fontes que não passam por um cálculo (custos diretos, cadastros das linhas).
+    """
+    __tablename__ = "dre_resumo_estado"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    cenario_id = Column(UUID(as_uuid=True), ForeignKey("cenarios.id", ondelete="CASCADE"), nullable=False)
+    fonte = Column(String(20), nullable=False)
+    versao = Column(String(64), nullable=True)
+    atualizado_em = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint('cenario_id', 'fonte', name='uq_dre_resumo_estado_fonte'),
+    )
+    
+    def __repr__(self):
+        return f"<DREResumoEstado {self.cenario_id} {self.fonte}>"
@@ -6,7 +6,7 @@ from datetime import datetime, date
 from decimal import Decimal
 from typing import Optional, List, Dict, Any
 from uuid import UUID
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 
 
 # ============================================
@@ -1238,6 +1238,35 @@ class FuncaoSpanComRelacionamentos(FuncaoSpanResponse):
 # Premissa por FunÃ§Ã£o e MÃªs
 # ============================================
 
+class DistribuicaoPremissa(BaseModel):
+    """Distribuição de probabilidade de um índice da premissa (simulação de Monte Carlo)."""
+    tipo: str = Field("triangular", pattern="^(triangular|normal|uniforme)$")
+    # triangular: min/moda/max (sem moda = ponto médio); uniforme: min/max; normal: media/desvio
+    min: Optional[float] = None
+    moda: Optional[float] = None
+    max: Optional[float] = None
+    media: Optional[float] = None
+    desvio: Optional[float] = Field(None, gt=0)
+
+    @model_validator(mode='after')
+    def validate_parametros(self):
+        """Valida os parâmetros exigidos pelo tipo e a ordem min <= moda <= max."""
+        if self.tipo == "normal":
+            if self.desvio is None:
+                raise ValueError("Distribuição normal exige desvio maior que zero")
+            # Distribuição relativa (padrão da simulação): média omitida = 0 em torno do índice
+            if self.media is None and not getattr(self, "relativa", False):
+                raise ValueError("Distribuição normal exige media")
+            return self
+        if self.min is None or self.max is None:
+            raise ValueError(f"Distribuição {self.tipo} exige min e max")
+        if self.min > self.max:
+            raise ValueError("min deve ser menor ou igual a max")
+        if self.tipo == "triangular" and self.moda is not None and not self.min <= self.moda <= self.max:
+            raise ValueError("moda deve estar entre min e max")
+        return self
+
+
 class PremissaFuncaoMesBase(BaseModel):
     cenario_id: UUID
     cenario_secao_id: Optional[UUID] = None
@@ -1249,6 +1278,8 @@ class PremissaFuncaoMesBase(BaseModel):
     turnover: float = Field(5.0, ge=0, le=100)
     ferias_indice: float = Field(8.33, ge=0, le=100)
     dias_treinamento: int = Field(15, ge=0, le=180)
+    # Incerteza dos índices: {"absenteismo": {...}, "turnover": {...}, "ferias_indice": {...}}
+    distribuicoes: Optional[Dict[str, DistribuicaoPremissa]] = None
 
 
 class PremissaFuncaoMesCreate(PremissaFuncaoMesBase):
@@ -1261,6 +1292,7 @@ class PremissaFuncaoMesUpdate(BaseModel):
     turnover: Optional[float] = Field(None, ge=0, le=100)
     ferias_indice: Optional[float] = Field(None, ge=0, le=100)
     dias_treinamento: Optional[int] = Field(None, ge=0, le=180)
+    distribuicoes: Optional[Dict[str, DistribuicaoPremissa]] = None
 
 
 class PremissaFuncaoMesResponse(PremissaFuncaoMesBase):
@@ -1363,6 +1395,10 @@ class CustoCalculadoBase(BaseModel):
     valor_base: float = 0
     indice_aplicado: float = 0
     valor_calculado: float = 0
+    quadro_pessoal_id: Optional[UUID] = None
+    rateio_grupo_id: Optional[UUID] = None
+    custo_origem_id: Optional[UUID] = None
+    custo_direto_id: Optional[UUID] = None
     memoria_calculo: Optional[dict] = None
 
 
@@ -1453,6 +1489,7 @@ class DREResponse(BaseModel):
     ano: int
     linhas: List[DRELinha]
     total_geral: float
+    desatualizado: bool = False  # Entradas alteradas desde o último cálculo
 
 
 class DRELinhaPorCC(BaseModel):
@@ -1490,6 +1527,7 @@ class DREPorCCResponse(BaseModel):
     visao: str  # "por_cc", "comparativo", "margem"
     centros_custo: List[DRECentroCusto]
     consolidado: Optional[DRECentroCusto] = None  # Totais gerais
+    desatualizado: bool = False  # Entradas alteradas desde o último cálculo
 
 
 # ============================================
@@ -1729,6 +1767,92 @@ class ReceitaCalculadaResponse(BaseModel):
     memoria_calculo: Optional[Dict[str, Any]] = None
 
 
+# ============================================
+# Simulação de Custos (what-if, sem gravar)
+# ============================================
+
+class AjustePremissaSimulacao(BaseModel):
+    """Ajuste de premissa aplicado só na simulação."""
+    campo: str = Field(..., description="absenteismo, abs_pct_justificado, turnover ou ferias_indice")
+    operacao: str = Field("somar", description="definir, somar ou multiplicar")
+    valor: float
+    # Filtros (vazio = todos)
+    cenario_secao_id: Optional[UUID] = None
+    funcao_id: Optional[UUID] = None
+    ano: Optional[int] = None
+    mes: Optional[int] = Field(None, ge=1, le=12)
+
+
+class AjusteParametroSimulacao(BaseModel):
+    """Valor de parâmetro de custo usado só na simulação."""
+    chave: str
+    valor: float
+    tipo_custo_codigo: Optional[str] = None  # Vazio = parâmetro global
+    cenario_secao_id: Optional[UUID] = None  # Vazio = todas as seções
+
+
+class SimulacaoCustosRequest(BaseModel):
+    """Pedido de simulação de custos."""
+    cenario_secao_id: Optional[UUID] = None
+    ano: Optional[int] = None
+    premissas: List[AjustePremissaSimulacao] = []
+    parametros: List[AjusteParametroSimulacao] = []
+    comparar: bool = True  # Incluir o resultado sem ajustes e a variação
+
+
+class VariacaoSensibilidade(BaseModel):
+    """Uma entrada variada em vários valores na análise de sensibilidade."""
+    nome: Optional[str] = None  # Rótulo no gráfico (padrão: tipo/campo)
+    tipo: str = Field(..., description="premissa, parametro ou salario")
+    campo: Optional[str] = None  # Premissa (absenteismo, turnover...) ou chave do parâmetro
+    operacao: str = Field("somar", description="Premissa: definir, somar ou multiplicar")
+    valores: List[float] = Field(..., min_length=1)  # Salário: % de reajuste
+    tipo_custo_codigo: Optional[str] = None  # Parâmetro de uma rubrica (vazio = global)
+    funcao_id: Optional[UUID] = None  # Premissa de uma função (vazio = todas)
+
+
+class SensibilidadeCustosRequest(BaseModel):
+    """Pedido de análise de sensibilidade (gráfico tornado)."""
+    cenario_secao_id: Optional[UUID] = None
+    ano: Optional[int] = None
+    variacoes: List[VariacaoSensibilidade] = Field(..., min_length=1)
+
+
+class DistribuicaoPadraoMonteCarlo(DistribuicaoPremissa):
+    """Distribuição aplicada às premissas que não têm uma própria."""
+    campo: str  # absenteismo, abs_pct_justificado, turnover ou ferias_indice
+    relativa: bool = True  # Valores somados ao índice da premissa (ex: min -1, moda 0, max 2)
+
+
+class MonteCarloCustosRequest(BaseModel):
+    """Pedido de simulação de Monte Carlo dos custos."""
+    cenario_secao_id: Optional[UUID] = None
+    ano: Optional[int] = None
+    amostras: int = Field(2000, ge=100, le=50000)
+    semente: Optional[int] = None  # Vazio = sorteada e devolvida na resposta
+    percentis: List[float] = [10, 50, 90]
+    # total: um sorteio por amostra e índice vale para todas as funções/meses;
+    # independente: cada função/mês sorteia o seu
+    correlacao: str = Field("total", pattern="^(total|independente)$")
+    distribuicoes_padrao: List[DistribuicaoPadraoMonteCarlo] = []
+
+
+# ============================================
+# Meta de Receita (busca do valor da premissa)
+# ============================================
+
+class MetaReceitaRequest(BaseModel):
+    """Pedido de busca do valor de premissa de receita que atinge a meta do CC."""
+    variavel: str = Field(..., pattern="^(vopdu|indice_conversao|ticket_medio)$")
+    # Informe um dos dois: margem % (como no DRE) ou resultado mensal (receitas - custos)
+    margem_alvo: Optional[float] = Field(None, lt=100)
+    resultado_alvo: Optional[float] = None
+    ano: Optional[int] = None
+    centro_custo_id: Optional[UUID] = None  # Vazio = todos os CCs com receita variável
+    receita_cenario_id: Optional[UUID] = None  # Vazio = todas as receitas variáveis do CC
+    meses: Optional[List[int]] = None  # Vazio = os 12 meses
+
+
 # Atualizar forward references
 DepartamentoComSecoes.model_rebuild()
 CenarioSecaoResponse.model_rebuild()
@@ -3,19 +3,45 @@ Motor de cálculo de custos de pessoal.
 Calcula todas as 30 rubricas para um cenário.
 """
 
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple, AsyncIterator, Callable, Awaitable
 from uuid import UUID
 from decimal import Decimal
-from datetime import date
-import calendar
+from datetime import date, datetime
+import time
+import numpy as np
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, tuple_, update, bindparam
 from sqlalchemy.orm import selectinload
 
 from app.db.models.orcamento import (
-    Cenario, CenarioSecao, QuadroPessoal, TipoCusto, CustoCalculado,
-    ParametroCusto, PremissaFuncaoMes, TabelaSalarial, PoliticaBeneficio,
-    Funcao, Feriado, FaixaSalarial
+    Cenario, CenarioSecao, QuadroPessoal, TipoCusto, CustoCalculado, CustoMemoriaPosicao,
+    PremissaFuncaoMes, TabelaSalarial, PoliticaBeneficio,
+    Funcao, Feriado, FaixaSalarial, Secao
+)
+from app.core.config import settings
+from app.services.calculo_custos_vetorizado import (
+    EntradasSecao, calcular_rubricas, gerar_registros
+)
+from app.services.plano_rubricas import PlanoRubricas, PassoRubrica, obter_plano_rubricas
+from app.services.gravacao_lote import gravar_registros, sincronizar_registros, remover_por_ids, ResumoSincronizacao
+from app.services.impressao_calculo import (
+    calcular_impressoes, combinar_impressoes, obter_resumo_em_cache, invalidar_impressoes, gravar_impressao
+)
+from app.services.rateio_reciproco import GrupoReciproco, fatores_reciprocos
+from app.services.rateio_lote import (
+    preparar_destinos, preparar_novos, garantir_tipos_custo_diretos, preparar_valores_diretos,
+    contar_origem, contar_origens,
+    consulta_rateio_custos, consulta_rateio_diretos, inserir_rateio, sincronizar_rateio,
+    remover_rateios_orfaos
+)
+from app.services.perfil_calculo import perfilar, fase, tempos_rubricas, OPERACAO_CUSTOS, OPERACAO_RATEIO
+from app.services.cubo_drivers import obter_cubo_drivers, MEDIDA_HC, MEDIDA_PA
+from app.services.dre_resumo import atualizar_dre_resumo, FONTE_PESSOAL
+from app.services.calendario import Calendario, RegimeTrabalho, REGIME_PADRAO, obter_calendario
+from app.services.parametros_custo import (
+    Parametros, TabelaParametros, carregar_tabela_parametros, buscar_parametro, vetor_parametros,
+    CHAVES_PARAMETROS, PARAM_HE_50, PARAM_HE_100, PARAM_ELEGIBILIDADE_AM, PARAM_ELEGIBILIDADE_CRECHE,
+    PARAM_DESLIG_EMPRESA, PARAM_NAO_CUMPRE_AVISO
 )
 
 
@@ -52,49 +78,123 @@ COD_DESC_VT = "0107"
 COD_DESC_VR = "0123"
 
 
+def periodos_cenario(cenario: Cenario) -> List[Tuple[int, int]]:
+    """Lista de (ano, mes) da janela do cenário (pode cruzar anos)."""
+    periodos = []
+    ano = cenario.ano_inicio
+    mes = cenario.mes_inicio or 1
+    ano_fim = cenario.ano_fim or cenario.ano_inicio
+    mes_fim = cenario.mes_fim or 12
+    while (ano, mes) <= (ano_fim, mes_fim):
+        periodos.append((ano, mes))
+        mes += 1
+        if mes > 12:
+            mes = 1
+            ano += 1
+    return periodos
+
+
+# Callback chamado a cada lote gravado: (secao_id, registros do lote).
+# Pode levantar exceção para interromper o cálculo (ex: cancelamento de job).
+ProgressoCallback = Callable[[UUID, int], Awaitable[None]]
+
+# Callback chamado no início de cada etapa depois dos lotes ("rateio", "dre").
+EtapaCallback = Callable[[str], Awaitable[None]]
+
+
+async def secoes_calculaveis(
+    db: AsyncSession,
+    cenario_id: UUID,
+    cenario_secao_id: Optional[UUID] = None
+) -> List[UUID]:
+    """Seções que têm quadro de pessoal no cenário (as que o cálculo percorre)."""
+    if cenario_secao_id:
+        return [cenario_secao_id]
+    result = await db.execute(
+        select(QuadroPessoal.cenario_secao_id)
+        .where(QuadroPessoal.cenario_id == cenario_id)
+        .where(QuadroPessoal.cenario_secao_id.isnot(None))
+        .distinct()
+    )
+    return [row[0] for row in result.fetchall()]
+
+
+def _agrupar_periodos_por_ano(periodos: List[Tuple[int, int]]) -> List[Tuple[int, List[int]]]:
+    """Agrupa [(ano, mes), ...] em [(ano, [meses]), ...] preservando a ordem."""
+    grupos: Dict[int, List[int]] = {}
+    for ano, mes in periodos:
+        grupos.setdefault(ano, []).append(mes)
+    return list(grupos.items())
+
+
+# Motores de cálculo disponíveis
+MOTOR_ESCALAR = "escalar"  # Posição x mês x rubrica (referência)
+MOTOR_VETORIZADO = "vetorizado"  # Matrizes NumPy por seção
+
+# Modos de persistência do resultado
+PERSISTENCIA_SUBSTITUIR = "substituir"  # DELETE de tudo + INSERT
+PERSISTENCIA_DIFF = "diff"  # Compara com o gravado e escreve só as mudanças
+
+# Armazenamento da memória de cálculo dos custos diretos
+MEMORIA_LINHA = "linha"  # memoria_calculo em cada linha de custos_calculados
+MEMORIA_POSICAO = "posicao"  # Uma vez por posição/mês em custos_memoria_posicao
+MEMORIA_NENHUMA = "nenhuma"  # Não grava; reconstruída sob demanda (explicar_custo)
+
+# Modos de rateio entre CCs
+RATEIO_SEQUENCIAL = "sequencial"  # Um grupo depois do outro (POOL -> destinos)
+RATEIO_RECIPROCO = "reciproco"  # Sistema linear entre os POOLs (ver rateio_reciproco)
+
+
 class CalculoCustosService:
     """Serviço para cálculo de custos de pessoal."""
     
-    def __init__(self, db: AsyncSession):
+    def __init__(self, db: AsyncSession, motor: Optional[str] = None):
         self.db = db
-        self._tipos_custo: Dict[str, TipoCusto] = {}
-        self._parametros: Dict[str, float] = {}
+        self.motor = motor or settings.CUSTOS_MOTOR
+        self._plano: Optional[PlanoRubricas] = None
+        self._tipos_custo: Dict[str, PassoRubrica] = {}
+        self._tabela_parametros: Optional[TabelaParametros] = None
+        self._parametros: Parametros = {}  # Vigentes na seção em cálculo
+        self._vetor_parametros: Optional[List[Optional[float]]] = None  # Por (rubrica, chave), ver parametros_custo
         self._custos_calculados: Dict[str, Decimal] = {}  # Para referências entre rubricas
         self._premissas_cache: Dict[tuple, Dict] = {}  # Cache de premissas: (funcao_id, mes) -> dados
+        self._calendario: Optional[Calendario] = None
+        self._regime: RegimeTrabalho = REGIME_PADRAO  # Regime de trabalho da seção em cálculo
     
     async def carregar_tipos_custo(self) -> None:
-        """Carrega todos os tipos de custo ativos."""
-        result = await self.db.execute(
-            select(TipoCusto).where(TipoCusto.ativo == True).order_by(TipoCusto.ordem)
-        )
-        tipos = result.scalars().all()
-        self._tipos_custo = {tc.codigo: tc for tc in tipos}
+        """Carrega o plano compilado dos tipos de custo ativos (em cache até tipos_custo mudar)."""
+        self._plano = await obter_plano_rubricas(self.db)
+        self._tipos_custo = {passo.codigo: passo for passo in self._plano.passos}
     
     async def carregar_parametros(self, cenario_id: UUID, cenario_secao_id: Optional[UUID] = None) -> None:
-        """Carrega parâmetros de custo para o cenário/seção."""
-        query = select(ParametroCusto).where(ParametroCusto.cenario_id == cenario_id)
-        if cenario_secao_id:
-            query = query.where(
-                (ParametroCusto.cenario_secao_id == cenario_secao_id) | 
-                (ParametroCusto.cenario_secao_id.is_(None))
-            )
-        result = await self.db.execute(query)
-        params = result.scalars().all()
-        
-        for p in params:
-            key = f"{p.tipo_custo_id or 'global'}:{p.chave}"
-            self._parametros[key] = float(p.valor)
+        """Seleciona os parâmetros vigentes na seção (a tabela do cenário é lida uma única vez)."""
+        if self._tabela_parametros is None or self._tabela_parametros.cenario_id != cenario_id:
+            self._tabela_parametros = await carregar_tabela_parametros(self.db, cenario_id)
+        self.usar_parametros(self._tabela_parametros.da_secao(cenario_secao_id))
+    
+    def usar_parametros(self, parametros: Parametros) -> None:
+        """Troca os parâmetros vigentes e refaz a lista por rubrica do plano (motor escalar)."""
+        self._parametros = parametros
+        self._vetor_parametros = vetor_parametros(self._plano, parametros) if self._plano else None
+    
+    async def carregar_calendario(self, cenario_secao_id: UUID, anos: List[int]) -> None:
+        """Carrega o calendário dos anos e o regime de trabalho (uf/cidade, política) da seção."""
+        self._calendario = await obter_calendario(self.db, min(anos), max(anos))
+        result = await self.db.execute(
+            select(Secao)
+            .join(CenarioSecao, CenarioSecao.secao_id == Secao.id)
+            .where(CenarioSecao.id == cenario_secao_id)
+        )
+        self._regime = RegimeTrabalho.de_secao(result.scalar_one_or_none())
     
     def get_parametro(self, chave: str, tipo_custo_id: Optional[UUID] = None, default: float = 0) -> float:
-        """Obtém um parâmetro de custo."""
-        # Tenta primeiro com tipo_custo específico
-        if tipo_custo_id:
-            key = f"{tipo_custo_id}:{chave}"
-            if key in self._parametros:
-                return self._parametros[key]
-        # Tenta parâmetro global
-        key = f"global:{chave}"
-        return self._parametros.get(key, default)
+        """Obtém um parâmetro de custo (o da rubrica, senão o global, senão o padrão)."""
+        return buscar_parametro(self._parametros, chave, tipo_custo_id, default)
+    
+    def _parametro(self, tipo: PassoRubrica, chave: int, default: float) -> float:
+        """Parâmetro vigente da rubrica por índice (chave = PARAM_*), sem montar chaves."""
+        valor = self._vetor_parametros[tipo.indice * len(CHAVES_PARAMETROS) + chave]
+        return default if valor is None else valor
     
     async def calcular_custos_cenario(
         self, 
@@ -108,11 +208,43 @@ class CalculoCustosService:
         Args:
             cenario_id: ID do cenário
             cenario_secao_id: ID da seção (opcional, se None calcula todas)
-            ano: Ano para cálculo (opcional, se None usa ano do cenário)
+            ano: Ano para cálculo (opcional, se None calcula toda a janela do cenário)
         
         Returns:
             Lista de custos calculados
         """
+        registros = await self.calcular_registros_cenario(cenario_id, cenario_secao_id, ano)
+        return [CustoCalculado(**r) for r in registros]
+    
+    async def calcular_registros_cenario(
+        self, 
+        cenario_id: UUID,
+        cenario_secao_id: Optional[UUID] = None,
+        ano: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Calcula todos os custos para um cenário e retorna os registros
+        prontos para inserção em lote (dicts com as colunas de custos_calculados).
+        """
+        todos_registros = []
+        async for _, _, registros in self.iterar_registros_cenario(cenario_id, cenario_secao_id, ano):
+            todos_registros.extend(registros)
+        return todos_registros
+    
+    async def iterar_registros_cenario(
+        self, 
+        cenario_id: UUID,
+        cenario_secao_id: Optional[UUID] = None,
+        ano: Optional[int] = None
+    ) -> AsyncIterator[Tuple[UUID, int, List[Dict[str, Any]]]]:
+        """
+        Calcula os custos do cenário em uma única passada e entrega os registros
+        em lotes (secao_id, ano, registros), para gravação incremental.
+        
+        Sem `ano`, cobre todos os (ano, mes) da janela do cenário (que pode cruzar
+        anos). Quadro e premissas de cada seção são carregados uma única vez e
+        todos os meses da janela são calculados na mesma matriz.
+        """
         # Carregar tipos de custo
         await self.carregar_tipos_custo()
         
@@ -121,30 +253,27 @@ class CalculoCustosService:
         if not cenario:
             raise ValueError(f"Cenário {cenario_id} não encontrado")
         
-        if not ano:
-            ano = cenario.ano_inicio
-        
-        # Determinar seções a calcular
-        if cenario_secao_id:
-            secoes_ids = [cenario_secao_id]
+        if ano:
+            # Compatibilidade: ano informado calcula os 12 meses daquele ano
+            periodos = [(ano, mes) for mes in range(1, 13)]
         else:
-            # Buscar todas as seções que tem quadro pessoal neste cenário
-            result = await self.db.execute(
-                select(QuadroPessoal.cenario_secao_id)
-                .where(QuadroPessoal.cenario_id == cenario_id)
-                .where(QuadroPessoal.cenario_secao_id.isnot(None))
-                .distinct()
-            )
-            secoes_ids = [row[0] for row in result.fetchall()]
+            periodos = periodos_cenario(cenario)
         
-        todos_custos = []
+        # Determinar seções a calcular
+        secoes_ids = await secoes_calculaveis(self.db, cenario_id, cenario_secao_id)
         
         for secao_id in secoes_ids:
-            await self.carregar_parametros(cenario_id, secao_id)
-            custos_secao = await self._calcular_custos_secao(cenario_id, secao_id, ano)
-            todos_custos.extend(custos_secao)
-        
-        return todos_custos
+            with fase("parametros", secao_id):
+                await self.carregar_parametros(cenario_id, secao_id)
+            if self.motor == MOTOR_ESCALAR:
+                for ano_calc, meses in _agrupar_periodos_por_ano(periodos):
+                    custos_secao = await self._calcular_custos_secao(cenario_id, secao_id, ano_calc, meses)
+                    with fase("registros", secao_id):
+                        registros = [_custo_para_registro(c) for c in custos_secao]
+                    yield secao_id, ano_calc, registros
+            else:
+                async for ano_calc, registros in self._iterar_custos_secao_vetorizado(cenario_id, secao_id, periodos):
+                    yield secao_id, ano_calc, registros
     
     async def _carregar_premissas_secao(
         self, 
@@ -178,6 +307,114 @@ class CalculoCustosService:
                 'dias_treinamento': p.dias_treinamento,
             }
     
+    async def _carregar_quadro_secao(
+        self, 
+        cenario_id: UUID, 
+        cenario_secao_id: UUID,
+        funcoes_ids: Optional[List[UUID]] = None
+    ) -> List[QuadroPessoal]:
+        """Carrega o quadro de pessoal ativo da seção (opcionalmente só algumas funções)."""
+        query = select(QuadroPessoal).options(
+            selectinload(QuadroPessoal.funcao),
+            selectinload(QuadroPessoal.tabela_salarial).selectinload(TabelaSalarial.politica)
+        ).where(
+            QuadroPessoal.cenario_id == cenario_id,
+            QuadroPessoal.cenario_secao_id == cenario_secao_id,
+            QuadroPessoal.ativo == True
+        )
+        if funcoes_ids is not None:
+            query = query.where(QuadroPessoal.funcao_id.in_(funcoes_ids))
+        result = await self.db.execute(query)
+        return result.scalars().all()
+    
+    async def calcular_registros_celulas(
+        self, 
+        cenario_id: UUID, 
+        cenario_secao_id: UUID,
+        funcoes_ids: Optional[List[UUID]],
+        periodos: List[Tuple[int, int]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Calcula apenas as posições das funções informadas, nos períodos informados.
+        Usado pelo recálculo incremental (funcoes_ids=None = todas as funções da seção).
+        """
+        if self._plano is None:
+            await self.carregar_tipos_custo()
+        await self.carregar_parametros(cenario_id, cenario_secao_id)
+        
+        registros = []
+        if self.motor == MOTOR_ESCALAR:
+            for ano, meses in _agrupar_periodos_por_ano(periodos):
+                custos = await self._calcular_custos_secao(cenario_id, cenario_secao_id, ano, meses, funcoes_ids)
+                registros.extend(_custo_para_registro(c) for c in custos)
+        else:
+            async for _, lote in self._iterar_custos_secao_vetorizado(
+                cenario_id, cenario_secao_id, periodos, funcoes_ids
+            ):
+                registros.extend(lote)
+        return registros
+    
+    async def _carregar_premissas_periodos(
+        self, 
+        cenario_id: UUID, 
+        cenario_secao_id: UUID, 
+        anos: List[int]
+    ) -> Dict[tuple, Dict]:
+        """Carrega as premissas da seção para todos os anos da janela, indexadas por (funcao_id, ano, mes)."""
+        result = await self.db.execute(
+            select(PremissaFuncaoMes).where(
+                PremissaFuncaoMes.cenario_id == cenario_id,
+                PremissaFuncaoMes.cenario_secao_id == cenario_secao_id,
+                PremissaFuncaoMes.ano.in_(anos)
+            )
+        )
+        
+        premissas = {}
+        for p in result.scalars().all():
+            premissas[(p.funcao_id, p.ano, p.mes)] = {
+                'absenteismo': float(p.absenteismo or 0),
+                'abs_pct_justificado': float(p.abs_pct_justificado or 75),
+                'turnover': float(p.turnover or 0),
+                'ferias_indice': float(p.ferias_indice or 8.33),
+                'dias_treinamento': p.dias_treinamento,
+            }
+        return premissas
+    
+    async def _iterar_custos_secao_vetorizado(
+        self, 
+        cenario_id: UUID, 
+        cenario_secao_id: UUID,
+        periodos: List[Tuple[int, int]],
+        funcoes_ids: Optional[List[UUID]] = None
+    ) -> AsyncIterator[Tuple[int, List[Dict[str, Any]]]]:
+        """
+        Calcula custos de uma seção com o motor vetorizado.
+        Cada rubrica é calculada de uma vez para a matriz (posições x meses da janela);
+        os registros são entregues ano a ano.
+        """
+        with fase("quadro", cenario_secao_id):
+            quadro_itens = await self._carregar_quadro_secao(cenario_id, cenario_secao_id, funcoes_ids)
+        if not quadro_itens:
+            return
+        
+        anos = sorted({a for a, _ in periodos})
+        with fase("premissas", cenario_secao_id):
+            premissas = await self._carregar_premissas_periodos(cenario_id, cenario_secao_id, anos)
+        with fase("calendario", cenario_secao_id):
+            await self.carregar_calendario(cenario_secao_id, anos)
+        
+        with fase("matrizes", cenario_secao_id):
+            entradas = EntradasSecao(quadro_itens, premissas, periodos, self._calendario, self._regime)
+        with fase("rubricas", cenario_secao_id):
+            hc_folha, valores = calcular_rubricas(entradas, self._plano, self.get_parametro, tempos_rubricas())
+        
+        for ano, colunas in entradas.colunas_por_ano():
+            with fase("registros", cenario_secao_id):
+                registros = gerar_registros(
+                    cenario_id, cenario_secao_id, entradas, self._plano, hc_folha, valores, colunas
+                )
+            yield ano, registros
+    
     def _get_premissa_cached(self, funcao_id: UUID, mes: int) -> Optional[Dict]:
         """Obtém premissa do cache (acesso O(1))."""
         return self._premissas_cache.get((funcao_id, mes))
@@ -186,35 +423,48 @@ class CalculoCustosService:
         self, 
         cenario_id: UUID, 
         cenario_secao_id: UUID,
-        ano: int
+        ano: int,
+        meses: Optional[List[int]] = None,
+        funcoes_ids: Optional[List[UUID]] = None
     ) -> List[CustoCalculado]:
-        """Calcula custos para uma seção específica."""
+        """Calcula custos para uma seção específica (meses do ano; None = 12 meses)."""
         
         # OTIMIZAÇÃO: Pré-carregar todas as premissas de uma vez
-        await self._carregar_premissas_secao(cenario_id, cenario_secao_id, ano)
+        with fase("premissas", cenario_secao_id):
+            await self._carregar_premissas_secao(cenario_id, cenario_secao_id, ano)
         
         # Carregar quadro pessoal da seção
-        result = await self.db.execute(
-            select(QuadroPessoal).options(
-                selectinload(QuadroPessoal.funcao),
-                selectinload(QuadroPessoal.tabela_salarial).selectinload(TabelaSalarial.politica)
-            ).where(
-                QuadroPessoal.cenario_id == cenario_id,
-                QuadroPessoal.cenario_secao_id == cenario_secao_id,
-                QuadroPessoal.ativo == True
-            )
-        )
-        quadro_itens = result.scalars().all()
+        with fase("quadro", cenario_secao_id):
+            quadro_itens = await self._carregar_quadro_secao(cenario_id, cenario_secao_id, funcoes_ids)
         
         if not quadro_itens:
             return []
         
+        with fase("calendario", cenario_secao_id):
+            await self.carregar_calendario(cenario_secao_id, [ano])
+        
+        with fase("rubricas", cenario_secao_id):
+            return await self._calcular_quadros(cenario_id, cenario_secao_id, quadro_itens, ano, meses)
+    
+    async def _calcular_quadros(
+        self,
+        cenario_id: UUID,
+        cenario_secao_id: UUID,
+        quadro_itens: List[QuadroPessoal],
+        ano: int,
+        meses: Optional[List[int]] = None
+    ) -> List[CustoCalculado]:
+        """
+        Calcula as rubricas das posições, mês a mês, sem consultar o banco: plano,
+        parâmetros, calendário e premissas (cache) já carregados.
+        """
         custos = []
+        tempos = tempos_rubricas()
         
         # Para cada item do quadro (função)
         for quadro in quadro_itens:
             # Para cada mês
-            for mes in range(1, 13):
+            for mes in (meses or range(1, 13)):
                 # Limpar cache de custos calculados para este mês
                 self._custos_calculados = {}
                 
@@ -235,8 +485,9 @@ class CalculoCustosService:
                 # Obter política de benefícios
                 politica = quadro.tabela_salarial.politica if quadro.tabela_salarial else None
                 
-                # Calcular cada rubrica na ordem correta
-                for tipo in sorted(self._tipos_custo.values(), key=lambda x: x.ordem):
+                # Calcular cada rubrica na ordem do plano compilado
+                for tipo in self._plano.passos:
+                    inicio = time.perf_counter() if tempos is not None else 0.0
                     valor = await self._calcular_rubrica(
                         tipo=tipo,
                         quadro=quadro,
@@ -248,12 +499,15 @@ class CalculoCustosService:
                         mes=mes,
                         ano=ano
                     )
+                    if tempos is not None:
+                        tempos[tipo.codigo] = tempos.get(tipo.codigo, 0.0) + time.perf_counter() - inicio
                     
                     if valor != 0:
                         custo = CustoCalculado(
                             cenario_id=cenario_id,
                             cenario_secao_id=cenario_secao_id,
                             funcao_id=quadro.funcao_id,
+                            quadro_pessoal_id=quadro.id,
                             faixa_id=quadro.tabela_salarial.faixa_id if quadro.tabela_salarial else None,
                             tipo_custo_id=tipo.id,
                             centro_custo_id=quadro.centro_custo_id,  # CC do quadro de pessoal
@@ -343,7 +597,7 @@ class CalculoCustosService:
     
     async def _calcular_rubrica(
         self,
-        tipo: TipoCusto,
+        tipo: PassoRubrica,
         quadro: QuadroPessoal,
         hc_operando: float,
         hc_folha: float,
@@ -367,13 +621,13 @@ class CalculoCustosService:
         
         elif codigo == COD_HE_50:
             # Horas extras 50% - usar parâmetro
-            pct_he = self.get_parametro("pct_horas_extras_50", tipo.id, 0)
+            pct_he = self._parametro(tipo, PARAM_HE_50, 0)
             return hc_folha * salario * (pct_he / 100) * 1.5
         
         elif codigo == COD_HE_100:
             # Horas extras 100% (feriados) - calcular automaticamente
             # TODO: Implementar cálculo baseado em feriados
-            pct_he = self.get_parametro("pct_horas_extras_100", tipo.id, 0)
+            pct_he = self._parametro(tipo, PARAM_HE_100, 0)
             return hc_folha * salario * (pct_he / 100) * 2.0
         
         elif codigo == COD_DSR:
@@ -442,7 +696,7 @@ class CalculoCustosService:
             if not politica or politica.plano_saude <= 0:
                 return 0
             
-            idx_elegibilidade = self.get_parametro("pct_elegibilidade_am", tipo.id, 100) / 100
+            idx_elegibilidade = self._parametro(tipo, PARAM_ELEGIBILIDADE_AM, 100) / 100
             return hc_folha * float(politica.plano_saude) * idx_elegibilidade
         
         elif codigo == COD_CRECHE:
@@ -450,8 +704,8 @@ class CalculoCustosService:
             if not politica or politica.aux_creche <= 0:
                 return 0
             
-            idx_elegibilidade = self.get_parametro("pct_elegibilidade_creche", tipo.id, 
-                                                   float(politica.aux_creche_percentual)) / 100
+            idx_elegibilidade = self._parametro(tipo, PARAM_ELEGIBILIDADE_CRECHE,
+                                               float(politica.aux_creche_percentual)) / 100
             return hc_folha * float(politica.aux_creche) * idx_elegibilidade
         
         elif codigo == COD_HO:
@@ -472,25 +726,25 @@ class CalculoCustosService:
         elif codigo == COD_FGTS:
             # FGTS - alíquota do cadastro (padrão 8%)
             base = self._calcular_base_encargo("incide_fgts")
-            aliquota = self._get_aliquota(tipo, 8.0)
+            aliquota = tipo.aliquota
             return base * aliquota
         
         elif codigo == COD_INSS_EMP:
             # INSS Empresa - alíquota do cadastro (padrão 20%)
             base = self._calcular_base_encargo("incide_inss")
-            aliquota = self._get_aliquota(tipo, 20.0)
+            aliquota = tipo.aliquota
             return base * aliquota
         
         elif codigo == COD_INSS_TERC:
             # INSS Terceiros - alíquota do cadastro (padrão 5.8%)
             base = self._calcular_base_encargo("incide_inss")
-            aliquota = self._get_aliquota(tipo, 5.8)
+            aliquota = tipo.aliquota
             return base * aliquota
         
         elif codigo == COD_SAT_RAT:
             # SAT/RAT - alíquota do cadastro (padrão 3%)
             base = self._calcular_base_encargo("incide_inss")
-            aliquota = self._get_aliquota(tipo, 3.0)
+            aliquota = tipo.aliquota
             return base * aliquota
         
         # ============================================
@@ -500,55 +754,55 @@ class CalculoCustosService:
         elif codigo == COD_PROV_FERIAS:
             # Provisão Férias - alíquota do cadastro (padrão 11.11% = 1/12 + 1/3)
             base = self._calcular_base_reflexo("reflexo_ferias")
-            aliquota = self._get_aliquota(tipo, 11.11)
+            aliquota = tipo.aliquota
             return base * aliquota
         
         elif codigo == COD_FGTS_FERIAS:
             # FGTS sobre Férias - alíquota do cadastro (padrão 8%)
             prov_ferias = self._custos_calculados.get(COD_PROV_FERIAS, Decimal(0))
-            aliquota = self._get_aliquota(tipo, 8.0)
+            aliquota = tipo.aliquota
             return float(prov_ferias) * aliquota
         
         elif codigo == COD_INSS_FERIAS:
             # INSS sobre Férias - alíquota do cadastro (padrão 28.8%)
             prov_ferias = self._custos_calculados.get(COD_PROV_FERIAS, Decimal(0))
-            aliquota = self._get_aliquota(tipo, 28.8)
+            aliquota = tipo.aliquota
             return float(prov_ferias) * aliquota
         
         elif codigo == COD_PROV_13:
             # Provisão 13º - alíquota do cadastro (padrão 8.33%)
             base = self._calcular_base_reflexo("reflexo_13")
-            aliquota = self._get_aliquota(tipo, 8.33)
+            aliquota = tipo.aliquota
             return base * aliquota
         
         elif codigo == COD_FGTS_13:
             # FGTS sobre 13º - alíquota do cadastro (padrão 8%)
             prov_13 = self._custos_calculados.get(COD_PROV_13, Decimal(0))
-            aliquota = self._get_aliquota(tipo, 8.0)
+            aliquota = tipo.aliquota
             return float(prov_13) * aliquota
         
         elif codigo == COD_INSS_13:
             # INSS sobre 13º - alíquota do cadastro (padrão 28.8%)
             prov_13 = self._custos_calculados.get(COD_PROV_13, Decimal(0))
-            aliquota = self._get_aliquota(tipo, 28.8)
+            aliquota = tipo.aliquota
             return float(prov_13) * aliquota
         
         elif codigo == COD_INDENIZ:
-            # Indenizações Trabalhistas - alíquota do cadastro sobre o Salário (0001)
+            # Indenizações Trabalhistas - alíquota do cadastro sobre o Salário (0001), padrão 0
             salario_total = self._custos_calculados.get(COD_SALARIO, Decimal(0))
-            aliquota = self._get_aliquota(tipo, 0)  # Padrão 0 se não cadastrado
+            aliquota = tipo.aliquota
             return float(salario_total) * aliquota
         
         elif codigo == COD_AVISO_IND:
             # Aviso Prévio Indenizado
             turnover = (premissa.get('turnover', 0) if premissa else 0) / 100
-            pct_deslig_empresa = self.get_parametro("pct_deslig_empresa", tipo.id, 50) / 100
+            pct_deslig_empresa = self._parametro(tipo, PARAM_DESLIG_EMPRESA, 50) / 100
             return hc_folha * salario * turnover * pct_deslig_empresa
         
         elif codigo == COD_MULTA_FGTS:
             # Multa 40% FGTS
             turnover = (premissa.get('turnover', 0) if premissa else 0) / 100
-            pct_deslig_empresa = self.get_parametro("pct_deslig_empresa", tipo.id, 50) / 100
+            pct_deslig_empresa = self._parametro(tipo, PARAM_DESLIG_EMPRESA, 50) / 100
             # Saldo médio FGTS: 8% x salário x 6 meses (média)
             saldo_fgts = hc_folha * salario * 0.08 * 6
             return saldo_fgts * 0.4 * turnover * pct_deslig_empresa / 12  # Dividido por 12 para mensal
@@ -557,16 +811,9 @@ class CalculoCustosService:
         # PRÊMIOS
         # ============================================
         
-        elif codigo == COD_BONUS:
-            # Bônus - % da receita (implementar quando houver receita)
-            pct = self.get_parametro("pct_bonus_receita", tipo.id, 0)
-            # TODO: Implementar quando módulo de receitas estiver pronto
-            return 0
-        
-        elif codigo == COD_PREMIACAO:
-            # Premiação
-            pct = self.get_parametro("pct_premios_receita", tipo.id, 0)
-            # TODO: Implementar quando módulo de receitas estiver pronto
+        elif codigo in (COD_BONUS, COD_PREMIACAO):
+            # Bônus e premiação são % da receita (pct_bonus_receita, pct_premios_receita),
+            # não da folha: o motor de custos de pessoal não gera valor para elas
             return 0
         
         # ============================================
@@ -576,15 +823,15 @@ class CalculoCustosService:
         elif codigo == COD_DESC_480:
             # Desconto Art. 480 CLT
             turnover = (premissa.get('turnover', 0) if premissa else 0) / 100
-            pct_pedido_demissao = 1 - self.get_parametro("pct_deslig_empresa", tipo.id, 50) / 100
+            pct_pedido_demissao = 1 - self._parametro(tipo, PARAM_DESLIG_EMPRESA, 50) / 100
             # 50% do período restante de experiência (média 22 dias)
             return -(hc_folha * (salario / 30) * 22 * 0.5 * turnover * pct_pedido_demissao / 12)
         
         elif codigo == COD_DESC_AVISO:
             # Desconto Aviso Prévio
             turnover = (premissa.get('turnover', 0) if premissa else 0) / 100
-            pct_pedido_demissao = 1 - self.get_parametro("pct_deslig_empresa", tipo.id, 50) / 100
-            pct_nao_cumpre = self.get_parametro("pct_nao_cumpre_aviso", tipo.id, 30) / 100
+            pct_pedido_demissao = 1 - self._parametro(tipo, PARAM_DESLIG_EMPRESA, 50) / 100
+            pct_nao_cumpre = self._parametro(tipo, PARAM_NAO_CUMPRE_AVISO, 30) / 100
             return -(hc_folha * salario * turnover * pct_pedido_demissao * pct_nao_cumpre)
         
         elif codigo == COD_DESC_FALTAS:
@@ -620,27 +867,11 @@ class CalculoCustosService:
         
         return 0
     
-    def _get_aliquota(self, tipo: TipoCusto, padrao: float) -> float:
-        """
-        Obtém a alíquota do cadastro do evento (tipos_custo.aliquota_padrao).
-        Se não houver alíquota cadastrada, usa o valor padrão.
-        
-        Args:
-            tipo: Objeto TipoCusto
-            padrao: Valor padrão caso não haja alíquota cadastrada
-        
-        Returns:
-            Alíquota em decimal (ex: 8.33% retorna 0.0833)
-        """
-        if tipo and tipo.aliquota_padrao is not None:
-            return float(tipo.aliquota_padrao) / 100
-        return padrao / 100
-    
     def _calcular_base_encargo(self, flag: str) -> float:
         """Calcula a base para encargos (soma das rubricas com flag True)."""
         base = Decimal(0)
-        for codigo, tipo in self._tipos_custo.items():
-            if getattr(tipo, flag, False) and codigo in self._custos_calculados:
+        for codigo in self._plano.codigos_por_flag.get(flag, ()):
+            if codigo in self._custos_calculados:
                 base += self._custos_calculados[codigo]
         return float(base)
     
@@ -649,95 +880,330 @@ class CalculoCustosService:
         return self._calcular_base_encargo(flag)
     
     def _get_dias_trabalhados(self, mes: int, ano: int, escala: str) -> int:
-        """Obtém dias trabalhados no mês baseado na escala."""
-        dias_mes = calendar.monthrange(ano, mes)[1]
-        
-        if escala == "6x1":
-            return int(dias_mes * 26 / 30)
-        elif escala == "5x2":
-            return int(dias_mes * 21 / 30)
-        elif escala == "12x36":
-            return int(dias_mes * 15 / 30)
-        else:
-            return dias_mes
+        """Obtém dias trabalhados no mês pela escala, no calendário da seção."""
+        return self._calendario.dias_trabalhados(ano, mes, escala, self._regime)
     
-    def _get_dias_uteis(self, mes: int, ano: int) -> int:
-        """Obtém dias úteis do mês."""
-        dias_mes = calendar.monthrange(ano, mes)[1]
-        # Aproximação: 22 dias úteis por mês
-        return min(22, dias_mes - 8)
+    def _get_dias_uteis(self, mes: int, ano: int) -> float:
+        """Obtém dias úteis do mês no calendário da seção."""
+        return self._calendario.dias_uteis(ano, mes, self._regime)
+
+
+def _custo_para_registro(c: CustoCalculado) -> Dict[str, Any]:
+    """Converte um CustoCalculado (não persistido) em dict para bulk insert."""
+    return {
+        "cenario_id": c.cenario_id,
+        "cenario_secao_id": c.cenario_secao_id,
+        "funcao_id": c.funcao_id,
+        "quadro_pessoal_id": c.quadro_pessoal_id,
+        "faixa_id": c.faixa_id,
+        "tipo_custo_id": c.tipo_custo_id,
+        "centro_custo_id": c.centro_custo_id,
+        "mes": c.mes,
+        "ano": c.ano,
+        "hc_base": c.hc_base,
+        "valor_base": c.valor_base,
+        "indice_aplicado": c.indice_aplicado,
+        "valor_calculado": c.valor_calculado,
+        "memoria_calculo": c.memoria_calculo,
+    }
+
+
+async def _inserir_registros(db: AsyncSession, registros: List[Dict[str, Any]]) -> None:
+    """Insere registros de custos_calculados (COPY binário, ver gravacao_lote)."""
+    await gravar_registros(db, CustoCalculado.__table__, registros)
+
+
+# Campos comparados na sincronização de custos_calculados
+CAMPOS_VALOR_CUSTO = ("hc_base", "valor_base", "indice_aplicado", "valor_calculado", "memoria_calculo")
+
+
+def _chave_custo(r: Dict[str, Any]) -> Tuple[Any, ...]:
+    """
+    Chave de emparelhamento de custos_calculados na sincronização.
+    Custos diretos: posição + rubrica + período (uq_custo_calculado + CC para linhas
+    antigas, sem quadro_pessoal_id). Rateios: grupo + custo de origem + CC destino
+    (o id da origem é preservado pelo diff).
+    """
+    if r.get("rateio_grupo_id"):
+        return (
+            "R", r.get("rateio_grupo_id"), r.get("custo_origem_id") or r.get("custo_direto_id"),
+            r.get("centro_custo_id"), r.get("tipo_custo_id"), r.get("mes"), r.get("ano")
+        )
+    if r.get("quadro_pessoal_id"):
+        return ("P", r.get("quadro_pessoal_id"), r.get("tipo_custo_id"), r.get("mes"), r.get("ano"))
+    return ("D",) + _chave_custo_legado(r)
+
+
+def _chave_custo_legado(r: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Chave de um custo direto sem posição: seção, função, faixa, rubrica, CC e período."""
+    return (
+        r.get("cenario_secao_id"), r.get("funcao_id"), r.get("faixa_id"),
+        r.get("tipo_custo_id"), r.get("centro_custo_id"), r.get("mes"), r.get("ano")
+    )
+
+
+def _adotar_custos_legados(
+    existentes: List[Dict[str, Any]],
+    registros: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Emparelha custos diretos gravados antes de quadro_pessoal_id (a migração não
+    preenche a coluna) com a linha nova da mesma seção/função/faixa/rubrica/CC/período.
+
+    A linha antiga recebe o quadro_pessoal_id da nova e passa a casar pela chave "P";
+    sem isso o primeiro diff apagaria e reinseriria todas as linhas diretas.
+
+    Returns:
+        Parâmetros (id, quadro_pessoal_id) para gravar a posição nas linhas adotadas
+    """
+    legados: Dict[Tuple[Any, ...], List[Dict[str, Any]]] = {}
+    for r in existentes:
+        if not r.get("rateio_grupo_id") and not r.get("quadro_pessoal_id"):
+            legados.setdefault(_chave_custo_legado(r), []).append(r)
+    if not legados:
+        return []
+    adotados = []
+    for novo in registros:
+        if novo.get("rateio_grupo_id") or not novo.get("quadro_pessoal_id"):
+            continue
+        candidatos = legados.get(_chave_custo_legado(novo))
+        if candidatos:
+            existente = candidatos.pop()
+            existente["quadro_pessoal_id"] = novo["quadro_pessoal_id"]
+            adotados.append({"id_custo": existente["id"], "posicao_id": novo["quadro_pessoal_id"]})
+    return adotados
+
+
+async def _gravar_posicao_adotada(db: AsyncSession, adotados: List[Dict[str, Any]]) -> None:
+    """Grava quadro_pessoal_id nas linhas antigas adotadas (ver _adotar_custos_legados)."""
+    if not adotados:
+        return
+    tabela = CustoCalculado.__table__
+    await db.execute(
+        update(tabela)
+        .where(tabela.c.id == bindparam("id_custo"))
+        .values(quadro_pessoal_id=bindparam("posicao_id")),
+        adotados
+    )
+
+
+def _filtro_custos_diretos():
+    """Custos que não são rateio."""
+    return CustoCalculado.rateio_grupo_id.is_(None)
+
+
+def _separar_memoria(registros: List[Dict[str, Any]], modo: str) -> List[Dict[str, Any]]:
+    """
+    Retira memoria_calculo dos registros conforme o modo de armazenamento.
+    No modo "posicao" devolve as linhas de custos_memoria_posicao (uma por posição/mês);
+    tipo_calculo não é repetido, pois vem da rubrica.
+    """
+    if modo == MEMORIA_LINHA:
+        return []
+    
+    memorias: Dict[Tuple[Any, int, int], Dict[str, Any]] = {}
+    for r in registros:
+        memoria = r.pop("memoria_calculo", None)
+        r["memoria_calculo"] = None
+        quadro_id = r.get("quadro_pessoal_id")
+        if modo != MEMORIA_POSICAO or not memoria or not quadro_id:
+            continue
+        chave = (quadro_id, r["ano"], r["mes"])
+        if chave not in memorias:
+            memorias[chave] = {
+                "cenario_id": r["cenario_id"],
+                "cenario_secao_id": r.get("cenario_secao_id"),
+                "funcao_id": r.get("funcao_id"),
+                "quadro_pessoal_id": quadro_id,
+                "mes": r["mes"],
+                "ano": r["ano"],
+                "memoria": {k: v for k, v in memoria.items() if k != "tipo_calculo"},
+            }
+    return list(memorias.values())
+
+
+async def _gravar_memorias(db: AsyncSession, memorias: List[Dict[str, Any]]) -> None:
+    await gravar_registros(db, CustoMemoriaPosicao.__table__, memorias)
+
+
+async def _carregar_custos_gravados(db: AsyncSession, *condicoes) -> List[Dict[str, Any]]:
+    """Linhas de custos_calculados (como dicts, com id) que atendem às condições."""
+    tabela = CustoCalculado.__table__
+    result = await db.execute(select(tabela).where(*condicoes))
+    return [dict(row) for row in result.mappings().all()]
 
 
 async def calcular_e_salvar_custos(
     db: AsyncSession,
     cenario_id: UUID,
     cenario_secao_id: Optional[UUID] = None,
-    ano: Optional[int] = None
-) -> int:
+    ano: Optional[int] = None,
+    motor: Optional[str] = None,
+    ao_gravar_lote: Optional[ProgressoCallback] = None,
+    persistencia: Optional[str] = None,
+    forcar: bool = False,
+    ao_iniciar_etapa: Optional[EtapaCallback] = None
+) -> Dict[str, Any]:
     """
     Calcula e salva os custos de um cenário.
     
-    Returns:
-        Quantidade de custos calculados
-    """
-    from sqlalchemy import delete
-    from sqlalchemy.dialects.postgresql import insert as pg_insert
-    
-    service = CalculoCustosService(db)
+    Se as entradas do escopo (ver impressao_calculo) não mudaram desde o último
+    cálculo, devolve o resumo gravado com "cache": True, sem recalcular.
+    `forcar` pula essa verificação.
     
-    # Limpar custos anteriores
-    stmt = delete(CustoCalculado).where(CustoCalculado.cenario_id == cenario_id)
-    if cenario_secao_id:
-        stmt = stmt.where(CustoCalculado.cenario_secao_id == cenario_secao_id)
-    await db.execute(stmt)
+    Persistência (padrão: settings.CUSTOS_PERSISTENCIA):
+    - "diff": compara cada lote com o que está gravado e escreve só inserções,
+      atualizações e remoções; leitores nunca veem o cenário vazio
+    - "substituir": remove todos os custos do escopo e insere de novo
     
-    # Calcular novos custos
-    custos = await service.calcular_custos_cenario(cenario_id, cenario_secao_id, ano)
+    Custos, rateio, resumo do DRE e impressão são gravados em uma única
+    transação: se `ao_gravar_lote`, `ao_iniciar_etapa` ou o rateio levantarem exceção (ex:
+    RateioReciprocoError), nada é commitado e os custos anteriores permanecem.
     
-    if not custos:
-        await db.commit()
-        return 0
+    A execução é perfilada (ver perfil_calculo); o id do perfil vem em "perfil_id".
     
-    # OTIMIZAÇÃO: Bulk insert em vez de add() individual
-    # Converter objetos para dicts para bulk insert
-    BATCH_SIZE = 1000  # Inserir em lotes para evitar memory issues
-    
-    for i in range(0, len(custos), BATCH_SIZE):
-        batch = custos[i:i + BATCH_SIZE]
-        valores = [
-            {
-                "cenario_id": c.cenario_id,
-                "cenario_secao_id": c.cenario_secao_id,
-                "funcao_id": c.funcao_id,
-                "faixa_id": c.faixa_id,
-                "tipo_custo_id": c.tipo_custo_id,
-                "centro_custo_id": c.centro_custo_id,
-                "mes": c.mes,
-                "ano": c.ano,
-                "hc_base": c.hc_base,
-                "valor_base": c.valor_base,
-                "indice_aplicado": c.indice_aplicado,
-                "valor_calculado": c.valor_calculado,
-                "memoria_calculo": c.memoria_calculo,
-            }
-            for c in batch
-        ]
-        
-        # Usar insert nativo do SQLAlchemy (funciona com qualquer banco)
-        await db.execute(
-            CustoCalculado.__table__.insert(),
-            valores
+    Returns:
+        Dict com quantidade, rateio, cache, perfil_id e, no modo diff, persistencia
+    """
+    motor = motor or settings.CUSTOS_MOTOR
+    async with perfilar(db, OPERACAO_CUSTOS, cenario_id, cenario_secao_id, ano, motor) as perfil:
+        resultado = await _calcular_e_salvar_custos(
+            db, cenario_id, cenario_secao_id, ano, motor, ao_gravar_lote, persistencia, forcar,
+            ao_iniciar_etapa
         )
+    resultado["perfil_id"] = str(perfil.id)
+    return resultado
+
+
+async def _calcular_e_salvar_custos(
+    db: AsyncSession,
+    cenario_id: UUID,
+    cenario_secao_id: Optional[UUID],
+    ano: Optional[int],
+    motor: str,
+    ao_gravar_lote: Optional[ProgressoCallback],
+    persistencia: Optional[str],
+    forcar: bool,
+    ao_iniciar_etapa: Optional[EtapaCallback]
+) -> Dict[str, Any]:
+    from sqlalchemy import delete
     
-    await db.commit()
+    from app.db.models.orcamento import CustoAlteracaoPendente
+    
+    service = CalculoCustosService(db, motor)
+    persistencia = persistencia or settings.CUSTOS_PERSISTENCIA
+    diff = persistencia == PERSISTENCIA_DIFF
+    modo_memoria = settings.CUSTOS_MEMORIA
+    tabela = CustoCalculado.__table__
+    
+    with fase("impressao"):
+        impressoes_secoes, impressao_rateio = await calcular_impressoes(db, cenario_id, cenario_secao_id)
+        impressao = combinar_impressoes(impressoes_secoes, impressao_rateio, ano)
+        resumo_cache = None
+        if not forcar:
+            resumo_cache = await obter_resumo_em_cache(db, cenario_id, cenario_secao_id, ano, impressao)
+    if resumo_cache is not None:
+        return {**resumo_cache, "cache": True}
+    
+    escopo = [CustoCalculado.cenario_id == cenario_id]
+    escopo_memoria = [CustoMemoriaPosicao.cenario_id == cenario_id]
+    if cenario_secao_id:
+        escopo.append(CustoCalculado.cenario_secao_id == cenario_secao_id)
+        escopo_memoria.append(CustoMemoriaPosicao.cenario_secao_id == cenario_secao_id)
+    if ano and diff:
+        escopo.append(CustoCalculado.ano == ano)
+        escopo_memoria.append(CustoMemoriaPosicao.ano == ano)
+    
+    with fase("limpeza"):
+        if not diff:
+            # Limpar custos anteriores
+            await db.execute(delete(CustoCalculado).where(*escopo))
+        
+        # A memória por posição é regravada a cada lote
+        await db.execute(delete(CustoMemoriaPosicao).where(*escopo_memoria))
+        await invalidar_impressoes(db, cenario_id)
+        
+        # O cálculo completo consome as alterações pendentes do escopo recalculado
+        stmt = delete(CustoAlteracaoPendente).where(CustoAlteracaoPendente.cenario_id == cenario_id)
+        if cenario_secao_id:
+            stmt = stmt.where(CustoAlteracaoPendente.cenario_secao_id == cenario_secao_id)
+        await db.execute(stmt)
+    
+    # Calcular novos custos, gravando cada lote (seção/ano) assim que fica pronto
+    quantidade = 0
+    sincronizacao = ResumoSincronizacao()
+    lotes_gravados = set()
+    async for secao_id, ano_lote, registros in service.iterar_registros_cenario(cenario_id, cenario_secao_id, ano):
+        with fase("memoria", secao_id) as f:
+            memorias = _separar_memoria(registros, modo_memoria)
+            await _gravar_memorias(db, memorias)
+            f.linhas += len(memorias)
+        with fase("gravacao", secao_id) as f:
+            if diff:
+                existentes = await _carregar_custos_gravados(
+                    db,
+                    CustoCalculado.cenario_id == cenario_id,
+                    CustoCalculado.cenario_secao_id == secao_id,
+                    CustoCalculado.ano == ano_lote,
+                    _filtro_custos_diretos()
+                )
+                adotados = _adotar_custos_legados(existentes, registros)
+                sincronizacao += await sincronizar_registros(
+                    db, tabela, existentes, registros, _chave_custo, CAMPOS_VALOR_CUSTO
+                )
+                await _gravar_posicao_adotada(db, adotados)
+                lotes_gravados.add((secao_id, ano_lote))
+            elif registros:
+                await _inserir_registros(db, registros)
+            f.linhas += len(registros)
+        quantidade += len(registros)
+        if ao_gravar_lote:
+            await ao_gravar_lote(secao_id, len(registros))
+    
+    with fase("gravacao"):
+        if diff:
+            # Custos diretos de seções/anos que não existem mais no cálculo
+            result = await db.execute(
+                select(CustoCalculado.id, CustoCalculado.cenario_secao_id, CustoCalculado.ano)
+                .where(*escopo, _filtro_custos_diretos())
+            )
+            orfaos = [
+                row.id for row in result.all()
+                if (row.cenario_secao_id, row.ano) not in lotes_gravados
+            ]
+            sincronizacao.removidos += await remover_por_ids(db, tabela, orfaos)
+    
+    if not quantidade and not diff:
+        if ao_iniciar_etapa:
+            await ao_iniciar_etapa("dre")
+        with fase("dre"):
+            await atualizar_dre_resumo(db, cenario_id, (FONTE_PESSOAL,))
+            await db.commit()
+        return {"quantidade": 0, "rateio": {}, "cache": False}
     
     # Aplicar rateio de custos de CCs POOL para CCs operacionais
-    resumo_rateio = await aplicar_rateio_custos(db, cenario_id)
+    if ao_iniciar_etapa:
+        await ao_iniciar_etapa("rateio")
+    resumo_rateio = await aplicar_rateio_custos(db, cenario_id, persistencia=persistencia, commit=False)
     
-    return {
-        "quantidade": len(custos),
+    resumo = {
+        "quantidade": quantidade,
         "rateio": resumo_rateio
     }
+    if diff:
+        resumo["persistencia"] = sincronizacao.to_dict()
+    
+    # Resumo do DRE: todos os anos, porque o rateio é refeito no cenário inteiro
+    if ao_iniciar_etapa:
+        await ao_iniciar_etapa("dre")
+    with fase("dre") as f:
+        dre = await atualizar_dre_resumo(db, cenario_id, (FONTE_PESSOAL,))
+        f.linhas += dre["linhas"]
+    
+    with fase("impressao"):
+        await gravar_impressao(db, cenario_id, cenario_secao_id, ano, impressao, impressoes_secoes, resumo)
+        await db.commit()
+    return {**resumo, "cache": False}
 
 
 class ResumoCustos:
@@ -802,38 +1268,12 @@ async def calcular_custos_cenario(
     await db.execute(stmt)
     
     # Calcular novos custos
-    custos = await service.calcular_custos_cenario(cenario_id, cenario_secao_id, ano)
-    
-    if custos:
-        # OTIMIZAÇÃO: Bulk insert em vez de add() individual
-        BATCH_SIZE = 1000
-        
-        for i in range(0, len(custos), BATCH_SIZE):
-            batch = custos[i:i + BATCH_SIZE]
-            valores = [
-                {
-                    "cenario_id": c.cenario_id,
-                    "cenario_secao_id": c.cenario_secao_id,
-                    "funcao_id": c.funcao_id,
-                    "faixa_id": c.faixa_id,
-                    "tipo_custo_id": c.tipo_custo_id,
-                    "centro_custo_id": c.centro_custo_id,
-                    "mes": c.mes,
-                    "ano": c.ano,
-                    "hc_base": c.hc_base,
-                    "valor_base": c.valor_base,
-                    "indice_aplicado": c.indice_aplicado,
-                    "valor_calculado": c.valor_calculado,
-                    "memoria_calculo": c.memoria_calculo,
-                }
-                for c in batch
-            ]
-            
-            await db.execute(
-                CustoCalculado.__table__.insert(),
-                valores
-            )
+    async for _, _, registros in service.iterar_registros_cenario(cenario_id, cenario_secao_id, ano):
+        if registros:
+            await _inserir_registros(db, registros)
     
+    await invalidar_impressoes(db, cenario_id)
+    await atualizar_dre_resumo(db, cenario_id, (FONTE_PESSOAL,))
     await db.commit()
     
     # Recarregar custos com relações
@@ -970,126 +1410,89 @@ async def calcular_overhead_ineficiencia(
 
 async def _calcular_percentuais_rateio(
     db: AsyncSession,
-    grupo,  # RateioGrupo
+    grupos: List[Any],  # RateioGrupo
     cenario_id: UUID
-) -> Dict[UUID, float]:
+) -> Dict[UUID, Dict[UUID, List[float]]]:
     """
-    Calcula os percentuais de rateio para cada CC destino baseado no tipo de rateio.
+    Calcula os percentuais de rateio de cada grupo, mês a mês, para cada CC destino.
     
     Tipos suportados:
-    - MANUAL: usa percentuais definidos em RateioDestino
-    - HC: proporcional ao HC Folha de cada CC destino
-    - AREA: proporcional à área (m²) de cada CC destino
-    - PA: proporcional às Posições de Atendimento de cada CC destino
+    - MANUAL: usa percentuais definidos em RateioDestino (iguais em todos os meses)
+    - HC: proporcional ao HC Folha de cada CC destino no mês
+    - AREA: proporcional à área (m²) de cada CC destino (igual em todos os meses)
+    - PA: proporcional às Posições de Atendimento de cada CC destino no mês
+    
+    HC e PA de todos os grupos saem do cubo de drivers do cenário (matriz
+    CC x 12, ver cubo_drivers). Nos tipos calculados, os percentuais de cada mês
+    somam 100%; mês sem HC/PA/área em nenhum destino distribui igualmente.
     
     Returns:
-        Dict[cc_destino_id, percentual]
+        Dict[grupo_id, Dict[cc_destino_id, [percentual jan..dez]]]
     """
-    from app.db.models.orcamento import QuadroPessoal, CentroCusto
-    
-    tipo = grupo.tipo_rateio or "MANUAL"
-    destinos_ids = [d.cc_destino_id for d in grupo.destinos]
-    
-    if tipo == "MANUAL":
-        # Usa percentuais definidos manualmente
-        return {d.cc_destino_id: float(d.percentual or 0) for d in grupo.destinos}
-    
-    elif tipo == "HC":
-        # Proporcional ao HC Folha de cada CC destino
-        MESES = ['jan', 'fev', 'mar', 'abr', 'mai', 'jun', 'jul', 'ago', 'set', 'out', 'nov', 'dez']
-        
-        # Buscar quadro de pessoal dos CCs destino
+    from app.db.models.orcamento import CentroCusto
+    
+    def destinos_do_tipo(*tipos: str) -> List[UUID]:
+        return list({
+            d.cc_destino_id for g in grupos if (g.tipo_rateio or "MANUAL") in tipos for d in g.destinos
+        })
+    
+    # HC e PA (HC / fator_pa) por CC destino e mês
+    indicadores: Dict[str, Dict[UUID, np.ndarray]] = {"HC": {}, "PA": {}}
+    if destinos_do_tipo("HC", "PA"):
+        cubo = await obter_cubo_drivers(db, cenario_id)
+        indicadores["HC"] = cubo.por_dimensao("centro_custo_id", MEDIDA_HC)
+        indicadores["PA"] = cubo.por_dimensao("centro_custo_id", MEDIDA_PA)
+    
+    # Área (m²) por CC destino, igual em todos os meses
+    ccs_area = destinos_do_tipo("AREA")
+    area_por_cc: Dict[UUID, float] = {}
+    if ccs_area:
         result = await db.execute(
-            select(QuadroPessoal).where(
-                QuadroPessoal.cenario_id == cenario_id,
-                QuadroPessoal.centro_custo_id.in_(destinos_ids),
-                QuadroPessoal.ativo == True
-            )
+            select(CentroCusto.id, CentroCusto.area_m2).where(CentroCusto.id.in_(ccs_area))
         )
-        quadros = result.scalars().all()
-        
-        # Calcular HC médio por CC
-        hc_por_cc: Dict[UUID, float] = {cc_id: 0.0 for cc_id in destinos_ids}
-        for q in quadros:
-            cc_id = q.centro_custo_id
-            if cc_id:
-                hc_total = sum(float(getattr(q, f"qtd_{mes}", 0) or 0) for mes in MESES)
-                hc_medio = hc_total / 12  # Média mensal
-                hc_por_cc[cc_id] = hc_por_cc.get(cc_id, 0.0) + hc_medio
-        
-        # Calcular percentuais
-        total_hc = sum(hc_por_cc.values())
-        if total_hc > 0:
-            return {cc_id: (hc / total_hc) * 100 for cc_id, hc in hc_por_cc.items()}
-        else:
-            # Se não há HC, distribui igualmente
-            n = len(destinos_ids)
-            return {cc_id: 100 / n for cc_id in destinos_ids} if n > 0 else {}
+        area_por_cc = {cc_id: float(area or 0) for cc_id, area in result.all()}
     
-    elif tipo == "AREA":
-        # Proporcional à área (m²) de cada CC destino
-        result = await db.execute(
-            select(CentroCusto).where(CentroCusto.id.in_(destinos_ids))
-        )
-        ccs = result.scalars().all()
+    percentuais: Dict[UUID, Dict[UUID, List[float]]] = {}
+    for grupo in grupos:
+        tipo = grupo.tipo_rateio or "MANUAL"
+        destinos_ids = list(dict.fromkeys(d.cc_destino_id for d in grupo.destinos))
+        if not destinos_ids:
+            percentuais[grupo.id] = {}
+            continue
         
-        area_por_cc: Dict[UUID, float] = {}
-        for cc in ccs:
-            area_por_cc[cc.id] = float(cc.area_m2 or 0)
+        if tipo == "MANUAL":
+            # Usa percentuais definidos manualmente
+            percentuais[grupo.id] = {d.cc_destino_id: [float(d.percentual or 0)] * 12 for d in grupo.destinos}
+            continue
         
-        # Calcular percentuais
-        total_area = sum(area_por_cc.values())
-        if total_area > 0:
-            return {cc_id: (area / total_area) * 100 for cc_id, area in area_por_cc.items()}
+        # Matriz destino x mês do indicador do grupo
+        if tipo in ("HC", "PA"):
+            zeros = np.zeros(12)
+            matriz = np.array([indicadores[tipo].get(cc_id, zeros) for cc_id in destinos_ids])
+        elif tipo == "AREA":
+            matriz = np.repeat([[area_por_cc.get(cc_id, 0.0)] for cc_id in destinos_ids], 12, axis=1)
         else:
-            # Se não há área cadastrada, distribui igualmente
-            n = len(destinos_ids)
-            return {cc_id: 100 / n for cc_id in destinos_ids} if n > 0 else {}
-    
-    elif tipo == "PA":
-        # Proporcional às Posições de Atendimento de cada CC destino
-        MESES = ['jan', 'fev', 'mar', 'abr', 'mai', 'jun', 'jul', 'ago', 'set', 'out', 'nov', 'dez']
+            # Fallback: distribui igualmente
+            matriz = np.zeros((len(destinos_ids), 12))
         
-        # Buscar quadro de pessoal dos CCs destino
-        result = await db.execute(
-            select(QuadroPessoal).where(
-                QuadroPessoal.cenario_id == cenario_id,
-                QuadroPessoal.centro_custo_id.in_(destinos_ids),
-                QuadroPessoal.ativo == True
-            )
-        )
-        quadros = result.scalars().all()
-        
-        # Calcular PAs por CC (HC / fator_pa)
-        pa_por_cc: Dict[UUID, float] = {cc_id: 0.0 for cc_id in destinos_ids}
-        for q in quadros:
-            cc_id = q.centro_custo_id
-            if cc_id:
-                fator_pa = float(q.fator_pa or 1.0)
-                if fator_pa <= 0:
-                    fator_pa = 1.0
-                hc_total = sum(float(getattr(q, f"qtd_{mes}", 0) or 0) for mes in MESES)
-                hc_medio = hc_total / 12
-                pa_medio = hc_medio / fator_pa
-                pa_por_cc[cc_id] = pa_por_cc.get(cc_id, 0.0) + pa_medio
-        
-        # Calcular percentuais
-        total_pa = sum(pa_por_cc.values())
-        if total_pa > 0:
-            return {cc_id: (pa / total_pa) * 100 for cc_id, pa in pa_por_cc.items()}
-        else:
-            # Se não há PAs, distribui igualmente
-            n = len(destinos_ids)
-            return {cc_id: 100 / n for cc_id in destinos_ids} if n > 0 else {}
+        totais = matriz.sum(axis=0)
+        # Mês sem indicador em nenhum destino: distribui igualmente
+        matriz[:, totais <= 0] = 1.0
+        totais = matriz.sum(axis=0)
+        matriz = matriz / totais * 100
+        percentuais[grupo.id] = {cc_id: matriz[i].tolist() for i, cc_id in enumerate(destinos_ids)}
     
-    # Fallback: distribui igualmente
-    n = len(destinos_ids)
-    return {cc_id: 100 / n for cc_id in destinos_ids} if n > 0 else {}
+    return percentuais
 
 
 async def aplicar_rateio_custos(
     db: AsyncSession,
-    cenario_id: UUID
+    cenario_id: UUID,
+    grupos_ids: Optional[List[UUID]] = None,
+    celulas: Optional[List[Tuple[UUID, UUID, int, int]]] = None,
+    persistencia: str = PERSISTENCIA_SUBSTITUIR,
+    modo: Optional[str] = None,
+    commit: bool = True
 ) -> Dict[str, Any]:
     """
     Aplica os rateios configurados para distribuir custos de CCs POOL para CCs OPERACIONAIS.
@@ -1102,29 +1505,80 @@ async def aplicar_rateio_custos(
     
     Esta função:
     1. Busca todos os grupos de rateio ativos do cenário
-    2. Para cada grupo, calcula os percentuais baseado no tipo de rateio
-    3. Busca custos do CC POOL de origem
-    4. Distribui proporcionalmente para os CCs OPERACIONAIS de destino
-    5. Cria registros de CustoCalculado com os valores rateados
+    2. Calcula os percentuais de cada grupo, mês a mês, baseado no tipo de rateio
+    3. Grava os percentuais de todos os grupos (por mês) numa tabela temporária
+    4. Distribui os custos do CC POOL de origem para os CCs OPERACIONAIS de
+       destino com um INSERT ... SELECT por grupo (ver rateio_lote), sem
+       trazer as linhas para o Python
+    
+    No modo "reciproco", os grupos que têm outro POOL como destino são resolvidos
+    juntos (ver rateio_reciproco): cada custo próprio de um POOL vai direto aos
+    CCs finais, com o fator do sistema, e todos os grupos são gravados em um
+    único INSERT ... SELECT.
+    
+    Args:
+        grupos_ids: Limita o rateio a estes grupos (None = todos os ativos)
+        celulas: Limita o rateio aos custos destas células (secao, funcao, ano, mes),
+            sem custos diretos - usado pelo recálculo incremental
+        persistencia: "diff" sincroniza com os rateios já gravados de cada grupo
+            (o chamador não precisa removê-los antes); "substituir" só insere
+        modo: "sequencial" ou "reciproco" (padrão: settings.RATEIO_MODO)
+        commit: False deixa o commit para o chamador, que grava o rateio na
+            mesma transação dos custos (o chamador deve estar perfilado)
+    
+    Chamado dentro do cálculo de custos, entra como fase "rateio" do perfil
+    do cálculo; sozinho, grava o próprio perfil (ver perfil_calculo).
     
     Returns:
         Dict com resumo do rateio aplicado
     """
+    async with perfilar(db, OPERACAO_RATEIO, cenario_id):
+        return await _aplicar_rateio_custos(
+            db, cenario_id, grupos_ids, celulas, persistencia, modo or settings.RATEIO_MODO, commit
+        )
+
+
+async def _aplicar_rateio_custos(
+    db: AsyncSession,
+    cenario_id: UUID,
+    grupos_ids: Optional[List[UUID]],
+    celulas: Optional[List[Tuple[UUID, UUID, int, int]]],
+    persistencia: str,
+    modo: str,
+    commit: bool
+) -> Dict[str, Any]:
     from app.db.models.orcamento import RateioGrupo, RateioDestino, CentroCusto
     
-    # Buscar grupos de rateio ativos
-    result = await db.execute(
-        select(RateioGrupo)
-        .where(
-            RateioGrupo.cenario_id == cenario_id,
-            RateioGrupo.ativo == True
-        )
-        .options(
-            selectinload(RateioGrupo.destinos).selectinload(RateioDestino.cc_destino),
-            selectinload(RateioGrupo.cc_origem)
+    with fase("grupos"):
+        # Buscar grupos de rateio ativos
+        query_grupos = (
+            select(RateioGrupo)
+            .where(
+                RateioGrupo.cenario_id == cenario_id,
+                RateioGrupo.ativo == True
+            )
+            .options(
+                selectinload(RateioGrupo.destinos).selectinload(RateioDestino.cc_destino),
+                selectinload(RateioGrupo.cc_origem)
+            )
         )
-    )
-    grupos = result.scalars().all()
+        # No recíproco, os fatores dependem de todos os grupos (grupos_ids só limita a gravação)
+        reciproco = modo == RATEIO_RECIPROCO
+        if grupos_ids is not None and not reciproco:
+            query_grupos = query_grupos.where(RateioGrupo.id.in_(grupos_ids))
+        result = await db.execute(query_grupos)
+        grupos = result.scalars().all()
+        
+        # Buscar o cenário para obter a janela de meses (custos diretos)
+        cenario = await db.get(Cenario, cenario_id)
+        periodos = periodos_cenario(cenario) if cenario else [(2026, mes) for mes in range(1, 13)]
+    
+    diff = persistencia == PERSISTENCIA_DIFF and celulas is None
+    # Sem memória na linha, a origem do rateio fica nas colunas (explicar_custo reconstrói o resto)
+    memoria_linha = settings.CUSTOS_MEMORIA == MEMORIA_LINHA
+    sincronizacao = ResumoSincronizacao()
+    grupos_sincronizados = set()
+    agora = datetime.utcnow()
     
     resumo = {
         "grupos_processados": 0,
@@ -1134,187 +1588,210 @@ async def aplicar_rateio_custos(
         "erros": []
     }
     
+    with fase("percentuais"):
+        # Percentuais mês a mês de todos os grupos (uma consulta de HC/PA para o cenário)
+        percentuais_grupos = await _calcular_percentuais_rateio(db, grupos, cenario_id)
+    
+    def destino(grupo, tipo_rateio: str, cc_destino_id: UUID, mes: int, percentual: float) -> Dict[str, Any]:
+        return {
+            "grupo_id": grupo.id,
+            "grupo_nome": grupo.nome,
+            "tipo_rateio": tipo_rateio,
+            "cc_origem_id": grupo.cc_origem_pool_id,
+            "cc_destino_id": cc_destino_id,
+            "mes": mes,
+            "percentual": Decimal(str(round(percentual, 2))),
+            "fator": Decimal(str(percentual / 100)),
+        }
+    
+    # Percentuais de todos os grupos, por mês, gravados na tabela temporária de destinos
+    validos = []
+    destinos = []
     for grupo in grupos:
         if not grupo.destinos:
             resumo["erros"].append(f"Grupo '{grupo.nome}' não tem destinos configurados")
             continue
         
-        # Calcular percentuais baseado no tipo de rateio
         tipo_rateio = grupo.tipo_rateio or "MANUAL"
-        percentuais = await _calcular_percentuais_rateio(db, grupo, cenario_id)
-        
-        # Verificar se percentuais somam 100%
-        total_pct = sum(percentuais.values())
-        if abs(total_pct - 100.0) > 0.01 and tipo_rateio == "MANUAL":
-            resumo["erros"].append(f"Grupo '{grupo.nome}' tem percentual total de {total_pct:.2f}% (deve ser 100%)")
-            continue
-        
-        # Normalizar percentuais para somar exatamente 100% (para tipos calculados)
-        if total_pct > 0 and tipo_rateio != "MANUAL":
-            fator = 100.0 / total_pct
-            percentuais = {cc_id: pct * fator for cc_id, pct in percentuais.items()}
-        
-        # Buscar custos calculados do CC origem (POOL)
-        custos_origem = await db.execute(
-            select(CustoCalculado).where(
-                CustoCalculado.cenario_id == cenario_id,
-                CustoCalculado.centro_custo_id == grupo.cc_origem_pool_id
-            )
-        )
-        custos_pool = custos_origem.scalars().all()
-        
-        # Buscar custos diretos do CC origem (POOL) - ex: Aluguel
-        from app.db.models.orcamento import CustoDireto, ProdutoTecnologia, TipoCusto
-        
-        custos_diretos_origem = await db.execute(
-            select(CustoDireto, ProdutoTecnologia).join(
-                ProdutoTecnologia, CustoDireto.item_custo_id == ProdutoTecnologia.id
-            ).where(
-                CustoDireto.cenario_id == cenario_id,
-                CustoDireto.centro_custo_id == grupo.cc_origem_pool_id,
-                CustoDireto.ativo == True
-            )
+        percentuais = percentuais_grupos[grupo.id]
+        
+        # Verificar se percentuais somam 100% (os calculados já saem normalizados por mês)
+        if tipo_rateio == "MANUAL":
+            total_pct = sum(mensais[0] for mensais in percentuais.values())
+            if abs(total_pct - 100.0) > 0.01:
+                resumo["erros"].append(f"Grupo '{grupo.nome}' tem percentual total de {total_pct:.2f}% (deve ser 100%)")
+                continue
+        
+        validos.append((grupo, tipo_rateio, percentuais))
+        for cc_destino_id, mensais in percentuais.items():
+            for mes, percentual in enumerate(mensais, start=1):
+                if percentual > 0:
+                    destinos.append(destino(grupo, tipo_rateio, cc_destino_id, mes, percentual))
+    
+    if reciproco:
+        with fase("sistema"):
+            # Um sistema por mês: os percentuais (e portanto os fatores) variam com o HC/PA do mês
+            fatores = {
+                mes: fatores_reciprocos([
+                    GrupoReciproco(
+                        grupo.id, grupo.nome, grupo.cc_origem_pool_id,
+                        {cc_id: mensais[mes - 1] for cc_id, mensais in percentuais.items()}
+                    )
+                    for grupo, _, percentuais in validos
+                ])
+                for mes in range(1, 13)
+            }
+        if grupos_ids is not None:
+            escopo = set(grupos_ids)
+            validos = [v for v in validos if v[0].id in escopo]
+        destinos = [
+            destino(grupo, tipo_rateio, cc_destino_id, mes, fator * 100)
+            for mes, fatores_mes in fatores.items()
+            for grupo, tipo_rateio, _ in validos
+            for cc_destino_id, fator in fatores_mes[grupo.id].items()
+        ]
+    
+    with fase("preparacao"):
+        await preparar_destinos(db, destinos)
+        if diff:
+            await preparar_novos(db)
+        if celulas is None:
+            # TipoCusto "CD_<produto>" dos custos diretos do POOL, criados antes da distribuição
+            ccs_origem = [g.cc_origem_pool_id for g, _, _ in validos]
+            await garantir_tipos_custo_diretos(db, cenario_id, ccs_origem)
+            await preparar_valores_diretos(db, cenario_id, ccs_origem)
+    
+    if reciproco:
+        await _distribuir_reciproco(
+            db, cenario_id, validos, fatores, celulas, periodos, diff, memoria_linha, agora,
+            resumo, sincronizacao, grupos_sincronizados
         )
-        custos_diretos_pool = custos_diretos_origem.fetchall()
-        
-        # Buscar o cenário para obter o ano
-        cenario = await db.get(Cenario, cenario_id)
-        ano_cenario = cenario.ano_inicio if cenario else 2026
+    
+    for grupo, tipo_rateio, percentuais in ([] if reciproco else validos):
+        with fase("origem"):
+            custos_origem = await contar_origem(db, cenario_id, grupo.cc_origem_pool_id, celulas)
         
-        if not custos_pool and not custos_diretos_pool:
+        if not custos_origem:
             continue
         
         grupo_detalhe = {
             "nome": grupo.nome,
             "tipo_rateio": tipo_rateio,
             "cc_origem": grupo.cc_origem.nome if grupo.cc_origem else str(grupo.cc_origem_pool_id),
-            "custos_origem": len(custos_pool) + len(custos_diretos_pool),
+            "custos_origem": custos_origem,
             "destinos": []
         }
         
-        # Para cada custo calculado, criar rateios nos destinos
-        for custo_original in custos_pool:
-            for destino in grupo.destinos:
-                cc_destino_id = destino.cc_destino_id
-                percentual = percentuais.get(cc_destino_id, 0)
-                
-                if percentual <= 0:
-                    continue
-                
-                valor_rateado = custo_original.valor_calculado * Decimal(str(percentual / 100))
-                
-                # Criar novo registro de custo rateado
-                custo_rateado = CustoCalculado(
-                    cenario_id=cenario_id,
-                    cenario_secao_id=custo_original.cenario_secao_id,
-                    funcao_id=custo_original.funcao_id,
-                    faixa_id=custo_original.faixa_id,
-                    tipo_custo_id=custo_original.tipo_custo_id,
-                    centro_custo_id=cc_destino_id,
-                    mes=custo_original.mes,
-                    ano=custo_original.ano,
-                    hc_base=custo_original.hc_base * Decimal(str(percentual / 100)),
-                    valor_base=custo_original.valor_base,
-                    indice_aplicado=custo_original.indice_aplicado,
-                    valor_calculado=valor_rateado,
-                    memoria_calculo={
-                        "tipo": "rateio",
-                        "tipo_rateio": tipo_rateio,
-                        "grupo_rateio": str(grupo.id),
-                        "grupo_nome": grupo.nome,
-                        "cc_origem": str(grupo.cc_origem_pool_id),
-                        "cc_destino": str(cc_destino_id),
-                        "percentual": round(percentual, 2),
-                        "custo_original_id": str(custo_original.id),
-                    }
-                )
-                db.add(custo_rateado)
-                resumo["custos_rateados"] += 1
-                resumo["valor_total_rateado"] += valor_rateado
-        
-        # Para cada custo direto (ex: Aluguel), criar rateios nos destinos
-        for custo_direto, produto in custos_diretos_pool:
-            # Buscar ou criar TipoCusto correspondente ao produto
-            tipo_custo_result = await db.execute(
-                select(TipoCusto).where(
-                    TipoCusto.codigo == f"CD_{produto.codigo}"
-                )
-            )
-            tipo_custo = tipo_custo_result.scalar_one_or_none()
-            
-            if not tipo_custo:
-                # Criar TipoCusto para o custo direto
-                tipo_custo = TipoCusto(
-                    codigo=f"CD_{produto.codigo}",
-                    nome=produto.nome,
-                    categoria=produto.categoria or "CUSTO_DIRETO",
-                    tipo_calculo="HC_X_VALOR",
-                    conta_contabil_codigo=produto.conta_contabil_codigo,
-                    conta_contabil_descricao=produto.conta_contabil_descricao,
-                    ativo=True
-                )
-                db.add(tipo_custo)
-                await db.flush()
-            
-            # Calcular valor mensal
-            valor_mensal = Decimal(str(custo_direto.valor_fixo or 0))
-            if custo_direto.tipo_valor in ["VARIAVEL", "FIXO_VARIAVEL"] and custo_direto.valor_unitario_variavel:
-                # TODO: Calcular baseado no HC/PA real
-                valor_mensal += Decimal(str(custo_direto.valor_unitario_variavel or 0)) * 100
-            
-            # Criar custo rateado para cada mês e cada destino
-            for mes in range(1, 13):
-                for destino in grupo.destinos:
-                    cc_destino_id = destino.cc_destino_id
-                    percentual = percentuais.get(cc_destino_id, 0)
-                    
-                    if percentual <= 0:
-                        continue
-                    
-                    valor_rateado = valor_mensal * Decimal(str(percentual / 100))
-                    
-                    custo_rateado = CustoCalculado(
-                        cenario_id=cenario_id,
-                        cenario_secao_id=custo_direto.cenario_secao_id,
-                        funcao_id=None,
-                        faixa_id=None,
-                        tipo_custo_id=tipo_custo.id,
-                        centro_custo_id=cc_destino_id,
-                        mes=mes,
-                        ano=ano_cenario,
-                        hc_base=Decimal("0"),
-                        valor_base=valor_mensal,
-                        indice_aplicado=Decimal(str(percentual / 100)),
-                        valor_calculado=valor_rateado,
-                        memoria_calculo={
-                            "tipo": "rateio",
-                            "tipo_rateio": tipo_rateio,
-                            "grupo_rateio": str(grupo.id),
-                            "grupo_nome": grupo.nome,
-                            "cc_origem": str(grupo.cc_origem_pool_id),
-                            "cc_destino": str(cc_destino_id),
-                            "percentual": round(percentual, 2),
-                            "custo_direto_id": str(custo_direto.id),
-                            "produto_nome": produto.nome,
-                        }
-                    )
-                    db.add(custo_rateado)
-                    resumo["custos_rateados"] += 1
-                    resumo["valor_total_rateado"] += valor_rateado
-        
-        # Registrar detalhes do grupo
-        for destino in grupo.destinos:
-            cc_nome = destino.cc_destino.nome if destino.cc_destino else str(destino.cc_destino_id)
-            pct = percentuais.get(destino.cc_destino_id, 0)
+        with fase("distribuicao") as f:
+            # Custos calculados do POOL e, fora do recálculo por células, custos diretos (ex: Aluguel)
+            consultas = [consulta_rateio_custos(cenario_id, grupo.id, celulas, memoria_linha, agora)]
+            if celulas is None and periodos:
+                consultas.append(consulta_rateio_diretos(cenario_id, grupo.id, periodos, memoria_linha, agora))
+            for consulta in consultas:
+                linhas, valor = await inserir_rateio(db, consulta, diff)
+                resumo["custos_rateados"] += linhas
+                resumo["valor_total_rateado"] += valor
+                f.linhas += linhas
+        
+        if diff:
+            with fase("gravacao"):
+                sincronizacao += await sincronizar_rateio(db, cenario_id, [grupo.id])
+                grupos_sincronizados.add(grupo.id)
+        
+        # Registrar detalhes do grupo (percentual médio do ano e o de cada mês)
+        for rateio_destino in grupo.destinos:
+            cc_nome = rateio_destino.cc_destino.nome if rateio_destino.cc_destino else str(rateio_destino.cc_destino_id)
+            mensais = percentuais.get(rateio_destino.cc_destino_id, [0.0] * 12)
             grupo_detalhe["destinos"].append({
                 "cc_nome": cc_nome,
-                "percentual": round(pct, 2)
+                "percentual": round(sum(mensais) / 12, 2),
+                "percentuais_mensais": [round(pct, 2) for pct in mensais]
             })
         
         resumo["detalhes_grupos"].append(grupo_detalhe)
         resumo["grupos_processados"] += 1
     
-    await db.commit()
+    with fase("gravacao"):
+        if diff:
+            # Rateios de grupos que não geraram custos nesta execução (inativos, sem destinos, sem origem)
+            sincronizacao.removidos += await remover_rateios_orfaos(
+                db, cenario_id, list(grupos_sincronizados), grupos_ids
+            )
+            resumo["persistencia"] = sincronizacao.to_dict()
+        
+        if commit:
+            await db.commit()
     
     resumo["valor_total_rateado"] = float(resumo["valor_total_rateado"])
     return resumo
+
+
+async def _distribuir_reciproco(
+    db: AsyncSession,
+    cenario_id: UUID,
+    validos: List[Tuple[Any, str, Dict[UUID, List[float]]]],
+    fatores: Dict[int, Dict[UUID, Dict[UUID, float]]],
+    celulas: Optional[List[Tuple[UUID, UUID, int, int]]],
+    periodos: List[Tuple[int, int]],
+    diff: bool,
+    memoria_linha: bool,
+    agora: datetime,
+    resumo: Dict[str, Any],
+    sincronizacao: ResumoSincronizacao,
+    grupos_sincronizados: set
+) -> None:
+    """
+    Grava o rateio recíproco de todos os grupos de uma vez (a tabela de destinos
+    já tem os fatores resolvidos, por mês). Só os custos próprios dos POOLs são rateados.
+    """
+    from app.db.models.orcamento import CentroCusto
+    
+    with fase("origem"):
+        origens = await contar_origens(db, cenario_id, [g.cc_origem_pool_id for g, _, _ in validos], celulas)
+    
+    with fase("distribuicao") as f:
+        consultas = [consulta_rateio_custos(cenario_id, None, celulas, memoria_linha, agora, apenas_proprios=True)]
+        if celulas is None and periodos:
+            consultas.append(consulta_rateio_diretos(cenario_id, None, periodos, memoria_linha, agora))
+        for consulta in consultas:
+            linhas, valor = await inserir_rateio(db, consulta, diff)
+            resumo["custos_rateados"] += linhas
+            resumo["valor_total_rateado"] += valor
+            f.linhas += linhas
+    
+    processados = [(g, t) for g, t, _ in validos if origens.get(g.cc_origem_pool_id)]
+    
+    # Fração efetiva de cada grupo para cada CC final, por mês
+    por_grupo: Dict[UUID, Dict[UUID, List[float]]] = {}
+    for mes, fatores_mes in fatores.items():
+        for grupo_id, fatores_grupo in fatores_mes.items():
+            for cc_id, fator in fatores_grupo.items():
+                por_grupo.setdefault(grupo_id, {}).setdefault(cc_id, [0.0] * 12)[mes - 1] = fator * 100
+    
+    finais = {cc_id for g, _ in processados for cc_id in por_grupo.get(g.id, {})}
+    nomes: Dict[UUID, str] = {}
+    if finais:
+        result = await db.execute(select(CentroCusto.id, CentroCusto.nome).where(CentroCusto.id.in_(finais)))
+        nomes = dict(result.all())
+    if diff and processados:
+        with fase("gravacao"):
+            sincronizacao += await sincronizar_rateio(db, cenario_id, [g.id for g, _ in processados])
+            grupos_sincronizados.update(g.id for g, _ in processados)
+    
+    for grupo, tipo_rateio in processados:
+        resumo["detalhes_grupos"].append({
+            "nome": grupo.nome,
+            "tipo_rateio": tipo_rateio,
+            "cc_origem": grupo.cc_origem.nome if grupo.cc_origem else str(grupo.cc_origem_pool_id),
+            "custos_origem": origens[grupo.cc_origem_pool_id],
+            # Destinos finais, com a fração efetiva depois da resolução entre POOLs
+            "destinos": [
+                {
+                    "cc_nome": nomes.get(cc_id, str(cc_id)),
+                    "percentual": round(sum(mensais) / 12, 2),
+                    "percentuais_mensais": [round(pct, 2) for pct in mensais]
+                }
+                for cc_id, mensais in por_grupo.get(grupo.id, {}).items()
+            ]
+        })
+        resumo["grupos_processados"] += 1
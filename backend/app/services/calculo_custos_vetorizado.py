@@ -0,0 +1,468 @@
+"""
+Motor vetorizado de cálculo de custos de pessoal.
+
+Em vez de iterar posição x mês x rubrica, monta matrizes (posições x meses da
+janela do cenário) com HC, salário e premissas de uma seção e calcula cada rubrica como uma única
+operação NumPy sobre a matriz inteira. As fórmulas replicam exatamente as de
+CalculoCustosService._calcular_rubrica (motor escalar).
+
+A ordem, as bases de encargos e as alíquotas vêm do PlanoRubricas compilado.
+"""
+
+from typing import List, Dict, Optional, Any, Callable, Tuple
+from uuid import UUID
+from decimal import Decimal
+import time
+
+import numpy as np
+
+from app.db.models.orcamento import QuadroPessoal
+from app.services.plano_rubricas import PlanoRubricas, PassoRubrica
+from app.services.calendario import Calendario, RegimeTrabalho, REGIME_PADRAO
+
+
+MESES_CAMPOS = [
+    'qtd_jan', 'qtd_fev', 'qtd_mar', 'qtd_abr', 'qtd_mai', 'qtd_jun',
+    'qtd_jul', 'qtd_ago', 'qtd_set', 'qtd_out', 'qtd_nov', 'qtd_dez'
+]
+
+
+def _float(valor: Any, padrao: float = 0.0) -> float:
+    """Converte Numeric/None para float."""
+    return float(valor) if valor is not None else padrao
+
+
+def fator_dsr_escala(escala: Optional[str]) -> float:
+    """Fator de DSR sobre horas extras conforme a escala."""
+    if escala == "5x2":
+        return 9 / 21
+    elif escala == "12x36":
+        return 0.0  # Não tem DSR em 12x36
+    return 4 / 26  # 6x1
+
+
+class EntradasSecao:
+    """
+    Entradas de uma seção organizadas em matrizes NumPy.
+
+    As colunas são os períodos (ano, mes) calculados - 12 para um ano ou toda a
+    janela do cenário (ex: 18 ou 24 meses). Matrizes mensais têm formato (P, M);
+    atributos da posição têm formato (P, 1) para fazer broadcast sobre os meses.
+    """
+
+    def __init__(
+        self,
+        quadros: List[QuadroPessoal],
+        premissas: Dict[tuple, Dict],
+        periodos: List[Tuple[int, int]],
+        calendario: Calendario,
+        regime: RegimeTrabalho = REGIME_PADRAO
+    ):
+        """
+        Args:
+            quadros: Posições ativas da seção
+            premissas: Premissas indexadas por (funcao_id, ano, mes)
+            periodos: Lista ordenada de (ano, mes) a calcular
+            calendario: Calendário com os anos dos períodos carregados
+            regime: Localidade e política de trabalho da seção (dias úteis/trabalhados)
+        """
+        self.quadros = quadros
+        self.periodos = periodos
+        n = len(quadros)
+        t = len(periodos)
+
+        # HC operando (o quadro tem uma quantidade por mês do ano, repetida em cada ano)
+        hc_mes = np.array(
+            [[_float(getattr(q, campo, 0)) for campo in MESES_CAMPOS] for q in quadros],
+            dtype=float
+        ).reshape(n, 12)
+        self.hc_operando = hc_mes[:, [mes - 1 for _, mes in periodos]]
+
+        # Premissas: posições sem premissa no mês recebem os mesmos padrões do motor escalar
+        self.tem_premissa = np.zeros((n, t), dtype=bool)
+        self.absenteismo = np.zeros((n, t))
+        self.abs_pct_justificado = np.full((n, t), 75.0)
+        self.turnover = np.zeros((n, t))
+        self.ferias_indice = np.full((n, t), 8.33)
+
+        for i, q in enumerate(quadros):
+            for j, (ano, mes) in enumerate(periodos):
+                premissa = premissas.get((q.funcao_id, ano, mes))
+                if not premissa:
+                    continue
+                self.tem_premissa[i, j] = True
+                self.absenteismo[i, j] = premissa.get('absenteismo', 0)
+                self.abs_pct_justificado[i, j] = premissa.get('abs_pct_justificado', 75)
+                self.turnover[i, j] = premissa.get('turnover', 0)
+                self.ferias_indice[i, j] = premissa.get('ferias_indice', 8.33)
+
+        # Atributos da posição (P, 1)
+        salario = []
+        tem_politica = []
+        vt_dia, vr_dia, plano_saude = [], [], []
+        aux_creche, aux_creche_pct, aux_home_office, pct_desconto_vr = [], [], [], []
+        is_pj, is_home_office = [], []
+        fator_dsr = []
+        dias_trabalhados = []
+
+        dias_por_escala: Dict[Optional[str], List[int]] = {}
+
+        for q in quadros:
+            if q.salario_override:
+                salario.append(float(q.salario_override))
+            elif q.tabela_salarial:
+                salario.append(_float(q.tabela_salarial.salario_base))
+            else:
+                salario.append(0.0)
+
+            politica = q.tabela_salarial.politica if q.tabela_salarial else None
+            tem_politica.append(politica is not None)
+            vt_dia.append(_float(politica.vt_dia) if politica else 0.0)
+            vr_dia.append(_float(politica.vr_dia) if politica else 0.0)
+            plano_saude.append(_float(politica.plano_saude) if politica else 0.0)
+            aux_creche.append(_float(politica.aux_creche) if politica else 0.0)
+            aux_creche_pct.append(_float(politica.aux_creche_percentual) if politica else 0.0)
+            aux_home_office.append(_float(politica.aux_home_office) if politica else 0.0)
+            pct_desconto_vr.append(_float(politica.pct_desconto_vr) if politica else 0.0)
+
+            funcao = q.funcao
+            is_pj.append(bool(funcao and funcao.is_pj))
+            is_home_office.append(bool(funcao and funcao.is_home_office))
+
+            escala = politica.escala if politica else "6x1"
+            fator_dsr.append(fator_dsr_escala(escala))
+            if escala not in dias_por_escala:
+                dias_por_escala[escala] = [
+                    calendario.dias_trabalhados(ano, mes, escala, regime) for ano, mes in periodos
+                ]
+            dias_trabalhados.append(dias_por_escala[escala])
+
+        def coluna(valores, dtype=float):
+            return np.array(valores, dtype=dtype).reshape(n, 1)
+
+        self.salario = coluna(salario)
+        self.tem_politica = coluna(tem_politica, bool)
+        self.vt_dia = coluna(vt_dia)
+        self.vr_dia = coluna(vr_dia)
+        self.plano_saude = coluna(plano_saude)
+        self.aux_creche = coluna(aux_creche)
+        self.aux_creche_percentual = coluna(aux_creche_pct)
+        self.aux_home_office = coluna(aux_home_office)
+        self.pct_desconto_vr = coluna(pct_desconto_vr)
+        self.is_pj = coluna(is_pj, bool)
+        self.is_home_office = coluna(is_home_office, bool)
+        self.fator_dsr = coluna(fator_dsr)
+        self.dias_trabalhados = np.array(dias_trabalhados, dtype=float).reshape(n, t)
+        self.dias_uteis = np.array(
+            [calendario.dias_uteis(ano, mes, regime) for ano, mes in periodos], dtype=float
+        ).reshape(1, t)
+
+    def colunas_por_ano(self) -> List[Tuple[int, List[int]]]:
+        """Agrupa os índices de coluna por ano, na ordem dos períodos."""
+        grupos: Dict[int, List[int]] = {}
+        for j, (ano, _) in enumerate(self.periodos):
+            grupos.setdefault(ano, []).append(j)
+        return list(grupos.items())
+
+    def calcular_hc_folha(self) -> np.ndarray:
+        """HC_Folha = HC_Operando / (1 - ABS - Férias) * (1 + TO/2), só onde há premissa."""
+        fator = 1 - self.absenteismo / 100 - self.ferias_indice / 100
+        fator = np.where(fator <= 0, 0.5, fator)  # Mínimo para evitar divisão por zero
+        hc_folha = self.hc_operando / fator * (1 + self.turnover / 100 / 2)
+        return np.where(self.tem_premissa, hc_folha, self.hc_operando)
+
+
+class _Contexto:
+    """Estado de uma avaliação vetorizada (valores já calculados por passo do plano)."""
+
+    def __init__(
+        self,
+        entradas: EntradasSecao,
+        plano: PlanoRubricas,
+        get_parametro: Callable[..., Optional[float]]
+    ):
+        self.e = entradas
+        self.get_parametro = get_parametro
+        self.hc_folha = entradas.calcular_hc_folha()
+        self.zeros = np.zeros_like(self.hc_folha)
+        self.valores: List[np.ndarray] = [self.zeros] * len(plano)
+
+    def referencia(self, passo: PassoRubrica, posicao: int = 0) -> np.ndarray:
+        """Valor da rubrica referenciada pela fórmula (zero se inativa)."""
+        indice = passo.indices_referencia[posicao] if posicao < len(passo.indices_referencia) else -1
+        return self.valores[indice] if indice >= 0 else self.zeros
+
+    def base(self, passo: PassoRubrica) -> np.ndarray:
+        """Soma das rubricas que compõem a base do passo (pré-computada no plano)."""
+        base = self.zeros
+        for indice in passo.indices_base:
+            base = base + self.valores[indice]
+        return base
+
+
+def _hc_efetivo(ctx: _Contexto) -> np.ndarray:
+    """HC descontando ABS e férias (padrões 0 e 8.33 quando não há premissa)."""
+    return ctx.hc_folha * (1 - ctx.e.absenteismo / 100 - ctx.e.ferias_indice / 100)
+
+
+def _pct_deslig_empresa(ctx: _Contexto, passo: PassoRubrica) -> float:
+    return ctx.get_parametro("pct_deslig_empresa", passo.id, 50) / 100
+
+
+# ============================================
+# FÓRMULAS DAS RUBRICAS (cada uma recebe a matriz inteira)
+# ============================================
+
+def _salario(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    return ctx.hc_folha * ctx.e.salario
+
+
+def _he_50(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    pct_he = ctx.get_parametro("pct_horas_extras_50", passo.id, 0)
+    return ctx.hc_folha * ctx.e.salario * (pct_he / 100) * 1.5
+
+
+def _he_100(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    pct_he = ctx.get_parametro("pct_horas_extras_100", passo.id, 0)
+    return ctx.hc_folha * ctx.e.salario * (pct_he / 100) * 2.0
+
+
+def _dsr(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    return (ctx.referencia(passo, 0) + ctx.referencia(passo, 1)) * ctx.e.fator_dsr
+
+
+def _honorarios(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    return np.where(ctx.e.is_pj, ctx.hc_folha * ctx.e.salario, 0.0)
+
+
+def _vt(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    e = ctx.e
+    elegivel = e.tem_politica & (e.vt_dia > 0) & ~e.is_home_office
+    return np.where(elegivel, _hc_efetivo(ctx) * e.dias_trabalhados * e.vt_dia, 0.0)
+
+
+def _vr(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    e = ctx.e
+    elegivel = e.tem_politica & (e.vr_dia > 0)
+    return np.where(elegivel, _hc_efetivo(ctx) * e.dias_trabalhados * e.vr_dia, 0.0)
+
+
+def _am(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    e = ctx.e
+    idx_elegibilidade = ctx.get_parametro("pct_elegibilidade_am", passo.id, 100) / 100
+    elegivel = e.tem_politica & (e.plano_saude > 0)
+    return np.where(elegivel, ctx.hc_folha * e.plano_saude * idx_elegibilidade, 0.0)
+
+
+def _creche(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    e = ctx.e
+    # Sem parâmetro cadastrado, usa o percentual da política de cada posição
+    pct = ctx.get_parametro("pct_elegibilidade_creche", passo.id, None)
+    idx_elegibilidade = (e.aux_creche_percentual if pct is None else pct) / 100
+    elegivel = e.tem_politica & (e.aux_creche > 0)
+    return np.where(elegivel, ctx.hc_folha * e.aux_creche * idx_elegibilidade, 0.0)
+
+
+def _home_office(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    e = ctx.e
+    elegivel = e.tem_politica & (e.aux_home_office > 0) & e.is_home_office
+    return np.where(elegivel, ctx.hc_folha * e.aux_home_office, 0.0)
+
+
+def _encargo(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    """Base (soma das rubricas com a flag) x alíquota resolvida."""
+    return ctx.base(passo) * passo.aliquota
+
+
+def _sobre_rubrica(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    """Rubrica referenciada x alíquota resolvida."""
+    return ctx.referencia(passo) * passo.aliquota
+
+
+def _aviso_indenizado(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    turnover = ctx.e.turnover / 100
+    return ctx.hc_folha * ctx.e.salario * turnover * _pct_deslig_empresa(ctx, passo)
+
+
+def _multa_fgts(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    turnover = ctx.e.turnover / 100
+    saldo_fgts = ctx.hc_folha * ctx.e.salario * 0.08 * 6
+    return saldo_fgts * 0.4 * turnover * _pct_deslig_empresa(ctx, passo) / 12
+
+
+def _zero(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    return ctx.zeros
+
+
+def _sobre_receita(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    """Bônus/premiação: % da receita, não da folha - sem valor no motor de pessoal (como no escalar)."""
+    return ctx.zeros
+
+
+def _desc_480(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    turnover = ctx.e.turnover / 100
+    pct_pedido_demissao = 1 - _pct_deslig_empresa(ctx, passo)
+    return -(ctx.hc_folha * (ctx.e.salario / 30) * 22 * 0.5 * turnover * pct_pedido_demissao / 12)
+
+
+def _desc_aviso(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    turnover = ctx.e.turnover / 100
+    pct_pedido_demissao = 1 - _pct_deslig_empresa(ctx, passo)
+    pct_nao_cumpre = ctx.get_parametro("pct_nao_cumpre_aviso", passo.id, 30) / 100
+    return -(ctx.hc_folha * ctx.e.salario * turnover * pct_pedido_demissao * pct_nao_cumpre)
+
+
+def _desc_faltas(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    e = ctx.e
+    abs_injust = e.absenteismo / 100 * (1 - e.abs_pct_justificado / 100)
+    hc_base = ctx.hc_folha * (1 - e.ferias_indice / 100)
+    valor = -(hc_base * e.dias_uteis * abs_injust * (e.salario / 30))
+    return np.where(e.tem_premissa, valor, 0.0)
+
+
+def _desc_vt(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    vt = ctx.referencia(passo)
+    desconto = ctx.hc_folha * ctx.e.salario * 0.06
+    return np.where(vt > 0, -np.minimum(desconto, vt), 0.0)
+
+
+def _desc_vr(ctx: _Contexto, passo: PassoRubrica) -> np.ndarray:
+    vr = ctx.referencia(passo)
+    pct_desconto = np.where(ctx.e.tem_politica, ctx.e.pct_desconto_vr / 100, 0.0)
+    return np.where(vr > 0, -(vr * pct_desconto), 0.0)
+
+
+def _formulas() -> Dict[str, Callable[[_Contexto, PassoRubrica], np.ndarray]]:
+    """Mapa código Totvs -> fórmula vetorizada."""
+    from app.services import calculo_custos as cc
+
+    return {
+        cc.COD_SALARIO: _salario,
+        cc.COD_HE_50: _he_50,
+        cc.COD_HE_100: _he_100,
+        cc.COD_DSR: _dsr,
+        cc.COD_HONORARIOS: _honorarios,
+        cc.COD_VT: _vt,
+        cc.COD_VR: _vr,
+        cc.COD_AM: _am,
+        cc.COD_CRECHE: _creche,
+        cc.COD_HO: _home_office,
+        cc.COD_FGTS: _encargo,
+        cc.COD_INSS_EMP: _encargo,
+        cc.COD_INSS_TERC: _encargo,
+        cc.COD_SAT_RAT: _encargo,
+        cc.COD_PROV_FERIAS: _encargo,
+        cc.COD_FGTS_FERIAS: _sobre_rubrica,
+        cc.COD_INSS_FERIAS: _sobre_rubrica,
+        cc.COD_PROV_13: _encargo,
+        cc.COD_FGTS_13: _sobre_rubrica,
+        cc.COD_INSS_13: _sobre_rubrica,
+        cc.COD_INDENIZ: _sobre_rubrica,
+        cc.COD_AVISO_IND: _aviso_indenizado,
+        cc.COD_MULTA_FGTS: _multa_fgts,
+        cc.COD_BONUS: _sobre_receita,
+        cc.COD_PREMIACAO: _sobre_receita,
+        cc.COD_DESC_480: _desc_480,
+        cc.COD_DESC_AVISO: _desc_aviso,
+        cc.COD_DESC_FALTAS: _desc_faltas,
+        cc.COD_DESC_VT: _desc_vt,
+        cc.COD_DESC_VR: _desc_vr,
+    }
+
+
+def calcular_rubricas(
+    entradas: EntradasSecao,
+    plano: PlanoRubricas,
+    get_parametro: Callable[..., Optional[float]],
+    tempos: Optional[Dict[str, float]] = None
+) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Calcula todas as rubricas de uma seção (todos os períodos) de uma vez, seguindo o plano.
+
+    Args:
+        entradas: Matrizes da seção
+        plano: Plano de rubricas compilado
+        get_parametro: Função (chave, tipo_custo_id, default) -> valor
+        tempos: Se informado, acumula o tempo (s) de cada rubrica por código
+
+    Returns:
+        (hc_folha, matriz (P, M) de valores para cada passo do plano)
+    """
+    formulas = _formulas()
+    ctx = _Contexto(entradas, plano, get_parametro)
+    tem_hc = entradas.hc_operando > 0
+
+    for passo in plano.passos:
+        inicio = time.perf_counter() if tempos is not None else 0.0
+        formula = formulas.get(passo.codigo, _zero)
+        valores = np.broadcast_to(formula(ctx, passo), ctx.hc_folha.shape)
+        # Posições sem HC no mês não geram custo nem entram nas bases
+        ctx.valores[passo.indice] = np.where(tem_hc, valores, 0.0)
+        if tempos is not None:
+            tempos[passo.codigo] = tempos.get(passo.codigo, 0.0) + time.perf_counter() - inicio
+
+    return ctx.hc_folha, ctx.valores
+
+
+def gerar_registros(
+    cenario_id: UUID,
+    cenario_secao_id: UUID,
+    entradas: EntradasSecao,
+    plano: PlanoRubricas,
+    hc_folha: np.ndarray,
+    valores: List[np.ndarray],
+    colunas: Optional[List[int]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Converte as matrizes calculadas em registros de custos_calculados.
+    Só são gerados registros para posição/mês com HC > 0 e valor diferente de zero.
+
+    Args:
+        colunas: Índices de período a converter (ex: um ano da janela); None = todos
+    """
+    registros: List[Dict[str, Any]] = []
+    quadros = entradas.quadros
+    if colunas is None:
+        colunas = list(range(len(entradas.periodos)))
+    periodos = [entradas.periodos[j] for j in colunas]
+    hc_operando = entradas.hc_operando[:, colunas]
+    hc_folha = hc_folha[:, colunas]
+    tem_hc = hc_operando > 0
+
+    for passo in plano.passos:
+        matriz = valores[passo.indice][:, colunas]
+        posicoes, meses = np.nonzero(tem_hc & (matriz != 0))
+        if len(posicoes) == 0:
+            continue
+
+        indice = Decimal(str(passo.aliquota_padrao or 0))
+
+        for i, m in zip(posicoes.tolist(), meses.tolist()):
+            quadro = quadros[i]
+            ano, mes = periodos[m]
+            hc = float(hc_folha[i, m])
+            salario = float(entradas.salario[i, 0])
+            registros.append({
+                "cenario_id": cenario_id,
+                "cenario_secao_id": cenario_secao_id,
+                "funcao_id": quadro.funcao_id,
+                "quadro_pessoal_id": quadro.id,
+                "faixa_id": quadro.tabela_salarial.faixa_id if quadro.tabela_salarial else None,
+                "tipo_custo_id": passo.id,
+                "centro_custo_id": quadro.centro_custo_id,
+                "mes": mes,
+                "ano": ano,
+                "hc_base": Decimal(str(hc)),
+                "valor_base": Decimal(str(salario)),
+                "indice_aplicado": indice,
+                "valor_calculado": Decimal(str(float(matriz[i, m]))),
+                "memoria_calculo": {
+                    "hc_operando": float(hc_operando[i, m]),
+                    "hc_folha": hc,
+                    "salario": salario,
+                    "tipo_calculo": passo.tipo_calculo,
+                    "centro_custo_id": str(quadro.centro_custo_id) if quadro.centro_custo_id else None,
+                }
+            })
+
+    return registros
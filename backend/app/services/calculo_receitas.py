@@ -0,0 +1,393 @@
+"""
+Cálculo em lote das receitas do cenário.
+
+Todas as receitas (ReceitaCenario) de um cenário são calculadas de uma vez,
+para uma lista de períodos (ano, mes), em matrizes NumPy receita x período:
+
+- FIXA_CC:  valor_fixo
+- FIXA_HC:  valor_fixo x HC do CC
+- FIXA_PA:  valor_fixo x PA da função (no CC, ou em toda a operação sem CC)
+- VARIAVEL: HC_PA x VOPDU x Índice x Ticket x Fator x Dias úteis x (1 - Estorno),
+            limitado a [valor_minimo_pa, valor_maximo_pa] x PA; só nos meses
+            com premissa (ReceitaPremissaMes). Sem HC da função no CC, usa o HC
+            da função em toda a operação.
+
+As entradas saem de um número fixo de consultas, independente do número de
+receitas e meses: receitas com premissas e CC (selectinload), cubo de drivers
+(HC/PA por CC e função, ver cubo_drivers) e calendário de todos os anos.
+
+O resultado é gravado em receitas_calculadas, por ano (12 meses), e a
+impressão das entradas (impressao_calculo) de cada ano em
+receitas_calculadas_anos. A etapa de receitas dos cálculos e a API de
+receitas chamam garantir_receitas_calculadas, que só recalcula os anos cuja impressão
+gravada difere da atual: qualquer alteração em receitas, premissas,
+quadro de pessoal, CCs das receitas ou feriados invalida as linhas gravadas.
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+from decimal import Decimal
+from dataclasses import dataclass, field
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete
+from sqlalchemy.orm import selectinload
+
+from app.db.models.orcamento import Cenario, ReceitaCenario, ReceitaCalculada, ReceitaCalculadaAno
+from app.schemas.orcamento import ReceitaCalculadaResponse
+from app.services.calendario import obter_calendario, RegimeTrabalho
+from app.services.cubo_drivers import CuboDrivers, TODOS, obter_cubo_drivers
+from app.services.gravacao_lote import gravar_registros
+from app.services.impressao_calculo import calcular_impressao_receitas
+from app.services.perfil_calculo import perfilar, fase, OPERACAO_RECEITAS
+from app.services.calculo_custos import periodos_cenario
+from app.services.dre_resumo import atualizar_dre_resumo, garantir_dre_resumo, FONTE_RECEITA
+
+
+CAMPOS_PREMISSA = ("vopdu", "indice_conversao", "ticket_medio", "fator", "indice_estorno")
+
+
+@dataclass
+class ReceitasCalculadas:
+    """
+    Resultado do cálculo: matrizes (receita x período), na ordem de `receitas`
+    e `periodos`. Campos que não se aplicam à célula (ex: dias_uteis de uma
+    receita fixa) ficam NaN.
+    """
+    receitas: List[ReceitaCenario]
+    periodos: List[Tuple[int, int]]
+    valor_calculado: np.ndarray
+    valor_bruto: np.ndarray
+    hc_total: np.ndarray
+    hc_pa: np.ndarray
+    qtd_pa: np.ndarray
+    dias_uteis: np.ndarray
+    premissas: Dict[str, np.ndarray]
+    indice: Dict[UUID, int] = field(init=False)
+
+    def __post_init__(self):
+        self.indice = {r.id: i for i, r in enumerate(self.receitas)}
+
+    def valores(self, receita_id: UUID) -> np.ndarray:
+        """Valor calculado da receita em cada período."""
+        return self.valor_calculado[self.indice[receita_id]]
+
+    def respostas(self, receita_id: UUID) -> List[ReceitaCalculadaResponse]:
+        """Uma resposta por período, com a memória de cálculo, no formato da API de receitas."""
+        i = self.indice[receita_id]
+        receita = self.receitas[i]
+        return [self._resposta(receita, i, t, ano, mes) for t, (ano, mes) in enumerate(self.periodos)]
+
+    def registros(self, impressao: str) -> List[Dict[str, Any]]:
+        """Linhas de receitas_calculadas (uma por receita e período)."""
+        registros = []
+        for i, receita in enumerate(self.receitas):
+            for t, (ano, mes) in enumerate(self.periodos):
+                resposta = self._resposta(receita, i, t, ano, mes)
+                registros.append({
+                    "cenario_id": receita.cenario_id,
+                    "receita_cenario_id": receita.id,
+                    "centro_custo_id": receita.centro_custo_id,
+                    "tipo_receita_id": receita.tipo_receita_id,
+                    "mes": mes,
+                    "ano": ano,
+                    "valor_calculado": resposta.valor_calculado,
+                    "valor_bruto": resposta.valor_bruto,
+                    "hc_pa": resposta.hc_pa,
+                    "qtd_pa": resposta.qtd_pa,
+                    "dias_uteis": resposta.dias_uteis,
+                    "memoria_calculo": resposta.memoria_calculo,
+                    "impressao": impressao,
+                })
+        return registros
+
+    def _resposta(self, receita: ReceitaCenario, i: int, t: int, ano: int, mes: int) -> ReceitaCalculadaResponse:
+        def valor(matriz: np.ndarray) -> Optional[float]:
+            v = matriz[i, t]
+            return None if np.isnan(v) else float(v)
+
+        valor_fixo = float(receita.valor_fixo or 0)
+        memoria: Dict[str, Any] = {}
+        tipo = receita.tipo_calculo
+        if tipo == "FIXA_CC":
+            memoria = {"tipo": "FIXA_CC", "valor_fixo": valor_fixo}
+        elif tipo == "FIXA_HC":
+            memoria = {"tipo": "FIXA_HC", "valor_fixo": valor_fixo, "hc_total": valor(self.hc_total)}
+        elif tipo == "FIXA_PA":
+            memoria = {"tipo": "FIXA_PA", "valor_fixo": valor_fixo, "qtd_pa": valor(self.qtd_pa)}
+        elif tipo == "VARIAVEL" and not np.isnan(self.valor_bruto[i, t]):
+            qtd_pa = valor(self.qtd_pa)
+            memoria = {
+                "tipo": "VARIAVEL",
+                "hc_pa": valor(self.hc_pa),
+                **{campo: float(self.premissas[campo][i, t]) for campo in CAMPOS_PREMISSA},
+                "dias_uteis": int(self.dias_uteis[i, t]),
+                "qtd_pa": qtd_pa,
+                "valor_bruto": valor(self.valor_bruto),
+                "valor_min": float(receita.valor_minimo_pa) * qtd_pa if receita.valor_minimo_pa else None,
+                "valor_max": float(receita.valor_maximo_pa) * qtd_pa if receita.valor_maximo_pa else None,
+            }
+
+        dias_uteis = valor(self.dias_uteis)
+        return ReceitaCalculadaResponse(
+            receita_cenario_id=receita.id,
+            mes=mes,
+            ano=ano,
+            valor_calculado=float(self.valor_calculado[i, t]),
+            valor_bruto=valor(self.valor_bruto),
+            hc_pa=valor(self.hc_pa),
+            qtd_pa=valor(self.qtd_pa),
+            dias_uteis=int(dias_uteis) if dias_uteis is not None else None,
+            memoria_calculo=memoria
+        )
+
+
+async def carregar_receitas(
+    db: AsyncSession,
+    cenario_id: Optional[UUID],
+    receita_id: Optional[UUID] = None
+) -> List[ReceitaCenario]:
+    """Receitas ativas do cenário (ou só a receita informada) com tipo, CC e premissas."""
+    query = select(ReceitaCenario).options(
+        selectinload(ReceitaCenario.tipo_receita),
+        selectinload(ReceitaCenario.centro_custo),
+        selectinload(ReceitaCenario.premissas)
+    )
+    if receita_id:
+        query = query.where(ReceitaCenario.id == receita_id)
+    else:
+        query = query.where(ReceitaCenario.cenario_id == cenario_id, ReceitaCenario.ativo == True)
+    result = await db.execute(query)
+    return list(result.scalars().all())
+
+
+async def calcular_receitas(
+    db: AsyncSession,
+    cenario_id: UUID,
+    periodos: List[Tuple[int, int]],
+    receitas: Optional[Sequence[ReceitaCenario]] = None,
+    cubo: Optional[CuboDrivers] = None
+) -> ReceitasCalculadas:
+    """
+    Calcula as receitas do cenário em todos os períodos.
+
+    Args:
+        periodos: Lista de (ano, mes)
+        receitas: Receitas já carregadas com centro_custo e premissas
+            (padrão: todas as ativas do cenário, ver carregar_receitas)
+        cubo: Cubo de drivers do cenário, se o chamador já o tiver
+    """
+    if receitas is None:
+        receitas = await carregar_receitas(db, cenario_id)
+    receitas = list(receitas)
+    if cubo is None:
+        cubo = await obter_cubo_drivers(db, cenario_id)
+
+    n, t = len(receitas), len(periodos)
+    meses = np.array([mes - 1 for _, mes in periodos], dtype=np.intp)
+
+    # Dias úteis por UF do CC da receita
+    dias_por_uf: Dict[Optional[str], np.ndarray] = {}
+    if periodos:
+        anos = [ano for ano, _ in periodos]
+        calendario = await obter_calendario(db, min(anos), max(anos))
+        for uf in {r.centro_custo.uf if r.centro_custo else None for r in receitas}:
+            regime = RegimeTrabalho(uf=uf)
+            dias_por_uf[uf] = np.array(
+                [int(calendario.dias_uteis(ano, mes, regime)) for ano, mes in periodos], dtype=float
+            )
+
+    # Drivers (HC/PA) e premissas por receita x período
+    hc_total = np.zeros((n, t))
+    hc_funcao = np.zeros((n, t))
+    qtd_pa = np.zeros((n, t))
+    dias = np.zeros((n, t))
+    tem_premissa = np.zeros((n, t), dtype=bool)
+    premissas = {campo: np.zeros((n, t)) for campo in CAMPOS_PREMISSA}
+    premissas["fator"][:] = 1.0
+    indice_periodo = {periodo: j for j, periodo in enumerate(periodos)}
+
+    for i, receita in enumerate(receitas):
+        cc_funcao = receita.centro_custo_id or TODOS
+        hc_total[i] = cubo.hc(centro_custo_id=receita.centro_custo_id)[meses]
+        qtd_pa[i] = cubo.pa(centro_custo_id=cc_funcao, funcao_id=receita.funcao_pa_id)[meses]
+        hc_funcao[i] = cubo.hc(centro_custo_id=cc_funcao, funcao_id=receita.funcao_pa_id)[meses]
+        if receita.funcao_pa_id:
+            # Sem HC da função no CC: HC da função em toda a operação
+            hc_operacao = cubo.hc(funcao_id=receita.funcao_pa_id)[meses]
+            hc_funcao[i] = np.where(hc_funcao[i] == 0, hc_operacao, hc_funcao[i])
+        if periodos:
+            dias[i] = dias_por_uf[receita.centro_custo.uf if receita.centro_custo else None]
+
+        if receita.tipo_calculo != "VARIAVEL":
+            continue
+        for premissa in receita.premissas:
+            j = indice_periodo.get((premissa.ano, premissa.mes))
+            if j is None:
+                continue
+            tem_premissa[i, j] = True
+            premissas["vopdu"][i, j] = float(premissa.vopdu or 0)
+            premissas["indice_conversao"][i, j] = float(premissa.indice_conversao or 0)
+            premissas["ticket_medio"][i, j] = float(premissa.ticket_medio or 0)
+            premissas["fator"][i, j] = float(premissa.fator or 1)
+            premissas["indice_estorno"][i, j] = float(premissa.indice_estorno or 0)
+
+    # Receita variável com limites por PA (NaN = sem limite)
+    bruto = (
+        hc_funcao * premissas["vopdu"] * premissas["indice_conversao"] * premissas["ticket_medio"]
+        * premissas["fator"] * dias * (1 - premissas["indice_estorno"])
+    )
+    minimo_pa = np.array([float(r.valor_minimo_pa) if r.valor_minimo_pa else np.nan for r in receitas])[:, None]
+    maximo_pa = np.array([float(r.valor_maximo_pa) if r.valor_maximo_pa else np.nan for r in receitas])[:, None]
+    minimo = minimo_pa * qtd_pa
+    maximo = maximo_pa * qtd_pa
+    variavel = np.where(bruto < minimo, minimo, np.where(bruto > maximo, maximo, bruto))
+
+    tipos = np.array([r.tipo_calculo for r in receitas], dtype=object)[:, None]
+    valor_fixo = np.array([float(r.valor_fixo or 0) for r in receitas])[:, None]
+    e_variavel = (tipos == "VARIAVEL") & tem_premissa
+
+    valor_calculado = np.select(
+        [
+            np.broadcast_to(tipos == "FIXA_CC", (n, t)),
+            np.broadcast_to(tipos == "FIXA_HC", (n, t)),
+            np.broadcast_to(tipos == "FIXA_PA", (n, t)),
+            e_variavel,
+        ],
+        [np.broadcast_to(valor_fixo, (n, t)), valor_fixo * hc_total, valor_fixo * qtd_pa, variavel],
+        default=0.0
+    )
+
+    return ReceitasCalculadas(
+        receitas=receitas,
+        periodos=list(periodos),
+        valor_calculado=valor_calculado,
+        valor_bruto=np.where(e_variavel, bruto, np.nan),
+        hc_total=np.where(tipos == "FIXA_HC", hc_total, np.nan),
+        hc_pa=np.where(e_variavel, hc_funcao, np.nan),
+        qtd_pa=np.where(e_variavel | (tipos == "FIXA_PA"), qtd_pa, np.nan),
+        dias_uteis=np.where(e_variavel, dias, np.nan),
+        premissas=premissas
+    )
+
+
+def resposta_gravada(linha: ReceitaCalculada) -> ReceitaCalculadaResponse:
+    """Linha de receitas_calculadas no formato da API de receitas."""
+    def valor(v: Optional[Decimal]) -> Optional[float]:
+        return None if v is None else float(v)
+
+    return ReceitaCalculadaResponse(
+        receita_cenario_id=linha.receita_cenario_id,
+        mes=linha.mes,
+        ano=linha.ano,
+        valor_calculado=float(linha.valor_calculado),
+        valor_bruto=valor(linha.valor_bruto),
+        hc_pa=valor(linha.hc_pa),
+        qtd_pa=valor(linha.qtd_pa),
+        dias_uteis=linha.dias_uteis,
+        memoria_calculo=linha.memoria_calculo
+    )
+
+
+async def _impressoes_gravadas(db: AsyncSession, cenario_id: UUID, anos: List[int]) -> Dict[int, str]:
+    """Impressão com que cada ano foi calculado (anos nunca calculados ficam de fora)."""
+    result = await db.execute(
+        select(ReceitaCalculadaAno.ano, ReceitaCalculadaAno.impressao)
+        .where(ReceitaCalculadaAno.cenario_id == cenario_id, ReceitaCalculadaAno.ano.in_(anos))
+    )
+    return dict(result.all())
+
+
+async def receitas_atualizadas(db: AsyncSession, cenario_id: UUID, anos: Sequence[int]) -> bool:
+    """Só leitura: True se todos os anos foram gravados com a impressão atual."""
+    anos = sorted(set(anos))
+    impressao = await calcular_impressao_receitas(db, cenario_id)
+    gravadas = await _impressoes_gravadas(db, cenario_id, anos)
+    return all(gravadas.get(ano) == impressao for ano in anos)
+
+
+async def garantir_receitas_calculadas(
+    db: AsyncSession,
+    cenario_id: UUID,
+    anos: Sequence[int],
+    forcar: bool = False
+) -> Dict[str, Any]:
+    """
+    Recalcula e grava as receitas dos anos cuja impressão gravada não é a atual
+    (ou de todos, com forcar) e atualiza as receitas desses anos no resumo do
+    DRE. Faz commit se gravar algo.
+
+    Returns:
+        {"anos": anos recalculados, "receitas_calculadas": linhas gravadas, "cache": nada a recalcular}
+    """
+    anos = sorted(set(anos))
+    impressao = await calcular_impressao_receitas(db, cenario_id)
+    gravadas = await _impressoes_gravadas(db, cenario_id, anos)
+    if not forcar and all(gravadas.get(ano) == impressao for ano in anos):
+        return {"anos": [], "receitas_calculadas": 0, "cache": True}
+
+    # Um recálculo por cenário de cada vez; quem esperou pode encontrar tudo gravado
+    await db.execute(select(Cenario.id).where(Cenario.id == cenario_id).with_for_update())
+    gravadas = await _impressoes_gravadas(db, cenario_id, anos)
+    desatualizados = [ano for ano in anos if forcar or gravadas.get(ano) != impressao]
+    if not desatualizados:
+        await db.commit()
+        return {"anos": [], "receitas_calculadas": 0, "cache": True}
+
+    with fase("calculo"):
+        calculadas = await calcular_receitas(
+            db, cenario_id, [(ano, mes) for ano in desatualizados for mes in range(1, 13)]
+        )
+        registros = calculadas.registros(impressao)
+
+    with fase("gravacao") as f:
+        await db.execute(
+            delete(ReceitaCalculada).where(
+                ReceitaCalculada.cenario_id == cenario_id,
+                ReceitaCalculada.ano.in_(desatualizados)
+            )
+        )
+        await gravar_registros(db, ReceitaCalculada.__table__, registros)
+        await db.execute(
+            delete(ReceitaCalculadaAno).where(
+                ReceitaCalculadaAno.cenario_id == cenario_id,
+                ReceitaCalculadaAno.ano.in_(desatualizados)
+            )
+        )
+        db.add_all([
+            ReceitaCalculadaAno(cenario_id=cenario_id, ano=ano, impressao=impressao)
+            for ano in desatualizados
+        ])
+        f.linhas += len(registros)
+
+    with fase("dre"):
+        await atualizar_dre_resumo(db, cenario_id, (FONTE_RECEITA,), desatualizados)
+        await db.commit()
+
+    return {"anos": desatualizados, "receitas_calculadas": len(registros), "cache": False}
+
+
+async def calcular_e_salvar_receitas(
+    db: AsyncSession,
+    cenario_id: UUID,
+    ano: Optional[int] = None,
+    forcar: bool = False
+) -> Dict[str, Any]:
+    """
+    Etapa de cálculo de receitas (ao lado do cálculo de custos): grava as
+    receitas do ano informado ou de todos os anos da janela do cenário e
+    remonta as fontes do resumo do DRE alteradas fora de um cálculo.
+
+    A execução é perfilada (ver perfil_calculo); o id do perfil vem em "perfil_id".
+    """
+    cenario = await db.get(Cenario, cenario_id)
+    if not cenario:
+        raise ValueError("Cenário não encontrado")
+
+    anos = [ano] if ano else sorted({a for a, _ in periodos_cenario(cenario)})
+    async with perfilar(db, OPERACAO_RECEITAS, cenario_id, None, ano) as perfil:
+        resultado = await garantir_receitas_calculadas(db, cenario_id, anos, forcar)
+        with fase("dre"):
+            await garantir_dre_resumo(db, cenario_id)
+    return {**resultado, "perfil_id": str(perfil.id)}
@@ -0,0 +1,192 @@
+"""
+Calendário de dias úteis compartilhado por receitas, motor de custos e DRE.
+
+Os feriados de cada ano são carregados uma única vez (uma consulta para todos
+os anos que faltam, incluindo os recorrentes) e ficam em memória, indexados
+por mês e abrangência (nacional, UF, UF+cidade). As contagens por
+(ano, mes, regime de trabalho) são calculadas na primeira consulta e servidas
+do dicionário a partir daí.
+
+O regime junta a localidade (uf/cidade) e a política de trabalho da seção
+(sábado, domingo, feriados). A regra é a mesma em todos os usos:
+
+    dias úteis = dias do mês - sábados * (1 - trabalha_sabado)
+                 - domingos (se não trabalha domingo)
+                 - feriados de seg a sex das abrangências não trabalhadas
+
+Feriados em fim de semana não descontam de novo (o fim de semana já saiu).
+O cache é descartado quando feriados mudam (invalidar_calendario, chamado
+pela API de feriados) e, para outros processos, a cada CALENDARIO_TTL_SEGUNDOS.
+"""
+
+from typing import Dict, Set, Tuple, Optional, Iterable
+from dataclasses import dataclass, field, replace
+from datetime import date
+from functools import lru_cache
+import calendar
+import time
+
+from sqlalchemy import select, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models.orcamento import Feriado, Secao
+
+
+@dataclass(frozen=True)
+class RegimeTrabalho:
+    """Localidade e política de trabalho usadas na contagem de dias."""
+    uf: Optional[str] = None
+    cidade: Optional[str] = None
+    trabalha_sabado: float = 0.0  # 0=não, 0.5=meio período, 1=integral
+    trabalha_domingo: bool = False
+    trabalha_feriado_nacional: bool = False
+    trabalha_feriado_estadual: bool = False
+    trabalha_feriado_municipal: bool = False
+
+    @classmethod
+    def de_secao(cls, secao: Optional[Secao]) -> "RegimeTrabalho":
+        """Regime da seção (política de trabalho + uf/cidade); sem seção, o padrão."""
+        if secao is None:
+            return REGIME_PADRAO
+        return cls(
+            uf=secao.uf,
+            cidade=secao.cidade,
+            trabalha_sabado=float(secao.trabalha_sabado or 0),
+            trabalha_domingo=bool(secao.trabalha_domingo),
+            trabalha_feriado_nacional=bool(secao.trabalha_feriado_nacional),
+            trabalha_feriado_estadual=bool(secao.trabalha_feriado_estadual),
+            trabalha_feriado_municipal=bool(secao.trabalha_feriado_municipal),
+        )
+
+
+# Segunda a sexta, sem localidade: só feriados nacionais
+REGIME_PADRAO = RegimeTrabalho()
+
+
+@lru_cache(maxsize=None)
+def _tabela_mes(ano: int, mes: int) -> Tuple[int, int, int]:
+    """(dias do mês, sábados, domingos)."""
+    primeiro, dias = calendar.monthrange(ano, mes)
+    sabados = sum(1 for d in range(dias) if (primeiro + d) % 7 == 5)
+    domingos = sum(1 for d in range(dias) if (primeiro + d) % 7 == 6)
+    return dias, sabados, domingos
+
+
+@dataclass
+class _Feriados:
+    """Feriados de seg a sex por mês e abrangência, dos anos carregados."""
+    anos: Set[int] = field(default_factory=set)
+    nacionais: Dict[Tuple[int, int], Set[date]] = field(default_factory=dict)
+    estaduais: Dict[Tuple[int, int, str], Set[date]] = field(default_factory=dict)
+    municipais: Dict[Tuple[int, int, str, str], Set[date]] = field(default_factory=dict)
+    contagens: Dict[Tuple[int, int, RegimeTrabalho], float] = field(default_factory=dict)
+    criado_em: float = field(default_factory=time.monotonic)
+
+    def adicionar(self, feriado: Feriado, data: date) -> None:
+        if data.weekday() >= 5:
+            return
+        if feriado.tipo == "NACIONAL":
+            self.nacionais.setdefault((data.year, data.month), set()).add(data)
+        elif feriado.tipo == "ESTADUAL" and feriado.uf:
+            self.estaduais.setdefault((data.year, data.month, feriado.uf), set()).add(data)
+        elif feriado.tipo == "MUNICIPAL" and feriado.uf and feriado.cidade:
+            self.municipais.setdefault((data.year, data.month, feriado.uf, feriado.cidade), set()).add(data)
+
+
+_feriados = _Feriados()
+
+
+def invalidar_calendario() -> None:
+    """Descarta feriados e contagens em cache (chamar quando feriados mudarem)."""
+    global _feriados
+    _feriados = _Feriados()
+
+
+class Calendario:
+    """Consultas de dias úteis/trabalhados sobre os anos carregados (ver obter_calendario)."""
+
+    def __init__(self, feriados: _Feriados):
+        self._f = feriados
+
+    def dias_uteis(self, ano: int, mes: int, regime: RegimeTrabalho = REGIME_PADRAO) -> float:
+        """Dias úteis do mês no regime (float: sábado em meio período conta 0,5)."""
+        chave = (ano, mes, regime)
+        dias = self._f.contagens.get(chave)
+        if dias is None:
+            dias = self._f.contagens[chave] = self._contar(ano, mes, regime)
+        return dias
+
+    def dias_trabalhados(
+        self,
+        ano: int,
+        mes: int,
+        escala: Optional[str],
+        regime: RegimeTrabalho = REGIME_PADRAO
+    ) -> int:
+        """Dias trabalhados no mês pela escala (5x2 = seg-sex, 6x1 = seg-sáb, 12x36 = dia sim, dia não)."""
+        if escala == "5x2":
+            return int(self.dias_uteis(ano, mes, replace(regime, trabalha_sabado=0.0, trabalha_domingo=False)))
+        elif escala == "6x1":
+            return int(self.dias_uteis(ano, mes, replace(regime, trabalha_sabado=1.0, trabalha_domingo=False)))
+        dias_mes = _tabela_mes(ano, mes)[0]
+        if escala == "12x36":
+            return dias_mes // 2
+        return dias_mes
+
+    def _contar(self, ano: int, mes: int, regime: RegimeTrabalho) -> float:
+        if ano not in self._f.anos:
+            raise ValueError(f"Ano {ano} não carregado no calendário")
+
+        dias_mes, sabados, domingos = _tabela_mes(ano, mes)
+        desconto_sabados = sabados * (1 - regime.trabalha_sabado)
+        desconto_domingos = 0 if regime.trabalha_domingo else domingos
+
+        feriados: Set[date] = set()
+        if not regime.trabalha_feriado_nacional:
+            feriados |= self._f.nacionais.get((ano, mes), set())
+        if not regime.trabalha_feriado_estadual and regime.uf:
+            feriados |= self._f.estaduais.get((ano, mes, regime.uf), set())
+        if not regime.trabalha_feriado_municipal and regime.uf and regime.cidade:
+            feriados |= self._f.municipais.get((ano, mes, regime.uf, regime.cidade), set())
+
+        return float(max(dias_mes - desconto_sabados - desconto_domingos - len(feriados), 0))
+
+
+async def obter_calendario(db: AsyncSession, ano_inicio: int, ano_fim: Optional[int] = None) -> Calendario:
+    """
+    Calendário com os anos [ano_inicio, ano_fim] carregados.
+
+    Só consulta o banco para anos ainda fora do cache (ou com o cache vencido).
+    """
+    if time.monotonic() - _feriados.criado_em > settings.CALENDARIO_TTL_SEGUNDOS:
+        invalidar_calendario()
+    feriados = _feriados
+
+    faltando = [a for a in range(ano_inicio, (ano_fim or ano_inicio) + 1) if a not in feriados.anos]
+    if faltando:
+        await _carregar_anos(db, feriados, faltando)
+    return Calendario(feriados)
+
+
+async def _carregar_anos(db: AsyncSession, feriados: _Feriados, anos: Iterable[int]) -> None:
+    """Carrega os feriados dos anos (datados no ano ou recorrentes) em uma consulta."""
+    anos = sorted(anos)
+    result = await db.execute(
+        select(Feriado).where(
+            or_(
+                Feriado.data.between(date(anos[0], 1, 1), date(anos[-1], 12, 31)),
+                Feriado.recorrente == True
+            )
+        )
+    )
+    for feriado in result.scalars().all():
+        if feriado.recorrente:
+            for ano in anos:
+                try:
+                    feriados.adicionar(feriado, feriado.data.replace(year=ano))
+                except ValueError:
+                    pass  # 29/02 em ano não bissexto
+        elif feriado.data.year in anos:
+            feriados.adicionar(feriado, feriado.data)
+    feriados.anos.update(anos)
@@ -2,15 +2,16 @@
 Serviço de Capacity Planning - Cálculo de quantidades via spans.
 """
 
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, FrozenSet, Iterable
 from uuid import UUID
 from math import ceil
 from decimal import Decimal
+from collections import deque
+from dataclasses import dataclass
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from sqlalchemy.orm import noload
+from sqlalchemy import select, update, func, or_
 
-from app.db.models.orcamento import FuncaoSpan, QuadroPessoal, Cenario
+from app.db.models.orcamento import FuncaoSpan, QuadroPessoal, Cenario, Funcao
 
 
 def to_float(value) -> float:
@@ -25,59 +26,225 @@ def to_float(value) -> float:
 MESES = ['jan', 'fev', 'mar', 'abr', 'mai', 'jun', 'jul', 'ago', 'set', 'out', 'nov', 'dez']
 
 
-async def calcular_span_para_posicao(
-    db: AsyncSession,
-    posicao: QuadroPessoal,
-    cenario_secao_id: Optional[UUID] = None
-) -> Dict[str, int]:
+class CicloSpanError(ValueError):
+    """Spans que dependem uns dos outros em ciclo (nenhuma ordem de cálculo é possível)."""
+
+
+@dataclass
+class NoSpan:
+    """Posição SPAN (ou FuncaoSpan) no grafo de dependências."""
+    chave: UUID  # id da posição (ou do FuncaoSpan)
+    funcao_id: UUID
+    cenario_secao_id: Optional[UUID]  # None = soma as bases do cenário inteiro
+    funcoes_base: FrozenSet[UUID]
+    span_ratio: float
+    quantidades: List[float]  # jan..dez
+    rotulo: str  # código da função, para mensagens
+
+
+def _funcoes_base(ids) -> FrozenSet[UUID]:
+    """IDs das funções base (podem ser strings UUID vindas do JSON)."""
+    return frozenset(UUID(fid) if isinstance(fid, str) else fid for fid in (ids or []))
+
+
+class GrafoSpans:
     """
-    Calcula as quantidades mensais para uma posição do tipo SPAN.
-    
-    Args:
-        db: Sessão do banco de dados
-        posicao: Posição do tipo SPAN a ser calculada
-        cenario_secao_id: Se fornecido, filtra funções base apenas desta seção
-    
-    Returns:
-        Dict com quantidades mensais {qtd_jan: X, qtd_fev: Y, ...}
+    Dependências entre spans de um cenário.
+
+    Um span depende das posições das suas funções base na mesma seção (ou no
+    cenário inteiro, se não tiver seção). Quando uma função base é ela mesma
+    calculada por span (supervisor de supervisores), o span de cima depende do
+    de baixo: o recálculo percorre os nós em ordem topológica, cada um usando o
+    resultado já recalculado dos anteriores.
+
+    `base` guarda as quantidades das posições que não são nós, somadas por
+    (cenario_secao_id, funcao_id); a chave (None, funcao_id) é o total do cenário.
     """
-    if posicao.tipo_calculo != 'span' or not posicao.span_funcoes_base_ids or not posicao.span_ratio:
-        return {}
-    
-    # IDs das funções base (podem ser strings UUID vindas do JSON)
-    funcoes_base_ids = [
-        UUID(fid) if isinstance(fid, str) else fid 
-        for fid in posicao.span_funcoes_base_ids
-    ]
-    
-    span_ratio = float(posicao.span_ratio)
-    if span_ratio <= 0:
-        return {}
-    
-    # Buscar posições das funções base na mesma seção
-    query = select(QuadroPessoal).options(noload(QuadroPessoal.cenario)).where(
-        QuadroPessoal.cenario_id == posicao.cenario_id,
-        QuadroPessoal.funcao_id.in_(funcoes_base_ids),
-        QuadroPessoal.ativo == True
+
+    def __init__(self, nos: Iterable[NoSpan], base: Dict[Tuple[Optional[UUID], UUID], List[float]]):
+        self.nos: Dict[UUID, NoSpan] = {no.chave: no for no in nos}
+        self.base = base
+        self._por_funcao: Dict[UUID, List[NoSpan]] = {}
+        self._por_base: Dict[UUID, List[NoSpan]] = {}
+        for no in self.nos.values():
+            self._por_funcao.setdefault(no.funcao_id, []).append(no)
+            for funcao_id in no.funcoes_base:
+                self._por_base.setdefault(funcao_id, []).append(no)
+
+    def _dependentes(self, funcao_id: UUID, cenario_secao_id: Optional[UUID]) -> List[NoSpan]:
+        """Spans cuja base inclui a função na seção (os da seção e os do cenário inteiro)."""
+        return [
+            no for no in self._por_base.get(funcao_id, [])
+            if no.cenario_secao_id is None or no.cenario_secao_id == cenario_secao_id
+        ]
+
+    def _dependencias(self, no: NoSpan) -> List[NoSpan]:
+        """Spans que entram na base do nó."""
+        return [
+            dep for funcao_id in no.funcoes_base for dep in self._por_funcao.get(funcao_id, [])
+            if no.cenario_secao_id is None or dep.cenario_secao_id == no.cenario_secao_id
+        ]
+
+    def afetados(
+        self,
+        funcao_id: UUID,
+        cenario_secao_id: Optional[UUID],
+        incluir: Iterable[NoSpan] = ()
+    ) -> List[NoSpan]:
+        """Spans a jusante de uma alteração na função/seção (mais os incluídos), em ordem topológica."""
+        pendentes = list(incluir) + self._dependentes(funcao_id, cenario_secao_id)
+        alcancados: Dict[UUID, NoSpan] = {}
+        while pendentes:
+            no = pendentes.pop()
+            if no.chave in alcancados:
+                continue
+            alcancados[no.chave] = no
+            pendentes.extend(self._dependentes(no.funcao_id, no.cenario_secao_id))
+        return self.ordenar(alcancados.values())
+
+    def ordenar(self, nos: Optional[Iterable[NoSpan]] = None) -> List[NoSpan]:
+        """Ordem topológica dos nós (todos, se não informados); levanta CicloSpanError se houver ciclo."""
+        nos = list(self.nos.values() if nos is None else nos)
+        grau = {no.chave: 0 for no in nos}
+        saidas: Dict[UUID, List[NoSpan]] = {no.chave: [] for no in nos}
+        for no in nos:
+            for dep in self._dependencias(no):
+                if dep.chave in grau:
+                    grau[no.chave] += 1
+                    saidas[dep.chave].append(no)
+
+        fila = deque(no for no in nos if grau[no.chave] == 0)
+        ordem = []
+        while fila:
+            no = fila.popleft()
+            ordem.append(no)
+            for seguinte in saidas[no.chave]:
+                grau[seguinte.chave] -= 1
+                if grau[seguinte.chave] == 0:
+                    fila.append(seguinte)
+
+        if len(ordem) < len(nos):
+            # Sobram o ciclo e o que está só a jusante dele; tira os de jusante
+            restantes = {no.chave for no in nos if grau[no.chave] > 0}
+            podados = True
+            while podados:
+                podados = {c for c in restantes if not any(s.chave in restantes for s in saidas[c])}
+                restantes -= podados
+            funcoes = sorted({no.rotulo for no in nos if no.chave in restantes})
+            raise CicloSpanError(
+                f"Ciclo entre spans: as funções {', '.join(funcoes)} dependem umas das outras "
+                f"(direta ou indiretamente) e não podem ser calculadas"
+            )
+        return ordem
+
+    def recalcular(self, ordem: List[NoSpan]) -> List[NoSpan]:
+        """Recalcula os nós na ordem dada; retorna os que mudaram."""
+        alterados = []
+        for no in ordem:
+            soma = [0.0] * 12
+            for funcao_id in no.funcoes_base:
+                fixas = self.base.get((no.cenario_secao_id, funcao_id))
+                if fixas:
+                    soma = [s + q for s, q in zip(soma, fixas)]
+                for dep in self._por_funcao.get(funcao_id, []):
+                    if no.cenario_secao_id is None or dep.cenario_secao_id == no.cenario_secao_id:
+                        soma = [s + q for s, q in zip(soma, dep.quantidades)]
+            novas = [float(ceil(s / no.span_ratio)) if s > 0 else 0.0 for s in soma]
+            if novas != no.quantidades:
+                no.quantidades = novas
+                alterados.append(no)
+        return alterados
+
+
+def _somar(base: Dict[Tuple[Optional[UUID], UUID], List[float]], chave, quantidades) -> None:
+    atual = base.get(chave)
+    base[chave] = list(quantidades) if atual is None else [a + q for a, q in zip(atual, quantidades)]
+
+
+async def carregar_grafo_spans(db: AsyncSession, cenario_id: UUID) -> GrafoSpans:
+    """
+    Grafo das posições SPAN do cenário.
+
+    Duas consultas: as posições SPAN (nós) e as demais posições somadas por
+    seção e função.
+    """
+    colunas_qtd = [getattr(QuadroPessoal, f'qtd_{mes}') for mes in MESES]
+
+    spans_result = await db.execute(
+        select(
+            QuadroPessoal.id,
+            QuadroPessoal.funcao_id,
+            QuadroPessoal.cenario_secao_id,
+            QuadroPessoal.span_funcoes_base_ids,
+            QuadroPessoal.span_ratio,
+            Funcao.codigo,
+            *colunas_qtd
+        )
+        .join(Funcao, Funcao.id == QuadroPessoal.funcao_id)
+        .where(
+            QuadroPessoal.cenario_id == cenario_id,
+            QuadroPessoal.tipo_calculo == 'span',
+            QuadroPessoal.ativo == True
+        )
+    )
+
+    base_result = await db.execute(
+        select(
+            QuadroPessoal.cenario_secao_id,
+            QuadroPessoal.funcao_id,
+            *[func.sum(coluna) for coluna in colunas_qtd]
+        )
+        .where(
+            QuadroPessoal.cenario_id == cenario_id,
+            QuadroPessoal.ativo == True,
+            or_(QuadroPessoal.tipo_calculo.is_(None), QuadroPessoal.tipo_calculo != 'span')
+        )
+        .group_by(QuadroPessoal.cenario_secao_id, QuadroPessoal.funcao_id)
+    )
+
+    base: Dict[Tuple[Optional[UUID], UUID], List[float]] = {}
+
+    def acumular(cenario_secao_id, funcao_id, quantidades):
+        if cenario_secao_id is not None:
+            _somar(base, (cenario_secao_id, funcao_id), quantidades)
+        _somar(base, (None, funcao_id), quantidades)
+
+    for row in base_result.all():
+        acumular(row[0], row[1], [to_float(q) for q in row[2:]])
+
+    nos = []
+    for row in spans_result.all():
+        quantidades = [to_float(q) for q in row[6:]]
+        funcoes_base = _funcoes_base(row.span_funcoes_base_ids)
+        span_ratio = to_float(row.span_ratio)
+        if not funcoes_base or span_ratio <= 0:
+            # Span sem configuração válida: entra como posição fixa
+            acumular(row.cenario_secao_id, row.funcao_id, quantidades)
+            continue
+        nos.append(NoSpan(
+            chave=row.id,
+            funcao_id=row.funcao_id,
+            cenario_secao_id=row.cenario_secao_id,
+            funcoes_base=funcoes_base,
+            span_ratio=span_ratio,
+            quantidades=quantidades,
+            rotulo=row.codigo,
+        ))
+
+    return GrafoSpans(nos, base)
+
+
+async def _gravar_quantidades(db: AsyncSession, nos: List[NoSpan]) -> None:
+    """UPDATE em lote (por id) das quantidades recalculadas."""
+    if not nos:
+        return
+    await db.execute(
+        update(QuadroPessoal),
+        [
+            {"id": no.chave, **{f'qtd_{mes}': qtd for mes, qtd in zip(MESES, no.quantidades)}}
+            for no in nos
+        ]
     )
-    
-    # Filtrar pela mesma seção se especificado
-    if cenario_secao_id:
-        query = query.where(QuadroPessoal.cenario_secao_id == cenario_secao_id)
-    elif posicao.cenario_secao_id:
-        query = query.where(QuadroPessoal.cenario_secao_id == posicao.cenario_secao_id)
-    
-    result = await db.execute(query)
-    posicoes_base = result.scalars().all()
-    
-    # Somar quantidades por mês
-    quantidades = {}
-    for mes in MESES:
-        soma_base = sum(to_float(getattr(p, f'qtd_{mes}', 0)) for p in posicoes_base)
-        quantidade_span = ceil(soma_base / span_ratio) if soma_base > 0 else 0
-        quantidades[f'qtd_{mes}'] = quantidade_span
-    
-    return quantidades
 
 
 async def aplicar_calculo_span(
@@ -85,7 +252,8 @@ async def aplicar_calculo_span(
     posicao: QuadroPessoal
 ) -> QuadroPessoal:
     """
-    Calcula e aplica as quantidades SPAN a uma posição.
+    Calcula e aplica as quantidades SPAN a uma posição e aos spans que
+    dependem dela (em ordem topológica).
     
     Args:
         db: Sessão do banco de dados
@@ -93,11 +261,26 @@ async def aplicar_calculo_span(
     
     Returns:
         Posição atualizada com as quantidades calculadas
-    """
-    quantidades = await calcular_span_para_posicao(db, posicao)
     
-    for campo, valor in quantidades.items():
-        setattr(posicao, campo, valor)
+    Raises:
+        CicloSpanError: se a posição fechar um ciclo entre spans
+    """
+    if posicao.tipo_calculo != 'span':
+        return posicao
+
+    # A posição precisa estar no banco para entrar no grafo
+    await db.flush()
+    grafo = await carregar_grafo_spans(db, posicao.cenario_id)
+    no = grafo.nos.get(posicao.id)
+    if no is None:
+        return posicao
+
+    ordem = grafo.afetados(posicao.funcao_id, posicao.cenario_secao_id, incluir=[no])
+    alterados = grafo.recalcular(ordem)
+    await _gravar_quantidades(db, [n for n in alterados if n.chave != posicao.id])
+
+    for mes, qtd in zip(MESES, no.quantidades):
+        setattr(posicao, f'qtd_{mes}', qtd)
     
     return posicao
 
@@ -109,47 +292,26 @@ async def recalcular_spans_afetados_sem_commit(
     cenario_secao_id: Optional[UUID] = None
 ) -> int:
     """
-    Recalcula todas as posições SPAN que dependem de uma função específica.
+    Recalcula as posições SPAN a jusante de uma função: as que a têm como
+    base e, em cadeia, as que dependem dessas (ordem topológica, UPDATE em lote).
     NÃO faz commit - permite que o chamador controle a transação.
     
     Args:
         db: Sessão do banco de dados
         cenario_id: ID do cenário
         funcao_id: ID da função que foi alterada
-        cenario_secao_id: Se fornecido, limita recálculo a esta seção
+        cenario_secao_id: Seção da posição alterada (None = posição sem seção)
     
     Returns:
-        Número de posições recalculadas
-    """
-    # Buscar todas as posições SPAN que referenciam esta função
-    query = select(QuadroPessoal).options(noload(QuadroPessoal.cenario)).where(
-        QuadroPessoal.cenario_id == cenario_id,
-        QuadroPessoal.tipo_calculo == 'span',
-        QuadroPessoal.ativo == True
-    )
+        Número de posições recalculadas (com quantidades alteradas)
     
-    if cenario_secao_id:
-        query = query.where(QuadroPessoal.cenario_secao_id == cenario_secao_id)
-    
-    result = await db.execute(query)
-    posicoes_span = result.scalars().all()
-    
-    recalculadas = 0
-    funcao_id_str = str(funcao_id)
-    
-    for posicao in posicoes_span:
-        # Verificar se esta função está nas funções base
-        if posicao.span_funcoes_base_ids:
-            funcoes_base = [
-                str(fid) if not isinstance(fid, str) else fid 
-                for fid in posicao.span_funcoes_base_ids
-            ]
-            
-            if funcao_id_str in funcoes_base:
-                await aplicar_calculo_span(db, posicao)
-                recalculadas += 1
-    
-    return recalculadas
+    Raises:
+        CicloSpanError: se houver ciclo entre os spans afetados
+    """
+    grafo = await carregar_grafo_spans(db, cenario_id)
+    alterados = grafo.recalcular(grafo.afetados(funcao_id, cenario_secao_id))
+    await _gravar_quantidades(db, alterados)
+    return len(alterados)
 
 
 async def recalcular_spans_afetados(
@@ -194,6 +356,9 @@ async def calcular_quantidades_span(
     2. Divide pelo span_ratio (arredondando para cima)
     3. Retorna um dicionário com as quantidades calculadas
     
+    Spans encadeados (a função base também é calculada por span) seguem a
+    ordem topológica; ciclo entre spans levanta CicloSpanError.
+    
     Returns:
         Dict com chave "{funcao_id}_{mes}" e valor = quantidade calculada
     """
@@ -209,48 +374,52 @@ async def calcular_quantidades_span(
     if not spans:
         return {}
     
-    # Buscar todas as posições do quadro de pessoal do cenário
+    # Quantidades do quadro somadas por função (uma consulta agregada)
     quadro_result = await db.execute(
-        select(QuadroPessoal).where(
+        select(
+            QuadroPessoal.funcao_id,
+            *[func.sum(getattr(QuadroPessoal, f'qtd_{mes}')) for mes in MESES]
+        )
+        .where(
             QuadroPessoal.cenario_id == cenario_id,
             QuadroPessoal.ativo == True
         )
+        .group_by(QuadroPessoal.funcao_id)
     )
-    quadro = quadro_result.scalars().all()
-    
-    # Criar dicionário de quantidades por função e mês
-    # Chave: (funcao_id, mes) -> quantidade (float)
-    quantidades_base: Dict[tuple, float] = {}
+    quantidades_base = {
+        row[0]: [to_float(q) for q in row[1:]] for row in quadro_result.all()
+    }
     
-    for posicao in quadro:
-        funcao_id = posicao.funcao_id
-        for idx, mes in enumerate(MESES, start=1):
-            qtd = to_float(getattr(posicao, f'qtd_{mes}', 0))
-            key = (funcao_id, idx)
-            quantidades_base[key] = quantidades_base.get(key, 0.0) + qtd
+    # Funções calculadas por span entram como nós: o resultado substitui a
+    # quantidade atual delas na base dos spans que dependem delas
+    nos = [
+        NoSpan(
+            chave=span.id,
+            funcao_id=span.funcao_id,
+            cenario_secao_id=None,
+            funcoes_base=_funcoes_base(span.funcoes_base_ids),
+            span_ratio=float(span.span_ratio),
+            quantidades=[0.0] * 12,
+            rotulo=span.funcao.codigo if span.funcao else str(span.funcao_id),
+        )
+        for span in spans
+        if float(span.span_ratio or 0) > 0
+    ]
+    alvos = {no.funcao_id for no in nos}
+    base = {
+        (None, funcao_id): quantidades
+        for funcao_id, quantidades in quantidades_base.items()
+        if funcao_id not in alvos
+    }
+    grafo = GrafoSpans(nos, base)
+    ordem = grafo.ordenar()
+    grafo.recalcular(ordem)
     
-    # Calcular quantidades via spans
+    # Chave "funcao_id|mes" (mês 1-12)
     quantidades_calculadas: Dict[str, int] = {}
-    
-    for span in spans:
-        funcao_id = span.funcao_id
-        funcoes_base_ids = span.funcoes_base_ids  # Lista de UUIDs
-        span_ratio = float(span.span_ratio)
-        
-        # Para cada mês (1-12)
-        for mes in range(1, 13):
-            # Soma quantidades das funções base para este mês
-            soma_base = 0.0
-            for funcao_base_id in funcoes_base_ids:
-                key = (funcao_base_id, mes)
-                soma_base += quantidades_base.get(key, 0.0)
-            
-            # Calcula quantidade via span (arredondando para cima)
-            quantidade_span = ceil(soma_base / span_ratio) if span_ratio > 0 else 0
-            
-            # Armazena resultado (usar str() para UUID)
-            chave = f"{str(funcao_id)}|{mes}"
-            quantidades_calculadas[chave] = quantidade_span
+    for no in ordem:
+        for mes, qtd in enumerate(no.quantidades, start=1):
+            quantidades_calculadas[f"{str(no.funcao_id)}|{mes}"] = int(qtd)
     
     return quantidades_calculadas
 
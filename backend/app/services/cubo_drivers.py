@@ -0,0 +1,257 @@
+"""
+Cubo de drivers do cenário: HC, PA e HC folha por dimensão e mês.
+
+Receitas (FIXA_HC, FIXA_PA, VARIAVEL), custos diretos variáveis do DRE,
+percentuais de rateio por HC/PA, alocações de tecnologia por HC/PA e a busca de
+meta de receita usam os mesmos totais do quadro de pessoal, só que recortados
+por dimensões diferentes (CC, função, seção ou combinações). Em vez de cada um
+varrer o quadro, o cubo carrega o quadro do cenário em uma única consulta
+agregada por (centro_custo_id, funcao_id, cenario_secao_id) e guarda matrizes
+NumPy (célula x 12 meses):
+
+- HC: soma de qtd_<mês> das posições ativas
+- PA: soma de qtd_<mês> / fator_pa (fator nulo ou <= 0 vale 1)
+- HC folha: HC / (1 - ABS - Férias) * (1 + TO/2) com as premissas da função
+  na seção, por ano (mesma fórmula do motor de custos; sem premissa = HC)
+
+Qualquer recorte é uma soma de linhas da matriz, memorizada no próprio cubo.
+
+O cubo fica em cache no processo, por cenário, junto com uma assinatura barata
+do quadro e das premissas (contagem e maiores created_at/updated_at); cada
+obter_cubo_drivers custa a consulta da assinatura enquanto nada muda. Dentro
+de uma requisição, obtenha o cubo uma vez e passe-o adiante.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, case
+
+from app.db.models.orcamento import QuadroPessoal, PremissaFuncaoMes
+
+
+MESES = ('jan', 'fev', 'mar', 'abr', 'mai', 'jun', 'jul', 'ago', 'set', 'out', 'nov', 'dez')
+
+DIMENSOES = ("centro_custo_id", "funcao_id", "cenario_secao_id")
+
+MEDIDA_HC = "hc"
+MEDIDA_PA = "pa"
+
+# Cenários mantidos em cache
+MAX_CENARIOS_CACHE = 16
+
+
+class _Todos:
+    """Filtro que aceita qualquer valor da dimensão (None filtra as posições sem valor)."""
+
+    def __repr__(self) -> str:
+        return "TODOS"
+
+
+TODOS: Any = _Todos()
+
+
+class CuboDrivers:
+    """HC, PA e HC folha do cenário por (CC, função, seção) e mês."""
+
+    def __init__(
+        self,
+        cenario_id: UUID,
+        versao: Tuple[Any, ...],
+        celulas: List[Tuple[Optional[UUID], UUID, Optional[UUID]]],
+        hc: np.ndarray,
+        pa: np.ndarray,
+        fatores_folha: Dict[int, np.ndarray]
+    ):
+        """
+        Args:
+            celulas: (centro_custo_id, funcao_id, cenario_secao_id) de cada linha
+            hc, pa: Matrizes (célula x 12)
+            fatores_folha: Por ano, multiplicador (célula x 12) que leva HC a HC folha
+        """
+        self.cenario_id = cenario_id
+        self.versao = versao
+        self.celulas = celulas
+        self._medidas = {MEDIDA_HC: hc, MEDIDA_PA: pa}
+        self._fatores_folha = fatores_folha
+        self._zeros = np.zeros(12)
+        self._zeros.setflags(write=False)
+
+        # Códigos inteiros de cada dimensão (filtros viram comparações de inteiros)
+        self._indices: Dict[str, Dict[Optional[UUID], int]] = {}
+        self._codigos: Dict[str, np.ndarray] = {}
+        for posicao, dimensao in enumerate(DIMENSOES):
+            indice: Dict[Optional[UUID], int] = {}
+            codigos = [indice.setdefault(celula[posicao], len(indice)) for celula in celulas]
+            self._indices[dimensao] = indice
+            self._codigos[dimensao] = np.array(codigos, dtype=np.intp)
+
+        self._somas: Dict[tuple, np.ndarray] = {}
+
+    def hc(self, centro_custo_id: Any = TODOS, funcao_id: Any = TODOS, cenario_secao_id: Any = TODOS) -> np.ndarray:
+        """HC por mês (vetor de 12, somente leitura) do recorte informado."""
+        return self._somar(MEDIDA_HC, None, (centro_custo_id, funcao_id, cenario_secao_id))
+
+    def pa(self, centro_custo_id: Any = TODOS, funcao_id: Any = TODOS, cenario_secao_id: Any = TODOS) -> np.ndarray:
+        """PA (HC / fator_pa) por mês do recorte informado."""
+        return self._somar(MEDIDA_PA, None, (centro_custo_id, funcao_id, cenario_secao_id))
+
+    def hc_folha(
+        self,
+        ano: int,
+        centro_custo_id: Any = TODOS,
+        funcao_id: Any = TODOS,
+        cenario_secao_id: Any = TODOS
+    ) -> np.ndarray:
+        """HC folha por mês do ano, com as premissas de ineficiência de cada função/seção."""
+        return self._somar(MEDIDA_HC, ano, (centro_custo_id, funcao_id, cenario_secao_id))
+
+    def por_dimensao(self, dimensao: str, medida: str = MEDIDA_HC, ano: Optional[int] = None) -> Dict[Optional[UUID], np.ndarray]:
+        """
+        Medida agrupada por uma dimensão: {valor da dimensão: vetor de 12 meses}.
+
+        Com ano informado e medida HC, devolve HC folha.
+        """
+        matriz = self._matriz(medida, ano)
+        indice = self._indices[dimensao]
+        somas = np.zeros((len(indice), 12))
+        np.add.at(somas, self._codigos[dimensao], matriz)
+        return {valor: somas[codigo] for valor, codigo in indice.items()}
+
+    def _matriz(self, medida: str, ano: Optional[int]) -> np.ndarray:
+        matriz = self._medidas[medida]
+        if ano is not None and ano in self._fatores_folha:
+            matriz = matriz * self._fatores_folha[ano]
+        return matriz
+
+    def _somar(self, medida: str, ano: Optional[int], filtros: Tuple[Any, ...]) -> np.ndarray:
+        chave = (medida, ano, filtros)
+        soma = self._somas.get(chave)
+        if soma is not None:
+            return soma
+
+        mascara = np.ones(len(self.celulas), dtype=bool)
+        for dimensao, valor in zip(DIMENSOES, filtros):
+            if valor is TODOS:
+                continue
+            codigo = self._indices[dimensao].get(valor)
+            if codigo is None:
+                return self._zeros
+            mascara &= self._codigos[dimensao] == codigo
+
+        soma = self._matriz(medida, ano)[mascara].sum(axis=0) if mascara.any() else np.zeros(12)
+        soma.setflags(write=False)
+        self._somas[chave] = soma
+        return soma
+
+
+_cache_cubos: "OrderedDict[UUID, CuboDrivers]" = OrderedDict()
+
+
+def invalidar_cubo_drivers(cenario_id: Optional[UUID] = None) -> None:
+    """Descarta o cubo em cache do cenário (ou de todos)."""
+    if cenario_id is None:
+        _cache_cubos.clear()
+    else:
+        _cache_cubos.pop(cenario_id, None)
+
+
+async def _versao_drivers(db: AsyncSession, cenario_id: UUID) -> Tuple[Any, ...]:
+    """Assinatura barata do quadro e das premissas do cenário (detecta alterações de outros processos)."""
+    colunas = []
+    for modelo in (QuadroPessoal, PremissaFuncaoMes):
+        for agregado in (func.count(modelo.id), func.max(modelo.updated_at), func.max(modelo.created_at)):
+            colunas.append(select(agregado).where(modelo.cenario_id == cenario_id).scalar_subquery())
+    result = await db.execute(select(*colunas))
+    return tuple(result.one())
+
+
+async def obter_cubo_drivers(db: AsyncSession, cenario_id: UUID) -> CuboDrivers:
+    """Cubo de drivers do cenário, reconstruído apenas se o quadro ou as premissas mudaram."""
+    versao = await _versao_drivers(db, cenario_id)
+    cubo = _cache_cubos.get(cenario_id)
+    if cubo is not None and cubo.versao == versao:
+        _cache_cubos.move_to_end(cenario_id)
+        return cubo
+
+    cubo = await _montar_cubo(db, cenario_id, versao)
+    _cache_cubos[cenario_id] = cubo
+    while len(_cache_cubos) > MAX_CENARIOS_CACHE:
+        _cache_cubos.popitem(last=False)
+    return cubo
+
+
+async def _montar_cubo(db: AsyncSession, cenario_id: UUID, versao: Tuple[Any, ...]) -> CuboDrivers:
+    fator_pa = func.coalesce(QuadroPessoal.fator_pa, 1)
+    fator_pa = case((fator_pa <= 0, 1), else_=fator_pa)
+    result = await db.execute(
+        select(
+            QuadroPessoal.centro_custo_id,
+            QuadroPessoal.funcao_id,
+            QuadroPessoal.cenario_secao_id,
+            *[func.coalesce(func.sum(getattr(QuadroPessoal, f"qtd_{mes}")), 0) for mes in MESES],
+            *[func.coalesce(func.sum(getattr(QuadroPessoal, f"qtd_{mes}") / fator_pa), 0) for mes in MESES]
+        )
+        .where(QuadroPessoal.cenario_id == cenario_id, QuadroPessoal.ativo == True)
+        .group_by(QuadroPessoal.centro_custo_id, QuadroPessoal.funcao_id, QuadroPessoal.cenario_secao_id)
+    )
+    linhas = result.all()
+    celulas = [(row[0], row[1], row[2]) for row in linhas]
+    valores = np.array([row[3:] for row in linhas], dtype=float).reshape(len(linhas), 24)
+
+    return CuboDrivers(
+        cenario_id,
+        versao,
+        celulas,
+        hc=valores[:, :12],
+        pa=valores[:, 12:],
+        fatores_folha=await _fatores_folha(db, cenario_id, celulas)
+    )
+
+
+async def _fatores_folha(
+    db: AsyncSession,
+    cenario_id: UUID,
+    celulas: List[Tuple[Optional[UUID], UUID, Optional[UUID]]]
+) -> Dict[int, np.ndarray]:
+    """
+    Por ano das premissas, o fator (célula x 12) que leva HC a HC folha:
+    (1 + TO/2) / (1 - ABS - Férias), com mínimo de 0.5 no divisor, e 1 onde
+    a função não tem premissa na seção/mês.
+    """
+    if not celulas:
+        return {}
+
+    result = await db.execute(
+        select(
+            PremissaFuncaoMes.cenario_secao_id,
+            PremissaFuncaoMes.funcao_id,
+            PremissaFuncaoMes.ano,
+            PremissaFuncaoMes.mes,
+            PremissaFuncaoMes.absenteismo,
+            PremissaFuncaoMes.turnover,
+            PremissaFuncaoMes.ferias_indice
+        ).where(PremissaFuncaoMes.cenario_id == cenario_id)
+    )
+
+    linhas_por_chave: Dict[Tuple[Optional[UUID], UUID], List[int]] = {}
+    for i, (_, funcao_id, secao_id) in enumerate(celulas):
+        linhas_por_chave.setdefault((secao_id, funcao_id), []).append(i)
+
+    fatores: Dict[int, np.ndarray] = {}
+    for secao_id, funcao_id, ano, mes, absenteismo, turnover, ferias in result.all():
+        linhas = linhas_por_chave.get((secao_id, funcao_id))
+        if not linhas or not 1 <= mes <= 12:
+            continue
+        divisor = 1 - float(absenteismo or 0) / 100 - float(ferias or 8.33) / 100
+        if divisor <= 0:
+            divisor = 0.5
+        matriz = fatores.get(ano)
+        if matriz is None:
+            matriz = fatores[ano] = np.ones((len(celulas), 12))
+        matriz[linhas, mes - 1] = (1 + float(turnover or 0) / 100 / 2) / divisor
+
+    return fatores
@@ -0,0 +1,449 @@
+"""
+Resumo pré-agregado do DRE (dre_resumo).
+
+O DRE é a tela mais consultada e muda pouco: em vez de agrupar
+custos_calculados e custos_tecnologia e calcular custos diretos e receitas a
+cada requisição, os valores ficam em dre_resumo, já somados por (cenário,
+seção, CC, linha/conta contábil, categoria, origem, ano, mês). Os dois
+endpoints do DRE (consolidado e por CC) leem essa tabela com uma consulta no
+índice (cenario_id, ano, ...).
+
+Cada fonte do resumo é montada separadamente:
+
+- PESSOAL: custos_calculados por tipo de custo (INDIRETO = rateio, com o grupo)
+- TECNOLOGIA: custos_tecnologia por produto (TEC_<codigo>, sem CC)
+- CUSTO_DIRETO: custos diretos ativos com HC/PA do cubo de drivers (DIR_<codigo>)
+- RECEITA: receitas_calculadas por tipo de receita (REC_<codigo>, sem seção)
+
+Os cálculos (custos, recálculo incremental, tecnologia, receitas) chamam
+atualizar_dre_resumo ao final, só para a sua fonte e os anos que gravaram.
+Entradas que não passam por um cálculo (custos diretos e o quadro usado por
+eles, cadastros de tipos de custo, produtos, tipos de receita e grupos de
+rateio) entram em uma assinatura barata por fonte (contagem e maiores
+created_at/updated_at, como no cubo de drivers), gravada em
+dre_resumo_estado; fonte sem estado ou com assinatura diferente é remontada
+por inteiro na próxima etapa de receitas de um cálculo (garantir_dre_resumo).
+A leitura do DRE não grava: só informa, com dre_resumo_atualizado, se há
+fonte pendente.
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+from datetime import datetime
+import hashlib
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, insert, func, case, literal, null, cast
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import selectinload
+
+from app.db.models.orcamento import (
+    Cenario, CustoCalculado, CustoTecnologia, CustoDireto, ReceitaCalculada,
+    TipoCusto, ProdutoTecnologia, TipoReceita, RateioGrupo, QuadroPessoal,
+    DREResumo, DREResumoEstado
+)
+from app.services.cubo_drivers import CuboDrivers, obter_cubo_drivers
+from app.services.gravacao_lote import gravar_registros
+
+
+FONTE_PESSOAL = "PESSOAL"
+FONTE_TECNOLOGIA = "TECNOLOGIA"
+FONTE_CUSTO_DIRETO = "CUSTO_DIRETO"
+FONTE_RECEITA = "RECEITA"
+
+# Ordem das linhas no DRE (a resposta consolidada põe as receitas no topo)
+FONTES = (FONTE_PESSOAL, FONTE_TECNOLOGIA, FONTE_CUSTO_DIRETO, FONTE_RECEITA)
+
+ORIGEM_DIRETO = "DIRETO"
+ORIGEM_INDIRETO = "INDIRETO"
+
+COLUNAS_RESUMO = (
+    "id", "cenario_id", "cenario_secao_id", "centro_custo_id", "fonte",
+    "linha_codigo", "linha_nome", "categoria",
+    "conta_contabil_codigo", "conta_contabil_descricao",
+    "origem", "origem_pool", "ano", "mes", "valor", "atualizado_em",
+)
+
+_resumo = DREResumo.__table__
+
+
+def ordem_fonte():
+    """Expressão para ordenar linhas do resumo na ordem de FONTES."""
+    return case(*[(DREResumo.fonte == fonte, i) for i, fonte in enumerate(FONTES)], else_=len(FONTES))
+
+
+# ============================================
+# ASSINATURA DAS ENTRADAS
+# ============================================
+
+def _assinatura(modelo, filtro=None) -> List[Any]:
+    """Contagem e maiores created_at/updated_at do modelo, como subconsultas escalares."""
+    agregados = [func.count(modelo.id), func.max(modelo.created_at)]
+    if hasattr(modelo, "updated_at"):
+        agregados.append(func.max(modelo.updated_at))
+    colunas = []
+    for agregado in agregados:
+        consulta = select(agregado)
+        if filtro is not None:
+            consulta = consulta.where(filtro)
+        colunas.append(consulta.scalar_subquery())
+    return colunas
+
+
+async def _versoes(db: AsyncSession, cenario_id: UUID) -> Dict[str, str]:
+    """Assinatura, por fonte, das entradas do resumo que não passam por um cálculo."""
+    janela = [
+        select(campo).where(Cenario.id == cenario_id).scalar_subquery()
+        for campo in (Cenario.ano_inicio, Cenario.mes_inicio, Cenario.ano_fim, Cenario.mes_fim)
+    ]
+    partes = {
+        FONTE_PESSOAL: _assinatura(TipoCusto) + _assinatura(RateioGrupo, RateioGrupo.cenario_id == cenario_id),
+        FONTE_TECNOLOGIA: _assinatura(ProdutoTecnologia),
+        FONTE_CUSTO_DIRETO: (
+            _assinatura(CustoDireto, CustoDireto.cenario_id == cenario_id)
+            + _assinatura(ProdutoTecnologia)
+            + _assinatura(QuadroPessoal, QuadroPessoal.cenario_id == cenario_id)
+            + janela
+        ),
+        FONTE_RECEITA: _assinatura(TipoReceita),
+    }
+    result = await db.execute(select(*[coluna for fonte in FONTES for coluna in partes[fonte]]))
+    valores = list(result.one())
+
+    versoes = {}
+    for fonte in FONTES:
+        n = len(partes[fonte])
+        versoes[fonte] = hashlib.sha256(repr(tuple(valores[:n])).encode()).hexdigest()
+        valores = valores[n:]
+    return versoes
+
+
+async def _estados(db: AsyncSession, cenario_id: UUID) -> Dict[str, Optional[str]]:
+    result = await db.execute(
+        select(DREResumoEstado.fonte, DREResumoEstado.versao)
+        .where(DREResumoEstado.cenario_id == cenario_id)
+    )
+    return {fonte: versao for fonte, versao in result.all()}
+
+
+def _desatualizadas(versoes: Dict[str, str], estados: Dict[str, Optional[str]]) -> List[str]:
+    return [fonte for fonte in FONTES if fonte not in estados or estados[fonte] != versoes[fonte]]
+
+
+# ============================================
+# MONTAGEM DAS FONTES
+# ============================================
+
+def _nulo(coluna: str):
+    return cast(null(), _resumo.c[coluna].type)
+
+
+def _conta(codigo, descricao):
+    return func.coalesce(codigo, ""), func.coalesce(descricao, "")
+
+
+# Agrupa pelas colunas e monta textos/constantes só no SELECT: literais viram
+# parâmetros distintos no SELECT e no GROUP BY e o PostgreSQL não os casaria
+
+def _consulta_pessoal(cenario_id: UUID, anos: Optional[Sequence[int]], agora: datetime):
+    """custos_calculados por seção, CC, tipo de custo, grupo de rateio (INDIRETO) e mês."""
+    c = CustoCalculado
+    t = TipoCusto
+    origem = case((c.rateio_grupo_id.isnot(None), ORIGEM_INDIRETO), else_=ORIGEM_DIRETO)
+    consulta = (
+        select(
+            func.gen_random_uuid(), c.cenario_id, c.cenario_secao_id, c.centro_custo_id, literal(FONTE_PESSOAL),
+            t.codigo, t.nome, t.categoria, *_conta(t.conta_contabil_codigo, t.conta_contabil_descricao),
+            origem, RateioGrupo.nome, c.ano, c.mes,
+            func.coalesce(func.sum(c.valor_calculado), 0), literal(agora)
+        )
+        .join(t, c.tipo_custo_id == t.id)
+        .outerjoin(RateioGrupo, c.rateio_grupo_id == RateioGrupo.id)
+        .where(c.cenario_id == cenario_id)
+        .group_by(
+            c.cenario_id, c.cenario_secao_id, c.centro_custo_id, t.id, c.rateio_grupo_id, RateioGrupo.nome,
+            c.ano, c.mes
+        )
+    )
+    if anos is not None:
+        consulta = consulta.where(c.ano.in_(anos))
+    return consulta
+
+
+def _consulta_tecnologia(cenario_id: UUID, anos: Optional[Sequence[int]], agora: datetime):
+    """custos_tecnologia por seção, produto e mês (custo de tecnologia não tem CC)."""
+    c = CustoTecnologia
+    p = ProdutoTecnologia
+    consulta = (
+        select(
+            func.gen_random_uuid(), c.cenario_id, c.cenario_secao_id, _nulo("centro_custo_id"), literal(FONTE_TECNOLOGIA),
+            literal("TEC_") + p.codigo, p.nome + literal(" (Tecnologia)"), literal("TECNOLOGIA_") + p.categoria,
+            *_conta(p.conta_contabil_codigo, p.conta_contabil_descricao),
+            literal(ORIGEM_DIRETO), _nulo("origem_pool"), c.ano, c.mes,
+            func.coalesce(func.sum(c.valor_calculado), 0), literal(agora)
+        )
+        .join(p, c.produto_id == p.id)
+        .where(c.cenario_id == cenario_id)
+        .group_by(c.cenario_id, c.cenario_secao_id, p.id, c.ano, c.mes)
+    )
+    if anos is not None:
+        consulta = consulta.where(c.ano.in_(anos))
+    return consulta
+
+
+def _consulta_receitas(cenario_id: UUID, anos: Optional[Sequence[int]], agora: datetime):
+    """receitas_calculadas por CC, tipo de receita e mês (receita não tem seção)."""
+    r = ReceitaCalculada
+    t = TipoReceita
+    consulta = (
+        select(
+            func.gen_random_uuid(), r.cenario_id, _nulo("cenario_secao_id"), r.centro_custo_id, literal(FONTE_RECEITA),
+            literal("REC_") + t.codigo, t.nome, literal("RECEITA"),
+            *_conta(t.conta_contabil_codigo, t.conta_contabil_descricao),
+            literal(ORIGEM_DIRETO), _nulo("origem_pool"), r.ano, r.mes,
+            func.coalesce(func.sum(r.valor_calculado), 0), literal(agora)
+        )
+        .join(t, r.tipo_receita_id == t.id)
+        .where(r.cenario_id == cenario_id)
+        .group_by(r.cenario_id, r.centro_custo_id, t.id, r.ano, r.mes)
+    )
+    if anos is not None:
+        consulta = consulta.where(r.ano.in_(anos))
+    return consulta
+
+
+_CONSULTAS = {
+    FONTE_PESSOAL: _consulta_pessoal,
+    FONTE_TECNOLOGIA: _consulta_tecnologia,
+    FONTE_RECEITA: _consulta_receitas,
+}
+
+
+def _driver(medida, centro_custo_id: Optional[UUID], funcao_id: Optional[UUID]):
+    """HC ou PA (12 meses) do recorte: por função (todos os CCs), senão por CC, senão do cenário."""
+    if funcao_id:
+        return medida(funcao_id=funcao_id)
+    if centro_custo_id:
+        return medida(centro_custo_id=centro_custo_id)
+    return medida()
+
+
+def valores_custo_direto(custo: CustoDireto, cubo: CuboDrivers) -> List[float]:
+    """
+    Valor de cada mês (jan-dez) do custo direto, pelo tipo de valor e, se houver, rateio.
+    Mesmo critério no DRE, na busca de meta de receita e no rateio dos custos diretos do POOL.
+    """
+    valor_fixo = float(custo.valor_fixo or 0)
+    valor_unitario = float(custo.valor_unitario_variavel or 0)
+
+    if custo.tipo_valor == "FIXO":
+        valores = [valor_fixo] * 12
+    elif custo.tipo_valor == "VARIAVEL":
+        if custo.unidade_medida == "HC":
+            hc = _driver(
+                cubo.hc,
+                custo.centro_custo_id if custo.tipo_medida in ["HC_TOTAL", None] else None,
+                custo.funcao_base_id if custo.tipo_medida == "HC_FUNCAO" else None
+            )
+            valores = [valor_unitario * float(v) for v in hc]
+        elif custo.unidade_medida == "PA":
+            # PA = Posição de Atendimento (HC / fator_pa)
+            pa = _driver(
+                cubo.pa,
+                custo.centro_custo_id,
+                custo.funcao_base_id if custo.tipo_medida == "PA_FUNCAO" else None
+            )
+            valores = [valor_unitario * float(v) for v in pa]
+        else:
+            # Unidade genérica, usar valor unitário direto
+            valores = [valor_unitario] * 12
+    elif custo.tipo_valor == "FIXO_VARIAVEL":
+        hc = _driver(cubo.hc, custo.centro_custo_id, custo.funcao_base_id)
+        valores = [valor_fixo + valor_unitario * float(v) for v in hc]
+    else:
+        valores = [0.0] * 12
+
+    if custo.tipo_calculo == "rateio" and custo.rateio_percentual:
+        percentual = float(custo.rateio_percentual) / 100
+        valores = [v * percentual for v in valores]
+    return valores
+
+
+async def _registros_custos_diretos(
+    db: AsyncSession,
+    cenario: Any,
+    anos: Optional[Sequence[int]],
+    agora: datetime
+) -> List[Dict[str, Any]]:
+    """Custos diretos ativos por seção, CC, item e mês, nos meses da janela do cenário."""
+    result = await db.execute(
+        select(CustoDireto)
+        .options(selectinload(CustoDireto.item_custo))
+        .where(CustoDireto.cenario_id == cenario.id, CustoDireto.ativo == True)
+    )
+    custos = [c for c in result.scalars().all() if c.item_custo]
+    if not custos:
+        return []
+
+    cubo = await obter_cubo_drivers(db, cenario.id)
+    periodos = [
+        (ano, mes)
+        for ano in range(cenario.ano_inicio, cenario.ano_fim + 1)
+        if anos is None or ano in anos
+        for mes in range(1, 13)
+        if not (ano == cenario.ano_inicio and mes < cenario.mes_inicio)
+        and not (ano == cenario.ano_fim and mes > cenario.mes_fim)
+    ]
+
+    linhas: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    for custo in custos:
+        item = custo.item_custo
+        valores = valores_custo_direto(custo, cubo)
+        for ano, mes in periodos:
+            chave = (custo.cenario_secao_id, custo.centro_custo_id, item.id, ano, mes)
+            linha = linhas.get(chave)
+            if linha is None:
+                linha = linhas[chave] = {
+                    "cenario_id": cenario.id,
+                    "cenario_secao_id": custo.cenario_secao_id,
+                    "centro_custo_id": custo.centro_custo_id,
+                    "fonte": FONTE_CUSTO_DIRETO,
+                    "linha_codigo": f"DIR_{item.codigo}",
+                    "linha_nome": f"{item.nome} (Custo Direto)",
+                    "categoria": f"CUSTO_DIRETO_{item.categoria}",
+                    "conta_contabil_codigo": item.conta_contabil_codigo or "",
+                    "conta_contabil_descricao": item.conta_contabil_descricao or "",
+                    "origem": ORIGEM_DIRETO,
+                    "origem_pool": None,
+                    "ano": ano,
+                    "mes": mes,
+                    "valor": 0.0,
+                    "atualizado_em": agora,
+                }
+            linha["valor"] += valores[mes - 1]
+
+    for linha in linhas.values():
+        linha["valor"] = round(linha["valor"], 2)
+    return list(linhas.values())
+
+
+async def _montar_fonte(
+    db: AsyncSession,
+    cenario: Any,
+    fonte: str,
+    anos: Optional[Sequence[int]],
+    agora: datetime
+) -> int:
+    """Regrava as linhas da fonte (nos anos informados ou em todos). Retorna as linhas gravadas."""
+    stmt = delete(DREResumo).where(DREResumo.cenario_id == cenario.id, DREResumo.fonte == fonte)
+    if anos is not None:
+        stmt = stmt.where(DREResumo.ano.in_(anos))
+    await db.execute(stmt)
+
+    if fonte == FONTE_CUSTO_DIRETO:
+        registros = await _registros_custos_diretos(db, cenario, anos, agora)
+        return await gravar_registros(db, _resumo, registros)
+
+    consulta = _CONSULTAS[fonte](cenario.id, anos, agora)
+    result = await db.execute(insert(_resumo).from_select(list(COLUNAS_RESUMO), consulta))
+    return result.rowcount or 0
+
+
+# ============================================
+# ATUALIZAÇÃO E LEITURA
+# ============================================
+
+async def atualizar_dre_resumo(
+    db: AsyncSession,
+    cenario_id: UUID,
+    fontes: Sequence[str] = (),
+    anos: Optional[Sequence[int]] = None
+) -> Dict[str, Any]:
+    """
+    Atualiza o resumo do DRE do cenário: as `fontes` informadas só nos `anos`
+    (None = todos) e, por inteiro, as fontes sem estado ou com assinatura
+    desatualizada. Chamado ao fim de cada cálculo; não faz commit.
+
+    Returns:
+        {"fontes": {fonte: anos atualizados (None = todos)}, "linhas": linhas gravadas}
+    """
+    # Uma atualização por cenário de cada vez (o estado é relido depois do lock).
+    # Só as colunas da janela: o modelo Cenario carrega relacionamentos selectin
+    cenario = (await db.execute(
+        select(Cenario.id, Cenario.ano_inicio, Cenario.mes_inicio, Cenario.ano_fim, Cenario.mes_fim)
+        .where(Cenario.id == cenario_id)
+        .with_for_update()
+    )).one_or_none()
+    if cenario is None:
+        return {"fontes": {}, "linhas": 0}
+
+    versoes = await _versoes(db, cenario_id)
+    estados = await _estados(db, cenario_id)
+
+    plano: Dict[str, Optional[List[int]]] = {fonte: None for fonte in _desatualizadas(versoes, estados)}
+    for fonte in fontes:
+        if fonte not in plano:
+            plano[fonte] = sorted(set(anos)) if anos is not None else None
+
+    agora = datetime.utcnow()
+    linhas = 0
+    for fonte in FONTES:
+        if fonte not in plano or plano[fonte] == []:
+            continue
+        linhas += await _montar_fonte(db, cenario, fonte, plano[fonte], agora)
+        await db.execute(
+            pg_insert(DREResumoEstado)
+            .values(cenario_id=cenario_id, fonte=fonte, versao=versoes[fonte], atualizado_em=agora)
+            .on_conflict_do_update(
+                constraint="uq_dre_resumo_estado_fonte",
+                set_={"versao": versoes[fonte], "atualizado_em": agora}
+            )
+        )
+
+    return {"fontes": plano, "linhas": linhas}
+
+
+async def dre_resumo_atualizado(db: AsyncSession, cenario_id: UUID) -> bool:
+    """Só leitura: True se nenhuma fonte do resumo está sem estado ou com entradas alteradas."""
+    return not _desatualizadas(await _versoes(db, cenario_id), await _estados(db, cenario_id))
+
+
+async def garantir_dre_resumo(db: AsyncSession, cenario_id: UUID) -> bool:
+    """
+    Ao fim das etapas de cálculo: remonta as fontes sem estado ou com entradas
+    alteradas fora de um cálculo. Faz commit se atualizar algo.
+
+    Os endpoints do DRE só leem; quem grava é o cálculo (custos, job e
+    recálculo incremental, via etapa de receitas).
+
+    Returns:
+        True se o resumo já estava atualizado
+    """
+    if await dre_resumo_atualizado(db, cenario_id):
+        return True
+
+    # Uma remontagem por cenário de cada vez; quem esperou pode encontrar tudo montado
+    await db.execute(select(Cenario.id).where(Cenario.id == cenario_id).with_for_update())
+    if await dre_resumo_atualizado(db, cenario_id):
+        await db.commit()
+        return True
+
+    await atualizar_dre_resumo(db, cenario_id)
+    await db.commit()
+    return False
+
+
+async def descartar_dre_resumo(
+    db: AsyncSession,
+    cenario_ids: Sequence[UUID],
+    fontes: Sequence[str] = FONTES
+) -> None:
+    """Marca as fontes dos cenários como não montadas (remontadas na próxima leitura do DRE)."""
+    if not cenario_ids:
+        return
+    await db.execute(
+        delete(DREResumoEstado).where(
+            DREResumoEstado.cenario_id.in_(cenario_ids),
+            DREResumoEstado.fonte.in_(fontes)
+        )
+    )
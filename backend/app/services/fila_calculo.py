@@ -0,0 +1,362 @@
+"""
+Fila de cálculo de custos.
+
+O cálculo completo (motor + rateio) pode levar minutos em cenários grandes.
+A API apenas enfileira um job em jobs_calculo_custos; o worker local
+(python -m app.worker) reserva os jobs pendentes, executa o cálculo em sessão
+própria e publica o progresso por seção. Não há broker externo: a própria
+tabela é a fila (SELECT ... FOR UPDATE SKIP LOCKED).
+"""
+
+from typing import Dict, Optional, Any
+from uuid import UUID
+from datetime import datetime, timedelta
+import asyncio
+import json
+import os
+import socket
+import time
+import traceback
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.db.models.orcamento import JobCalculoCustos
+from app.services.calculo_custos import calcular_e_salvar_custos, secoes_calculaveis
+from app.services.recalculo_incremental import recalcular_custos_incremental
+from app.services.calculo_receitas import calcular_e_salvar_receitas
+
+
+STATUS_PENDENTE = "PENDENTE"
+STATUS_EXECUTANDO = "EXECUTANDO"
+STATUS_CONCLUIDO = "CONCLUIDO"
+STATUS_ERRO = "ERRO"
+STATUS_CANCELADO = "CANCELADO"
+
+STATUS_FINAIS = (STATUS_CONCLUIDO, STATUS_ERRO, STATUS_CANCELADO)
+
+
+class CalculoCancelado(Exception):
+    """Cancelamento solicitado durante a execução do job."""
+    pass
+
+
+# ============================================
+# API DA FILA
+# ============================================
+
+async def _job_pendente(db: AsyncSession, cenario_id: UUID) -> Optional[JobCalculoCustos]:
+    result = await db.execute(
+        select(JobCalculoCustos)
+        .where(
+            JobCalculoCustos.cenario_id == cenario_id,
+            JobCalculoCustos.status == STATUS_PENDENTE
+        )
+        .with_for_update()
+    )
+    return result.scalar_one_or_none()
+
+
+def _coalescer(
+    job: JobCalculoCustos,
+    cenario_secao_id: Optional[UUID],
+    ano: Optional[int],
+    incremental: bool,
+    forcar: bool
+) -> None:
+    """Une um novo pedido ao job pendente, ampliando o escopo quando divergem."""
+    if job.cenario_secao_id != cenario_secao_id:
+        job.cenario_secao_id = None
+    if job.ano != ano:
+        job.ano = None
+    job.incremental = bool(job.incremental and incremental)
+    job.forcar = bool(job.forcar or forcar)
+    job.pedidos = (job.pedidos or 1) + 1
+
+
+async def enfileirar_calculo(
+    db: AsyncSession,
+    cenario_id: UUID,
+    cenario_secao_id: Optional[UUID] = None,
+    ano: Optional[int] = None,
+    incremental: bool = False,
+    forcar: bool = False
+) -> JobCalculoCustos:
+    """
+    Enfileira o cálculo de custos de um cenário.
+
+    Se já houver job PENDENTE para o cenário, o pedido é coalescido nele
+    (o escopo vira o cenário inteiro quando seção/ano divergem).
+    """
+    for _ in range(2):
+        job = await _job_pendente(db, cenario_id)
+        if job:
+            _coalescer(job, cenario_secao_id, ano, incremental, forcar)
+            await db.commit()
+            return job
+
+        job = JobCalculoCustos(
+            cenario_id=cenario_id,
+            cenario_secao_id=cenario_secao_id,
+            ano=ano,
+            incremental=incremental,
+            forcar=forcar,
+            status=STATUS_PENDENTE,
+        )
+        db.add(job)
+        try:
+            await db.commit()
+            return job
+        except IntegrityError:
+            # Outro pedido criou o job pendente ao mesmo tempo: coalescer nele
+            await db.rollback()
+
+    raise RuntimeError(f"Não foi possível enfileirar o cálculo do cenário {cenario_id}")
+
+
+async def obter_job(db: AsyncSession, job_id: UUID) -> Optional[JobCalculoCustos]:
+    return await db.get(JobCalculoCustos, job_id, populate_existing=True)
+
+
+async def solicitar_cancelamento(db: AsyncSession, job: JobCalculoCustos) -> JobCalculoCustos:
+    """
+    Cancela um job. Pendente: cancelado na hora. Em execução: o worker
+    interrompe no próximo lote, sem gravar nada.
+
+    Raises:
+        ValueError: se o job já terminou
+    """
+    if job.status in STATUS_FINAIS:
+        raise ValueError(f"Job já finalizado ({job.status})")
+
+    if job.status == STATUS_PENDENTE:
+        job.status = STATUS_CANCELADO
+        job.concluido_em = datetime.utcnow()
+    job.cancelamento_solicitado = True
+
+    await db.commit()
+    return job
+
+
+def job_para_dict(job: JobCalculoCustos) -> Dict[str, Any]:
+    """Representação do job para a API."""
+    return {
+        "id": str(job.id),
+        "cenario_id": str(job.cenario_id),
+        "cenario_secao_id": str(job.cenario_secao_id) if job.cenario_secao_id else None,
+        "ano": job.ano,
+        "incremental": job.incremental,
+        "forcar": job.forcar,
+        "status": job.status,
+        "cancelamento_solicitado": job.cancelamento_solicitado,
+        "pedidos": job.pedidos,
+        "progresso": job.progresso,
+        "erro": job.erro,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "iniciado_em": job.iniciado_em.isoformat() if job.iniciado_em else None,
+        "concluido_em": job.concluido_em.isoformat() if job.concluido_em else None,
+    }
+
+
+# ============================================
+# WORKER
+# ============================================
+
+def _identificacao_worker() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def reservar_proximo_job(db: AsyncSession, worker: str) -> Optional[JobCalculoCustos]:
+    """
+    Reserva o job pendente mais antigo, pulando cenários que já têm job em execução.
+    Seguro com vários workers (FOR UPDATE SKIP LOCKED).
+    """
+    em_execucao = (
+        select(JobCalculoCustos.cenario_id)
+        .where(JobCalculoCustos.status == STATUS_EXECUTANDO)
+    )
+    result = await db.execute(
+        select(JobCalculoCustos)
+        .where(
+            JobCalculoCustos.status == STATUS_PENDENTE,
+            JobCalculoCustos.cenario_id.notin_(em_execucao)
+        )
+        .order_by(JobCalculoCustos.created_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    job = result.scalar_one_or_none()
+    if not job:
+        await db.rollback()
+        return None
+
+    agora = datetime.utcnow()
+    job.status = STATUS_EXECUTANDO
+    job.worker = worker
+    job.iniciado_em = agora
+    job.heartbeat_em = agora
+    await db.commit()
+    return job
+
+
+async def recuperar_jobs_orfaos(db: AsyncSession) -> int:
+    """Marca como ERRO os jobs em execução cujo worker parou de dar sinal."""
+    limite = datetime.utcnow() - timedelta(minutes=settings.CALCULO_JOB_TIMEOUT_MINUTOS)
+    result = await db.execute(
+        update(JobCalculoCustos)
+        .where(
+            JobCalculoCustos.status == STATUS_EXECUTANDO,
+            JobCalculoCustos.heartbeat_em < limite
+        )
+        .values(
+            status=STATUS_ERRO,
+            erro="Worker interrompido durante a execução",
+            concluido_em=datetime.utcnow()
+        )
+    )
+    await db.commit()
+    return result.rowcount or 0
+
+
+class _AcompanhamentoJob:
+    """Publica o progresso do job e verifica pedidos de cancelamento, em sessão própria."""
+
+    def __init__(self, db: AsyncSession, job: JobCalculoCustos, secoes_total: Optional[int]):
+        self.db = db
+        self.job = job
+        self.secoes: Dict[str, int] = {}
+        self.secao_atual: Optional[str] = None
+        self.etapa_atual = "custos"
+        self.secoes_total = secoes_total
+        self.registros = 0
+
+    def _progresso(self, concluidas: int) -> Dict[str, Any]:
+        return {
+            "etapa": self.etapa_atual,
+            "secoes_total": self.secoes_total,
+            "secoes_concluidas": concluidas,
+            "secao_atual": self.secao_atual,
+            "registros": self.registros,
+            "secoes": dict(self.secoes),
+        }
+
+    async def __call__(self, secao_id: UUID, quantidade: int) -> None:
+        chave = str(secao_id)
+        self.secoes[chave] = self.secoes.get(chave, 0) + quantidade
+        self.secao_atual = chave
+        self.registros += quantidade
+        # A seção atual só conta como concluída quando a próxima começa
+        await self._sinal(len(self.secoes) - 1)
+
+    async def etapa(self, nome: str) -> None:
+        """Início de uma etapa depois dos lotes (rateio, dre, receitas)."""
+        self.etapa_atual = nome
+        self.secao_atual = None
+        await self._sinal(len(self.secoes))
+
+    async def _sinal(self, concluidas: int) -> None:
+        """Verifica cancelamento, publica o progresso e renova o heartbeat."""
+        await self.db.refresh(self.job, attribute_names=["cancelamento_solicitado"])
+        if self.job.cancelamento_solicitado:
+            raise CalculoCancelado()
+
+        self.job.progresso = self._progresso(concluidas)
+        self.job.heartbeat_em = datetime.utcnow()
+        await self.db.commit()
+
+    def progresso_final(self) -> Dict[str, Any]:
+        self.etapa_atual = None
+        self.secao_atual = None
+        return self._progresso(len(self.secoes))
+
+
+def _para_json(valor: Any) -> Any:
+    """Converte o resumo do cálculo (Decimal, UUID...) para algo serializável no JSON."""
+    return json.loads(json.dumps(valor, default=str))
+
+
+async def executar_job(job: JobCalculoCustos) -> None:
+    """
+    Executa um job reservado. O cálculo roda em uma sessão e o acompanhamento
+    (progresso, heartbeat, cancelamento) em outra, para que o progresso fique
+    visível sem commitar custos parciais.
+    """
+    async with AsyncSessionLocal() as db_status, AsyncSessionLocal() as db_calculo:
+        job = await db_status.get(JobCalculoCustos, job.id)
+
+        secoes_total = None
+        if not job.incremental:
+            secoes_total = len(await secoes_calculaveis(db_calculo, job.cenario_id, job.cenario_secao_id))
+        acompanhamento = _AcompanhamentoJob(db_status, job, secoes_total)
+
+        try:
+            if job.incremental:
+                resultado = await recalcular_custos_incremental(
+                    db_calculo, job.cenario_id,
+                    ao_gravar_lote=acompanhamento,
+                    ao_iniciar_etapa=acompanhamento.etapa
+                )
+            else:
+                resultado = await calcular_e_salvar_custos(
+                    db_calculo,
+                    job.cenario_id,
+                    cenario_secao_id=job.cenario_secao_id,
+                    ano=job.ano,
+                    ao_gravar_lote=acompanhamento,
+                    forcar=job.forcar,
+                    ao_iniciar_etapa=acompanhamento.etapa
+                )
+
+            # Etapa de receitas: regrava receitas_calculadas se as entradas mudaram
+            await acompanhamento.etapa("receitas")
+            resultado["receitas"] = await calcular_e_salvar_receitas(
+                db_calculo, job.cenario_id, job.ano, job.forcar
+            )
+
+            job.status = STATUS_CONCLUIDO
+            job.resultado = _para_json(resultado)
+            job.progresso = acompanhamento.progresso_final()
+        except CalculoCancelado:
+            await db_calculo.rollback()
+            job.status = STATUS_CANCELADO
+        except Exception as e:
+            await db_calculo.rollback()
+            traceback.print_exc()
+            job.status = STATUS_ERRO
+            job.erro = str(e)
+
+        job.concluido_em = datetime.utcnow()
+        await db_status.commit()
+
+
+async def executar_worker(intervalo: Optional[float] = None) -> None:
+    """
+    Laço do worker: reserva e executa jobs até ser interrompido. Jobs órfãos
+    (de outros workers que pararam) são recuperados na partida e depois a cada
+    CALCULO_RECUPERACAO_ORFAOS_SEGUNDOS.
+    """
+    intervalo = intervalo or settings.CALCULO_WORKER_INTERVALO
+    worker = _identificacao_worker()
+    print(f"Worker de cálculo de custos iniciado ({worker})")
+
+    proxima_recuperacao = time.monotonic()
+    while True:
+        if time.monotonic() >= proxima_recuperacao:
+            async with AsyncSessionLocal() as db:
+                orfaos = await recuperar_jobs_orfaos(db)
+            if orfaos:
+                print(f"{orfaos} job(s) órfão(s) marcados como ERRO")
+            proxima_recuperacao = time.monotonic() + settings.CALCULO_RECUPERACAO_ORFAOS_SEGUNDOS
+
+        async with AsyncSessionLocal() as db:
+            job = await reservar_proximo_job(db, worker)
+
+        if not job:
+            await asyncio.sleep(intervalo)
+            continue
+
+        print(f"Executando job {job.id} (cenário {job.cenario_id})")
+        await executar_job(job)
@@ -0,0 +1,288 @@
+"""
+Gravação em lote dos resultados de cálculo.
+
+Os motores geram centenas de milhares de linhas (custos_calculados,
+rateios, custos_tecnologia). Em vez de INSERT ... VALUES em lotes (ou
+db.add() por linha), grava com COPY binário do asyncpg
+(copy_records_to_table) na mesma conexão/transação da sessão, de modo que
+rollback e commit continuam valendo. Se o driver não for asyncpg (ou
+GRAVACAO_COPY=False), cai para executemany em lotes.
+
+sincronizar_registros compara o resultado novo com o gravado e escreve só
+a diferença (INSERT dos novos, INSERT ... ON CONFLICT DO UPDATE dos
+alterados, DELETE dos que sumiram), sem esvaziar a tabela durante o cálculo.
+"""
+
+from typing import List, Dict, Any, Callable, Optional, Tuple, Sequence, Hashable
+from dataclasses import dataclass
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from datetime import datetime
+import json
+
+from sqlalchemy import Table, Numeric, JSON, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+
+
+LOTE_EXECUTEMANY = 1000
+
+
+def _conversor(coluna) -> Optional[Callable[[Any], Any]]:
+    """Conversão de valor Python para o que o COPY binário do asyncpg espera."""
+    if isinstance(coluna.type, JSON):
+        return lambda v: None if v is None else json.dumps(v, default=str)
+    if isinstance(coluna.type, Numeric):
+        # O codec binário de numeric exige Decimal
+        return lambda v: v if v is None or isinstance(v, Decimal) else Decimal(str(v))
+    return None
+
+
+def _valor_padrao(coluna, agora: datetime) -> Optional[Callable[[], Any]]:
+    """Gerador do default Python da coluna (id, created_at...), ou None se não houver."""
+    default = coluna.default
+    if default is None:
+        return None
+    if default.is_scalar:
+        valor = default.arg
+        return lambda: valor
+    if default.is_callable:
+        # Timestamps: um único valor por lote, como faria um INSERT multi-linha
+        if isinstance(default.arg(None), datetime):
+            return lambda: agora
+        return lambda: default.arg(None)
+    return None
+
+
+def _preparar(
+    tabela: Table,
+    registros: List[Dict[str, Any]]
+) -> Tuple[List[str], List[Tuple[Any, ...]]]:
+    """Monta colunas e tuplas para o COPY, preenchendo os defaults do modelo."""
+    agora = datetime.utcnow()
+    informadas = set(registros[0].keys())
+
+    colunas = []
+    extratores = []
+    for coluna in tabela.columns:
+        padrao = _valor_padrao(coluna, agora)
+        if coluna.name not in informadas and padrao is None:
+            continue  # Default do servidor / NULL
+        colunas.append(coluna.name)
+        conversor = _conversor(coluna)
+        extratores.append((coluna.name, padrao, conversor))
+
+    linhas = []
+    for r in registros:
+        linha = []
+        for nome, padrao, conversor in extratores:
+            valor = r.get(nome)
+            if valor is None and padrao is not None:
+                valor = padrao()
+            if conversor is not None:
+                valor = conversor(valor)
+            linha.append(valor)
+        linhas.append(tuple(linha))
+
+    return colunas, linhas
+
+
+async def _conexao_asyncpg(db: AsyncSession):
+    """Conexão asyncpg subjacente à sessão (mesma transação), ou None."""
+    conexao = await db.connection()
+    bruta = await conexao.get_raw_connection()
+    driver = getattr(bruta, "driver_connection", None)
+    if driver is None or not hasattr(driver, "copy_records_to_table"):
+        return None
+    # O adaptador asyncpg do SQLAlchemy só abre a transação no primeiro execute
+    # do cursor: COPY logo depois de um commit rodaria em autocommit e não
+    # seria desfeito por um rollback
+    if not getattr(bruta.dbapi_connection, "_started", True):
+        await conexao.exec_driver_sql("SELECT 1")
+    return driver
+
+
+async def gravar_registros(
+    db: AsyncSession,
+    tabela: Table,
+    registros: List[Dict[str, Any]]
+) -> int:
+    """
+    Grava registros (dicts coluna -> valor) na tabela.
+
+    Usa COPY binário quando a sessão está sobre asyncpg; senão, executemany
+    em lotes. Não faz commit.
+
+    Returns:
+        Quantidade de linhas gravadas
+    """
+    if not registros:
+        return 0
+
+    driver = await _conexao_asyncpg(db) if settings.GRAVACAO_COPY else None
+
+    if driver is not None:
+        colunas, linhas = _preparar(tabela, registros)
+        await driver.copy_records_to_table(
+            tabela.name,
+            records=linhas,
+            columns=colunas,
+            schema_name=tabela.schema
+        )
+    else:
+        for i in range(0, len(registros), LOTE_EXECUTEMANY):
+            await db.execute(tabela.insert(), registros[i:i + LOTE_EXECUTEMANY])
+
+    return len(registros)
+
+
+# ============================================
+# SINCRONIZAÇÃO (DIFF + UPSERT)
+# ============================================
+
+@dataclass
+class ResumoSincronizacao:
+    """Contagem de linhas por operação em uma sincronização."""
+    inseridos: int = 0
+    atualizados: int = 0
+    removidos: int = 0
+    inalterados: int = 0
+
+    def __iadd__(self, outro: "ResumoSincronizacao") -> "ResumoSincronizacao":
+        self.inseridos += outro.inseridos
+        self.atualizados += outro.atualizados
+        self.removidos += outro.removidos
+        self.inalterados += outro.inalterados
+        return self
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "inseridos": self.inseridos,
+            "atualizados": self.atualizados,
+            "removidos": self.removidos,
+            "inalterados": self.inalterados,
+        }
+
+
+def _normalizador(coluna) -> Callable[[Any], Any]:
+    """Normaliza um valor como o banco o guardaria (escala do numeric, JSON serializado)."""
+    if isinstance(coluna.type, Numeric):
+        escala = coluna.type.scale
+        quantum = Decimal(1).scaleb(-escala) if escala is not None else None
+
+        def numerico(v):
+            if v is None:
+                return None
+            d = v if isinstance(v, Decimal) else Decimal(str(v))
+            return d.quantize(quantum, rounding=ROUND_HALF_UP) if quantum is not None else d
+        return numerico
+    if isinstance(coluna.type, JSON):
+        return lambda v: None if v is None else json.loads(json.dumps(v, default=str))
+    return lambda v: v
+
+
+def _emparelhar(
+    existentes: List[Dict[str, Any]],
+    novos: List[Dict[str, Any]],
+    chave: Callable[[Dict[str, Any]], Hashable],
+    ordenacao: Callable[[Dict[str, Any]], Any]
+) -> Tuple[List[Tuple[Dict[str, Any], Dict[str, Any]]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Emparelha registros novos e existentes pela chave. Chaves repetidas
+    (ex: duas posições iguais na mesma seção) são pareadas em ordem de valor.
+
+    Returns:
+        (pares (existente, novo), só novos, só existentes)
+    """
+    por_chave_existentes: Dict[Hashable, List[Dict[str, Any]]] = defaultdict(list)
+    for r in existentes:
+        por_chave_existentes[chave(r)].append(r)
+    por_chave_novos: Dict[Hashable, List[Dict[str, Any]]] = defaultdict(list)
+    for r in novos:
+        por_chave_novos[chave(r)].append(r)
+
+    pares = []
+    so_novos = []
+    so_existentes = []
+    for k, lista_novos in por_chave_novos.items():
+        lista_existentes = por_chave_existentes.pop(k, [])
+        if len(lista_novos) > 1 or len(lista_existentes) > 1:
+            lista_novos = sorted(lista_novos, key=ordenacao)
+            lista_existentes = sorted(lista_existentes, key=ordenacao)
+        n = min(len(lista_novos), len(lista_existentes))
+        pares.extend(zip(lista_existentes[:n], lista_novos[:n]))
+        so_novos.extend(lista_novos[n:])
+        so_existentes.extend(lista_existentes[n:])
+    for restantes in por_chave_existentes.values():
+        so_existentes.extend(restantes)
+
+    return pares, so_novos, so_existentes
+
+
+async def remover_por_ids(db: AsyncSession, tabela: Table, ids: Sequence[Any]) -> int:
+    """Remove linhas pelo id, em lotes."""
+    for i in range(0, len(ids), LOTE_EXECUTEMANY):
+        await db.execute(delete(tabela).where(tabela.c.id.in_(ids[i:i + LOTE_EXECUTEMANY])))
+    return len(ids)
+
+
+async def sincronizar_registros(
+    db: AsyncSession,
+    tabela: Table,
+    existentes: List[Dict[str, Any]],
+    novos: List[Dict[str, Any]],
+    chave: Callable[[Dict[str, Any]], Hashable],
+    campos_valor: Sequence[str]
+) -> ResumoSincronizacao:
+    """
+    Grava apenas a diferença entre `novos` e `existentes` (linhas já gravadas, com id).
+
+    - novo sem correspondente: INSERT (COPY)
+    - par com algum campo de `campos_valor` diferente: INSERT ... ON CONFLICT (id) DO UPDATE,
+      preservando o id existente
+    - existente sem correspondente: DELETE
+
+    Os DELETEs vão antes dos INSERTs: uma linha que mudou de chave de
+    emparelhamento (ex: posição recriada, com outro quadro_pessoal_id) pode
+    manter a mesma chave única da tabela que a linha antiga.
+
+    Não faz commit.
+    """
+    resumo = ResumoSincronizacao()
+    normalizar = {campo: _normalizador(tabela.c[campo]) for campo in campos_valor}
+    campos_numericos = [c for c in campos_valor if isinstance(tabela.c[c].type, Numeric)]
+
+    def ordenacao(r: Dict[str, Any]) -> Tuple[Any, ...]:
+        return tuple(normalizar[c](r.get(c)) or Decimal(0) for c in campos_numericos)
+
+    pares, so_novos, so_existentes = _emparelhar(existentes, novos, chave, ordenacao)
+
+    resumo.removidos = await remover_por_ids(db, tabela, [r["id"] for r in so_existentes])
+
+    alterados = []
+    for existente, novo in pares:
+        if any(normalizar[c](existente.get(c)) != normalizar[c](novo.get(c)) for c in campos_valor):
+            alterados.append({**novo, "id": existente["id"]})
+        else:
+            resumo.inalterados += 1
+
+    if alterados:
+        agora = datetime.utcnow()
+        colunas_update = [c for c in alterados[0].keys() if c != "id"]
+        if "updated_at" in tabela.c:
+            colunas_update.append("updated_at")
+            alterados = [{**r, "updated_at": agora} for r in alterados]
+        stmt = pg_insert(tabela)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[tabela.c.id],
+            set_={c: stmt.excluded[c] for c in colunas_update}
+        )
+        for i in range(0, len(alterados), LOTE_EXECUTEMANY):
+            await db.execute(stmt, alterados[i:i + LOTE_EXECUTEMANY])
+        resumo.atualizados = len(alterados)
+
+    resumo.inseridos = await gravar_registros(db, tabela, so_novos)
+
+    return resumo
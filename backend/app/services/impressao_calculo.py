@@ -0,0 +1,282 @@
+"""
+Impressão digital (hash de conteúdo) das entradas do cálculo de custos.
+
+Antes de recalcular, o cálculo completo compara o hash das entradas de cada
+seção (quadro_pessoal, premissa_funcao_mes, parametros_custo, tabela_salarial,
+politicas_beneficio, tipos_custo, janela do cenário, calendário: feriados e
+regime de trabalho da seção) e das entradas do rateio
+com o hash gravado no último cálculo do mesmo escopo. Se nada mudou, devolve o
+resumo gravado sem recalcular nem regravar nada.
+
+As receitas calculadas (receitas_calculadas) guardam a impressão das entradas
+das receitas (receitas, premissas, quadro, CCs e feriados); o DRE só recalcula
+receitas quando ela muda.
+
+O hash é calculado no próprio PostgreSQL (md5 de cada linha em JSONB, sem
+timestamps), em uma única consulta.
+"""
+
+from typing import Dict, Optional, Any, Tuple
+from uuid import UUID
+from datetime import datetime
+import hashlib
+import json
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, exists, text
+
+from app.core.config import settings
+from app.db.models.orcamento import CustoCalculado, CustoImpressaoCalculo
+
+
+# Incrementar quando o motor mudar de forma que resultados antigos não valham mais
+VERSAO_IMPRESSAO = 3
+
+# md5 do conteúdo da linha, ignorando colunas que não afetam o cálculo
+_LINHA = "md5((to_jsonb({a}) - 'created_at' - 'updated_at'{extra})::text)"
+
+
+def _hash_linhas(alias: str, extra: str = "") -> str:
+    return f"md5(string_agg({_LINHA.format(a=alias, extra=extra)}, '' ORDER BY {alias}.id))"
+
+
+_SQL_IMPRESSOES = f"""
+WITH secoes AS (
+    SELECT DISTINCT q.cenario_secao_id AS secao_id
+    FROM quadro_pessoal q
+    WHERE q.cenario_id = :cenario_id
+      AND q.cenario_secao_id IS NOT NULL
+      {{filtro_secao}}
+),
+quadro AS (
+    SELECT q.cenario_secao_id AS secao_id, {_hash_linhas("q", " - 'observacao'")} AS h
+    FROM quadro_pessoal q
+    WHERE q.cenario_id = :cenario_id
+      AND q.cenario_secao_id IN (SELECT secao_id FROM secoes)
+    GROUP BY q.cenario_secao_id
+),
+premissas AS (
+    SELECT p.cenario_secao_id AS secao_id, {_hash_linhas("p", " - 'distribuicoes'")} AS h
+    FROM premissa_funcao_mes p
+    WHERE p.cenario_id = :cenario_id
+      AND p.cenario_secao_id IN (SELECT secao_id FROM secoes)
+    GROUP BY p.cenario_secao_id
+),
+parametros AS (
+    SELECT pc.cenario_secao_id AS secao_id, {_hash_linhas("pc")} AS h
+    FROM parametros_custo pc
+    WHERE pc.cenario_id = :cenario_id
+    GROUP BY pc.cenario_secao_id
+),
+tabelas AS (
+    SELECT r.secao_id, {_hash_linhas("t")} AS h
+    FROM (
+        SELECT DISTINCT q.cenario_secao_id AS secao_id, q.tabela_salarial_id
+        FROM quadro_pessoal q
+        WHERE q.cenario_id = :cenario_id
+          AND q.cenario_secao_id IN (SELECT secao_id FROM secoes)
+    ) r
+    JOIN tabela_salarial t ON t.id = r.tabela_salarial_id
+    GROUP BY r.secao_id
+),
+politicas AS (
+    SELECT r.secao_id, {_hash_linhas("pb")} AS h
+    FROM (
+        SELECT DISTINCT q.cenario_secao_id AS secao_id, t.politica_id
+        FROM quadro_pessoal q
+        JOIN tabela_salarial t ON t.id = q.tabela_salarial_id
+        WHERE q.cenario_id = :cenario_id
+          AND q.cenario_secao_id IN (SELECT secao_id FROM secoes)
+    ) r
+    JOIN politicas_beneficio pb ON pb.id = r.politica_id
+    GROUP BY r.secao_id
+),
+regimes AS (
+    SELECT cs.id AS secao_id, md5((to_jsonb(sc) - 'created_at' - 'updated_at')::text) AS h
+    FROM cenario_secao cs
+    JOIN secoes sc ON sc.id = cs.secao_id
+    WHERE cs.id IN (SELECT secao_id FROM secoes)
+),
+comum AS (
+    SELECT
+        (SELECT concat_ws(':', c.ano_inicio, c.mes_inicio, c.ano_fim, c.mes_fim)
+         FROM cenarios c WHERE c.id = :cenario_id) AS janela,
+        (SELECT {_hash_linhas("tc")} FROM tipos_custo tc) AS tipos,
+        (SELECT h FROM parametros WHERE secao_id IS NULL) AS parametros_globais,
+        (SELECT {_hash_linhas("f")} FROM feriados f) AS feriados
+)
+SELECT
+    s.secao_id,
+    md5(concat_ws('#',
+        coalesce(cm.janela, ''), coalesce(cm.tipos, ''), coalesce(cm.parametros_globais, ''),
+        coalesce(q.h, ''), coalesce(p.h, ''), coalesce(pc.h, ''),
+        coalesce(t.h, ''), coalesce(pb.h, ''),
+        coalesce(cm.feriados, ''), coalesce(rg.h, '')
+    )) AS impressao
+FROM secoes s
+CROSS JOIN comum cm
+LEFT JOIN quadro q ON q.secao_id = s.secao_id
+LEFT JOIN premissas p ON p.secao_id = s.secao_id
+LEFT JOIN parametros pc ON pc.secao_id = s.secao_id
+LEFT JOIN tabelas t ON t.secao_id = s.secao_id
+LEFT JOIN politicas pb ON pb.secao_id = s.secao_id
+LEFT JOIN regimes rg ON rg.secao_id = s.secao_id
+"""
+
+# Entradas do rateio (comuns ao cenário): grupos, destinos, CCs envolvidos e custos diretos
+_SQL_IMPRESSAO_RATEIO = f"""
+SELECT md5(concat_ws('#',
+    coalesce((SELECT {_hash_linhas("g")} FROM rateio_grupos g WHERE g.cenario_id = :cenario_id), ''),
+    coalesce((SELECT {_hash_linhas("d")} FROM rateio_destinos d
+              JOIN rateio_grupos g ON g.id = d.rateio_grupo_id
+              WHERE g.cenario_id = :cenario_id), ''),
+    coalesce((SELECT {_hash_linhas("cc")} FROM centros_custo cc
+              WHERE cc.id IN (
+                  SELECT g.cc_origem_pool_id FROM rateio_grupos g WHERE g.cenario_id = :cenario_id
+                  UNION
+                  SELECT d.cc_destino_id FROM rateio_destinos d
+                  JOIN rateio_grupos g ON g.id = d.rateio_grupo_id
+                  WHERE g.cenario_id = :cenario_id
+              )), ''),
+    coalesce((SELECT {_hash_linhas("cd")} FROM custos_diretos cd WHERE cd.cenario_id = :cenario_id), '')
+))
+"""
+
+# Entradas das receitas do cenário: receitas, premissas, quadro (drivers HC/PA),
+# CCs das receitas (UF dos dias úteis) e feriados
+_SQL_IMPRESSAO_RECEITAS = f"""
+SELECT md5(concat_ws('#',
+    coalesce((SELECT {_hash_linhas("r")} FROM receitas_cenario r WHERE r.cenario_id = :cenario_id), ''),
+    coalesce((SELECT {_hash_linhas("p")} FROM receita_premissa_mes p
+              JOIN receitas_cenario r ON r.id = p.receita_cenario_id
+              WHERE r.cenario_id = :cenario_id), ''),
+    coalesce((SELECT {_hash_linhas("q", " - 'observacao'")} FROM quadro_pessoal q
+              WHERE q.cenario_id = :cenario_id), ''),
+    coalesce((SELECT {_hash_linhas("cc")} FROM centros_custo cc
+              WHERE cc.id IN (SELECT r.centro_custo_id FROM receitas_cenario r WHERE r.cenario_id = :cenario_id)), ''),
+    coalesce((SELECT {_hash_linhas("f")} FROM feriados f), '')
+))
+"""
+
+
+async def calcular_impressoes(
+    db: AsyncSession,
+    cenario_id: UUID,
+    cenario_secao_id: Optional[UUID] = None
+) -> Tuple[Dict[str, str], str]:
+    """
+    Hash das entradas de cada seção calculável e das entradas do rateio.
+
+    Returns:
+        ({secao_id: hash}, hash do rateio)
+    """
+    params: Dict[str, Any] = {"cenario_id": cenario_id}
+    filtro_secao = ""
+    if cenario_secao_id:
+        filtro_secao = "AND q.cenario_secao_id = :cenario_secao_id"
+        params["cenario_secao_id"] = cenario_secao_id
+
+    result = await db.execute(text(_SQL_IMPRESSOES.format(filtro_secao=filtro_secao)), params)
+    secoes = {str(row.secao_id): row.impressao for row in result.all()}
+
+    result = await db.execute(text(_SQL_IMPRESSAO_RATEIO), {"cenario_id": cenario_id})
+    return secoes, result.scalar_one()
+
+
+def combinar_impressoes(
+    secoes: Dict[str, str],
+    rateio: str,
+    ano: Optional[int] = None
+) -> str:
+    """Hash único do escopo: seções, rateio, ano e opções que mudam o que é gravado."""
+    conteudo = json.dumps(
+        {
+            "versao": VERSAO_IMPRESSAO,
+            "memoria": settings.CUSTOS_MEMORIA,
+            "rateio_modo": settings.RATEIO_MODO,
+            "ano": ano,
+            "secoes": secoes,
+            "rateio": rateio,
+        },
+        sort_keys=True
+    )
+    return hashlib.sha256(conteudo.encode()).hexdigest()
+
+
+async def calcular_impressao_receitas(db: AsyncSession, cenario_id: UUID) -> str:
+    """Hash das entradas do cálculo de receitas do cenário."""
+    result = await db.execute(text(_SQL_IMPRESSAO_RECEITAS), {"cenario_id": cenario_id})
+    conteudo = f"{VERSAO_IMPRESSAO}#{result.scalar_one()}"
+    return hashlib.sha256(conteudo.encode()).hexdigest()
+
+
+def _filtro_escopo(cenario_id: UUID, cenario_secao_id: Optional[UUID], ano: Optional[int]):
+    return [
+        CustoImpressaoCalculo.cenario_id == cenario_id,
+        CustoImpressaoCalculo.cenario_secao_id == cenario_secao_id
+        if cenario_secao_id else CustoImpressaoCalculo.cenario_secao_id.is_(None),
+        CustoImpressaoCalculo.ano == ano if ano else CustoImpressaoCalculo.ano.is_(None),
+    ]
+
+
+async def obter_resumo_em_cache(
+    db: AsyncSession,
+    cenario_id: UUID,
+    cenario_secao_id: Optional[UUID],
+    ano: Optional[int],
+    impressao: str
+) -> Optional[Dict[str, Any]]:
+    """
+    Resumo gravado do último cálculo do escopo, se as entradas não mudaram desde então.
+
+    Se o cálculo gravou custos mas o escopo não tem mais nenhum (apagados por
+    um caminho que não passou pelo cálculo), o cache não vale.
+    """
+    result = await db.execute(
+        select(CustoImpressaoCalculo.resumo)
+        .where(*_filtro_escopo(cenario_id, cenario_secao_id, ano))
+        .where(CustoImpressaoCalculo.impressao == impressao)
+        .limit(1)
+    )
+    resumo = result.scalar_one_or_none()
+    if resumo is None or not resumo.get("quantidade"):
+        return resumo
+
+    condicoes = [CustoCalculado.cenario_id == cenario_id]
+    if cenario_secao_id:
+        condicoes.append(CustoCalculado.cenario_secao_id == cenario_secao_id)
+    if ano:
+        condicoes.append(CustoCalculado.ano == ano)
+    result = await db.execute(select(exists().where(*condicoes)))
+    return resumo if result.scalar() else None
+
+
+async def invalidar_impressoes(db: AsyncSession, cenario_id: UUID) -> None:
+    """
+    Descarta as impressões do cenário (qualquer escopo). Chamado por todo
+    cálculo que regrava custos: um cálculo parcial pode mudar o resultado de
+    escopos mais amplos. Não faz commit.
+    """
+    await db.execute(delete(CustoImpressaoCalculo).where(CustoImpressaoCalculo.cenario_id == cenario_id))
+
+
+async def gravar_impressao(
+    db: AsyncSession,
+    cenario_id: UUID,
+    cenario_secao_id: Optional[UUID],
+    ano: Optional[int],
+    impressao: str,
+    impressoes_secoes: Dict[str, str],
+    resumo: Dict[str, Any]
+) -> None:
+    """Grava a impressão e o resumo do cálculo do escopo. Não faz commit."""
+    await db.execute(delete(CustoImpressaoCalculo).where(*_filtro_escopo(cenario_id, cenario_secao_id, ano)))
+    db.add(CustoImpressaoCalculo(
+        cenario_id=cenario_id,
+        cenario_secao_id=cenario_secao_id,
+        ano=ano,
+        impressao=impressao,
+        impressoes_secoes=impressoes_secoes,
+        resumo=json.loads(json.dumps(resumo, default=str)),
+        calculado_em=datetime.utcnow()
+    ))
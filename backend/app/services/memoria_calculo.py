@@ -0,0 +1,132 @@
+"""
+Memória de cálculo sob demanda.
+
+Com CUSTOS_MEMORIA = "posicao" ou "nenhuma", custos_calculados não carrega
+o JSON de memória em cada linha. Este serviço monta a explicação de um custo
+quando alguém pede: usa a memória gravada na linha (modo "linha" ou linhas
+antigas), a memória da posição/mês (custos_memoria_posicao) ou, em último
+caso, recalcula a posição naquele mês.
+"""
+
+from typing import Dict, Optional, Any
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from app.db.models.orcamento import (
+    CustoCalculado, CustoMemoriaPosicao, TipoCusto, RateioGrupo,
+    CustoDireto, ProdutoTecnologia
+)
+
+
+async def _explicar_rateio(db: AsyncSession, custo: CustoCalculado) -> Dict[str, Any]:
+    """Reconstrói a memória de um custo rateado a partir das colunas de origem."""
+    grupo = await db.get(RateioGrupo, custo.rateio_grupo_id)
+    memoria: Dict[str, Any] = {
+        "tipo": "rateio",
+        "tipo_rateio": grupo.tipo_rateio if grupo else None,
+        "grupo_rateio": str(custo.rateio_grupo_id),
+        "grupo_nome": grupo.nome if grupo else None,
+        "cc_origem": str(grupo.cc_origem_pool_id) if grupo else None,
+        "cc_destino": str(custo.centro_custo_id) if custo.centro_custo_id else None,
+    }
+
+    if custo.custo_origem_id:
+        origem = await db.get(CustoCalculado, custo.custo_origem_id)
+        memoria["custo_original_id"] = str(custo.custo_origem_id)
+        if origem and origem.valor_calculado:
+            memoria["percentual"] = round(float(custo.valor_calculado) / float(origem.valor_calculado) * 100, 2)
+            memoria["origem"] = await explicar_custo(db, origem.id, incluir_origem=False)
+    elif custo.custo_direto_id:
+        memoria["custo_direto_id"] = str(custo.custo_direto_id)
+        memoria["percentual"] = round(float(custo.indice_aplicado or 0) * 100, 2)
+        result = await db.execute(
+            select(ProdutoTecnologia.nome)
+            .join(CustoDireto, CustoDireto.item_custo_id == ProdutoTecnologia.id)
+            .where(CustoDireto.id == custo.custo_direto_id)
+        )
+        memoria["produto_nome"] = result.scalar_one_or_none()
+
+    return memoria
+
+
+async def _recalcular_memoria(db: AsyncSession, custo: CustoCalculado) -> Optional[Dict[str, Any]]:
+    """Recalcula a posição no mês do custo e devolve a memória da rubrica correspondente."""
+    from app.services.calculo_custos import CalculoCustosService
+
+    if not custo.cenario_secao_id or not custo.funcao_id:
+        return None
+
+    service = CalculoCustosService(db)
+    registros = await service.calcular_registros_celulas(
+        custo.cenario_id, custo.cenario_secao_id, [custo.funcao_id], [(custo.ano, custo.mes)]
+    )
+    for r in registros:
+        if r["tipo_custo_id"] == custo.tipo_custo_id and r.get("quadro_pessoal_id") == custo.quadro_pessoal_id:
+            memoria = dict(r["memoria_calculo"] or {})
+            # Entradas podem ter mudado desde o cálculo gravado
+            valor_recalculado = float(r["valor_calculado"])
+            memoria["valor_recalculado"] = valor_recalculado
+            memoria["divergente"] = abs(valor_recalculado - float(custo.valor_calculado or 0)) >= 0.01
+            return memoria
+    return None
+
+
+async def explicar_custo(
+    db: AsyncSession,
+    custo_id: UUID,
+    incluir_origem: bool = True
+) -> Optional[Dict[str, Any]]:
+    """
+    Explica um custo calculado.
+
+    Returns:
+        Dict com os valores gravados, a memória de cálculo e a fonte da memória
+        ("linha", "posicao", "rateio", "recalculada" ou None), ou None se o custo não existe
+    """
+    custo = await db.get(CustoCalculado, custo_id)
+    if not custo:
+        return None
+
+    tipo = await db.get(TipoCusto, custo.tipo_custo_id)
+
+    fonte = None
+    memoria = None
+    if custo.memoria_calculo:
+        fonte, memoria = "linha", custo.memoria_calculo
+    elif custo.rateio_grupo_id:
+        fonte = "rateio"
+        memoria = await _explicar_rateio(db, custo) if incluir_origem else {
+            "tipo": "rateio", "grupo_rateio": str(custo.rateio_grupo_id)
+        }
+    elif custo.quadro_pessoal_id:
+        result = await db.execute(
+            select(CustoMemoriaPosicao.memoria).where(
+                CustoMemoriaPosicao.quadro_pessoal_id == custo.quadro_pessoal_id,
+                CustoMemoriaPosicao.ano == custo.ano,
+                CustoMemoriaPosicao.mes == custo.mes
+            ).limit(1)
+        )
+        memoria_posicao = result.scalar_one_or_none()
+        if memoria_posicao is not None:
+            fonte = "posicao"
+            memoria = {**memoria_posicao, "tipo_calculo": tipo.tipo_calculo if tipo else None}
+        else:
+            memoria = await _recalcular_memoria(db, custo)
+            fonte = "recalculada" if memoria is not None else None
+
+    return {
+        "custo_id": str(custo.id),
+        "tipo_custo_codigo": tipo.codigo if tipo else None,
+        "tipo_custo_nome": tipo.nome if tipo else None,
+        "mes": custo.mes,
+        "ano": custo.ano,
+        "hc_base": float(custo.hc_base or 0),
+        "valor_base": float(custo.valor_base or 0),
+        "indice_aplicado": float(custo.indice_aplicado or 0),
+        "valor_calculado": float(custo.valor_calculado or 0),
+        "origem": "INDIRETO" if custo.rateio_grupo_id else "DIRETO",
+        "fonte_memoria": fonte,
+        "memoria_calculo": memoria,
+    }
@@ -0,0 +1,323 @@
+"""
+Busca do valor de premissa de receita que atinge a meta do centro de custo.
+
+Dada uma margem alvo (ou um resultado mensal alvo) e uma variável livre da
+receita variável (vopdu, indice_conversao ou ticket_medio), encontra, para cada
+CC e mês, o menor valor da variável com o qual a receita cobre a meta.
+
+Receitas e custos são carregados uma vez e montados em um modelo em memória:
+cada receita variável vira um termo coeficiente x variável, limitado pelo
+mínimo/máximo por PA (mesma fórmula de calculo_receitas), e as
+demais receitas e os custos viram constantes por CC/mês. Como a receita é
+monótona na variável, a busca é por bisseção, com todos os CCs/meses avançando
+juntos em operações NumPy. Nada é gravado.
+"""
+
+from typing import List, Dict, Any, Tuple
+from uuid import UUID
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func
+
+from app.db.models.orcamento import (
+    Cenario, CentroCusto, ReceitaCenario,
+    CustoCalculado, CustoDireto, CustoTecnologia
+)
+from app.schemas.orcamento import MetaReceitaRequest
+from app.services.calendario import obter_calendario, RegimeTrabalho
+from app.services.cubo_drivers import CuboDrivers, obter_cubo_drivers
+from app.services.calculo_custos import periodos_cenario
+from app.services.dre_resumo import valores_custo_direto
+
+
+VARIAVEIS = ("vopdu", "indice_conversao", "ticket_medio")
+
+# Casas decimais das colunas de ReceitaPremissaMes (o valor devolvido é arredondado para cima)
+CASAS_DECIMAIS = {"vopdu": 4, "indice_conversao": 4, "ticket_medio": 2}
+
+# Limite superior da busca (índices vão de 0 a 1; demais crescem até atingir a meta)
+LIMITE_SUPERIOR = {"indice_conversao": 1.0}
+
+MAX_EXPANSOES = 60
+MAX_ITERACOES = 100
+
+
+async def _custos_por_cc_mes(
+    db: AsyncSession,
+    cenario: Cenario,
+    ano: int,
+    ccs: set,
+    cubo: CuboDrivers
+) -> Dict[Tuple[UUID, int], float]:
+    """
+    Total de custos por CC/mês, com o mesmo critério do DRE por CC (custos
+    diretos valorados pelo HC/PA do cubo, ver dre_resumo.valores_custo_direto).
+    """
+    cenario_id = cenario.id
+    custos: Dict[Tuple[UUID, int], float] = {}
+
+    def somar(cc_id, mes, valor):
+        if cc_id in ccs:
+            custos[(cc_id, mes)] = custos.get((cc_id, mes), 0.0) + float(valor or 0)
+
+    for modelo in (CustoCalculado, CustoTecnologia):
+        result = await db.execute(
+            select(modelo.centro_custo_id, modelo.mes, func.sum(modelo.valor_calculado))
+            .where(modelo.cenario_id == cenario_id, modelo.ano == ano)
+            .group_by(modelo.centro_custo_id, modelo.mes)
+        )
+        for cc_id, mes, valor in result.all():
+            somar(cc_id, mes, valor)
+
+    # Como no resumo do DRE, só os meses da janela do cenário
+    meses_janela = [mes for a, mes in periodos_cenario(cenario) if a == ano]
+    result = await db.execute(
+        select(CustoDireto).where(CustoDireto.cenario_id == cenario_id, CustoDireto.ativo == True)
+    )
+    for custo in result.scalars().all():
+        valores = valores_custo_direto(custo, cubo)
+        for mes in meses_janela:
+            somar(custo.centro_custo_id, mes, valores[mes - 1])
+
+    return custos
+
+
+def _receita(
+    x: np.ndarray,
+    fixo: np.ndarray,
+    grupo: np.ndarray,
+    coeficiente: np.ndarray,
+    minimo: np.ndarray,
+    maximo: np.ndarray
+) -> np.ndarray:
+    """Receita de cada CC/mês com a variável livre valendo x em cada termo (NaN = sem limite)."""
+    bruto = coeficiente * x
+    valor = np.where(bruto < minimo, minimo, np.where(bruto > maximo, maximo, bruto))
+    return fixo + np.bincount(grupo, weights=valor, minlength=len(fixo))
+
+
+def _margem(receita: float, custos: float) -> float:
+    return float((receita - custos) / receita * 100) if receita > 0 else 0.0
+
+
+async def buscar_meta_receita(
+    db: AsyncSession,
+    cenario_id: UUID,
+    pedido: MetaReceitaRequest
+) -> Dict[str, Any]:
+    """
+    Valor da variável livre, por CC e mês, que leva a margem (ou o resultado)
+    do CC à meta, mantidas as demais premissas.
+
+    Raises:
+        ValueError: cenário inexistente ou pedido inválido
+    """
+    if (pedido.margem_alvo is None) == (pedido.resultado_alvo is None):
+        raise ValueError("Informe margem_alvo ou resultado_alvo (apenas um)")
+    meses = sorted(set(pedido.meses or range(1, 13)))
+    if any(mes < 1 or mes > 12 for mes in meses):
+        raise ValueError("Meses devem estar entre 1 e 12")
+
+    cenario = await db.get(Cenario, cenario_id)
+    if not cenario:
+        raise ValueError(f"Cenário {cenario_id} não encontrado")
+    ano = pedido.ano or cenario.ano_inicio
+    variavel = pedido.variavel
+    outras = [v for v in VARIAVEIS if v != variavel]
+
+    # CCs do DRE (operacionais, sem POOL)
+    query_ccs = select(CentroCusto).where(CentroCusto.ativo == True, CentroCusto.tipo != "POOL")
+    if pedido.centro_custo_id:
+        query_ccs = query_ccs.where(CentroCusto.id == pedido.centro_custo_id)
+    centros_custo = {cc.id: cc for cc in (await db.execute(query_ccs)).scalars().all()}
+
+    result = await db.execute(
+        select(ReceitaCenario).where(
+            ReceitaCenario.cenario_id == cenario_id,
+            ReceitaCenario.ativo == True,
+            ReceitaCenario.centro_custo_id.in_(list(centros_custo))
+        )
+    )
+    receitas = result.scalars().all()
+    if pedido.receita_cenario_id and not any(
+        r.id == pedido.receita_cenario_id and r.tipo_calculo == "VARIAVEL" for r in receitas
+    ):
+        raise ValueError("Receita variável não encontrada no cenário/CC informado")
+
+    cubo = await obter_cubo_drivers(db, cenario_id)
+    custos = await _custos_por_cc_mes(db, cenario, ano, set(centros_custo), cubo)
+    calendario = await obter_calendario(db, ano)
+
+    # Modelo: uma linha (grupo) por CC/mês e um termo por receita variável livre
+    ccs_livres = {
+        r.centro_custo_id for r in receitas
+        if r.tipo_calculo == "VARIAVEL" and (not pedido.receita_cenario_id or r.id == pedido.receita_cenario_id)
+    }
+    chaves = [(cc_id, mes) for cc_id in centros_custo if cc_id in ccs_livres for mes in meses]
+    indice_grupo = {chave: i for i, chave in enumerate(chaves)}
+    fixo = np.zeros(len(chaves))
+    termos: List[Tuple[int, UUID, float, float, float, float]] = []  # grupo, receita, coef, min, max, atual
+
+    for receita in receitas:
+        cc_id = receita.centro_custo_id
+        premissas = {(p.ano, p.mes): p for p in receita.premissas}
+        for mes in meses:
+            g = indice_grupo.get((cc_id, mes))
+            if g is None:
+                continue
+            m = mes - 1
+            valor_fixo = float(receita.valor_fixo or 0)
+
+            if receita.tipo_calculo == "FIXA_CC":
+                fixo[g] += valor_fixo
+                continue
+            if receita.tipo_calculo == "FIXA_HC":
+                fixo[g] += valor_fixo * cubo.hc(centro_custo_id=cc_id)[m]
+                continue
+            qtd_pa = cubo.pa(centro_custo_id=cc_id, funcao_id=receita.funcao_pa_id)[m]
+            if receita.tipo_calculo == "FIXA_PA":
+                fixo[g] += valor_fixo * qtd_pa
+                continue
+
+            premissa = premissas.get((ano, mes))
+            if receita.tipo_calculo != "VARIAVEL" or not premissa:
+                continue
+
+            hc_pa = cubo.hc(centro_custo_id=cc_id, funcao_id=receita.funcao_pa_id)[m]
+            if hc_pa == 0 and receita.funcao_pa_id:
+                hc_pa = cubo.hc(funcao_id=receita.funcao_pa_id)[m]
+            uf = receita.centro_custo.uf if receita.centro_custo else None
+            dias_uteis = int(calendario.dias_uteis(ano, mes, RegimeTrabalho(uf=uf)))
+
+            coeficiente = (
+                hc_pa * float(premissa.fator or 1) * dias_uteis
+                * (1 - float(premissa.indice_estorno or 0))
+            )
+            for outra in outras:
+                coeficiente *= float(getattr(premissa, outra) or 0)
+            minimo = float(receita.valor_minimo_pa) * qtd_pa if receita.valor_minimo_pa else np.nan
+            maximo = float(receita.valor_maximo_pa) * qtd_pa if receita.valor_maximo_pa else np.nan
+            atual = float(getattr(premissa, variavel) or 0)
+
+            if pedido.receita_cenario_id and receita.id != pedido.receita_cenario_id:
+                # Receita variável fora da busca: entra pelo valor atual
+                bruto = coeficiente * atual
+                fixo[g] += minimo if bruto < minimo else maximo if bruto > maximo else bruto
+            else:
+                termos.append((g, receita.id, coeficiente, minimo, maximo, atual))
+
+    custos_grupo = np.array([custos.get(chave, 0.0) for chave in chaves])
+    grupo = np.array([t[0] for t in termos], dtype=np.intp)
+    coeficiente = np.array([t[2] for t in termos])
+    minimo = np.array([t[3] for t in termos])
+    maximo = np.array([t[4] for t in termos])
+    atual = np.array([t[5] for t in termos])
+
+    avaliacoes = 0
+
+    def receita_em(x_grupo: np.ndarray) -> np.ndarray:
+        nonlocal avaliacoes
+        avaliacoes += 1
+        return _receita(x_grupo[grupo], fixo, grupo, coeficiente, minimo, maximo)
+
+    if pedido.margem_alvo is not None:
+        alvo = custos_grupo / (1 - pedido.margem_alvo / 100)
+    else:
+        alvo = custos_grupo + pedido.resultado_alvo
+
+    receita_atual = fixo + np.bincount(
+        grupo, weights=np.where(
+            coeficiente * atual < minimo, minimo,
+            np.where(coeficiente * atual > maximo, maximo, coeficiente * atual)
+        ), minlength=len(chaves)
+    )
+    com_termo = np.bincount(grupo, minlength=len(chaves)) > 0
+
+    # Receita com a variável tendendo ao infinito: sem chance de meta, nem busca
+    teto_termo = np.where(
+        coeficiente > 0, np.where(np.isnan(maximo), np.inf, maximo),
+        _receita(np.zeros(len(termos)), np.zeros(len(termos)), np.arange(len(termos)), coeficiente, minimo, maximo)
+    )
+    alcancavel = fixo + np.bincount(grupo, weights=teto_termo, minlength=len(chaves)) >= alvo
+
+    # Intervalo inicial: [0, limite] ou [0, maior valor atual], dobrado até cobrir a meta
+    lo = np.zeros(len(chaves))
+    limite = LIMITE_SUPERIOR.get(variavel)
+    if limite is not None:
+        hi = np.full(len(chaves), limite)
+    else:
+        hi = np.ones(len(chaves))
+        np.maximum.at(hi, grupo, atual)
+        for _ in range(MAX_EXPANSOES):
+            falta = com_termo & alcancavel & (receita_em(hi) < alvo)
+            if not falta.any():
+                break
+            hi[falta] *= 2
+    viavel = com_termo & alcancavel & (receita_em(hi) >= alvo)
+    atingida = viavel & (receita_em(lo) >= alvo)
+    hi[atingida] = 0
+
+    # Bisseção: lo não atinge a meta, hi atinge; para abaixo da precisão da coluna
+    escala = 10 ** CASAS_DECIMAIS[variavel]
+    busca = viavel & ~atingida
+    for _ in range(MAX_ITERACOES):
+        if not (busca & (hi - lo > 0.1 / escala)).any():
+            break
+        meio = (lo + hi) / 2
+        ok = receita_em(meio) >= alvo
+        hi = np.where(busca & ok, meio, hi)
+        lo = np.where(busca & ~ok, meio, lo)
+
+    valor = np.ceil(hi * escala - 1e-6) / escala
+    if limite is not None:
+        valor = np.minimum(valor, limite)
+    receita_final = receita_em(valor)
+
+    # Valores atuais da variável por receita (por CC/mês)
+    atuais: Dict[int, List[Dict[str, Any]]] = {}
+    for g, receita_id, _, _, _, valor_atual in termos:
+        atuais.setdefault(g, []).append({"receita_cenario_id": str(receita_id), "valor": valor_atual})
+
+    resultado = []
+    for cc_id, cc in centros_custo.items():
+        if cc_id not in ccs_livres:
+            continue
+        linhas = []
+        for mes in meses:
+            g = indice_grupo[(cc_id, mes)]
+            if not com_termo[g]:
+                situacao = "sem_premissa"
+            elif not viavel[g]:
+                situacao = "inviavel"  # Limite máximo por PA, HC zerado ou índice acima de 1
+            else:
+                situacao = "ok"
+            encontrada = situacao == "ok"
+            linhas.append({
+                "mes": mes,
+                "custos": round(float(custos_grupo[g]), 2),
+                "receita_atual": round(float(receita_atual[g]), 2),
+                "margem_atual": round(_margem(receita_atual[g], custos_grupo[g]), 4),
+                "valores_atuais": atuais.get(g, []),
+                "receita_alvo": round(float(alvo[g]), 2),
+                "valor_necessario": float(valor[g]) if encontrada else None,
+                "receita_resultante": round(float(receita_final[g]), 2) if encontrada else None,
+                "margem_resultante": round(_margem(receita_final[g], custos_grupo[g]), 4) if encontrada else None,
+                "situacao": situacao,
+            })
+        resultado.append({
+            "centro_custo_id": str(cc_id),
+            "centro_custo_codigo": cc.codigo,
+            "centro_custo_nome": cc.nome,
+            "meses": linhas,
+        })
+
+    return {
+        "cenario_id": str(cenario_id),
+        "ano": ano,
+        "variavel": variavel,
+        "margem_alvo": pedido.margem_alvo,
+        "resultado_alvo": pedido.resultado_alvo,
+        "avaliacoes": avaliacoes,
+        "centros_custo": resultado,
+    }
@@ -0,0 +1,384 @@
+"""
+Simulação de Monte Carlo do orçamento de pessoal.
+
+Absenteísmo, turnover e índices de férias das premissas são estimativas
+pontuais; aqui cada um pode ter uma distribuição (triangular, uniforme ou
+normal), cadastrada na premissa (premissa_funcao_mes.distribuicoes) ou
+informada no pedido para todas as premissas. Cada amostra sorteia os índices e
+passa pelas fórmulas vetorizadas das rubricas (HC folha, VT/VR, aviso e multa
+do FGTS, desconto de faltas...), e o resultado são faixas de percentis por mês
+e por categoria de custo.
+
+Para caber em segundos:
+- As posições da seção com os mesmos atributos (função, salário, política,
+  escala) são somadas em uma linha só; as fórmulas são lineares no HC.
+- As amostras são empilhadas no eixo das posições (como na análise de
+  sensibilidade) e calculadas em lotes, no próprio processo ou em um pool
+  de processos limitado (MONTE_CARLO_PROCESSOS).
+
+A execução é reproduzível pela semente: os sorteios de cada lote dependem só
+da semente, da seção e do índice do lote, não da quantidade de processos.
+"""
+
+from typing import List, Dict, Optional, Any, Tuple
+from uuid import UUID
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+from types import SimpleNamespace
+import asyncio
+import copy
+import os
+import secrets
+import time
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db.models.orcamento import Cenario, TipoCusto, PremissaFuncaoMes
+from app.schemas.orcamento import MonteCarloCustosRequest, DistribuicaoPremissa
+from app.services.calculo_custos import CalculoCustosService, MOTOR_VETORIZADO, periodos_cenario
+from app.services.calculo_custos_vetorizado import EntradasSecao, calcular_rubricas
+from app.services.impressao_calculo import calcular_impressoes
+from app.services.plano_rubricas import PlanoRubricas
+from app.services.parametros_custo import Parametros
+from app.services.sensibilidade_custos import _empilhar
+from app.services.simulacao_custos import CAMPOS_PREMISSA, _entradas_secao
+
+
+CORRELACAO_TOTAL = "total"
+CORRELACAO_INDEPENDENTE = "independente"
+
+# Códigos de distribuição nas matrizes (0 = sem distribuição: valor da premissa)
+_SEM_DISTRIBUICAO, _TRIANGULAR, _UNIFORME, _NORMAL = 0, 1, 2, 3
+_CODIGOS = {"triangular": _TRIANGULAR, "uniforme": _UNIFORME, "normal": _NORMAL}
+
+# Limite de células (amostras x linhas x meses) por lote enviado ao pool
+MAX_CELULAS_LOTE = 500_000
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _pool_processos() -> Optional[ProcessPoolExecutor]:
+    """
+    Pool compartilhado entre simulações (None = executar no próprio processo).
+    Sem configuração, roda no próprio processo; o tamanho é limitado por
+    MONTE_CARLO_PROCESSOS_MAX e pelo número de CPUs.
+    """
+    global _pool
+    processos = min(settings.MONTE_CARLO_PROCESSOS, settings.MONTE_CARLO_PROCESSOS_MAX, os.cpu_count() or 1)
+    if processos <= 1:
+        return None
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=processos)
+    return _pool
+
+
+# ============================================
+# PREPARAÇÃO (processo da API)
+# ============================================
+
+def _compactar(entradas: EntradasSecao) -> EntradasSecao:
+    """
+    Soma o HC das posições com os mesmos atributos (inclusive função, logo as
+    mesmas premissas). As rubricas são lineares no HC, então o total não muda.
+    """
+    n = len(entradas.quadros)
+    por_posicao = {
+        nome: valor for nome, valor in vars(entradas).items()
+        if isinstance(valor, np.ndarray) and valor.shape[0] == n and nome != "hc_operando"
+    }
+
+    grupos: Dict[Tuple[Any, ...], int] = {}
+    indice_grupo = np.empty(n, dtype=int)
+    primeiros = []
+    for i, q in enumerate(entradas.quadros):
+        chave = (q.funcao_id, *(valor[i].tobytes() for valor in por_posicao.values()))
+        if chave not in grupos:
+            grupos[chave] = len(primeiros)
+            primeiros.append(i)
+        indice_grupo[i] = grupos[chave]
+
+    compactada = copy.copy(entradas)
+    for nome, valor in por_posicao.items():
+        setattr(compactada, nome, valor[primeiros])
+    hc = np.zeros((len(primeiros), entradas.hc_operando.shape[1]))
+    np.add.at(hc, indice_grupo, entradas.hc_operando)
+    compactada.hc_operando = hc
+    compactada.quadros = [SimpleNamespace(funcao_id=entradas.quadros[i].funcao_id) for i in primeiros]
+    return compactada
+
+
+def _matrizes_distribuicao(
+    entradas: EntradasSecao,
+    distribuicoes_premissas: Dict[Tuple[UUID, int, int], Dict[str, Any]],
+    padrao: Dict[str, Any]
+) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Para cada índice com incerteza: (código, p1, p2, p3), matrizes (linhas x meses).
+    triangular: min/moda/max; uniforme: min/max; normal: media/desvio.
+    Só células com premissa recebem distribuição.
+    """
+    n = len(entradas.quadros)
+    t = len(entradas.periodos)
+    campos = set(padrao) | {c for d in distribuicoes_premissas.values() for c in d}
+
+    resultado = {}
+    for campo in CAMPOS_PREMISSA:
+        if campo not in campos:
+            continue
+        codigo = np.zeros((n, t), dtype=np.int8)
+        p1, p2, p3 = np.zeros((n, t)), np.zeros((n, t)), np.zeros((n, t))
+        pontual = getattr(entradas, campo)
+
+        for i, q in enumerate(entradas.quadros):
+            for j, (ano, mes) in enumerate(entradas.periodos):
+                if not entradas.tem_premissa[i, j]:
+                    continue
+                propria = distribuicoes_premissas.get((q.funcao_id, ano, mes), {}).get(campo)
+                if propria:
+                    d, deslocamento = DistribuicaoPremissa(**propria), 0.0
+                elif campo in padrao:
+                    d = padrao[campo]
+                    deslocamento = pontual[i, j] if d.relativa else 0.0
+                else:
+                    continue
+                codigo[i, j] = _CODIGOS[d.tipo]
+                if d.tipo == "normal":
+                    p1[i, j] = (d.media if d.media is not None else 0.0) + deslocamento
+                    p2[i, j] = d.desvio or 0.0
+                else:
+                    minimo = (d.min if d.min is not None else 0.0) + deslocamento
+                    maximo = (d.max if d.max is not None else 0.0) + deslocamento
+                    moda = (d.moda + deslocamento) if d.moda is not None else (minimo + maximo) / 2
+                    p1[i, j], p2[i, j], p3[i, j] = minimo, moda, maximo
+
+        if codigo.any():
+            resultado[campo] = (codigo, p1, p2, p3)
+    return resultado
+
+
+# ============================================
+# AMOSTRAGEM (processos do pool)
+# ============================================
+
+def _quantil(codigo, p1, p2, p3, u, z) -> np.ndarray:
+    """Valor de cada célula no quantil u (z = quantil normal padrão correspondente)."""
+    amplitude = p3 - p1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corte = np.where(amplitude > 0, (p2 - p1) / amplitude, 0.0)
+        triangular = np.where(
+            u < corte,
+            p1 + np.sqrt(u * amplitude * (p2 - p1)),
+            p3 - np.sqrt((1 - u) * amplitude * (p3 - p2))
+        )
+    uniforme = p1 + u * (p3 - p1)
+    normal = p1 + p2 * z
+    return np.select(
+        [codigo == _TRIANGULAR, codigo == _UNIFORME, codigo == _NORMAL],
+        [triangular, uniforme, normal]
+    )
+
+
+def _simular_lote(
+    entradas: EntradasSecao,
+    plano: PlanoRubricas,
+    parametros: Parametros,
+    distribuicoes: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]],
+    categoria_por_passo: np.ndarray,
+    n_categorias: int,
+    quantidade: int,
+    choques: Optional[Tuple[np.ndarray, np.ndarray]],
+    semente: np.random.SeedSequence
+) -> np.ndarray:
+    """
+    Calcula `quantidade` amostras de uma seção de uma vez.
+
+    Args:
+        choques: (u, z) por amostra e índice (correlação total); None = sorteio por célula
+
+    Returns:
+        Matriz (amostras x categorias x meses)
+    """
+    n = len(entradas.quadros)
+    t = len(entradas.periodos)
+    rng = np.random.default_rng(semente)
+    empilhada = _empilhar(entradas, quantidade)
+
+    for k, campo in enumerate(CAMPOS_PREMISSA):
+        if campo not in distribuicoes:
+            continue
+        codigo, p1, p2, p3 = distribuicoes[campo]
+        if choques is not None:
+            u = choques[0][:, k].reshape(quantidade, 1, 1)
+            z = choques[1][:, k].reshape(quantidade, 1, 1)
+        else:
+            u = rng.random((quantidade, n, t))
+            z = rng.standard_normal((quantidade, n, t))
+        sorteado = _quantil(codigo, p1, p2, p3, u, z)
+        amostra = np.where(codigo > 0, sorteado, getattr(entradas, campo))
+        setattr(empilhada, campo, np.clip(amostra, 0, 100).reshape(quantidade * n, t))
+
+    service = CalculoCustosService(None, MOTOR_VETORIZADO)
+    service.usar_parametros(parametros)
+    _, valores = calcular_rubricas(empilhada, plano, service.get_parametro)
+
+    resultado = np.zeros((quantidade, n_categorias, t))
+    for passo in plano.passos:
+        resultado[:, categoria_por_passo[passo.indice], :] += (
+            valores[passo.indice].reshape(quantidade, n, t).sum(axis=1)
+        )
+    return resultado
+
+
+# ============================================
+# SIMULAÇÃO
+# ============================================
+
+def _faixas(amostras: np.ndarray, percentis: List[float]) -> Dict[str, Any]:
+    """Percentis do total e de cada mês de uma matriz (amostras x meses)."""
+    totais = amostras.sum(axis=1)
+    por_mes = np.percentile(amostras, percentis, axis=0)
+    return {
+        "media": round(float(totais.mean()), 2),
+        "desvio": round(float(totais.std()), 2),
+        "percentis": {
+            f"P{p:g}": round(float(v), 2) for p, v in zip(percentis, np.percentile(totais, percentis))
+        },
+        "mensal": {
+            f"P{p:g}": [round(float(v), 2) for v in linha] for p, linha in zip(percentis, por_mes)
+        },
+    }
+
+
+async def simular_monte_carlo(
+    db: AsyncSession,
+    cenario_id: UUID,
+    pedido: MonteCarloCustosRequest
+) -> Dict[str, Any]:
+    """
+    Sorteia `amostras` cenários de premissas e devolve faixas de percentis do
+    custo por mês e por categoria. Nada é gravado.
+
+    Raises:
+        ValueError: cenário inexistente ou distribuição inválida
+    """
+    inicio_execucao = time.perf_counter()
+
+    padrao = {}
+    for d in pedido.distribuicoes_padrao:
+        if d.campo not in CAMPOS_PREMISSA:
+            raise ValueError(f"Premissa '{d.campo}' não pode ter distribuição (use {', '.join(CAMPOS_PREMISSA)})")
+        padrao[d.campo] = d
+    if any(not 0 < p < 100 for p in pedido.percentis):
+        raise ValueError("Percentis devem estar entre 0 e 100")
+
+    cenario = await db.get(Cenario, cenario_id)
+    if not cenario:
+        raise ValueError(f"Cenário {cenario_id} não encontrado")
+
+    if pedido.ano:
+        periodos = [(pedido.ano, mes) for mes in range(1, 13)]
+    else:
+        periodos = periodos_cenario(cenario)
+
+    service = CalculoCustosService(db, MOTOR_VETORIZADO)
+    await service.carregar_tipos_custo()
+    plano = service._plano
+
+    result = await db.execute(
+        select(TipoCusto.id, TipoCusto.categoria).where(TipoCusto.id.in_([p.id for p in plano.passos]))
+    )
+    categoria_tipo = {row.id: row.categoria or "OUTROS" for row in result.all()}
+    categorias = sorted({categoria_tipo.get(p.id, "OUTROS") for p in plano.passos})
+    categoria_por_passo = np.array([categorias.index(categoria_tipo.get(p.id, "OUTROS")) for p in plano.passos])
+
+    semente = pedido.semente if pedido.semente is not None else secrets.randbits(32)
+    choques = None
+    if pedido.correlacao == CORRELACAO_TOTAL:
+        u = np.random.default_rng(semente).random((pedido.amostras, len(CAMPOS_PREMISSA)))
+        u = np.clip(u, 1e-12, 1 - 1e-12)
+        normal = NormalDist()
+        z = np.array([normal.inv_cdf(float(x)) for x in u.ravel()]).reshape(u.shape)
+        choques = (u, z)
+
+    impressoes, _ = await calcular_impressoes(db, cenario_id, pedido.cenario_secao_id)
+    secoes = sorted(impressoes)
+
+    query = select(
+        PremissaFuncaoMes.cenario_secao_id, PremissaFuncaoMes.funcao_id,
+        PremissaFuncaoMes.ano, PremissaFuncaoMes.mes, PremissaFuncaoMes.distribuicoes
+    ).where(
+        PremissaFuncaoMes.cenario_id == cenario_id,
+        PremissaFuncaoMes.distribuicoes.isnot(None)
+    )
+    if pedido.cenario_secao_id:
+        query = query.where(PremissaFuncaoMes.cenario_secao_id == pedido.cenario_secao_id)
+    distribuicoes_premissas: Dict[str, Dict[Tuple[UUID, int, int], Dict[str, Any]]] = {}
+    for row in (await db.execute(query)).all():
+        if row.distribuicoes:
+            distribuicoes_premissas.setdefault(str(row.cenario_secao_id), {})[
+                (row.funcao_id, row.ano, row.mes)
+            ] = row.distribuicoes
+
+    pool = _pool_processos()
+    loop = asyncio.get_running_loop()
+    amostras = np.zeros((pedido.amostras, len(categorias), len(periodos)))
+    deterministico = np.zeros((len(categorias), len(periodos)))
+    tarefas = []
+
+    for indice_secao, secao in enumerate(secoes):
+        item = await _entradas_secao(service, cenario_id, UUID(secao), periodos, impressoes[secao])
+        if item.entradas is None:
+            continue
+        entradas = _compactar(item.entradas)
+        distribuicoes = _matrizes_distribuicao(entradas, distribuicoes_premissas.get(secao, {}), padrao)
+
+        service.usar_parametros(item.parametros)
+        _, valores = calcular_rubricas(entradas, plano, service.get_parametro)
+        for passo in plano.passos:
+            deterministico[categoria_por_passo[passo.indice]] += valores[passo.indice].sum(axis=0)
+
+        por_lote = max(1, MAX_CELULAS_LOTE // (len(entradas.quadros) * len(periodos)))
+        for indice_lote, inicio in enumerate(range(0, pedido.amostras, por_lote)):
+            quantidade = min(por_lote, pedido.amostras - inicio)
+            argumentos = (
+                entradas, plano, item.parametros, distribuicoes, categoria_por_passo, len(categorias),
+                quantidade,
+                (choques[0][inicio:inicio + quantidade], choques[1][inicio:inicio + quantidade]) if choques else None,
+                np.random.SeedSequence(semente, spawn_key=(indice_secao, indice_lote))
+            )
+            if pool is not None:
+                tarefas.append((inicio, quantidade, loop.run_in_executor(pool, _simular_lote, *argumentos)))
+            else:
+                amostras[inicio:inicio + quantidade] += _simular_lote(*argumentos)
+
+    for inicio, quantidade, tarefa in tarefas:
+        amostras[inicio:inicio + quantidade] += await tarefa
+
+    resposta_categorias = []
+    for c, categoria in enumerate(categorias):
+        if not amostras[:, c, :].any() and not deterministico[c].any():
+            continue
+        resposta_categorias.append({
+            "categoria": categoria,
+            "deterministico": round(float(deterministico[c].sum()), 2),
+            **_faixas(amostras[:, c, :], pedido.percentis),
+        })
+
+    return {
+        "cenario_id": str(cenario_id),
+        "cenario_secao_id": str(pedido.cenario_secao_id) if pedido.cenario_secao_id else None,
+        "periodos": [{"ano": ano, "mes": mes} for ano, mes in periodos],
+        "amostras": pedido.amostras,
+        "semente": semente,
+        "correlacao": pedido.correlacao,
+        "deterministico": {
+            "total": round(float(deterministico.sum()), 2),
+            "valores_mensais": [round(float(v), 2) for v in deterministico.sum(axis=0)],
+        },
+        "total": _faixas(amostras.sum(axis=1), pedido.percentis),
+        "categorias": resposta_categorias,
+        "tempo_segundos": round(time.perf_counter() - inicio_execucao, 3),
+    }
@@ -0,0 +1,107 @@
+"""
+Resolução dos parâmetros de custo (ParametroCusto) por seção.
+
+Os parâmetros do cenário são lidos uma única vez e indexados por
+(cenario_secao_id, tipo_custo_id, chave). Os vigentes em uma seção saem da
+sobreposição dos parâmetros da seção sobre os do cenário, e a busca segue a
+precedência:
+
+    (seção, rubrica) > (cenário, rubrica) > (seção, global) > (cenário, global) > padrão
+
+Para o laço do motor escalar, os parâmetros vigentes viram uma lista plana
+por (rubrica do plano, chave), acessada por índice inteiro.
+"""
+
+from typing import Dict, List, Optional, Tuple, Iterable
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models.orcamento import ParametroCusto
+from app.services.plano_rubricas import PlanoRubricas
+
+
+# (tipo_custo_id ou None = global, chave) -> valor
+Parametros = Dict[Tuple[Optional[UUID], str], float]
+
+# Chaves lidas pelas fórmulas das rubricas (posição na lista plana)
+CHAVES_PARAMETROS = (
+    "pct_horas_extras_50",
+    "pct_horas_extras_100",
+    "pct_elegibilidade_am",
+    "pct_elegibilidade_creche",
+    "pct_deslig_empresa",
+    "pct_nao_cumpre_aviso",
+    "pct_bonus_receita",
+    "pct_premios_receita",
+)
+(
+    PARAM_HE_50,
+    PARAM_HE_100,
+    PARAM_ELEGIBILIDADE_AM,
+    PARAM_ELEGIBILIDADE_CRECHE,
+    PARAM_DESLIG_EMPRESA,
+    PARAM_NAO_CUMPRE_AVISO,
+    PARAM_BONUS_RECEITA,
+    PARAM_PREMIOS_RECEITA,
+) = range(len(CHAVES_PARAMETROS))
+
+
+class TabelaParametros:
+    """Parâmetros de um cenário, separados em globais do cenário e por seção."""
+
+    def __init__(self, cenario_id: UUID, parametros: Iterable[ParametroCusto]):
+        self.cenario_id = cenario_id
+        self._cenario: Parametros = {}
+        self._secoes: Dict[UUID, Parametros] = {}
+        for p in parametros:
+            if p.cenario_secao_id is None:
+                destino = self._cenario
+            else:
+                destino = self._secoes.setdefault(p.cenario_secao_id, {})
+            destino[(p.tipo_custo_id, p.chave)] = float(p.valor)
+
+    def da_secao(self, cenario_secao_id: Optional[UUID]) -> Parametros:
+        """Parâmetros vigentes na seção (os da seção sobrepõem os do cenário)."""
+        vigentes = dict(self._cenario)
+        if cenario_secao_id is not None:
+            vigentes.update(self._secoes.get(cenario_secao_id, {}))
+        return vigentes
+
+
+async def carregar_tabela_parametros(db: AsyncSession, cenario_id: UUID) -> TabelaParametros:
+    """Lê todos os parâmetros do cenário (globais e de todas as seções) em uma consulta."""
+    result = await db.execute(select(ParametroCusto).where(ParametroCusto.cenario_id == cenario_id))
+    return TabelaParametros(cenario_id, result.scalars().all())
+
+
+def buscar_parametro(
+    parametros: Parametros,
+    chave: str,
+    tipo_custo_id: Optional[UUID] = None,
+    default: Optional[float] = 0
+) -> Optional[float]:
+    """Valor vigente: o da rubrica, senão o global, senão o padrão."""
+    if tipo_custo_id is not None:
+        valor = parametros.get((tipo_custo_id, chave))
+        if valor is not None:
+            return valor
+    return parametros.get((None, chave), default)
+
+
+def vetor_parametros(plano: PlanoRubricas, parametros: Parametros) -> List[Optional[float]]:
+    """
+    Valores vigentes por (rubrica, chave) em lista plana, posição
+    passo.indice * len(CHAVES_PARAMETROS) + PARAM_*. None = usar o padrão.
+    """
+    n = len(CHAVES_PARAMETROS)
+    globais = [parametros.get((None, chave)) for chave in CHAVES_PARAMETROS]
+    valores = globais * len(plano)
+    for passo in plano.passos:
+        inicio = passo.indice * n
+        for k, chave in enumerate(CHAVES_PARAMETROS):
+            valor = parametros.get((passo.id, chave))
+            if valor is not None:
+                valores[inicio + k] = valor
+    return valores
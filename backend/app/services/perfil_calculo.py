@@ -0,0 +1,212 @@
+"""
+Perfil de execução dos cálculos (custos, rateio, tecnologia).
+
+Cada execução registra, por fase (carga do quadro, premissas, rubricas,
+gravação, rateio...), o tempo de parede, as consultas SQL e as linhas
+produzidas, além do tempo acumulado de cada rubrica e o tempo de cada seção.
+O perfil é gravado em custos_perfis_calculo ao fim da execução e exposto pela
+API, para que regressões apareçam em produção sem anexar um profiler.
+
+As consultas são contadas por um listener de Engine (before_cursor_execute)
+que consulta o perfil ativo em um ContextVar: só contam as consultas da tarefa
+perfilada. COPY (gravacao_lote) não passa pelo cursor e conta só em linhas.
+Chamadas aninhadas (ex: rateio dentro do cálculo de custos) entram como fase
+do perfil do chamador. Tempo e consultas de fases aninhadas ("rateio/origem")
+estão incluídos na fase de cima; linhas são contadas só onde são produzidas.
+"""
+
+from typing import List, Dict, Optional, Any, AsyncIterator, Iterator
+from uuid import UUID, uuid4
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime
+import time
+
+from sqlalchemy import event, select, delete
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.models.orcamento import CustoPerfilCalculo
+
+
+OPERACAO_CUSTOS = "custos"
+OPERACAO_RATEIO = "rateio"
+OPERACAO_TECNOLOGIA = "tecnologia"
+OPERACAO_RECEITAS = "receitas"
+
+
+@dataclass
+class Fase:
+    segundos: float = 0.0
+    consultas: int = 0
+    linhas: int = 0
+    chamadas: int = 0
+
+
+class PerfilCalculo:
+    """Medições de uma execução (uma por tarefa, ver perfilar)."""
+
+    def __init__(self, operacao: str, motor: Optional[str] = None):
+        self.id = uuid4()
+        self.operacao = operacao
+        self.motor = motor
+        self.iniciado_em = datetime.utcnow()
+        self.consultas = 0
+        self.fases: Dict[str, Fase] = {}
+        self.rubricas: Dict[str, float] = {}
+        self.secoes: Dict[str, Dict[str, float]] = {}
+        self._inicio = time.perf_counter()
+        self._pilha: List[str] = []
+
+    @contextmanager
+    def fase(self, nome: str, secao: Optional[UUID] = None) -> Iterator[Fase]:
+        """Mede o bloco como fase (dentro da fase corrente, se houver) e, opcionalmente, da seção."""
+        self._pilha.append(nome)
+        caminho = "/".join(self._pilha)
+        fase = self.fases.setdefault(caminho, Fase())
+        inicio, consultas = time.perf_counter(), self.consultas
+        try:
+            yield fase
+        finally:
+            self._pilha.pop()
+            segundos = time.perf_counter() - inicio
+            fase.segundos += segundos
+            fase.consultas += self.consultas - consultas
+            fase.chamadas += 1
+            if secao is not None:
+                tempos = self.secoes.setdefault(str(secao), {})
+                tempos[nome] = tempos.get(nome, 0.0) + segundos
+
+    def duracao(self) -> float:
+        return time.perf_counter() - self._inicio
+
+    def para_modelo(self, cenario_id: UUID, cenario_secao_id: Optional[UUID], ano: Optional[int]) -> CustoPerfilCalculo:
+        return CustoPerfilCalculo(
+            id=self.id,
+            cenario_id=cenario_id,
+            cenario_secao_id=cenario_secao_id,
+            ano=ano,
+            operacao=self.operacao,
+            motor=self.motor,
+            duracao_ms=int(self.duracao() * 1000),
+            consultas=self.consultas,
+            linhas=sum(f.linhas for f in self.fases.values()),
+            fases=[
+                {
+                    "fase": caminho,
+                    "segundos": round(f.segundos, 4),
+                    "consultas": f.consultas,
+                    "linhas": f.linhas,
+                    "chamadas": f.chamadas,
+                }
+                for caminho, f in self.fases.items()
+            ],
+            rubricas={
+                codigo: round(segundos, 5)
+                for codigo, segundos in sorted(self.rubricas.items(), key=lambda item: -item[1])
+            },
+            secoes={
+                secao: {nome: round(v, 4) for nome, v in tempos.items()}
+                for secao, tempos in self.secoes.items()
+            },
+            iniciado_em=self.iniciado_em
+        )
+
+
+_perfil_atual: ContextVar[Optional[PerfilCalculo]] = ContextVar("perfil_calculo", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _contar_consulta(conn, cursor, statement, parameters, context, executemany):
+    perfil = _perfil_atual.get()
+    if perfil is not None:
+        perfil.consultas += 1
+
+
+@contextmanager
+def fase(nome: str, secao: Optional[UUID] = None) -> Iterator[Fase]:
+    """Fase do perfil ativo; sem perfil ativo, só executa o bloco."""
+    perfil = _perfil_atual.get()
+    if perfil is None:
+        yield Fase()
+        return
+    with perfil.fase(nome, secao) as f:
+        yield f
+
+
+def tempos_rubricas() -> Optional[Dict[str, float]]:
+    """Acumulador de tempo por rubrica do perfil ativo (None = sem perfil)."""
+    perfil = _perfil_atual.get()
+    return perfil.rubricas if perfil is not None else None
+
+
+@asynccontextmanager
+async def perfilar(
+    db: AsyncSession,
+    operacao: str,
+    cenario_id: UUID,
+    cenario_secao_id: Optional[UUID] = None,
+    ano: Optional[int] = None,
+    motor: Optional[str] = None
+) -> AsyncIterator[PerfilCalculo]:
+    """
+    Perfila a execução do bloco. Se já houver um perfil ativo, o bloco vira
+    uma fase dele; senão, abre um perfil e o grava (com commit) ao final,
+    se o bloco terminar sem erro.
+    """
+    atual = _perfil_atual.get()
+    if atual is not None:
+        with atual.fase(operacao):
+            yield atual
+        return
+
+    perfil = PerfilCalculo(operacao, motor)
+    token = _perfil_atual.set(perfil)
+    try:
+        yield perfil
+    finally:
+        _perfil_atual.reset(token)
+
+    db.add(perfil.para_modelo(cenario_id, cenario_secao_id, ano))
+    await _remover_antigos(db, cenario_id)
+    await db.commit()
+
+
+async def _remover_antigos(db: AsyncSession, cenario_id: UUID) -> None:
+    """Mantém só os últimos CUSTOS_PERFIS_POR_CENARIO perfis do cenário."""
+    await db.flush()
+    mantidos = (
+        select(CustoPerfilCalculo.id)
+        .where(CustoPerfilCalculo.cenario_id == cenario_id)
+        .order_by(CustoPerfilCalculo.iniciado_em.desc())
+        .limit(settings.CUSTOS_PERFIS_POR_CENARIO)
+    )
+    await db.execute(
+        delete(CustoPerfilCalculo).where(
+            CustoPerfilCalculo.cenario_id == cenario_id,
+            CustoPerfilCalculo.id.not_in(mantidos)
+        )
+    )
+
+
+def perfil_para_dict(perfil: CustoPerfilCalculo, detalhes: bool = True) -> Dict[str, Any]:
+    """Representação do perfil para a API."""
+    dados = {
+        "id": str(perfil.id),
+        "cenario_id": str(perfil.cenario_id),
+        "cenario_secao_id": str(perfil.cenario_secao_id) if perfil.cenario_secao_id else None,
+        "ano": perfil.ano,
+        "operacao": perfil.operacao,
+        "motor": perfil.motor,
+        "duracao_ms": perfil.duracao_ms,
+        "consultas": perfil.consultas,
+        "linhas": perfil.linhas,
+        "iniciado_em": perfil.iniciado_em.isoformat() if perfil.iniciado_em else None,
+    }
+    if detalhes:
+        dados["fases"] = perfil.fases
+        dados["rubricas"] = perfil.rubricas
+        dados["secoes"] = perfil.secoes
+    return dados
@@ -0,0 +1,246 @@
+"""
+Plano de execução das rubricas de custo.
+
+Compila o conjunto de TipoCusto ativos em um plano imutável:
+- ordem topológica (rubrica_base_id + referências fixas entre códigos Totvs),
+  desempatada pela coluna `ordem`;
+- índices das rubricas que compõem cada base (incide_fgts, incide_inss,
+  reflexo_ferias, reflexo_13), já restritos às rubricas calculadas antes;
+- alíquotas resolvidas (cadastro ou padrão da rubrica).
+
+O plano fica em cache até tipos_custo mudar, de modo que o laço de cálculo
+não faz ordenação, getattr nem buscas em dicionário.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Any
+from uuid import UUID
+import heapq
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func
+
+from app.db.models.orcamento import TipoCusto
+
+
+FLAGS_BASE = ("incide_fgts", "incide_inss", "reflexo_ferias", "reflexo_13")
+
+
+class CicloRubricasError(ValueError):
+    """Dependência circular entre rubricas; `rubricas` traz os códigos envolvidos."""
+
+    def __init__(self, rubricas: List[str]):
+        super().__init__(f"Ciclo de dependência entre rubricas: {', '.join(rubricas)}")
+        self.rubricas = rubricas
+
+
+@dataclass(frozen=True)
+class PassoRubrica:
+    """Uma rubrica do plano, com tudo o que o cálculo precisa já resolvido."""
+    indice: int
+    id: UUID
+    codigo: str
+    ordem: int
+    tipo_calculo: Optional[str]
+    aliquota_padrao: Optional[float]  # Valor do cadastro (gravado em indice_aplicado)
+    aliquota: float  # Alíquota resolvida em decimal (cadastro ou padrão da rubrica)
+    incide_fgts: bool
+    incide_inss: bool
+    reflexo_ferias: bool
+    reflexo_13: bool
+    indices_base: Tuple[int, ...]  # Rubricas anteriores que compõem a base desta
+    indices_referencia: Tuple[int, ...]  # Rubricas referenciadas pela fórmula (na ordem da fórmula)
+
+
+@dataclass(frozen=True)
+class PlanoRubricas:
+    """Plano imutável de cálculo das rubricas."""
+    versao: Tuple[Any, ...]
+    passos: Tuple[PassoRubrica, ...]
+    codigos_por_flag: Dict[str, Tuple[str, ...]]
+    indice_por_codigo: Dict[str, int]
+
+    def __len__(self) -> int:
+        return len(self.passos)
+
+
+def _regras_rubricas() -> Tuple[Dict[str, str], Dict[str, Tuple[str, ...]], Dict[str, float]]:
+    """
+    Regras fixas das fórmulas por código Totvs:
+    (flag da base, códigos referenciados, alíquota padrão em %).
+    """
+    from app.services import calculo_custos as cc
+
+    flag_base = {
+        cc.COD_FGTS: "incide_fgts",
+        cc.COD_INSS_EMP: "incide_inss",
+        cc.COD_INSS_TERC: "incide_inss",
+        cc.COD_SAT_RAT: "incide_inss",
+        cc.COD_PROV_FERIAS: "reflexo_ferias",
+        cc.COD_PROV_13: "reflexo_13",
+    }
+    referencias = {
+        cc.COD_DSR: (cc.COD_HE_50, cc.COD_HE_100),
+        cc.COD_FGTS_FERIAS: (cc.COD_PROV_FERIAS,),
+        cc.COD_INSS_FERIAS: (cc.COD_PROV_FERIAS,),
+        cc.COD_FGTS_13: (cc.COD_PROV_13,),
+        cc.COD_INSS_13: (cc.COD_PROV_13,),
+        cc.COD_INDENIZ: (cc.COD_SALARIO,),
+        cc.COD_DESC_VT: (cc.COD_VT,),
+        cc.COD_DESC_VR: (cc.COD_VR,),
+    }
+    aliquota_padrao = {
+        cc.COD_FGTS: 8.0,
+        cc.COD_INSS_EMP: 20.0,
+        cc.COD_INSS_TERC: 5.8,
+        cc.COD_SAT_RAT: 3.0,
+        cc.COD_PROV_FERIAS: 11.11,
+        cc.COD_FGTS_FERIAS: 8.0,
+        cc.COD_INSS_FERIAS: 28.8,
+        cc.COD_PROV_13: 8.33,
+        cc.COD_FGTS_13: 8.0,
+        cc.COD_INSS_13: 28.8,
+        cc.COD_INDENIZ: 0.0,
+    }
+    return flag_base, referencias, aliquota_padrao
+
+
+def compilar_plano(tipos: List[TipoCusto], versao: Tuple[Any, ...] = ()) -> PlanoRubricas:
+    """
+    Compila os tipos de custo ativos em um plano de execução.
+
+    Raises:
+        CicloRubricasError: se houver ciclo de dependência entre rubricas
+    """
+    flag_base, referencias, aliquota_padrao = _regras_rubricas()
+
+    por_codigo = {t.codigo: t for t in tipos}
+    por_id = {t.id: t for t in tipos}
+
+    # Dependências: rubrica_base_id + referências fixas das fórmulas
+    dependencias: Dict[str, set] = {t.codigo: set() for t in tipos}
+    for t in tipos:
+        base = por_id.get(t.rubrica_base_id) if t.rubrica_base_id else None
+        if base is not None and base.codigo != t.codigo:
+            dependencias[t.codigo].add(base.codigo)
+        for ref in referencias.get(t.codigo, ()):
+            if ref in por_codigo and ref != t.codigo:
+                dependencias[t.codigo].add(ref)
+
+    # Ordenação topológica (Kahn), desempatando pela ordem cadastrada
+    chave = {t.codigo: (t.ordem or 0, i) for i, t in enumerate(tipos)}
+    dependentes: Dict[str, List[str]] = {c: [] for c in dependencias}
+    pendentes = {c: len(deps) for c, deps in dependencias.items()}
+    for codigo, deps in dependencias.items():
+        for dep in deps:
+            dependentes[dep].append(codigo)
+
+    fila = [(chave[c], c) for c, n in pendentes.items() if n == 0]
+    heapq.heapify(fila)
+    ordem_final: List[str] = []
+    while fila:
+        _, codigo = heapq.heappop(fila)
+        ordem_final.append(codigo)
+        for dependente in dependentes[codigo]:
+            pendentes[dependente] -= 1
+            if pendentes[dependente] == 0:
+                heapq.heappush(fila, (chave[dependente], dependente))
+
+    if len(ordem_final) != len(tipos):
+        em_ciclo = sorted(c for c, n in pendentes.items() if n > 0)
+        raise CicloRubricasError(em_ciclo)
+
+    indice_por_codigo = {codigo: i for i, codigo in enumerate(ordem_final)}
+
+    passos = []
+    for i, codigo in enumerate(ordem_final):
+        t = por_codigo[codigo]
+
+        # Base: rubricas com a flag calculadas antes desta
+        flag = flag_base.get(codigo)
+        indices_base: Tuple[int, ...] = ()
+        if flag:
+            indices_base = tuple(
+                j for j, anterior in enumerate(ordem_final[:i])
+                if getattr(por_codigo[anterior], flag, False)
+            )
+
+        # Referências fora do plano (rubrica inativa) ficam como -1 (valor zero)
+        indices_referencia = tuple(
+            indice_por_codigo.get(ref, -1) for ref in referencias.get(codigo, ())
+        )
+
+        if t.aliquota_padrao is not None:
+            aliquota = float(t.aliquota_padrao) / 100
+        else:
+            aliquota = aliquota_padrao.get(codigo, 0.0) / 100
+
+        passos.append(PassoRubrica(
+            indice=i,
+            id=t.id,
+            codigo=codigo,
+            ordem=t.ordem or 0,
+            tipo_calculo=t.tipo_calculo,
+            aliquota_padrao=float(t.aliquota_padrao) if t.aliquota_padrao is not None else None,
+            aliquota=aliquota,
+            incide_fgts=bool(t.incide_fgts),
+            incide_inss=bool(t.incide_inss),
+            reflexo_ferias=bool(t.reflexo_ferias),
+            reflexo_13=bool(t.reflexo_13),
+            indices_base=indices_base,
+            indices_referencia=indices_referencia,
+        ))
+
+    codigos_por_flag = {
+        flag: tuple(p.codigo for p in passos if getattr(p, flag))
+        for flag in FLAGS_BASE
+    }
+
+    return PlanoRubricas(
+        versao=versao,
+        passos=tuple(passos),
+        codigos_por_flag=codigos_por_flag,
+        indice_por_codigo=indice_por_codigo,
+    )
+
+
+# ============================================
+# CACHE DO PLANO
+# ============================================
+
+_plano_cache: Optional[PlanoRubricas] = None
+
+
+def invalidar_plano_rubricas() -> None:
+    """Descarta o plano em cache (chamar após alterar tipos_custo)."""
+    global _plano_cache
+    _plano_cache = None
+
+
+async def _versao_tipos_custo(db: AsyncSession) -> Tuple[Any, ...]:
+    """Assinatura barata de tipos_custo para detectar alterações (inclusive de outros processos)."""
+    result = await db.execute(
+        select(
+            func.count(TipoCusto.id),
+            func.max(TipoCusto.updated_at),
+            func.max(TipoCusto.created_at),
+        ).where(TipoCusto.ativo == True)
+    )
+    return tuple(result.one())
+
+
+async def obter_plano_rubricas(db: AsyncSession) -> PlanoRubricas:
+    """Retorna o plano de rubricas, compilando apenas se tipos_custo mudou."""
+    global _plano_cache
+
+    versao = await _versao_tipos_custo(db)
+    if _plano_cache is not None and _plano_cache.versao == versao:
+        return _plano_cache
+
+    result = await db.execute(
+        select(TipoCusto).where(TipoCusto.ativo == True).order_by(TipoCusto.ordem)
+    )
+    tipos = result.scalars().all()
+
+    _plano_cache = compilar_plano(tipos, versao)
+    return _plano_cache
@@ -0,0 +1,489 @@
+"""
+Distribuição dos rateios em SQL (INSERT ... SELECT).
+
+Em vez de carregar os custos do CC POOL para o Python e montar uma linha por
+(custo, destino), os percentuais de todos os grupos vão para uma tabela
+temporária (grupo, CC origem, CC destino, mês, percentual) e cada grupo é
+distribuído por um INSERT ... SELECT que junta custos_calculados (e
+custos_diretos, para os custos diretos do POOL) a essa tabela. O valor mensal
+dos custos diretos depende do HC/PA do cubo de drivers e vai para outra
+tabela temporária, calculado como no DRE. O volume
+rateado não passa pela aplicação: a memória fica constante e o tempo é o do
+próprio Postgres.
+
+Os grupos são distribuídos em ordem, um comando por grupo, para que um grupo
+cujo POOL recebe rateio de outro enxergue as linhas já inseridas. No rateio
+recíproco (ver rateio_reciproco), a tabela leva os fatores já resolvidos e
+todos os grupos saem em um único comando.
+
+No modo "diff", o grupo é distribuído para uma tabela temporária de novos
+rateios e sincronizado com o gravado por UPDATE (alterados), DELETE (que
+sumiram) e INSERT (novos), todos em SQL, preservando os ids existentes.
+
+As tabelas temporárias são descartadas no commit (ON COMMIT DROP).
+"""
+
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+from uuid import UUID
+from decimal import Decimal
+from datetime import datetime
+
+from sqlalchemy import (
+    MetaData, Table, Column, String, Integer, Numeric, and_, or_, cast, exists, func,
+    insert, literal, null, select, true, update, delete, tuple_, values, column
+)
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID, JSONB
+from sqlalchemy.schema import CreateTable, DropTable
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models.orcamento import CustoCalculado, CustoDireto, ProdutoTecnologia, TipoCusto
+from app.services.gravacao_lote import ResumoSincronizacao
+from app.services.cubo_drivers import obter_cubo_drivers
+from app.services.dre_resumo import valores_custo_direto
+
+
+_metadata = MetaData()
+_custos = CustoCalculado.__table__
+
+# Percentuais de todos os grupos da execução, por mês (só destinos com percentual > 0)
+destinos_rateio = Table(
+    "tmp_rateio_destinos",
+    _metadata,
+    Column("grupo_id", PG_UUID(as_uuid=True), nullable=False),
+    Column("grupo_nome", String),
+    Column("tipo_rateio", String),
+    Column("cc_origem_id", PG_UUID(as_uuid=True), nullable=False),
+    Column("cc_destino_id", PG_UUID(as_uuid=True), nullable=False),
+    Column("mes", Integer, nullable=False),
+    Column("percentual", Numeric),  # arredondado, para a memória de cálculo
+    Column("fator", Numeric),  # percentual / 100, aplicado aos valores
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+# Valor de cada mês (jan-dez) dos custos diretos ativos dos POOLs, calculado no Python
+# com o mesmo critério do DRE (HC/PA do cubo de drivers, ver dre_resumo.valores_custo_direto)
+valores_diretos = Table(
+    "tmp_rateio_diretos",
+    _metadata,
+    Column("custo_direto_id", PG_UUID(as_uuid=True), nullable=False),
+    Column("mes", Integer, nullable=False),
+    Column("valor", Numeric),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+# Rateios novos de um grupo (modo diff): mesmas colunas e escalas de custos_calculados
+rateios_novos = Table(
+    "tmp_rateio_novos",
+    _metadata,
+    *[Column(c.name, c.type) for c in _custos.columns],
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+# Colunas preenchidas pelo rateio (as demais ficam NULL)
+COLUNAS_RATEIO = (
+    "id", "cenario_id", "cenario_secao_id", "funcao_id", "faixa_id", "tipo_custo_id",
+    "centro_custo_id", "mes", "ano", "hc_base", "valor_base", "indice_aplicado",
+    "valor_calculado", "rateio_grupo_id", "custo_origem_id", "custo_direto_id",
+    "memoria_calculo", "created_at", "updated_at",
+)
+
+# Campos comparados na sincronização (os mesmos de CAMPOS_VALOR_CUSTO)
+_CAMPOS_VALOR = ("hc_base", "valor_base", "indice_aplicado", "valor_calculado", "memoria_calculo")
+
+
+async def _recriar(db: AsyncSession, tabela: Table) -> None:
+    await db.execute(DropTable(tabela, if_exists=True))
+    await db.execute(CreateTable(tabela))
+
+
+async def preparar_destinos(db: AsyncSession, destinos: List[Dict[str, Any]]) -> None:
+    """Cria a tabela temporária de percentuais e grava os destinos (um executemany)."""
+    await _recriar(db, destinos_rateio)
+    if destinos:
+        await db.execute(destinos_rateio.insert(), destinos)
+
+
+async def preparar_novos(db: AsyncSession) -> None:
+    """Cria (vazia) a tabela temporária de rateios novos do modo diff."""
+    await _recriar(db, rateios_novos)
+
+
+async def preparar_valores_diretos(
+    db: AsyncSession,
+    cenario_id: UUID,
+    ccs_origem: Sequence[UUID]
+) -> None:
+    """Cria a tabela temporária com o valor mensal dos custos diretos ativos dos CCs POOL."""
+    await _recriar(db, valores_diretos)
+    if not ccs_origem:
+        return
+    result = await db.execute(
+        select(CustoDireto).where(
+            CustoDireto.cenario_id == cenario_id,
+            CustoDireto.centro_custo_id.in_(list(ccs_origem)),
+            CustoDireto.ativo == True
+        )
+    )
+    custos = result.scalars().all()
+    if not custos:
+        return
+    cubo = await obter_cubo_drivers(db, cenario_id)
+    linhas = [
+        {"custo_direto_id": custo.id, "mes": mes, "valor": Decimal(str(valor))}
+        for custo in custos
+        for mes, valor in enumerate(valores_custo_direto(custo, cubo), start=1)
+        if valor
+    ]
+    if linhas:
+        await db.execute(valores_diretos.insert(), linhas)
+
+
+async def garantir_tipos_custo_diretos(
+    db: AsyncSession,
+    cenario_id: UUID,
+    ccs_origem: Sequence[UUID]
+) -> None:
+    """
+    Cria, de uma vez, os TipoCusto "CD_<produto>" que faltam para os custos
+    diretos ativos dos CCs POOL (a distribuição junta por código).
+    """
+    if not ccs_origem:
+        return
+    result = await db.execute(
+        select(ProdutoTecnologia)
+        .join(CustoDireto, CustoDireto.item_custo_id == ProdutoTecnologia.id)
+        .where(
+            CustoDireto.cenario_id == cenario_id,
+            CustoDireto.centro_custo_id.in_(list(ccs_origem)),
+            CustoDireto.ativo == True
+        )
+        .distinct()
+    )
+    produtos = {f"CD_{p.codigo}": p for p in result.scalars().all()}
+    if not produtos:
+        return
+
+    existentes = await db.execute(select(TipoCusto.codigo).where(TipoCusto.codigo.in_(list(produtos))))
+    faltando = set(produtos) - set(existentes.scalars().all())
+    for codigo in sorted(faltando):
+        produto = produtos[codigo]
+        db.add(TipoCusto(
+            codigo=codigo,
+            nome=produto.nome,
+            categoria=produto.categoria or "CUSTO_DIRETO",
+            tipo_calculo="HC_X_VALOR",
+            conta_contabil_codigo=produto.conta_contabil_codigo,
+            conta_contabil_descricao=produto.conta_contabil_descricao,
+            ativo=True
+        ))
+    if faltando:
+        await db.flush()
+
+
+def _filtro_celulas(celulas: Optional[List[Tuple[UUID, UUID, int, int]]]):
+    if celulas is None:
+        return true()
+    return tuple_(_custos.c.cenario_secao_id, _custos.c.funcao_id, _custos.c.ano, _custos.c.mes).in_(celulas)
+
+
+async def contar_origem(
+    db: AsyncSession,
+    cenario_id: UUID,
+    cc_origem_id: UUID,
+    celulas: Optional[List[Tuple[UUID, UUID, int, int]]]
+) -> int:
+    """Custos do CC POOL a ratear (calculados e, sem filtro de células, diretos ativos)."""
+    result = await db.execute(
+        select(func.count()).select_from(_custos).where(
+            _custos.c.cenario_id == cenario_id,
+            _custos.c.centro_custo_id == cc_origem_id,
+            _filtro_celulas(celulas)
+        )
+    )
+    total = result.scalar_one()
+    if celulas is None:
+        result = await db.execute(
+            select(func.count()).select_from(CustoDireto).where(
+                CustoDireto.cenario_id == cenario_id,
+                CustoDireto.centro_custo_id == cc_origem_id,
+                CustoDireto.ativo == True
+            )
+        )
+        total += result.scalar_one()
+    return total
+
+
+async def contar_origens(
+    db: AsyncSession,
+    cenario_id: UUID,
+    ccs_origem: Sequence[UUID],
+    celulas: Optional[List[Tuple[UUID, UUID, int, int]]]
+) -> Dict[UUID, int]:
+    """Custos próprios de cada CC POOL (sem rateios recebidos), como contar_origem, em uma consulta por tabela."""
+    result = await db.execute(
+        select(_custos.c.centro_custo_id, func.count())
+        .where(
+            _custos.c.cenario_id == cenario_id,
+            _custos.c.centro_custo_id.in_(list(ccs_origem)),
+            _custos.c.rateio_grupo_id.is_(None),
+            _filtro_celulas(celulas)
+        )
+        .group_by(_custos.c.centro_custo_id)
+    )
+    totais = dict(result.all())
+    if celulas is None:
+        result = await db.execute(
+            select(CustoDireto.centro_custo_id, func.count())
+            .where(
+                CustoDireto.cenario_id == cenario_id,
+                CustoDireto.centro_custo_id.in_(list(ccs_origem)),
+                CustoDireto.ativo == True
+            )
+            .group_by(CustoDireto.centro_custo_id)
+        )
+        for cc_id, quantidade in result.all():
+            totais[cc_id] = totais.get(cc_id, 0) + quantidade
+    return totais
+
+
+def _memoria(memoria_linha: bool, *pares):
+    """json_build_object com a memória do rateio (NULL fora do modo "linha")."""
+    if not memoria_linha:
+        return cast(null(), _custos.c.memoria_calculo.type)
+    argumentos = []
+    for chave, valor in pares:
+        argumentos.extend([literal(chave), valor])
+    return func.json_build_object(*argumentos)
+
+
+def _memoria_comum(d) -> List[Tuple[str, Any]]:
+    return [
+        ("tipo", literal("rateio")),
+        ("tipo_rateio", d.c.tipo_rateio),
+        ("grupo_rateio", cast(d.c.grupo_id, String)),
+        ("grupo_nome", d.c.grupo_nome),
+        ("cc_origem", cast(d.c.cc_origem_id, String)),
+        ("cc_destino", cast(d.c.cc_destino_id, String)),
+        ("percentual", d.c.percentual),
+    ]
+
+
+def _do_grupo(d, grupo_id: Optional[UUID]):
+    return true() if grupo_id is None else d.c.grupo_id == grupo_id
+
+
+def consulta_rateio_custos(
+    cenario_id: UUID,
+    grupo_id: Optional[UUID],
+    celulas: Optional[List[Tuple[UUID, UUID, int, int]]],
+    memoria_linha: bool,
+    agora: datetime,
+    apenas_proprios: bool = False
+):
+    """
+    SELECT dos custos calculados do POOL do grupo (None = de todos os grupos
+    da tabela de destinos), um por CC destino, já rateados.
+    `apenas_proprios` deixa de fora o que o POOL recebeu de outros rateios.
+    """
+    c = _custos
+    d = destinos_rateio
+    colunas = {
+        "id": func.gen_random_uuid(),
+        "cenario_id": c.c.cenario_id,
+        "cenario_secao_id": c.c.cenario_secao_id,
+        "funcao_id": c.c.funcao_id,
+        "faixa_id": c.c.faixa_id,
+        "tipo_custo_id": c.c.tipo_custo_id,
+        "centro_custo_id": d.c.cc_destino_id,
+        "mes": c.c.mes,
+        "ano": c.c.ano,
+        "hc_base": func.coalesce(c.c.hc_base, 0) * d.c.fator,
+        "valor_base": c.c.valor_base,
+        "indice_aplicado": c.c.indice_aplicado,
+        "valor_calculado": c.c.valor_calculado * d.c.fator,
+        "rateio_grupo_id": d.c.grupo_id,
+        "custo_origem_id": c.c.id,
+        "custo_direto_id": cast(null(), c.c.custo_direto_id.type),
+        "memoria_calculo": _memoria(
+            memoria_linha, *_memoria_comum(d), ("custo_original_id", cast(c.c.id, String))
+        ),
+        "created_at": literal(agora, c.c.created_at.type),
+        "updated_at": literal(agora, c.c.updated_at.type),
+    }
+    return (
+        select(*[colunas[nome].label(nome) for nome in COLUNAS_RATEIO])
+        .select_from(c.join(d, and_(
+            d.c.cc_origem_id == c.c.centro_custo_id, d.c.mes == c.c.mes, _do_grupo(d, grupo_id)
+        )))
+        .where(
+            c.c.cenario_id == cenario_id,
+            _filtro_celulas(celulas),
+            c.c.rateio_grupo_id.is_(None) if apenas_proprios else true()
+        )
+    )
+
+
+def consulta_rateio_diretos(
+    cenario_id: UUID,
+    grupo_id: Optional[UUID],
+    periodos: List[Tuple[int, int]],
+    memoria_linha: bool,
+    agora: datetime
+):
+    """
+    SELECT dos custos diretos ativos do POOL do grupo (None = todos), por mês da
+    janela e CC destino. O valor do mês vem de valores_diretos (ver preparar_valores_diretos).
+    """
+    c = _custos
+    d = destinos_rateio
+    v = valores_diretos
+    cd = CustoDireto.__table__
+    p = ProdutoTecnologia.__table__
+    t = TipoCusto.__table__
+    meses = values(column("ano", Integer), column("mes", Integer), name="periodos").data(periodos)
+
+    valor_mensal = v.c.valor
+    colunas = {
+        "id": func.gen_random_uuid(),
+        "cenario_id": cd.c.cenario_id,
+        "cenario_secao_id": cd.c.cenario_secao_id,
+        "funcao_id": cast(null(), c.c.funcao_id.type),
+        "faixa_id": cast(null(), c.c.faixa_id.type),
+        "tipo_custo_id": t.c.id,
+        "centro_custo_id": d.c.cc_destino_id,
+        "mes": meses.c.mes,
+        "ano": meses.c.ano,
+        "hc_base": literal(Decimal("0"), c.c.hc_base.type),
+        "valor_base": valor_mensal,
+        "indice_aplicado": d.c.fator,
+        "valor_calculado": valor_mensal * d.c.fator,
+        "rateio_grupo_id": d.c.grupo_id,
+        "custo_origem_id": cast(null(), c.c.custo_origem_id.type),
+        "custo_direto_id": cd.c.id,
+        "memoria_calculo": _memoria(
+            memoria_linha, *_memoria_comum(d),
+            ("custo_direto_id", cast(cd.c.id, String)),
+            ("produto_nome", p.c.nome)
+        ),
+        "created_at": literal(agora, c.c.created_at.type),
+        "updated_at": literal(agora, c.c.updated_at.type),
+    }
+    return (
+        select(*[colunas[nome].label(nome) for nome in COLUNAS_RATEIO])
+        .select_from(
+            cd.join(p, p.c.id == cd.c.item_custo_id)
+            .join(t, t.c.codigo == literal("CD_") + p.c.codigo)
+            .join(d, and_(d.c.cc_origem_id == cd.c.centro_custo_id, _do_grupo(d, grupo_id)))
+            .join(meses, meses.c.mes == d.c.mes)
+            .join(v, and_(v.c.custo_direto_id == cd.c.id, v.c.mes == meses.c.mes))
+        )
+        .where(cd.c.cenario_id == cenario_id, cd.c.ativo == True)
+    )
+
+
+async def inserir_rateio(db: AsyncSession, consulta, diff: bool) -> Tuple[int, Decimal]:
+    """
+    INSERT ... SELECT da consulta em custos_calculados (ou na tabela de novos, no diff).
+
+    Returns:
+        (linhas inseridas, soma de valor_calculado)
+    """
+    tabela = rateios_novos if diff else _custos
+    inseridos = (
+        insert(tabela)
+        .from_select(list(COLUNAS_RATEIO), consulta)
+        .returning(tabela.c.valor_calculado)
+        .cte("inseridos")
+    )
+    result = await db.execute(
+        select(func.count(), func.coalesce(func.sum(inseridos.c.valor_calculado), 0))
+    )
+    linhas, valor = result.one()
+    return linhas, Decimal(valor)
+
+
+def _mesma_chave(e, n):
+    """Chave de emparelhamento dos rateios (a de _chave_custo em calculo_custos)."""
+    return and_(
+        e.c.rateio_grupo_id == n.c.rateio_grupo_id,
+        func.coalesce(e.c.custo_origem_id, e.c.custo_direto_id)
+        == func.coalesce(n.c.custo_origem_id, n.c.custo_direto_id),
+        e.c.centro_custo_id == n.c.centro_custo_id,
+        e.c.tipo_custo_id == n.c.tipo_custo_id,
+        e.c.mes == n.c.mes,
+        e.c.ano == n.c.ano,
+    )
+
+
+def _valor_comparavel(tabela: Table, campo: str):
+    coluna = tabela.c[campo]
+    # json não tem igualdade no Postgres: compara como jsonb
+    return cast(coluna, JSONB) if campo == "memoria_calculo" else coluna
+
+
+async def sincronizar_rateio(
+    db: AsyncSession,
+    cenario_id: UUID,
+    grupos_ids: Sequence[UUID]
+) -> ResumoSincronizacao:
+    """
+    Sincroniza os rateios gravados dos grupos com os da tabela de novos e a esvazia.
+    """
+    e = _custos
+    n = rateios_novos
+    resumo = ResumoSincronizacao()
+    do_grupo = and_(e.c.cenario_id == cenario_id, e.c.rateio_grupo_id.in_(list(grupos_ids)))
+
+    total = (await db.execute(select(func.count()).select_from(n))).scalar_one()
+
+    alterado = [
+        _valor_comparavel(e, campo).is_distinct_from(_valor_comparavel(n, campo))
+        for campo in _CAMPOS_VALOR
+    ]
+    result = await db.execute(
+        update(e)
+        .where(do_grupo, _mesma_chave(e, n), or_(*alterado))
+        .values(**{campo: n.c[campo] for campo in _CAMPOS_VALOR}, updated_at=n.c.updated_at)
+    )
+    resumo.atualizados = result.rowcount
+
+    result = await db.execute(
+        delete(e).where(do_grupo, ~exists().where(_mesma_chave(e, n)))
+    )
+    resumo.removidos = result.rowcount
+
+    result = await db.execute(
+        insert(e).from_select(
+            list(COLUNAS_RATEIO),
+            select(*[n.c[nome] for nome in COLUNAS_RATEIO]).where(
+                ~exists().where(do_grupo, _mesma_chave(e, n))
+            )
+        )
+    )
+    resumo.inseridos = result.rowcount
+    resumo.inalterados = total - resumo.inseridos - resumo.atualizados
+
+    await db.execute(delete(n))
+    return resumo
+
+
+async def remover_rateios_orfaos(
+    db: AsyncSession,
+    cenario_id: UUID,
+    grupos_sincronizados: Sequence[UUID],
+    escopo_grupos: Optional[Sequence[UUID]]
+) -> int:
+    """Remove rateios de grupos (do escopo) que não geraram custos nesta execução."""
+    query = delete(_custos).where(
+        _custos.c.cenario_id == cenario_id,
+        _custos.c.rateio_grupo_id.isnot(None)
+    )
+    if grupos_sincronizados:
+        query = query.where(_custos.c.rateio_grupo_id.notin_(list(grupos_sincronizados)))
+    if escopo_grupos is not None:
+        query = query.where(_custos.c.rateio_grupo_id.in_(list(escopo_grupos)))
+    result = await db.execute(query)
+    return result.rowcount
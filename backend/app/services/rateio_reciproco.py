@@ -0,0 +1,154 @@
+"""
+Rateio recíproco (multinível) entre centros de custo.
+
+No modo sequencial, cada grupo distribui o CC POOL de origem para os seus
+destinos, um grupo depois do outro; quando serviços compartilhados rateiam
+entre si (TI -> RH e RH -> TI), o resultado depende da ordem dos grupos.
+
+No modo recíproco, os grupos ativos do cenário formam o sistema
+
+    T = D + A T
+
+em que D é o custo próprio de cada CC de origem (POOL), A[i, j] a fração do
+POOL j que vai para o POOL i e T o custo total (próprio + recebido) de cada
+POOL. Os CCs que não são origem de nenhum grupo são os finais e recebem
+B T = B (I - A)^-1 D. A matriz F = B (I - A)^-1 é obtida com um único
+np.linalg.solve; como o sistema é linear, vale igual para toda rubrica: cada
+custo próprio do POOL j chega ao CC final k multiplicado por F[k, j]. Os
+percentuais HC/PA mudam de mês para mês, então o chamador resolve um sistema
+por mês.
+
+Para manter a origem de cada linha, o fator é decomposto por grupo: o que o
+grupo manda direto aos finais mais o que manda aos POOLs, já resolvido.
+"""
+
+from typing import Dict, List
+from uuid import UUID
+from dataclasses import dataclass
+
+import numpy as np
+
+
+# Frações abaixo disso não geram linha de rateio
+FATOR_MINIMO = 1e-12
+
+# Acima desse número de condição, (I - A) é tratada como singular
+CONDICAO_MAXIMA = 1e12
+
+
+class RateioReciprocoError(ValueError):
+    """Sistema do rateio recíproco sem solução; `grupos` são os nomes dos grupos envolvidos."""
+
+    def __init__(self, mensagem: str, grupos: List[str]):
+        super().__init__(mensagem)
+        self.grupos = grupos
+
+
+@dataclass
+class GrupoReciproco:
+    """Grupo de rateio com os percentuais já calculados (0-100 por CC destino)."""
+    grupo_id: UUID
+    nome: str
+    cc_origem_id: UUID
+    percentuais: Dict[UUID, float]
+
+
+def fatores_reciprocos(grupos: List[GrupoReciproco]) -> Dict[UUID, Dict[UUID, float]]:
+    """
+    Fração do custo próprio da origem de cada grupo que chega a cada CC final.
+
+    Returns:
+        Dict[grupo_id, Dict[cc_final_id, fração]] (só frações > FATOR_MINIMO)
+
+    Raises:
+        RateioReciprocoError: se algum grupo distribui só entre POOLs que nunca
+            chegam a um CC final, ou se a matriz entre os POOLs é singular
+    """
+    if not grupos:
+        return {}
+
+    pools = list(dict.fromkeys(g.cc_origem_id for g in grupos))
+    indice_pool = {cc: i for i, cc in enumerate(pools)}
+    finais = list(dict.fromkeys(
+        cc for g in grupos for cc, pct in g.percentuais.items()
+        if pct > 0 and cc not in indice_pool
+    ))
+    indice_final = {cc: k for k, cc in enumerate(finais)}
+
+    # Frações de cada grupo para POOLs (A_g) e para CCs finais (B_g)
+    a_grupos = np.zeros((len(grupos), len(pools)))
+    b_grupos = np.zeros((len(grupos), len(finais)))
+    for g, grupo in enumerate(grupos):
+        for cc, pct in grupo.percentuais.items():
+            if pct <= 0:
+                continue
+            if cc in indice_pool:
+                a_grupos[g, indice_pool[cc]] += pct / 100
+            else:
+                b_grupos[g, indice_final[cc]] += pct / 100
+
+    _verificar_saida(grupos, pools, indice_pool, a_grupos, b_grupos)
+
+    # Transpostas de A e B (linha = POOL de origem), somando os grupos de cada origem
+    origens = np.array([indice_pool[g.cc_origem_id] for g in grupos])
+    a_t = np.zeros((len(pools), len(pools)))
+    b_t = np.zeros((len(pools), len(finais)))
+    np.add.at(a_t, origens, a_grupos)
+    np.add.at(b_t, origens, b_grupos)
+
+    # F^T = (I - A)^-T B^T
+    sistema = np.eye(len(pools)) - a_t
+    if np.linalg.cond(sistema) > CONDICAO_MAXIMA:
+        # Só os grupos que mandam para outros POOLs entram no acoplamento
+        nomes = sorted({grupo.nome for g, grupo in enumerate(grupos) if a_grupos[g].any()})
+        raise RateioReciprocoError(
+            "Rateio recíproco sem solução: a matriz de rateio entre os CCs POOL é singular "
+            f"(grupos {', '.join(nomes)})",
+            nomes
+        )
+    f_t = np.linalg.solve(sistema, b_t)
+
+    # Por grupo: direto aos finais + via POOLs (já resolvido)
+    fatores = b_grupos + a_grupos @ f_t
+
+    return {
+        grupo.grupo_id: {
+            finais[k]: float(fatores[g, k])
+            for k in np.flatnonzero(fatores[g] > FATOR_MINIMO)
+        }
+        for g, grupo in enumerate(grupos)
+    }
+
+
+def _verificar_saida(
+    grupos: List[GrupoReciproco],
+    pools: List[UUID],
+    indice_pool: Dict[UUID, int],
+    a_grupos: np.ndarray,
+    b_grupos: np.ndarray
+) -> None:
+    """Todo POOL que distribui precisa alcançar algum CC final (direto ou via outros POOLs)."""
+    alcanca = np.zeros(len(pools), dtype=bool)
+    for g, grupo in enumerate(grupos):
+        if b_grupos[g].any():
+            alcanca[indice_pool[grupo.cc_origem_id]] = True
+
+    mudou = True
+    while mudou:
+        mudou = False
+        for g, grupo in enumerate(grupos):
+            j = indice_pool[grupo.cc_origem_id]
+            if not alcanca[j] and (a_grupos[g] > 0)[alcanca].any():
+                alcanca[j] = True
+                mudou = True
+
+    presos = sorted({
+        grupo.nome for g, grupo in enumerate(grupos)
+        if not alcanca[indice_pool[grupo.cc_origem_id]] and a_grupos[g].any()
+    })
+    if presos:
+        raise RateioReciprocoError(
+            "Rateio recíproco sem solução: os grupos "
+            f"{', '.join(presos)} distribuem só entre CCs POOL, sem chegar a um CC final",
+            presos
+        )
@@ -0,0 +1,444 @@
+"""
+Recálculo incremental de custos.
+
+As edições de quadro de pessoal e premissas registram as células alteradas
+(seção, função, ano, mês) em custos_alteracoes_pendentes em vez de apagar os
+custos do cenário. O recálculo incremental refaz apenas os CustoCalculado
+dessas células e os rateios derivados deles.
+
+Células, rateio, resumo do DRE e consumo das alterações pendentes são
+gravados em uma única transação: se algum passo falhar, nada muda e as
+alterações continuam pendentes para a próxima execução.
+"""
+
+from typing import List, Dict, Optional, Any, Tuple, Set
+from uuid import UUID
+from collections import defaultdict
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, func, tuple_
+
+from app.core.config import settings
+from app.db.models.orcamento import (
+    Cenario, QuadroPessoal, CustoCalculado, CustoAlteracaoPendente, CustoMemoriaPosicao,
+    RateioGrupo, RateioDestino
+)
+from app.services.calculo_custos import (
+    CalculoCustosService, ProgressoCallback, EtapaCallback, periodos_cenario, aplicar_rateio_custos,
+    calcular_e_salvar_custos, _inserir_registros, _separar_memoria, _gravar_memorias,
+    RATEIO_RECIPROCO
+)
+from app.services.impressao_calculo import invalidar_impressoes
+from app.services.dre_resumo import atualizar_dre_resumo, FONTE_PESSOAL
+from app.services.perfil_calculo import perfilar, OPERACAO_CUSTOS
+
+
+ORIGEM_QUADRO = "QUADRO"
+ORIGEM_PREMISSA = "PREMISSA"
+
+MESES = ['jan', 'fev', 'mar', 'abr', 'mai', 'jun', 'jul', 'ago', 'set', 'out', 'nov', 'dez']
+
+
+# ============================================
+# REGISTRO DE ALTERAÇÕES
+# ============================================
+
+def registrar_alteracao_quadro(
+    db: AsyncSession,
+    cenario_id: UUID,
+    cenario_secao_id: Optional[UUID],
+    funcao_id: Optional[UUID],
+    centro_custo_id: Optional[UUID] = None,
+    quadro_pessoal_id: Optional[UUID] = None,
+    meses: Optional[List[int]] = None
+) -> None:
+    """
+    Registra que o HC/salário do quadro mudou nas células informadas.
+
+    Args:
+        funcao_id: Função afetada (None = todas as funções da seção)
+        centro_custo_id: CC da posição (None = CC desconhecido, refaz todos os rateios HC/PA)
+        meses: Meses cujo HC mudou (None = todos os meses)
+    """
+    for mes in (meses or [None]):
+        db.add(CustoAlteracaoPendente(
+            cenario_id=cenario_id,
+            cenario_secao_id=cenario_secao_id,
+            funcao_id=funcao_id,
+            quadro_pessoal_id=quadro_pessoal_id,
+            centro_custo_id=centro_custo_id,
+            mes=mes,
+            ano=None,  # O HC do quadro vale para o mesmo mês de todos os anos da janela
+            origem=ORIGEM_QUADRO
+        ))
+
+
+def registrar_alteracao_posicao(
+    db: AsyncSession,
+    posicao: QuadroPessoal,
+    meses: Optional[List[int]] = None
+) -> None:
+    """Registra que uma posição do quadro mudou (valores atuais ou anteriores à exclusão)."""
+    registrar_alteracao_quadro(
+        db, posicao.cenario_id, posicao.cenario_secao_id, posicao.funcao_id,
+        posicao.centro_custo_id, posicao.id, meses
+    )
+
+
+def registrar_alteracao_premissa(
+    db: AsyncSession,
+    cenario_id: UUID,
+    cenario_secao_id: Optional[UUID],
+    funcao_id: UUID,
+    mes: int,
+    ano: int
+) -> None:
+    """Registra que a premissa de uma função/mês mudou."""
+    db.add(CustoAlteracaoPendente(
+        cenario_id=cenario_id,
+        cenario_secao_id=cenario_secao_id,
+        funcao_id=funcao_id,
+        mes=mes,
+        ano=ano,
+        origem=ORIGEM_PREMISSA
+    ))
+
+
+def meses_alterados(update_data: Dict[str, Any]) -> Optional[List[int]]:
+    """
+    Meses afetados por uma atualização de posição.
+    Retorna None quando algum campo não mensal mudou (afeta todos os meses).
+    """
+    campos_mes = {f"qtd_{m}": i + 1 for i, m in enumerate(MESES)}
+    meses = []
+    for campo in update_data:
+        if campo not in campos_mes:
+            return None
+        meses.append(campos_mes[campo])
+    return sorted(meses)
+
+
+async def listar_alteracoes_pendentes(db: AsyncSession, cenario_id: UUID) -> Dict[str, Any]:
+    """Resumo das alterações pendentes de um cenário."""
+    result = await db.execute(
+        select(
+            CustoAlteracaoPendente.origem,
+            func.count(CustoAlteracaoPendente.id),
+            func.min(CustoAlteracaoPendente.created_at)
+        )
+        .where(CustoAlteracaoPendente.cenario_id == cenario_id)
+        .group_by(CustoAlteracaoPendente.origem)
+    )
+    por_origem = {origem: qtd for origem, qtd, _ in result.all()}
+
+    result = await db.execute(
+        select(func.count(func.distinct(CustoAlteracaoPendente.cenario_secao_id)))
+        .where(CustoAlteracaoPendente.cenario_id == cenario_id)
+    )
+
+    return {
+        "cenario_id": str(cenario_id),
+        "total": sum(por_origem.values()),
+        "por_origem": por_origem,
+        "secoes_afetadas": result.scalar() or 0,
+    }
+
+
+# ============================================
+# RECÁLCULO
+# ============================================
+
+async def _expandir_celulas(
+    db: AsyncSession,
+    cenario_id: UUID,
+    pendentes: List[CustoAlteracaoPendente],
+    janela: List[Tuple[int, int]]
+) -> Dict[UUID, Dict[Optional[UUID], Set[Tuple[int, int]]]]:
+    """
+    Converte as alterações pendentes em {secao_id: {funcao_id|None: {(ano, mes)}}}.
+    Seção/período nulos são expandidos para todas as seções/toda a janela;
+    funcao_id None significa todas as funções da seção.
+    """
+    celulas: Dict[UUID, Dict[Optional[UUID], Set[Tuple[int, int]]]] = defaultdict(lambda: defaultdict(set))
+    janela_set = set(janela)
+
+    secoes_por_funcao: Optional[Dict[UUID, Set[UUID]]] = None
+
+    for p in pendentes:
+        periodos = {
+            (ano, mes) for ano, mes in janela
+            if (p.ano is None or ano == p.ano) and (p.mes is None or mes == p.mes)
+        } & janela_set
+        if not periodos:
+            continue
+
+        if p.cenario_secao_id:
+            secoes = {p.cenario_secao_id}
+        else:
+            # Alteração sem seção: todas as seções onde a função aparece
+            # (ou todas as seções do quadro, se a função também for nula)
+            if secoes_por_funcao is None:
+                result = await db.execute(
+                    select(QuadroPessoal.funcao_id, QuadroPessoal.cenario_secao_id)
+                    .where(
+                        QuadroPessoal.cenario_id == cenario_id,
+                        QuadroPessoal.cenario_secao_id.isnot(None)
+                    )
+                    .distinct()
+                )
+                secoes_por_funcao = defaultdict(set)
+                for funcao_id, secao_id in result.all():
+                    secoes_por_funcao[funcao_id].add(secao_id)
+            if p.funcao_id is None:
+                secoes = set().union(*secoes_por_funcao.values())
+            else:
+                secoes = secoes_por_funcao.get(p.funcao_id, set())
+
+        for secao_id in secoes:
+            celulas[secao_id][p.funcao_id] |= periodos
+
+    return celulas
+
+
+async def _grupos_afetados_por_hc(
+    db: AsyncSession,
+    cenario_id: UUID,
+    ccs_alterados: Set[Optional[UUID]]
+) -> List[UUID]:
+    """
+    Grupos HC/PA com destino em um CC cujo HC mudou (percentuais precisam ser refeitos).
+    CC nulo entre os alterados significa CC desconhecido: todos os grupos HC/PA.
+    """
+    if not ccs_alterados:
+        return []
+    query = (
+        select(RateioGrupo.id)
+        .join(RateioDestino, RateioDestino.rateio_grupo_id == RateioGrupo.id)
+        .where(
+            RateioGrupo.cenario_id == cenario_id,
+            RateioGrupo.ativo == True,
+            RateioGrupo.tipo_rateio.in_(["HC", "PA"])
+        )
+        .distinct()
+    )
+    if None not in ccs_alterados:
+        query = query.where(RateioDestino.cc_destino_id.in_(ccs_alterados))
+    result = await db.execute(query)
+    return [row[0] for row in result.all()]
+
+
+async def recalcular_custos_incremental(
+    db: AsyncSession,
+    cenario_id: UUID,
+    ao_gravar_lote: Optional[ProgressoCallback] = None,
+    ao_iniciar_etapa: Optional[EtapaCallback] = None
+) -> Dict[str, Any]:
+    """
+    Recalcula apenas os custos das células alteradas desde o último cálculo.
+
+    Passos:
+    1. Expande as alterações pendentes em células (seção, função, ano, mês)
+    2. Remove os CustoCalculado dessas células (diretos e rateios derivados deles)
+    3. Recalcula só as posições das funções afetadas, só nos meses afetados
+    4. Refaz o rateio: grupos HC/PA cujos destinos mudaram de HC são refeitos
+       por inteiro; nos demais, apenas os custos das células recalculadas
+
+    Se o cenário ainda não tem custos calculados, faz o cálculo completo.
+    Se algum passo (ou um dos callbacks) levantar exceção, nada é commitado.
+
+    A execução é perfilada (ver perfil_calculo); o id do perfil vem em "perfil_id".
+
+    Returns:
+        Dict com resumo do recálculo
+    """
+    async with perfilar(db, OPERACAO_CUSTOS, cenario_id) as perfil:
+        resumo = await _recalcular_custos_incremental(db, cenario_id, ao_gravar_lote, ao_iniciar_etapa)
+    resumo["perfil_id"] = str(perfil.id)
+    return resumo
+
+
+async def _recalcular_custos_incremental(
+    db: AsyncSession,
+    cenario_id: UUID,
+    ao_gravar_lote: Optional[ProgressoCallback],
+    ao_iniciar_etapa: Optional[EtapaCallback]
+) -> Dict[str, Any]:
+    cenario = await db.get(Cenario, cenario_id)
+    if not cenario:
+        raise ValueError(f"Cenário {cenario_id} não encontrado")
+
+    result = await db.execute(
+        select(CustoAlteracaoPendente).where(CustoAlteracaoPendente.cenario_id == cenario_id)
+    )
+    pendentes = result.scalars().all()
+
+    resumo = {
+        "modo": "incremental",
+        "alteracoes": len(pendentes),
+        "celulas": 0,
+        "secoes": 0,
+        "removidos": 0,
+        "quantidade": 0,
+        "rateio": None,
+    }
+
+    if not pendentes:
+        return resumo
+
+    # Sem resultado anterior não há o que atualizar: cálculo completo
+    result = await db.execute(
+        select(CustoCalculado.id).where(CustoCalculado.cenario_id == cenario_id).limit(1)
+    )
+    if result.scalar_one_or_none() is None:
+        completo = await calcular_e_salvar_custos(
+            db, cenario_id, ao_gravar_lote=ao_gravar_lote, ao_iniciar_etapa=ao_iniciar_etapa
+        )
+        return {**resumo, "modo": "completo", **completo}
+
+    janela = periodos_cenario(cenario)
+    celulas_por_secao = await _expandir_celulas(db, cenario_id, pendentes, janela)
+
+    service = CalculoCustosService(db)
+    await service.carregar_tipos_custo()
+
+    celulas_afetadas: List[Tuple[UUID, UUID, int, int]] = []
+
+    for secao_id, por_funcao in celulas_por_secao.items():
+        # Funções explícitas x "todas as funções da seção"
+        periodos_secao = set()
+        for periodos in por_funcao.values():
+            periodos_secao |= periodos
+        todas_funcoes = None in por_funcao
+        funcoes_ids = None if todas_funcoes else list(por_funcao.keys())
+        periodos_ordenados = sorted(periodos_secao)
+
+        # Recalcular só as posições/meses afetados
+        registros = await service.calcular_registros_celulas(
+            cenario_id, secao_id, funcoes_ids, periodos_ordenados
+        )
+
+        # Células efetivamente refeitas nesta seção
+        if todas_funcoes:
+            result = await db.execute(
+                select(CustoCalculado.funcao_id)
+                .where(
+                    CustoCalculado.cenario_id == cenario_id,
+                    CustoCalculado.cenario_secao_id == secao_id,
+                    CustoCalculado.funcao_id.isnot(None)
+                )
+                .distinct()
+            )
+            funcoes_secao = {row[0] for row in result.all()} | {r["funcao_id"] for r in registros}
+            celulas_secao = {
+                (secao_id, funcao_id, ano, mes)
+                for funcao_id in funcoes_secao for ano, mes in periodos_ordenados
+            }
+        else:
+            celulas_secao = {
+                (secao_id, funcao_id, ano, mes)
+                for funcao_id, periodos in por_funcao.items() for ano, mes in periodos
+            }
+            registros = [
+                r for r in registros
+                if (secao_id, r["funcao_id"], r["ano"], r["mes"]) in celulas_secao
+            ]
+
+        celulas_lista = list(celulas_secao)
+
+        # Remover custos antigos das células (inclui rateios derivados, que herdam seção/função/mês)
+        LOTE = 1000
+        for i in range(0, len(celulas_lista), LOTE):
+            stmt = delete(CustoCalculado).where(
+                CustoCalculado.cenario_id == cenario_id,
+                tuple_(
+                    CustoCalculado.cenario_secao_id, CustoCalculado.funcao_id,
+                    CustoCalculado.ano, CustoCalculado.mes
+                ).in_(celulas_lista[i:i + LOTE])
+            )
+            result = await db.execute(stmt)
+            resumo["removidos"] += result.rowcount or 0
+            await db.execute(
+                delete(CustoMemoriaPosicao).where(
+                    CustoMemoriaPosicao.cenario_id == cenario_id,
+                    tuple_(
+                        CustoMemoriaPosicao.cenario_secao_id, CustoMemoriaPosicao.funcao_id,
+                        CustoMemoriaPosicao.ano, CustoMemoriaPosicao.mes
+                    ).in_(celulas_lista[i:i + LOTE])
+                )
+            )
+
+        if registros:
+            await _gravar_memorias(db, _separar_memoria(registros, settings.CUSTOS_MEMORIA))
+            await _inserir_registros(db, registros)
+
+        resumo["quantidade"] += len(registros)
+        resumo["celulas"] += len(celulas_lista)
+        resumo["secoes"] += 1
+        celulas_afetadas.extend(celulas_lista)
+        
+        if ao_gravar_lote:
+            await ao_gravar_lote(secao_id, len(registros))
+
+    # Rateio
+    if ao_iniciar_etapa:
+        await ao_iniciar_etapa("rateio")
+    ccs_alterados = {p.centro_custo_id for p in pendentes if p.origem == ORIGEM_QUADRO}
+    grupos_refazer = await _grupos_afetados_por_hc(db, cenario_id, ccs_alterados)
+    if grupos_refazer and settings.RATEIO_MODO == RATEIO_RECIPROCO:
+        # No recíproco, um percentual alterado muda os fatores de todos os grupos
+        result = await db.execute(
+            select(RateioGrupo.id).where(
+                RateioGrupo.cenario_id == cenario_id,
+                RateioGrupo.ativo == True
+            )
+        )
+        grupos_refazer = [row[0] for row in result.all()]
+
+    rateio_grupos = None
+    if grupos_refazer:
+        # Percentuais mudaram: refazer o grupo inteiro
+        for grupo_id in grupos_refazer:
+            await db.execute(
+                delete(CustoCalculado).where(
+                    CustoCalculado.cenario_id == cenario_id,
+                    CustoCalculado.rateio_grupo_id == grupo_id
+                )
+            )
+        rateio_grupos = await aplicar_rateio_custos(db, cenario_id, grupos_ids=grupos_refazer, commit=False)
+
+    rateio_celulas = None
+    if celulas_afetadas:
+        query = select(RateioGrupo.id).where(
+            RateioGrupo.cenario_id == cenario_id,
+            RateioGrupo.ativo == True
+        )
+        if grupos_refazer:
+            query = query.where(RateioGrupo.id.notin_(grupos_refazer))
+        result = await db.execute(query)
+        demais_grupos = [row[0] for row in result.all()]
+        if demais_grupos:
+            rateio_celulas = await aplicar_rateio_custos(
+                db, cenario_id, grupos_ids=demais_grupos, celulas=celulas_afetadas, commit=False
+            )
+
+    resumo["rateio"] = {
+        "grupos_refeitos": len(grupos_refazer),
+        "grupos": rateio_grupos,
+        "celulas": rateio_celulas,
+    }
+
+    # Resumo do DRE: anos das células refeitas (grupo refeito por inteiro = todos os anos)
+    anos = None if grupos_refazer else sorted({ano for _, _, ano, _ in celulas_afetadas})
+    if ao_iniciar_etapa:
+        await ao_iniciar_etapa("dre")
+    await atualizar_dre_resumo(db, cenario_id, (FONTE_PESSOAL,), anos)
+
+    # Consumir apenas as alterações lidas (novas edições durante o recálculo permanecem)
+    await db.execute(
+        delete(CustoAlteracaoPendente).where(
+            CustoAlteracaoPendente.id.in_([p.id for p in pendentes])
+        )
+    )
+    await invalidar_impressoes(db, cenario_id)
+    await db.commit()
+    return resumo
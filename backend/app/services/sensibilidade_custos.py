@@ -0,0 +1,245 @@
+"""
+Análise de sensibilidade dos custos (gráfico tornado).
+
+Cada ponto da grade (variação x valor) é um cenário alternativo. Em vez de
+rodar o motor uma vez por ponto, as matrizes da seção (posições x meses) são
+empilhadas uma vez por ponto ao longo do eixo das posições e todas as rubricas
+são calculadas em uma única chamada de calcular_rubricas. Parâmetros variados
+viram uma coluna (linhas x 1) que faz broadcast sobre os meses.
+
+As entradas vêm do mesmo cache da simulação (simulacao_custos): uma carga por
+seção, reaproveitada enquanto o cenário não muda. Nada é gravado.
+"""
+
+from typing import List, Dict, Optional, Any, Tuple
+from uuid import UUID
+import copy
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models.orcamento import Cenario
+from app.schemas.orcamento import SensibilidadeCustosRequest, VariacaoSensibilidade
+from app.services.calculo_custos import CalculoCustosService, MOTOR_VETORIZADO, periodos_cenario
+from app.services.calculo_custos_vetorizado import EntradasSecao, calcular_rubricas
+from app.services.impressao_calculo import calcular_impressoes
+from app.services.plano_rubricas import PlanoRubricas
+from app.services.simulacao_custos import CAMPOS_PREMISSA, OPERACOES, _entradas_secao
+
+
+TIPO_PREMISSA = "premissa"
+TIPO_PARAMETRO = "parametro"
+TIPO_SALARIO = "salario"
+
+# Limite de células (linhas empilhadas x meses) por chamada do motor
+MAX_CELULAS_LOTE = 2_000_000
+
+
+def _validar(variacoes: List[VariacaoSensibilidade], plano: PlanoRubricas) -> None:
+    for v in variacoes:
+        if v.tipo == TIPO_PREMISSA:
+            if v.campo not in CAMPOS_PREMISSA:
+                raise ValueError(f"Premissa '{v.campo}' não pode variar (use {', '.join(CAMPOS_PREMISSA)})")
+            if v.operacao not in OPERACOES:
+                raise ValueError(f"Operação '{v.operacao}' inválida (use {', '.join(OPERACOES)})")
+        elif v.tipo == TIPO_PARAMETRO:
+            if not v.campo:
+                raise ValueError("Informe a chave do parâmetro em 'campo'")
+            if v.tipo_custo_codigo and v.tipo_custo_codigo not in plano.indice_por_codigo:
+                raise ValueError(f"Rubrica '{v.tipo_custo_codigo}' não encontrada")
+        elif v.tipo != TIPO_SALARIO:
+            raise ValueError(f"Tipo de variação '{v.tipo}' inválido (use premissa, parametro ou salario)")
+
+
+def _nome(v: VariacaoSensibilidade) -> str:
+    if v.nome:
+        return v.nome
+    if v.tipo == TIPO_SALARIO:
+        return "Reajuste salarial (%)"
+    if v.tipo_custo_codigo:
+        return f"{v.campo} ({v.tipo_custo_codigo})"
+    return v.campo
+
+
+def _empilhar(entradas: EntradasSecao, blocos: int) -> EntradasSecao:
+    """Cópia das entradas com cada matriz por posição repetida `blocos` vezes (blocos x P linhas)."""
+    n = len(entradas.quadros)
+    empilhada = copy.copy(entradas)
+    for nome, valor in vars(entradas).items():
+        if isinstance(valor, np.ndarray) and valor.shape[0] == n:
+            setattr(empilhada, nome, np.tile(valor, (blocos, 1)))
+    empilhada.quadros = entradas.quadros * blocos
+    return empilhada
+
+
+def _aplicar_ponto(
+    entradas: EntradasSecao,
+    linhas: slice,
+    variacao: VariacaoSensibilidade,
+    valor: float,
+    funcoes: np.ndarray
+) -> None:
+    """Aplica um ponto da grade às linhas do seu bloco (premissa ou salário)."""
+    if variacao.tipo == TIPO_SALARIO:
+        entradas.salario[linhas] *= 1 + valor / 100
+        return
+    if variacao.tipo != TIPO_PREMISSA:
+        return  # Parâmetros entram pelo get_parametro
+
+    mascara = entradas.tem_premissa[linhas]
+    if variacao.funcao_id:
+        mascara = mascara & (funcoes == variacao.funcao_id)[:, None]
+    matriz = getattr(entradas, variacao.campo)[linhas]  # View: altera a matriz empilhada
+    if variacao.operacao == "definir":
+        matriz[mascara] = valor
+    elif variacao.operacao == "somar":
+        matriz[mascara] += valor
+    else:
+        matriz[mascara] *= valor
+
+
+def _get_parametro_empilhado(
+    service: CalculoCustosService,
+    pontos: List[Tuple[VariacaoSensibilidade, float]],
+    tipos_ids: Dict[str, UUID],
+    n: int
+):
+    """
+    get_parametro para o motor empilhado: chaves variadas devolvem uma coluna
+    (blocos x P, 1) com o valor de cada bloco; as demais, o escalar de sempre.
+    """
+    variados: Dict[str, List[Tuple[int, Optional[UUID], float]]] = {}
+    for bloco, (variacao, valor) in enumerate(pontos):
+        if variacao.tipo == TIPO_PARAMETRO:
+            tipo_id = tipos_ids.get(variacao.tipo_custo_codigo) if variacao.tipo_custo_codigo else None
+            variados.setdefault(variacao.campo, []).append((bloco, tipo_id, valor))
+
+    def get_parametro(chave: str, tipo_custo_id: Optional[UUID] = None, default: float = 0):
+        base = service.get_parametro(chave, tipo_custo_id, default)
+        if chave not in variados:
+            return base
+
+        especifico = tipo_custo_id is not None and (tipo_custo_id, chave) in service._parametros
+        valores = None
+        for bloco, tipo_id, valor in variados[chave]:
+            # Variação global não se sobrepõe a parâmetro específico da rubrica
+            if (tipo_id is None and not especifico) or tipo_id == tipo_custo_id:
+                if valores is None:
+                    if base is None:
+                        raise ValueError(f"Parâmetro '{chave}' não tem valor base no cenário para variar")
+                    valores = np.full(len(pontos), float(base))
+                valores[bloco] = valor
+        if valores is None:
+            return base
+        return np.repeat(valores, n)[:, None]
+
+    return get_parametro
+
+
+def _totais_pontos(
+    service: CalculoCustosService,
+    plano: PlanoRubricas,
+    entradas: EntradasSecao,
+    pontos: List[Tuple[VariacaoSensibilidade, float]],
+    tipos_ids: Dict[str, UUID]
+) -> np.ndarray:
+    """Custo total da seção em cada ponto, em lotes de pontos calculados de uma vez."""
+    n = len(entradas.quadros)
+    t = len(entradas.periodos)
+    por_lote = max(1, MAX_CELULAS_LOTE // max(1, n * t))
+    funcoes = np.array([q.funcao_id for q in entradas.quadros], dtype=object)
+
+    totais = []
+    for inicio in range(0, len(pontos), por_lote):
+        lote = pontos[inicio:inicio + por_lote]
+        empilhada = _empilhar(entradas, len(lote))
+        for bloco, (variacao, valor) in enumerate(lote):
+            _aplicar_ponto(empilhada, slice(bloco * n, (bloco + 1) * n), variacao, valor, funcoes)
+
+        get_parametro = _get_parametro_empilhado(service, lote, tipos_ids, n)
+        _, valores = calcular_rubricas(empilhada, plano, get_parametro)
+        soma = np.zeros((len(lote) * n, t))
+        for matriz in valores:
+            soma += matriz
+        totais.append(soma.reshape(len(lote), n * t).sum(axis=1))
+
+    return np.concatenate(totais)
+
+
+async def analisar_sensibilidade(
+    db: AsyncSession,
+    cenario_id: UUID,
+    pedido: SensibilidadeCustosRequest
+) -> Dict[str, Any]:
+    """
+    Custo total do cenário em cada ponto da grade de variações, comparado ao
+    custo sem variação, ordenado pela amplitude do impacto (gráfico tornado).
+
+    Raises:
+        ValueError: cenário inexistente ou variação inválida
+    """
+    cenario = await db.get(Cenario, cenario_id)
+    if not cenario:
+        raise ValueError(f"Cenário {cenario_id} não encontrado")
+
+    if pedido.ano:
+        periodos = [(pedido.ano, mes) for mes in range(1, 13)]
+    else:
+        periodos = periodos_cenario(cenario)
+
+    service = CalculoCustosService(db, MOTOR_VETORIZADO)
+    await service.carregar_tipos_custo()
+    plano = service._plano
+    _validar(pedido.variacoes, plano)
+    tipos_ids = {passo.codigo: passo.id for passo in plano.passos}
+
+    # Ponto 0 = base (sem variação); os demais, na ordem da grade
+    base = VariacaoSensibilidade(tipo=TIPO_SALARIO, valores=[0])
+    pontos = [(base, 0.0)] + [(v, valor) for v in pedido.variacoes for valor in v.valores]
+
+    impressoes, _ = await calcular_impressoes(db, cenario_id, pedido.cenario_secao_id)
+    totais = np.zeros(len(pontos))
+    for secao, impressao in impressoes.items():
+        item = await _entradas_secao(service, cenario_id, UUID(secao), periodos, impressao)
+        if item.entradas is None:
+            continue
+        service.usar_parametros(item.parametros)
+        totais += _totais_pontos(service, plano, item.entradas, pontos, tipos_ids)
+
+    total_base = float(totais[0])
+    resultado = []
+    posicao = 1
+    for variacao in pedido.variacoes:
+        pontos_variacao = []
+        for valor in variacao.valores:
+            total = float(totais[posicao])
+            posicao += 1
+            impacto = total - total_base
+            pontos_variacao.append({
+                "valor": valor,
+                "total": round(total, 2),
+                "impacto": round(impacto, 2),
+                "impacto_percentual": round(impacto / total_base * 100, 4) if total_base else None,
+            })
+        impactos = [p["impacto"] for p in pontos_variacao]
+        resultado.append({
+            "nome": _nome(variacao),
+            "tipo": variacao.tipo,
+            "campo": variacao.campo,
+            "pontos": pontos_variacao,
+            "impacto_min": min(impactos),
+            "impacto_max": max(impactos),
+            "amplitude": round(max(impactos) - min(impactos), 2),
+        })
+
+    # Tornado: maior impacto absoluto primeiro
+    resultado.sort(key=lambda v: -max(abs(v["impacto_min"]), abs(v["impacto_max"])))
+
+    return {
+        "cenario_id": str(cenario_id),
+        "cenario_secao_id": str(pedido.cenario_secao_id) if pedido.cenario_secao_id else None,
+        "periodos": len(periodos),
+        "cenarios_avaliados": len(pontos),
+        "total_base": round(total_base, 2),
+        "variacoes": resultado,
+    }
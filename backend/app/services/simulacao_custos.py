@@ -0,0 +1,326 @@
+"""
+Simulação de custos (what-if) em memória.
+
+Aplica ajustes de premissas e de parâmetros sobre as entradas do cenário,
+calcula as rubricas com o motor vetorizado e devolve agregados no formato do
+DRE (por rubrica, categoria, mês e centro de custo). Nada é gravado.
+
+Para uso interativo (ex: slider na tela), as entradas de cada seção ficam em
+cache no processo, indexadas pela impressão das entradas (impressao_calculo):
+enquanto o cenário não muda, cada simulação custa uma consulta de hash e as
+operações NumPy. Custos rateados não entram na simulação (o resultado mostra
+os custos diretos de cada CC).
+"""
+
+from typing import List, Dict, Optional, Any, Tuple
+from uuid import UUID
+from collections import OrderedDict
+from dataclasses import dataclass
+import copy
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from app.db.models.orcamento import Cenario, TipoCusto, CentroCusto
+from app.schemas.orcamento import (
+    SimulacaoCustosRequest, AjustePremissaSimulacao, AjusteParametroSimulacao
+)
+from app.services.calculo_custos import CalculoCustosService, MOTOR_VETORIZADO, periodos_cenario
+from app.services.calculo_custos_vetorizado import EntradasSecao, calcular_rubricas
+from app.services.impressao_calculo import calcular_impressoes
+from app.services.plano_rubricas import PlanoRubricas
+from app.services.parametros_custo import Parametros
+
+
+CAMPOS_PREMISSA = ("absenteismo", "abs_pct_justificado", "turnover", "ferias_indice")
+OPERACOES = ("definir", "somar", "multiplicar")
+
+# Seções mantidas em cache (entradas já em matrizes)
+MAX_SECOES_CACHE = 64
+
+
+@dataclass
+class _EntradasEmCache:
+    impressao: str
+    entradas: Optional[EntradasSecao]  # None = seção sem posições ativas
+    parametros: Parametros
+
+
+_cache_entradas: "OrderedDict[Tuple[UUID, UUID, Tuple[Tuple[int, int], ...]], _EntradasEmCache]" = OrderedDict()
+
+
+def _validar(premissas: List[AjustePremissaSimulacao]) -> None:
+    for ajuste in premissas:
+        if ajuste.campo not in CAMPOS_PREMISSA:
+            raise ValueError(f"Premissa '{ajuste.campo}' não pode ser simulada (use {', '.join(CAMPOS_PREMISSA)})")
+        if ajuste.operacao not in OPERACOES:
+            raise ValueError(f"Operação '{ajuste.operacao}' inválida (use {', '.join(OPERACOES)})")
+
+
+async def _entradas_secao(
+    service: CalculoCustosService,
+    cenario_id: UUID,
+    secao_id: UUID,
+    periodos: List[Tuple[int, int]],
+    impressao: str
+) -> _EntradasEmCache:
+    """Entradas da seção em matrizes, do cache se a impressão não mudou."""
+    chave = (cenario_id, secao_id, tuple(periodos))
+    item = _cache_entradas.get(chave)
+    if item is not None and item.impressao == impressao:
+        _cache_entradas.move_to_end(chave)
+        return item
+
+    quadros = await service._carregar_quadro_secao(cenario_id, secao_id)
+    entradas = None
+    if quadros:
+        anos = sorted({a for a, _ in periodos})
+        premissas = await service._carregar_premissas_periodos(cenario_id, secao_id, anos)
+        await service.carregar_calendario(secao_id, anos)
+        entradas = EntradasSecao(quadros, premissas, periodos, service._calendario, service._regime)
+
+    await service.carregar_parametros(cenario_id, secao_id)
+
+    item = _EntradasEmCache(impressao, entradas, dict(service._parametros))
+    _cache_entradas[chave] = item
+    while len(_cache_entradas) > MAX_SECOES_CACHE:
+        _cache_entradas.popitem(last=False)
+    return item
+
+
+def _aplicar_premissas(
+    entradas: EntradasSecao,
+    secao_id: UUID,
+    ajustes: List[AjustePremissaSimulacao]
+) -> EntradasSecao:
+    """
+    Cópia das entradas com os ajustes de premissa aplicados. Como uma edição
+    de premissa, o ajuste só vale onde a posição tem premissa no mês.
+    """
+    aplicaveis = [a for a in ajustes if a.cenario_secao_id in (None, secao_id)]
+    if not aplicaveis:
+        return entradas
+
+    simulada = copy.copy(entradas)
+    for campo in CAMPOS_PREMISSA:
+        setattr(simulada, campo, getattr(entradas, campo).copy())
+
+    funcoes = np.array([q.funcao_id for q in entradas.quadros], dtype=object)
+    anos = np.array([ano for ano, _ in entradas.periodos])
+    meses = np.array([mes for _, mes in entradas.periodos])
+
+    for ajuste in aplicaveis:
+        mascara = entradas.tem_premissa.copy()
+        if ajuste.funcao_id:
+            mascara &= (funcoes == ajuste.funcao_id)[:, None]
+        if ajuste.ano:
+            mascara &= (anos == ajuste.ano)[None, :]
+        if ajuste.mes:
+            mascara &= (meses == ajuste.mes)[None, :]
+
+        matriz = getattr(simulada, ajuste.campo)
+        if ajuste.operacao == "definir":
+            matriz[mascara] = ajuste.valor
+        elif ajuste.operacao == "somar":
+            matriz[mascara] += ajuste.valor
+        else:
+            matriz[mascara] *= ajuste.valor
+
+    return simulada
+
+
+def _aplicar_parametros(
+    parametros: Parametros,
+    secao_id: UUID,
+    ajustes: List[AjusteParametroSimulacao],
+    plano: PlanoRubricas
+) -> Parametros:
+    """Cópia dos parâmetros vigentes na seção com os valores simulados."""
+    resultado = dict(parametros)
+    for ajuste in ajustes:
+        if ajuste.cenario_secao_id not in (None, secao_id):
+            continue
+        tipo_custo_id = None
+        if ajuste.tipo_custo_codigo:
+            indice = plano.indice_por_codigo.get(ajuste.tipo_custo_codigo)
+            if indice is None:
+                raise ValueError(f"Rubrica '{ajuste.tipo_custo_codigo}' não encontrada")
+            tipo_custo_id = plano.passos[indice].id
+        resultado[(tipo_custo_id, ajuste.chave)] = ajuste.valor
+    return resultado
+
+
+def _somar_por_cc(
+    entradas: EntradasSecao,
+    valores: List[np.ndarray],
+    acumulado: Dict[Optional[UUID], np.ndarray]
+) -> None:
+    """Soma as matrizes (rubricas x posições x meses) da seção em acumulado[cc] (rubricas x meses)."""
+    ccs = [q.centro_custo_id for q in entradas.quadros]
+    distintos = list(dict.fromkeys(ccs))
+    indice_cc = {cc: i for i, cc in enumerate(distintos)}
+
+    agrupamento = np.zeros((len(distintos), len(ccs)))
+    agrupamento[[indice_cc[cc] for cc in ccs], np.arange(len(ccs))] = 1.0
+
+    por_cc = np.einsum("cp,rpt->crt", agrupamento, np.stack(valores))
+    for cc, matriz in zip(distintos, por_cc):
+        if cc in acumulado:
+            acumulado[cc] += matriz
+        else:
+            acumulado[cc] = matriz
+
+
+def _lista(valores: np.ndarray) -> List[float]:
+    return [round(float(v), 2) for v in valores]
+
+
+def _agregados(
+    acumulado: Dict[Optional[UUID], np.ndarray],
+    plano: PlanoRubricas,
+    tipos: Dict[UUID, TipoCusto],
+    ccs: Dict[UUID, CentroCusto],
+    n_periodos: int
+) -> Dict[str, Any]:
+    """Monta linhas por rubrica (como no DRE), por categoria e por centro de custo."""
+    por_rubrica = np.zeros((len(plano), n_periodos))
+    for matriz in acumulado.values():
+        por_rubrica += matriz
+
+    linhas = []
+    categorias: Dict[str, np.ndarray] = {}
+    for passo in plano.passos:
+        valores = por_rubrica[passo.indice]
+        if not valores.any():
+            continue
+        tipo = tipos.get(passo.id)
+        categoria = tipo.categoria if tipo else "OUTROS"
+        conta_codigo = (tipo.conta_contabil_codigo if tipo else None) or ""
+        conta_desc = (tipo.conta_contabil_descricao if tipo else None) or ""
+        linhas.append({
+            "tipo_custo_codigo": passo.codigo,
+            "tipo_custo_nome": tipo.nome if tipo else passo.codigo,
+            "categoria": categoria,
+            "conta_contabil_codigo": conta_codigo,
+            "conta_contabil_descricao": conta_desc,
+            "conta_contabil_completa": f"{conta_codigo} - {conta_desc}" if conta_codigo and conta_desc else conta_codigo or conta_desc,
+            "valores_mensais": _lista(valores),
+            "total": round(float(valores.sum()), 2),
+        })
+        categorias[categoria] = categorias.get(categoria, 0) + valores
+
+    categoria_por_indice = [
+        tipos[passo.id].categoria if passo.id in tipos else "OUTROS" for passo in plano.passos
+    ]
+    centros_custo = []
+    for cc_id, matriz in acumulado.items():
+        cc = ccs.get(cc_id) if cc_id else None
+        por_categoria: Dict[str, float] = {}
+        for indice, total in enumerate(matriz.sum(axis=1)):
+            if total:
+                categoria = categoria_por_indice[indice]
+                por_categoria[categoria] = round(por_categoria.get(categoria, 0) + float(total), 2)
+        valores = matriz.sum(axis=0)
+        centros_custo.append({
+            "centro_custo_id": str(cc_id) if cc_id else None,
+            "centro_custo_codigo": cc.codigo if cc else None,
+            "centro_custo_nome": cc.nome if cc else "Sem centro de custo",
+            "categorias": por_categoria,
+            "valores_mensais": _lista(valores),
+            "total": round(float(valores.sum()), 2),
+        })
+    centros_custo.sort(key=lambda c: -c["total"])
+
+    return {
+        "total": round(float(por_rubrica.sum()), 2),
+        "valores_mensais": _lista(por_rubrica.sum(axis=0)),
+        "linhas": linhas,
+        "categorias": [
+            {"categoria": cat, "valores_mensais": _lista(v), "total": round(float(v.sum()), 2)}
+            for cat, v in categorias.items()
+        ],
+        "centros_custo": centros_custo,
+    }
+
+
+def _variacao(base: Dict[str, Any], simulado: Dict[str, Any]) -> Dict[str, Any]:
+    """Diferença simulado - base no total e por categoria."""
+    categorias_base = {c["categoria"]: c["total"] for c in base["categorias"]}
+    categorias_sim = {c["categoria"]: c["total"] for c in simulado["categorias"]}
+    return {
+        "total": round(simulado["total"] - base["total"], 2),
+        "percentual": round((simulado["total"] - base["total"]) / base["total"] * 100, 4) if base["total"] else None,
+        "categorias": {
+            cat: round(categorias_sim.get(cat, 0) - categorias_base.get(cat, 0), 2)
+            for cat in dict.fromkeys([*categorias_base, *categorias_sim])
+        },
+    }
+
+
+async def simular_custos(
+    db: AsyncSession,
+    cenario_id: UUID,
+    pedido: SimulacaoCustosRequest
+) -> Dict[str, Any]:
+    """
+    Calcula os custos do cenário com os ajustes do pedido, sem gravar nada.
+
+    Raises:
+        ValueError: cenário inexistente ou ajuste inválido
+    """
+    _validar(pedido.premissas)
+
+    cenario = await db.get(Cenario, cenario_id)
+    if not cenario:
+        raise ValueError(f"Cenário {cenario_id} não encontrado")
+
+    if pedido.ano:
+        periodos = [(pedido.ano, mes) for mes in range(1, 13)]
+    else:
+        periodos = periodos_cenario(cenario)
+
+    service = CalculoCustosService(db, MOTOR_VETORIZADO)
+    await service.carregar_tipos_custo()
+    plano = service._plano
+
+    impressoes, _ = await calcular_impressoes(db, cenario_id, pedido.cenario_secao_id)
+
+    acumulado_simulado: Dict[Optional[UUID], np.ndarray] = {}
+    acumulado_base: Dict[Optional[UUID], np.ndarray] = {}
+    for secao, impressao in impressoes.items():
+        secao_id = UUID(secao)
+        item = await _entradas_secao(service, cenario_id, secao_id, periodos, impressao)
+        if item.entradas is None:
+            continue
+
+        service.usar_parametros(_aplicar_parametros(item.parametros, secao_id, pedido.parametros, plano))
+        entradas = _aplicar_premissas(item.entradas, secao_id, pedido.premissas)
+        _, valores = calcular_rubricas(entradas, plano, service.get_parametro)
+        _somar_por_cc(entradas, valores, acumulado_simulado)
+
+        if pedido.comparar:
+            service.usar_parametros(item.parametros)
+            _, valores = calcular_rubricas(item.entradas, plano, service.get_parametro)
+            _somar_por_cc(item.entradas, valores, acumulado_base)
+
+    result = await db.execute(select(TipoCusto).where(TipoCusto.id.in_([p.id for p in plano.passos])))
+    tipos = {t.id: t for t in result.scalars().all()}
+    ccs_ids = [cc for cc in {*acumulado_simulado, *acumulado_base} if cc]
+    ccs = {}
+    if ccs_ids:
+        result = await db.execute(select(CentroCusto).where(CentroCusto.id.in_(ccs_ids)))
+        ccs = {cc.id: cc for cc in result.scalars().all()}
+
+    simulado = _agregados(acumulado_simulado, plano, tipos, ccs, len(periodos))
+    resposta = {
+        "cenario_id": str(cenario_id),
+        "cenario_secao_id": str(pedido.cenario_secao_id) if pedido.cenario_secao_id else None,
+        "periodos": [{"ano": ano, "mes": mes} for ano, mes in periodos],
+        **simulado,
+    }
+    if pedido.comparar:
+        base = _agregados(acumulado_base, plano, tipos, ccs, len(periodos))
+        resposta["base"] = base
+        resposta["variacao"] = _variacao(base, simulado)
+    return resposta
@@ -0,0 +1,18 @@
+"""
+Worker local da fila de cálculo de custos.
+
+Uso (da pasta backend):
+    python -m app.worker
+"""
+
+import asyncio
+
+import app.db.models  # noqa: F401 - registra todos os modelos no mapper
+from app.services.fila_calculo import executar_worker
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(executar_worker())
+    except KeyboardInterrupt:
+        print("Worker encerrado")
@@ -0,0 +1,214 @@
+"""
+Benchmark do motor de custos sobre cenários sintéticos.
+
+Para cada tamanho (pequeno, medio, grande), gera o cenário sintético
+(benchmarks/cenario_sintetico.py) e cronometra:
+
+- calcular_e_salvar_custos (forcar=True, para não cair na impressão digital)
+- aplicar_rateio_custos
+- gerar_dre_cenario
+- gerar_dre_por_cc
+- calcular_receita (todas as receitas do cenário)
+
+Cada operação roda --repeticoes vezes, cada execução em sessão nova. O
+resultado (commit, configuração e tempos) vai para
+benchmarks/resultados/<data>_<commit>.json, e --comparar mostra a variação
+das medianas contra um resultado anterior.
+
+Requer Postgres local (DATABASE_URL) com tipos_custo populados.
+
+Uso:
+    python benchmarks/benchmark_custos.py --tamanhos pequeno,medio --repeticoes 3
+    python benchmarks/benchmark_custos.py --comparar benchmarks/resultados/<arquivo>.json
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, List, Any, Callable, Awaitable, Optional
+
+# Adicionar o diretório pai ao path para imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.db.models.orcamento import ReceitaCenario
+from app.services.calculo_custos import calcular_e_salvar_custos, aplicar_rateio_custos
+from app.api.v1.orcamento.custos import gerar_dre_cenario, gerar_dre_por_cc
+from app.api.v1.orcamento.receitas import calcular_receita
+
+from cenario_sintetico import TAMANHOS, gerar_cenario, remover_cenario
+
+
+DIRETORIO_RESULTADOS = Path(__file__).parent / "resultados"
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def _cronometrar(
+    operacao: Callable[[Any], Awaitable[Any]],
+    repeticoes: int
+) -> Dict[str, Any]:
+    """Executa a operação N vezes, cada uma em sessão nova, e resume os tempos."""
+    execucoes = []
+    for _ in range(repeticoes):
+        async with AsyncSessionLocal() as db:
+            inicio = time.perf_counter()
+            await operacao(db)
+            execucoes.append(round(time.perf_counter() - inicio, 4))
+    return {
+        "min": min(execucoes),
+        "mediana": round(statistics.median(execucoes), 4),
+        "media": round(statistics.mean(execucoes), 4),
+        "execucoes": execucoes,
+    }
+
+
+async def _receitas_cenario(cenario_id) -> List:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(ReceitaCenario.id).where(ReceitaCenario.cenario_id == cenario_id)
+        )
+        return list(result.scalars().all())
+
+
+async def executar_tamanho(tamanho: str, semente: int, repeticoes: int) -> Dict[str, Any]:
+    """Gera o cenário do tamanho e cronometra as operações sobre ele."""
+    async with AsyncSessionLocal() as db:
+        inicio = time.perf_counter()
+        cenario = await gerar_cenario(db, tamanho, semente)
+        geracao = round(time.perf_counter() - inicio, 4)
+
+    cenario_id = cenario["cenario_id"]
+    receitas = await _receitas_cenario(cenario_id)
+
+    async def custos(db):
+        await calcular_e_salvar_custos(db, cenario_id, forcar=True)
+
+    async def rateio(db):
+        await aplicar_rateio_custos(db, cenario_id, persistencia=settings.CUSTOS_PERSISTENCIA)
+
+    async def dre_cenario(db):
+        await gerar_dre_cenario(cenario_id=cenario_id, cenario_secao_id=None, ano=None, db=db)
+
+    async def dre_por_cc(db):
+        await gerar_dre_por_cc(cenario_id=cenario_id, ano=None, centro_custo_id=None, db=db)
+
+    async def receitas_cenario(db):
+        for receita_id in receitas:
+            await calcular_receita(receita_id=receita_id, db=db)
+
+    # Custos antes de rateio e DREs, que leem custos_calculados
+    operacoes = {
+        "calcular_e_salvar_custos": custos,
+        "aplicar_rateio_custos": rateio,
+        "gerar_dre_cenario": dre_cenario,
+        "gerar_dre_por_cc": dre_por_cc,
+        "calcular_receita": receitas_cenario,
+    }
+
+    tempos = {}
+    for nome, operacao in operacoes.items():
+        print(f"  [{tamanho}] {nome}...", flush=True)
+        tempos[nome] = await _cronometrar(operacao, repeticoes)
+        print(f"  [{tamanho}] {nome}: mediana {tempos[nome]['mediana']:.3f}s")
+
+    return {
+        "semente": semente,
+        "cenario_id": str(cenario_id),
+        "dimensoes": cenario["dimensoes"],
+        "linhas": cenario["linhas"],
+        "geracao_segundos": geracao,
+        "operacoes": tempos,
+    }
+
+
+def comparar(atual: Dict[str, Any], anterior: Dict[str, Any]) -> None:
+    """Imprime a variação das medianas do resultado atual contra o anterior."""
+    print(f"\nComparação com {anterior.get('commit') or '?'} ({anterior.get('data')}):")
+    print(f"  {'tamanho':<8} {'operação':<26} {'antes':>9} {'agora':>9} {'variação':>9}")
+    for tamanho, dados in atual["tamanhos"].items():
+        antes_tamanho = anterior.get("tamanhos", {}).get(tamanho)
+        if not antes_tamanho:
+            continue
+        for operacao, tempos in dados["operacoes"].items():
+            antes = antes_tamanho["operacoes"].get(operacao)
+            if not antes:
+                continue
+            agora, base = tempos["mediana"], antes["mediana"]
+            variacao = f"{(agora / base - 1) * 100:+.1f}%" if base else "-"
+            print(f"  {tamanho:<8} {operacao:<26} {base:>8.3f}s {agora:>8.3f}s {variacao:>9}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark do motor de custos")
+    parser.add_argument("--tamanhos", default="pequeno,medio,grande",
+                        help="Tamanhos separados por vírgula (pequeno, medio, grande)")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--comparar", type=Path, help="Resultado anterior (JSON) para comparação")
+    parser.add_argument("--manter", action="store_true",
+                        help="Mantém os cenários sintéticos no banco ao final")
+    args = parser.parse_args()
+
+    tamanhos = [t.strip() for t in args.tamanhos.split(",") if t.strip()]
+    invalidos = [t for t in tamanhos if t not in TAMANHOS]
+    if invalidos:
+        parser.error(f"Tamanhos inválidos: {', '.join(invalidos)}")
+
+    commit = _git("rev-parse", "--short", "HEAD")
+    resultado = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "branch": _git("rev-parse", "--abbrev-ref", "HEAD"),
+        "alteracoes_locais": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "configuracao": {
+            "motor": settings.CUSTOS_MOTOR,
+            "persistencia": settings.CUSTOS_PERSISTENCIA,
+            "memoria": settings.CUSTOS_MEMORIA,
+            "gravacao_copy": settings.GRAVACAO_COPY,
+        },
+        "repeticoes": args.repeticoes,
+        "tamanhos": {},
+    }
+
+    try:
+        for tamanho in tamanhos:
+            print(f"Tamanho {tamanho}:")
+            resultado["tamanhos"][tamanho] = await executar_tamanho(tamanho, args.semente, args.repeticoes)
+    finally:
+        if not args.manter:
+            async with AsyncSessionLocal() as db:
+                for tamanho in tamanhos:
+                    await remover_cenario(db, tamanho)
+
+    DIRETORIO_RESULTADOS.mkdir(exist_ok=True)
+    arquivo = DIRETORIO_RESULTADOS / f"{datetime.now():%Y%m%d-%H%M%S}_{commit or 'sem-git'}.json"
+    arquivo.write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\nResultado salvo em {arquivo}")
+
+    if args.comparar:
+        anterior = json.loads(args.comparar.read_text(encoding="utf-8"))
+        comparar(resultado, anterior)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
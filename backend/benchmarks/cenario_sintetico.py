@@ -0,0 +1,352 @@
+"""
+Gerador de cenário sintético para benchmark do motor de custos.
+
+Monta, no banco configurado (Postgres local), um cenário completo de tamanho
+configurável: empresas, seções (cada uma com seu CC operacional), funções com
+tabela salarial, posições no quadro por seção, premissas mensais, CCs POOL com
+grupos de rateio, receitas com premissas e custos diretos.
+
+A geração é reprodutível: mesma semente e mesmo tamanho produzem os mesmos
+códigos, ids e valores. Todos os cadastros levam o prefixo BENCH-<TAMANHO>-,
+e gerar de novo remove antes o cenário anterior do mesmo tamanho.
+
+Pré-requisito: tipos_custo populados (migrations/seed_tipos_custo.py).
+
+Uso:
+    python benchmarks/cenario_sintetico.py --tamanho medio --semente 42
+    python benchmarks/cenario_sintetico.py --tamanho medio --remover
+"""
+
+import sys
+import asyncio
+import argparse
+import random
+import uuid
+from pathlib import Path
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Any
+
+# Adicionar o diretório pai ao path para imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import AsyncSessionLocal
+from app.db.models.orcamento import (
+    Empresa, Departamento, Secao, CentroCusto, Funcao, Fornecedor, ProdutoTecnologia,
+    PoliticaBeneficio, FaixaSalarial, TabelaSalarial, Cenario, CenarioEmpresa,
+    CenarioSecao, CenarioSecaoCC, QuadroPessoal, PremissaFuncaoMes, TipoCusto,
+    RateioGrupo, RateioDestino, TipoReceita, ReceitaCenario, ReceitaPremissaMes,
+    CustoDireto
+)
+from app.services.gravacao_lote import gravar_registros
+
+
+COLUNAS_MES = ["qtd_jan", "qtd_fev", "qtd_mar", "qtd_abr", "qtd_mai", "qtd_jun",
+               "qtd_jul", "qtd_ago", "qtd_set", "qtd_out", "qtd_nov", "qtd_dez"]
+
+ANO_INICIO = 2026
+TIPOS_RATEIO = ["HC", "MANUAL", "PA", "AREA"]
+
+
+@dataclass(frozen=True)
+class TamanhoCenario:
+    empresas: int
+    secoes_por_empresa: int
+    funcoes: int
+    posicoes_por_secao: int
+    meses: int
+    grupos_rateio: int
+    receitas_por_cc: int
+    custos_diretos: int
+
+
+TAMANHOS: Dict[str, TamanhoCenario] = {
+    "pequeno": TamanhoCenario(
+        empresas=1, secoes_por_empresa=3, funcoes=8, posicoes_por_secao=10,
+        meses=12, grupos_rateio=1, receitas_por_cc=1, custos_diretos=6
+    ),
+    "medio": TamanhoCenario(
+        empresas=2, secoes_por_empresa=10, funcoes=25, posicoes_por_secao=40,
+        meses=12, grupos_rateio=3, receitas_por_cc=2, custos_diretos=40
+    ),
+    "grande": TamanhoCenario(
+        empresas=4, secoes_por_empresa=25, funcoes=60, posicoes_por_secao=120,
+        meses=24, grupos_rateio=6, receitas_por_cc=3, custos_diretos=200
+    ),
+}
+
+
+def prefixo_codigo(tamanho: str) -> str:
+    return f"BENCH-{tamanho.upper()}-"
+
+
+def _meses(qtd: int) -> List[tuple]:
+    """(ano, mes) da janela do cenário, a partir de janeiro de ANO_INICIO."""
+    return [(ANO_INICIO + i // 12, i % 12 + 1) for i in range(qtd)]
+
+
+class _Gerador:
+    """Acumula os registros de cada tabela, com ids derivados da semente."""
+
+    def __init__(self, semente: int):
+        self.rng = random.Random(semente)
+        self.tabelas: Dict[Any, List[Dict[str, Any]]] = {}
+
+    def novo_id(self) -> uuid.UUID:
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def add(self, modelo, **valores) -> uuid.UUID:
+        valores.setdefault("id", self.novo_id())
+        self.tabelas.setdefault(modelo, []).append(valores)
+        return valores["id"]
+
+    def valor(self, minimo: float, maximo: float, casas: int = 2) -> float:
+        return round(self.rng.uniform(minimo, maximo), casas)
+
+
+async def remover_cenario(db: AsyncSession, tamanho: str) -> bool:
+    """
+    Remove o cenário sintético do tamanho e os cadastros globais dele.
+
+    O cenário leva junto (CASCADE) quadro, premissas, rateios, receitas,
+    custos diretos e calculados; os cadastros globais saem pelo prefixo.
+    """
+    prefixo = prefixo_codigo(tamanho)
+    like = f"{prefixo}%"
+
+    result = await db.execute(delete(Cenario).where(Cenario.codigo.like(like)))
+    removido = (result.rowcount or 0) > 0
+
+    await db.execute(delete(TipoReceita).where(TipoReceita.codigo.like(like)))
+    await db.execute(delete(Fornecedor).where(Fornecedor.codigo.like(like)))
+    await db.execute(delete(Funcao).where(Funcao.codigo.like(like)))
+    await db.execute(delete(Departamento).where(Departamento.codigo.like(like)))
+    await db.execute(delete(CentroCusto).where(CentroCusto.codigo.like(like)))
+    await db.execute(delete(Empresa).where(Empresa.codigo.like(like)))
+    await db.execute(delete(PoliticaBeneficio).where(PoliticaBeneficio.codigo.like(like)))
+    await db.execute(delete(FaixaSalarial).where(FaixaSalarial.codigo.like(like)))
+    await db.commit()
+    return removido
+
+
+async def gerar_cenario(db: AsyncSession, tamanho: str, semente: int = 42) -> Dict[str, Any]:
+    """
+    Gera (ou regera) o cenário sintético do tamanho informado.
+
+    Returns:
+        Dict com cenario_id, as dimensões usadas e a contagem de linhas por tabela
+    """
+    if tamanho not in TAMANHOS:
+        raise ValueError(f"Tamanho inválido: {tamanho}. Use: {', '.join(TAMANHOS)}")
+    dimensoes = TAMANHOS[tamanho]
+
+    qtd_tipos = (await db.execute(
+        select(func.count()).select_from(TipoCusto).where(TipoCusto.ativo == True)
+    )).scalar()
+    if not qtd_tipos:
+        raise ValueError("tipos_custo está vazia. Rode migrations/seed_tipos_custo.py antes.")
+
+    await remover_cenario(db, tamanho)
+
+    g = _Gerador(semente)
+    prefixo = prefixo_codigo(tamanho)
+    meses = _meses(dimensoes.meses)
+    ano_fim, mes_fim = meses[-1]
+
+    # Cadastros globais
+    # ------------------------------------------------------------------
+    politica_id = g.add(
+        PoliticaBeneficio, codigo=f"{prefixo}POL", nome="Política sintética",
+        vt_dia=g.valor(8, 15), vr_dia=g.valor(20, 40), plano_saude=g.valor(150, 400)
+    )
+    faixa_id = g.add(FaixaSalarial, codigo=f"{prefixo}FX", nome="Faixa sintética")
+
+    funcoes = []
+    for i in range(dimensoes.funcoes):
+        funcao_id = g.add(
+            Funcao, codigo=f"{prefixo}FUN{i:03d}", nome=f"Função sintética {i}",
+            jornada_mensal=g.rng.choice([180, 220])
+        )
+        tabela_id = g.add(
+            TabelaSalarial, funcao_id=funcao_id, faixa_id=faixa_id, politica_id=politica_id,
+            salario_base=g.valor(1500, 12000)
+        )
+        funcoes.append((funcao_id, tabela_id))
+
+    fornecedor_id = g.add(Fornecedor, codigo=f"{prefixo}FOR", nome="Fornecedor sintético")
+    produtos = [
+        g.add(
+            ProdutoTecnologia, fornecedor_id=fornecedor_id, codigo=f"{prefixo}PRD{i:02d}",
+            nome=f"Item sintético {i}", categoria=g.rng.choice(["DISCADOR", "URA", "AUTOMACAO"])
+        )
+        for i in range(5)
+    ]
+
+    tipos_receita = [
+        g.add(TipoReceita, codigo=f"{prefixo}REC{i}", nome=f"Receita sintética {i}")
+        for i in range(2)
+    ]
+
+    # Cenário, empresas, seções e CCs
+    # ------------------------------------------------------------------
+    cenario_id = g.add(
+        Cenario, codigo=f"{prefixo}CEN", nome=f"Benchmark {tamanho} (semente {semente})",
+        ano_inicio=ANO_INICIO, mes_inicio=1, ano_fim=ano_fim, mes_fim=mes_fim
+    )
+    departamento_id = g.add(Departamento, codigo=f"{prefixo}DEP", nome="Departamento sintético")
+
+    secoes_operacionais = []  # (cenario_secao_id, secao_id, cc_id)
+    for e in range(dimensoes.empresas):
+        empresa_id = g.add(Empresa, codigo=f"{prefixo}EMP{e:02d}", razao_social=f"Empresa sintética {e}")
+        cenario_empresa_id = g.add(CenarioEmpresa, cenario_id=cenario_id, empresa_id=empresa_id)
+        for s in range(dimensoes.secoes_por_empresa):
+            codigo = f"{prefixo}SEC{e:02d}{s:03d}"
+            secao_id = g.add(Secao, departamento_id=departamento_id, codigo=codigo, nome=f"Seção sintética {e}.{s}")
+            cenario_secao_id = g.add(
+                CenarioSecao, cenario_empresa_id=cenario_empresa_id, secao_id=secao_id
+            )
+            cc_id = g.add(
+                CentroCusto, codigo=f"{prefixo}CC{e:02d}{s:03d}", nome=f"CC sintético {e}.{s}",
+                tipo="OPERACIONAL", uf="SP", area_m2=g.valor(50, 800)
+            )
+            g.add(CenarioSecaoCC, cenario_secao_id=cenario_secao_id, centro_custo_id=cc_id)
+            secoes_operacionais.append((cenario_secao_id, secao_id, cc_id))
+
+    # Seção corporativa com os CCs POOL (origem dos rateios)
+    secao_corp_id = g.add(Secao, departamento_id=departamento_id, codigo=f"{prefixo}SECCORP", nome="Corporativo sintético")
+    cenario_secao_corp_id = g.add(
+        CenarioSecao, cenario_empresa_id=cenario_empresa_id, secao_id=secao_corp_id
+    )
+    secoes_pool = []
+    for p in range(dimensoes.grupos_rateio):
+        cc_pool_id = g.add(
+            CentroCusto, codigo=f"{prefixo}POOL{p:02d}", nome=f"Pool sintético {p}",
+            tipo="POOL", uf="SP", area_m2=None
+        )
+        g.add(CenarioSecaoCC, cenario_secao_id=cenario_secao_corp_id, centro_custo_id=cc_pool_id)
+        secoes_pool.append((cenario_secao_corp_id, secao_corp_id, cc_pool_id))
+
+    # Quadro de pessoal e premissas
+    # ------------------------------------------------------------------
+    funcoes_por_cc: Dict[uuid.UUID, uuid.UUID] = {}
+    funcoes_por_secao: Dict[uuid.UUID, set] = {}
+    ccs_pool = {cc_id for _, _, cc_id in secoes_pool}
+    for cenario_secao_id, secao_id, cc_id in secoes_operacionais + secoes_pool:
+        qtd_posicoes = dimensoes.posicoes_por_secao
+        if cc_id in ccs_pool:
+            qtd_posicoes = max(1, qtd_posicoes // 4)
+        for _ in range(qtd_posicoes):
+            funcao_id, tabela_id = g.rng.choice(funcoes)
+            funcoes_por_secao.setdefault(cenario_secao_id, set()).add(funcao_id)
+            funcoes_por_cc.setdefault(cc_id, funcao_id)
+            base = g.rng.randint(1, 30)
+            g.add(
+                QuadroPessoal, cenario_id=cenario_id, cenario_secao_id=cenario_secao_id,
+                funcao_id=funcao_id, secao_id=secao_id, centro_custo_id=cc_id,
+                tabela_salarial_id=tabela_id, fator_pa=g.rng.choice([1.0, 1.0, 0.5, 2.0]),
+                **{coluna: max(0, base + g.rng.randint(-2, 3)) for coluna in COLUNAS_MES}
+            )
+
+    for cenario_secao_id, funcoes_secao in funcoes_por_secao.items():
+        for funcao_id in sorted(funcoes_secao, key=str):
+            for ano, mes in meses:
+                g.add(
+                    PremissaFuncaoMes, cenario_id=cenario_id, cenario_secao_id=cenario_secao_id,
+                    funcao_id=funcao_id, ano=ano, mes=mes,
+                    absenteismo=g.valor(1, 8), turnover=g.valor(1, 8), ferias_indice=8.33
+                )
+
+    # Rateios: cada POOL distribui para uma amostra dos CCs operacionais
+    # ------------------------------------------------------------------
+    ccs_operacionais = [s[2] for s in secoes_operacionais]
+    for p, (_, _, cc_pool_id) in enumerate(secoes_pool):
+        grupo_id = g.add(
+            RateioGrupo, cenario_id=cenario_id, cc_origem_pool_id=cc_pool_id,
+            nome=f"Rateio sintético {p}", tipo_rateio=TIPOS_RATEIO[p % len(TIPOS_RATEIO)]
+        )
+        destinos = g.rng.sample(ccs_operacionais, min(len(ccs_operacionais), g.rng.randint(2, 12)))
+        parte = round(100.0 / len(destinos), 2)
+        for d, cc_destino_id in enumerate(destinos):
+            percentual = parte if d < len(destinos) - 1 else round(100.0 - parte * d, 2)
+            g.add(RateioDestino, rateio_grupo_id=grupo_id, cc_destino_id=cc_destino_id, percentual=percentual)
+
+    # Receitas (VARIAVEL com premissas, FIXA_CC e FIXA_PA alternadas)
+    # ------------------------------------------------------------------
+    tipos_calculo = ["VARIAVEL", "FIXA_CC", "FIXA_PA"]
+    for _, _, cc_id in secoes_operacionais:
+        for r in range(dimensoes.receitas_por_cc):
+            tipo_calculo = tipos_calculo[r % len(tipos_calculo)]
+            receita_id = g.add(
+                ReceitaCenario, cenario_id=cenario_id, centro_custo_id=cc_id,
+                tipo_receita_id=tipos_receita[r % len(tipos_receita)], tipo_calculo=tipo_calculo,
+                funcao_pa_id=funcoes_por_cc.get(cc_id),
+                valor_fixo=g.valor(50000, 400000) if tipo_calculo == "FIXA_CC" else g.valor(800, 3000)
+            )
+            if tipo_calculo == "VARIAVEL":
+                for ano, mes in meses:
+                    g.add(
+                        ReceitaPremissaMes, receita_cenario_id=receita_id, ano=ano, mes=mes,
+                        vopdu=g.valor(2, 12, 4), indice_conversao=g.valor(0.3, 0.9, 4),
+                        ticket_medio=g.valor(40, 200), fator=1, indice_estorno=g.valor(0, 0.1, 4)
+                    )
+
+    # Custos diretos (operacionais e POOL, que entram no rateio)
+    # ------------------------------------------------------------------
+    todas_secoes = secoes_operacionais + secoes_pool
+    for i in range(dimensoes.custos_diretos):
+        cenario_secao_id, _, cc_id = todas_secoes[i % len(todas_secoes)]
+        tipo_valor = g.rng.choice(["FIXO", "VARIAVEL", "FIXO_VARIAVEL"])
+        g.add(
+            CustoDireto, cenario_id=cenario_id, cenario_secao_id=cenario_secao_id,
+            centro_custo_id=cc_id, item_custo_id=g.rng.choice(produtos), tipo_valor=tipo_valor,
+            valor_fixo=g.valor(1000, 30000) if tipo_valor != "VARIAVEL" else None,
+            valor_unitario_variavel=g.valor(5, 120, 4) if tipo_valor != "FIXO" else None,
+            unidade_medida="HC" if tipo_valor != "FIXO" else None,
+            funcao_base_id=funcoes_por_cc.get(cc_id) if tipo_valor != "FIXO" else None
+        )
+
+    # Gravação, na ordem das FKs
+    # ------------------------------------------------------------------
+    linhas = {}
+    for modelo in [
+        PoliticaBeneficio, FaixaSalarial, Funcao, TabelaSalarial, Fornecedor, ProdutoTecnologia,
+        TipoReceita, Empresa, Departamento, Secao, CentroCusto, Cenario, CenarioEmpresa,
+        CenarioSecao, CenarioSecaoCC, QuadroPessoal, PremissaFuncaoMes, RateioGrupo,
+        RateioDestino, ReceitaCenario, ReceitaPremissaMes, CustoDireto
+    ]:
+        registros = g.tabelas.get(modelo, [])
+        linhas[modelo.__tablename__] = await gravar_registros(db, modelo.__table__, registros)
+    await db.commit()
+
+    return {
+        "tamanho": tamanho,
+        "semente": semente,
+        "cenario_id": cenario_id,
+        "dimensoes": asdict(dimensoes),
+        "linhas": linhas,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Gera cenário sintético para benchmark")
+    parser.add_argument("--tamanho", choices=list(TAMANHOS), default="pequeno")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--remover", action="store_true", help="Só remove o cenário do tamanho")
+    args = parser.parse_args()
+
+    async with AsyncSessionLocal() as db:
+        if args.remover:
+            removido = await remover_cenario(db, args.tamanho)
+            print(f"Cenário {prefixo_codigo(args.tamanho)}CEN {'removido' if removido else 'não encontrado'}.")
+            return
+
+        resultado = await gerar_cenario(db, args.tamanho, args.semente)
+        print(f"Cenário gerado: {resultado['cenario_id']}")
+        for tabela, qtd in resultado["linhas"].items():
+            print(f"  {tabela:<24} {qtd:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
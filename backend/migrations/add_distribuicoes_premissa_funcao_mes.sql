@@ -0,0 +1,8 @@
+-- Migration: Distribuições de probabilidade nas premissas por função/mês
+-- Data: 2026-10-17
+-- Descrição: Coluna JSON com a incerteza de absenteísmo, turnover e índice de férias,
+--            usada pela simulação de Monte Carlo dos custos
+
+ALTER TABLE premissa_funcao_mes ADD COLUMN IF NOT EXISTS distribuicoes JSON NULL;
+
+COMMENT ON COLUMN premissa_funcao_mes.distribuicoes IS 'Distribuição de cada índice: {"campo": {"tipo": "triangular|normal|uniforme", "min", "moda", "max", "media", "desvio"}}';
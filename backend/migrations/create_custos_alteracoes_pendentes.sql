@@ -0,0 +1,26 @@
+-- Migration: Criar tabela de alterações pendentes de custos
+-- Data: 2026-10-17
+-- Descrição: Registra as células (seção/função/mês) alteradas desde o último cálculo,
+--            para que o recálculo incremental refaça apenas os custos afetados
+
+CREATE TABLE IF NOT EXISTS custos_alteracoes_pendentes (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    cenario_id UUID NOT NULL REFERENCES cenarios(id) ON DELETE CASCADE,
+    cenario_secao_id UUID NULL REFERENCES cenario_secao(id) ON DELETE CASCADE,
+    funcao_id UUID NULL REFERENCES funcoes(id) ON DELETE CASCADE,
+    quadro_pessoal_id UUID NULL,
+    centro_custo_id UUID NULL,
+    
+    -- Período afetado (NULL = todos os meses/anos da janela)
+    mes INTEGER NULL,
+    ano INTEGER NULL,
+    
+    -- Origem: QUADRO, PREMISSA
+    origem VARCHAR(20) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_custos_alteracoes_pendentes_cenario_id ON custos_alteracoes_pendentes(cenario_id);
+CREATE INDEX IF NOT EXISTS ix_custos_alteracoes_cenario_secao ON custos_alteracoes_pendentes(cenario_id, cenario_secao_id);
+
+COMMENT ON TABLE custos_alteracoes_pendentes IS 'Células alteradas desde o último cálculo de custos (recálculo incremental)';
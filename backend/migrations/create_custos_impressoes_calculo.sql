@@ -0,0 +1,23 @@
+-- Migration: Impressão das entradas do cálculo de custos
+-- Data: 2026-10-17
+-- Descrição: Hash das entradas do último cálculo de cada escopo (cenário, seção, ano)
+--            com o resumo devolvido, para pular recálculos sem mudança
+
+CREATE TABLE IF NOT EXISTS custos_impressoes_calculo (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    cenario_id UUID NOT NULL REFERENCES cenarios(id) ON DELETE CASCADE,
+    cenario_secao_id UUID NULL REFERENCES cenario_secao(id) ON DELETE CASCADE,
+    ano INTEGER NULL,
+    impressao VARCHAR(64) NOT NULL,
+    impressoes_secoes JSON NULL,
+    resumo JSON NULL,
+    calculado_em TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS ix_custos_impressoes_calculo_cenario_id
+    ON custos_impressoes_calculo(cenario_id);
+
+-- Jobs na fila podem pedir recálculo mesmo sem mudança nas entradas
+ALTER TABLE jobs_calculo_custos ADD COLUMN IF NOT EXISTS forcar BOOLEAN NOT NULL DEFAULT FALSE;
+
+COMMENT ON TABLE custos_impressoes_calculo IS 'Hash das entradas do último cálculo de custos por escopo (cache do resumo)';
@@ -0,0 +1,37 @@
+-- Migration: Memória de cálculo fora da linha de custos_calculados
+-- Data: 2026-10-17
+-- Descrição: Colunas de origem do custo (posição, grupo de rateio, custo de origem) e
+--            tabela custos_memoria_posicao, com a memória uma vez por posição/mês
+
+ALTER TABLE custos_calculados ADD COLUMN IF NOT EXISTS quadro_pessoal_id UUID NULL;
+ALTER TABLE custos_calculados ADD COLUMN IF NOT EXISTS rateio_grupo_id UUID NULL;
+ALTER TABLE custos_calculados ADD COLUMN IF NOT EXISTS custo_origem_id UUID NULL;
+ALTER TABLE custos_calculados ADD COLUMN IF NOT EXISTS custo_direto_id UUID NULL;
+
+CREATE INDEX IF NOT EXISTS ix_custos_calculados_quadro_pessoal_id ON custos_calculados(quadro_pessoal_id);
+CREATE INDEX IF NOT EXISTS ix_custos_calculados_rateio_grupo_id ON custos_calculados(rateio_grupo_id);
+
+-- Preencher a origem dos rateios já gravados a partir da memória de cálculo
+UPDATE custos_calculados
+SET rateio_grupo_id = (memoria_calculo->>'grupo_rateio')::uuid,
+    custo_origem_id = (memoria_calculo->>'custo_original_id')::uuid,
+    custo_direto_id = (memoria_calculo->>'custo_direto_id')::uuid
+WHERE memoria_calculo->>'tipo' = 'rateio'
+  AND rateio_grupo_id IS NULL;
+
+CREATE TABLE IF NOT EXISTS custos_memoria_posicao (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    cenario_id UUID NOT NULL REFERENCES cenarios(id) ON DELETE CASCADE,
+    cenario_secao_id UUID NULL REFERENCES cenario_secao(id) ON DELETE CASCADE,
+    funcao_id UUID NULL,
+    quadro_pessoal_id UUID NOT NULL,
+    mes INTEGER NOT NULL,
+    ano INTEGER NOT NULL,
+    memoria JSON NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_custos_memoria_posicao_lote ON custos_memoria_posicao(cenario_id, cenario_secao_id, ano);
+CREATE INDEX IF NOT EXISTS ix_custos_memoria_posicao_quadro ON custos_memoria_posicao(quadro_pessoal_id, ano, mes);
+
+COMMENT ON TABLE custos_memoria_posicao IS 'Memória de cálculo por posição/mês (compartilhada pelas rubricas)';
@@ -0,0 +1,27 @@
+-- Migration: Perfil de execução dos cálculos
+-- Data: 2026-10-17
+-- Descrição: Tempo, consultas e linhas por fase, por rubrica e por seção de cada
+--            execução de cálculo de custos, rateio e tecnologia
+
+CREATE TABLE IF NOT EXISTS custos_perfis_calculo (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    cenario_id UUID NOT NULL REFERENCES cenarios(id) ON DELETE CASCADE,
+    cenario_secao_id UUID NULL REFERENCES cenario_secao(id) ON DELETE CASCADE,
+    ano INTEGER NULL,
+    operacao VARCHAR(20) NOT NULL,
+    motor VARCHAR(20) NULL,
+    duracao_ms INTEGER NOT NULL DEFAULT 0,
+    consultas INTEGER NOT NULL DEFAULT 0,
+    linhas INTEGER NOT NULL DEFAULT 0,
+    fases JSON NULL,
+    rubricas JSON NULL,
+    secoes JSON NULL,
+    iniciado_em TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS ix_custos_perfis_calculo_cenario_id
+    ON custos_perfis_calculo(cenario_id);
+CREATE INDEX IF NOT EXISTS ix_custos_perfis_calculo_iniciado_em
+    ON custos_perfis_calculo(iniciado_em);
+
+COMMENT ON TABLE custos_perfis_calculo IS 'Perfil de execução (tempo/consultas/linhas por fase) dos cálculos de custos';
@@ -0,0 +1,41 @@
+-- Migration: Resumo pré-agregado do DRE
+-- Data: 2026-10-17
+-- Descrição: Valores do DRE já somados por cenário, seção, CC, linha/conta contábil,
+--            categoria, origem, ano e mês, atualizados ao fim de cada cálculo (custos,
+--            tecnologia, receitas); os endpoints do DRE leem só esta tabela.
+--            dre_resumo_estado guarda, por cenário e fonte, a assinatura das entradas
+--            que não passam por um cálculo (custos diretos, cadastros das linhas)
+
+CREATE TABLE IF NOT EXISTS dre_resumo (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    cenario_id UUID NOT NULL REFERENCES cenarios(id) ON DELETE CASCADE,
+    cenario_secao_id UUID NULL REFERENCES cenario_secao(id) ON DELETE CASCADE,
+    centro_custo_id UUID NULL REFERENCES centros_custo(id) ON DELETE CASCADE,
+    fonte VARCHAR(20) NOT NULL,
+    linha_codigo VARCHAR(60) NOT NULL,
+    linha_nome VARCHAR(255) NOT NULL,
+    categoria VARCHAR(80) NOT NULL,
+    conta_contabil_codigo VARCHAR(50) NOT NULL DEFAULT '',
+    conta_contabil_descricao VARCHAR(255) NOT NULL DEFAULT '',
+    origem VARCHAR(10) NOT NULL DEFAULT 'DIRETO',
+    origem_pool VARCHAR(200) NULL,
+    ano INTEGER NOT NULL,
+    mes INTEGER NOT NULL,
+    valor NUMERIC(15, 2) NOT NULL DEFAULT 0,
+    atualizado_em TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS ix_dre_resumo_cenario_ano
+    ON dre_resumo(cenario_id, ano, cenario_secao_id, centro_custo_id);
+
+CREATE TABLE IF NOT EXISTS dre_resumo_estado (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    cenario_id UUID NOT NULL REFERENCES cenarios(id) ON DELETE CASCADE,
+    fonte VARCHAR(20) NOT NULL,
+    versao VARCHAR(64) NULL,
+    atualizado_em TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT uq_dre_resumo_estado_fonte UNIQUE (cenario_id, fonte)
+);
+
+COMMENT ON TABLE dre_resumo IS 'DRE pré-agregado por cenário/seção/CC/linha/mês (atualizado ao fim de cada cálculo)';
+COMMENT ON TABLE dre_resumo_estado IS 'Fontes do resumo do DRE já montadas por cenário, com a assinatura das entradas';
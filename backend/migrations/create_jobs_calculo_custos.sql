@@ -0,0 +1,38 @@
+-- Migration: Criar tabela da fila de cálculo de custos
+-- Data: 2026-10-17
+-- Descrição: Jobs de cálculo de custos executados pelo worker local (python -m app.worker),
+--            com progresso por seção, resultado e cancelamento
+
+CREATE TABLE IF NOT EXISTS jobs_calculo_custos (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    cenario_id UUID NOT NULL REFERENCES cenarios(id) ON DELETE CASCADE,
+    
+    -- Escopo do cálculo (NULL = cenário inteiro / toda a janela)
+    cenario_secao_id UUID NULL REFERENCES cenario_secao(id) ON DELETE CASCADE,
+    ano INTEGER NULL,
+    incremental BOOLEAN NOT NULL DEFAULT FALSE,
+    
+    -- Status: PENDENTE, EXECUTANDO, CONCLUIDO, ERRO, CANCELADO
+    status VARCHAR(20) NOT NULL DEFAULT 'PENDENTE',
+    cancelamento_solicitado BOOLEAN NOT NULL DEFAULT FALSE,
+    pedidos INTEGER NOT NULL DEFAULT 1,
+    
+    progresso JSON NULL,
+    resultado JSON NULL,
+    erro TEXT NULL,
+    
+    worker VARCHAR(100) NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    iniciado_em TIMESTAMP NULL,
+    heartbeat_em TIMESTAMP NULL,
+    concluido_em TIMESTAMP NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_jobs_calculo_custos_cenario_id ON jobs_calculo_custos(cenario_id);
+CREATE INDEX IF NOT EXISTS ix_jobs_calculo_custos_status ON jobs_calculo_custos(status);
+
+-- No máximo um job pendente por cenário (pedidos repetidos são coalescidos)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_jobs_calculo_custos_pendente
+    ON jobs_calculo_custos(cenario_id) WHERE status = 'PENDENTE';
+
+COMMENT ON TABLE jobs_calculo_custos IS 'Fila de cálculo de custos (worker local, sem broker externo)';
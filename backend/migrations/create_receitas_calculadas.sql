@@ -0,0 +1,44 @@
+-- Migration: Receitas calculadas (materializadas)
+-- Data: 2026-10-17
+-- Descrição: Receita por receita/mês gravada pelo cálculo de receitas, com a impressão
+--            das entradas (receitas, premissas, quadro, CCs e feriados); o DRE lê
+--            com uma consulta agregada e recalcula apenas quando a impressão muda.
+--            receitas_calculadas_anos guarda a impressão de cada cenário/ano
+--            calculado (inclusive anos sem receitas)
+
+CREATE TABLE IF NOT EXISTS receitas_calculadas (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    cenario_id UUID NOT NULL REFERENCES cenarios(id) ON DELETE CASCADE,
+    receita_cenario_id UUID NOT NULL REFERENCES receitas_cenario(id) ON DELETE CASCADE,
+    centro_custo_id UUID NOT NULL REFERENCES centros_custo(id) ON DELETE CASCADE,
+    tipo_receita_id UUID NOT NULL REFERENCES tipos_receita(id) ON DELETE CASCADE,
+    mes INTEGER NOT NULL,
+    ano INTEGER NOT NULL,
+    valor_calculado NUMERIC(15, 2) NOT NULL,
+    valor_bruto NUMERIC(15, 2) NULL,
+    hc_pa NUMERIC(12, 4) NULL,
+    qtd_pa NUMERIC(12, 4) NULL,
+    dias_uteis INTEGER NULL,
+    memoria_calculo JSON NULL,
+    impressao VARCHAR(64) NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT uq_receita_calculada_mes UNIQUE (receita_cenario_id, ano, mes)
+);
+
+CREATE INDEX IF NOT EXISTS ix_receitas_calculadas_receita_cenario_id
+    ON receitas_calculadas(receita_cenario_id);
+
+CREATE INDEX IF NOT EXISTS ix_receitas_calculadas_cenario_ano
+    ON receitas_calculadas(cenario_id, ano);
+
+CREATE TABLE IF NOT EXISTS receitas_calculadas_anos (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    cenario_id UUID NOT NULL REFERENCES cenarios(id) ON DELETE CASCADE,
+    ano INTEGER NOT NULL,
+    impressao VARCHAR(64) NOT NULL,
+    calculado_em TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT uq_receita_calculada_ano UNIQUE (cenario_id, ano)
+);
+
+COMMENT ON TABLE receitas_calculadas IS 'Receitas calculadas por mês (recalculadas quando a impressão das entradas muda)';
+COMMENT ON TABLE receitas_calculadas_anos IS 'Impressão das entradas de cada cenário/ano de receitas calculado';
@@ -25,8 +25,8 @@ async def test_calculo():
     async with async_session() as db:
         try:
             print(f"Calculando custos para cenário {cenario_id}...")
-            quantidade = await calcular_e_salvar_custos(db, cenario_id, ano=2026)
-            print(f"Custos calculados: {quantidade}")
+            resultado = await calcular_e_salvar_custos(db, cenario_id, ano=2026)
+            print(f"Custos calculados: {resultado['quantidade']}")
         except Exception as e:
             import traceback
             print(f"ERRO: {e}")
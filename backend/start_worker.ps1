@@ -0,0 +1,13 @@
+# SIG Backend - Worker da fila de cálculo de custos
+# Uso: .\start_worker.ps1
+
+Write-Host "Iniciando worker de cálculo de custos..." -ForegroundColor Cyan
+Write-Host ""
+
+# Verificar se está na pasta correta
+if (-not (Test-Path "app\worker.py")) {
+    Write-Host "Erro: Execute este script da pasta backend\" -ForegroundColor Red
+    exit 1
+}
+
+python -m app.worker
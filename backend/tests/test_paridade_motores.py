@@ -0,0 +1,201 @@
+"""
+Paridade entre os motores de custos.
+
+O motor vetorizado (calculo_custos_vetorizado) precisa dar, centavo a centavo,
+os mesmos custos do motor escalar (CalculoCustosService._calcular_rubrica).
+Os dois rodam sobre quadros, premissas, parâmetros, alíquotas e calendário
+sorteados, sem banco: o plano é compilado de tipos de custo em memória.
+
+Execute (em backend/): python -m pytest tests
+"""
+
+import sys
+import random
+import asyncio
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services import calculo_custos as cc
+from app.services.calculo_custos import CalculoCustosService, MOTOR_ESCALAR
+from app.services.calculo_custos_vetorizado import EntradasSecao, calcular_rubricas, gerar_registros
+from app.services.calendario import Calendario, RegimeTrabalho, _Feriados
+from app.services.parametros_custo import CHAVES_PARAMETROS
+from app.services.plano_rubricas import compilar_plano
+
+
+ANOS = (2026, 2027)
+MESES_CAMPOS = ['qtd_jan', 'qtd_fev', 'qtd_mar', 'qtd_abr', 'qtd_mai', 'qtd_jun',
+                'qtd_jul', 'qtd_ago', 'qtd_set', 'qtd_out', 'qtd_nov', 'qtd_dez']
+
+# Rubricas com fórmula própria nos dois motores, na ordem do cadastro padrão
+CODIGOS = (
+    cc.COD_SALARIO, cc.COD_HE_50, cc.COD_HE_100, cc.COD_DSR, cc.COD_HONORARIOS,
+    cc.COD_VT, cc.COD_VR, cc.COD_AM, cc.COD_CRECHE, cc.COD_HO,
+    cc.COD_FGTS, cc.COD_INSS_EMP, cc.COD_INSS_TERC, cc.COD_SAT_RAT,
+    cc.COD_PROV_FERIAS, cc.COD_FGTS_FERIAS, cc.COD_INSS_FERIAS,
+    cc.COD_PROV_13, cc.COD_FGTS_13, cc.COD_INSS_13, cc.COD_INDENIZ,
+    cc.COD_AVISO_IND, cc.COD_MULTA_FGTS, cc.COD_BONUS, cc.COD_PREMIACAO,
+    cc.COD_DESC_480, cc.COD_DESC_AVISO, cc.COD_DESC_FALTAS, cc.COD_DESC_VT, cc.COD_DESC_VR,
+)
+
+# Remuneração que entra nas bases de encargos e reflexos
+REMUNERACAO = {cc.COD_SALARIO, cc.COD_HE_50, cc.COD_HE_100, cc.COD_DSR}
+
+
+def _decimal(rnd: random.Random, minimo: float, maximo: float) -> Decimal:
+    return Decimal(str(round(rnd.uniform(minimo, maximo), 2)))
+
+
+def _tipos_custo(rnd: random.Random):
+    tipos = []
+    for ordem, codigo in enumerate(CODIGOS):
+        remuneracao = codigo in REMUNERACAO
+        tipos.append(SimpleNamespace(
+            id=uuid4(),
+            codigo=codigo,
+            ordem=ordem,
+            tipo_calculo="FORMULA",
+            rubrica_base_id=None,
+            # Alíquota do cadastro ou, sem ela, o padrão da rubrica
+            aliquota_padrao=_decimal(rnd, 0, 30) if rnd.random() < 0.5 else None,
+            incide_fgts=remuneracao or rnd.random() < 0.2,
+            incide_inss=remuneracao or rnd.random() < 0.2,
+            reflexo_ferias=remuneracao or rnd.random() < 0.2,
+            reflexo_13=remuneracao or rnd.random() < 0.2,
+        ))
+    # Algumas rubricas inativas (referências ausentes viram zero nos dois motores)
+    return [t for t in tipos if t.codigo == cc.COD_SALARIO or rnd.random() < 0.9]
+
+
+def _parametros(rnd: random.Random, tipos):
+    parametros = {}
+    for chave in CHAVES_PARAMETROS:
+        if rnd.random() < 0.6:
+            parametros[(None, chave)] = round(rnd.uniform(0, 100), 2)
+        for tipo in tipos:
+            if rnd.random() < 0.05:
+                parametros[(tipo.id, chave)] = round(rnd.uniform(0, 100), 2)
+    return parametros
+
+
+def _calendario(rnd: random.Random) -> Calendario:
+    feriados = _Feriados(anos=set(ANOS))
+    for ano in ANOS:
+        for _ in range(10):
+            data = date(ano, rnd.randint(1, 12), rnd.randint(1, 28))
+            feriado = SimpleNamespace(tipo=rnd.choice(["NACIONAL", "ESTADUAL", "MUNICIPAL"]), uf="SP", cidade="Campinas")
+            feriados.adicionar(feriado, data)
+    return Calendario(feriados)
+
+
+def _regime(rnd: random.Random) -> RegimeTrabalho:
+    return RegimeTrabalho(
+        uf=rnd.choice([None, "SP"]),
+        cidade=rnd.choice([None, "Campinas"]),
+        trabalha_sabado=rnd.choice([0.0, 0.5, 1.0]),
+        trabalha_domingo=rnd.random() < 0.2,
+        trabalha_feriado_nacional=rnd.random() < 0.2,
+    )
+
+
+def _quadros(rnd: random.Random, funcoes):
+    quadros = []
+    for _ in range(rnd.randint(5, 25)):
+        politica = None
+        if rnd.random() < 0.8:
+            politica = SimpleNamespace(
+                escala=rnd.choice(["5x2", "6x1", "12x36", None]),
+                vt_dia=_decimal(rnd, 0, 20) if rnd.random() < 0.7 else Decimal("0"),
+                vr_dia=_decimal(rnd, 0, 40) if rnd.random() < 0.7 else Decimal("0"),
+                plano_saude=_decimal(rnd, 0, 600) if rnd.random() < 0.7 else Decimal("0"),
+                aux_creche=_decimal(rnd, 0, 400) if rnd.random() < 0.4 else Decimal("0"),
+                aux_creche_percentual=_decimal(rnd, 0, 100),
+                aux_home_office=_decimal(rnd, 0, 200) if rnd.random() < 0.4 else Decimal("0"),
+                pct_desconto_vr=_decimal(rnd, 0, 20),
+            )
+        tabela = None
+        if rnd.random() < 0.9:
+            tabela = SimpleNamespace(salario_base=_decimal(rnd, 1500, 15000), faixa_id=uuid4(), politica=politica)
+        quadro = SimpleNamespace(
+            id=uuid4(),
+            funcao_id=rnd.choice(funcoes),
+            centro_custo_id=rnd.choice([uuid4(), None]),
+            salario_override=_decimal(rnd, 1500, 15000) if rnd.random() < 0.2 else None,
+            tabela_salarial=tabela,
+            funcao=SimpleNamespace(is_pj=rnd.random() < 0.15, is_home_office=rnd.random() < 0.3),
+        )
+        for campo in MESES_CAMPOS:
+            setattr(quadro, campo, rnd.choice([0, 0, 1, 2, 5, 12.5, 40]))
+        quadros.append(quadro)
+    return quadros
+
+
+def _premissas(rnd: random.Random, funcoes):
+    premissas = {}
+    for funcao_id in funcoes:
+        for ano in ANOS:
+            for mes in range(1, 13):
+                if rnd.random() < 0.75:
+                    premissas[(funcao_id, ano, mes)] = {
+                        'absenteismo': round(rnd.uniform(0, 15), 2),
+                        'abs_pct_justificado': round(rnd.uniform(0, 100), 2),
+                        'turnover': round(rnd.uniform(0, 12), 2),
+                        'ferias_indice': round(rnd.uniform(0, 12), 2),
+                        'dias_treinamento': rnd.randint(0, 30),
+                    }
+    return premissas
+
+
+def _escalar(service, cenario_id, secao_id, quadros, premissas):
+    custos = {}
+    for ano in ANOS:
+        service._premissas_cache = {(f, m): p for (f, a, m), p in premissas.items() if a == ano}
+        for c in asyncio.run(service._calcular_quadros(cenario_id, secao_id, quadros, ano)):
+            custos[(c.quadro_pessoal_id, c.tipo_custo_id, c.ano, c.mes)] = c
+    return custos
+
+
+@pytest.mark.parametrize("semente", range(20))
+def test_vetorizado_igual_ao_escalar(semente):
+    rnd = random.Random(semente)
+    tipos = _tipos_custo(rnd)
+    plano = compilar_plano(tipos)
+    funcoes = [uuid4() for _ in range(4)]
+    quadros = _quadros(rnd, funcoes)
+    premissas = _premissas(rnd, funcoes)
+    calendario = _calendario(rnd)
+    regime = _regime(rnd)
+    cenario_id, secao_id = uuid4(), uuid4()
+
+    service = CalculoCustosService(None, MOTOR_ESCALAR)
+    service._plano = plano
+    service.usar_parametros(_parametros(rnd, tipos))
+    service._calendario = calendario
+    service._regime = regime
+    escalares = _escalar(service, cenario_id, secao_id, quadros, premissas)
+
+    periodos = [(ano, mes) for ano in ANOS for mes in range(1, 13)]
+    entradas = EntradasSecao(quadros, premissas, periodos, calendario, regime)
+    hc_folha, valores = calcular_rubricas(entradas, plano, service.get_parametro)
+    vetorizados = {
+        (r["quadro_pessoal_id"], r["tipo_custo_id"], r["ano"], r["mes"]): r
+        for r in gerar_registros(cenario_id, secao_id, entradas, plano, hc_folha, valores)
+    }
+
+    assert escalares, "cenário sorteado sem custos"
+    for chave in escalares.keys() | vetorizados.keys():
+        escalar = escalares.get(chave)
+        vetorizado = vetorizados.get(chave)
+        valor_escalar = float(escalar.valor_calculado) if escalar is not None else 0.0
+        valor_vetorizado = float(vetorizado["valor_calculado"]) if vetorizado is not None else 0.0
+        assert abs(valor_escalar - valor_vetorizado) < 0.005, (chave, valor_escalar, valor_vetorizado)
+        if escalar is not None and vetorizado is not None:
+            assert abs(float(escalar.hc_base) - float(vetorizado["hc_base"])) < 1e-6, chave
+            assert escalar.indice_aplicado == vetorizado["indice_aplicado"], chave